@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory and on-disk caches of arrays derived from grid files.
+
+The face areas (unstructured.py), the topologies (topology.py), the raster
+lookups (raster.py), the land fractions (landsea.py) and the regridding
+weights (regrid.py) of grids are computed once and cached in two tiers: the entries used last are kept in memory, and the arrays are stored
+in a cache directory, so other processes (and later sessions) read them
+instead of computing them again. Here:
+
+    - memory_cache, get and put implement the memory tier: a thread-safe
+      OrderedDict that drops the entries used least recently beyond a size
+    - load_npz and save_npz implement the disk tier: .npz files written
+      atomically (to a temporary file that is then renamed), so readers in
+      other processes never see a partial file, and read back as None if
+      they are missing or corrupted (e.g., removed by another process), so
+      callers compute them again
+    - remove_files clears the entries of a cache directory
+    - write_atomic is the atomic write of save_npz, for any file writer
+      (e.g., the netCDF states of climatology.py)
+
+Example Usage:
+-------------
+    import arraycache
+
+    _areas = arraycache.memory_cache()
+
+    areas = arraycache.get(_areas, key)
+    if areas is None:
+        arrays = arraycache.load_npz(path, ['areas'])
+        if arrays is None:
+            arrays = {'areas': compute_areas(grid_path)}
+            arraycache.save_npz(path, arrays)
+        areas = arraycache.put(_areas, key, arrays['areas'], 8)
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+# The entries of a memory cache (from the least to the most recently used)
+# and the lock that guards them.
+MemoryCache = namedtuple('MemoryCache', ['entries', 'lock'])
+
+
+def memory_cache() -> MemoryCache:
+    """
+    memory = memory_cache().
+
+    Returns an empty memory cache.
+    """
+    return MemoryCache(OrderedDict(), threading.Lock())
+
+
+def get(memory: MemoryCache, key: Hashable) -> Optional[Any]:
+    """
+    value = get(memory, key).
+
+    Returns the entry of a key (marked as the most recently used), or None.
+    """
+    with memory.lock:
+        value = memory.entries.get(key)
+        if value is not None:
+            memory.entries.move_to_end(key)
+
+    return value
+
+
+def put(memory: MemoryCache, key: Hashable, value: Any, size: int) -> Any:
+    """
+    value = put(memory, key, value, size).
+
+    Stores the entry of a key, drops the least recently used entries beyond
+    size and returns the value.
+    """
+    with memory.lock:
+        memory.entries[key] = value
+        memory.entries.move_to_end(key)
+        while len(memory.entries) > size:
+            memory.entries.popitem(last=False)
+
+    return value
+
+
+def clear(memory: MemoryCache):
+    """
+    clear(memory).
+
+    Drops the entries of a memory cache.
+    """
+    with memory.lock:
+        memory.entries.clear()
+
+
+def load_npz(path: Optional[str], names: List[str]) -> Optional[Dict[str, np.ndarray]]:
+    """
+    arrays = load_npz(path, names).
+
+    Returns the named arrays of a .npz file, or None if path is None or the
+    file is missing, corrupted or lacks one of them.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path) as f:
+            return {name: f[name] for name in names}
+    except (OSError, ValueError, KeyError):
+        # removed or corrupted by another process, recompute
+        return None
+
+
+def save_npz(path: Optional[str], arrays: Dict[str, np.ndarray]):
+    """
+    save_npz(path, arrays).
+
+    Writes arrays to a .npz file atomically (nothing if path is None),
+    creating its directory.
+    """
+    if path is None:
+        return
+
+    def _write(tmp: str):
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    write_atomic(path, _write)
+
+
+def write_atomic(path: str, write: Callable[[str], Any]):
+    """
+    write_atomic(path, write).
+
+    Calls write with a temporary path next to path, then renames the
+    temporary file to path, so readers in other processes never see a
+    partial file. The temporary file is removed if write fails.
+    """
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def remove_files(cache: Optional[str], suffix: str = '.npz'):
+    """
+    remove_files(cache, suffix).
+
+    Removes the files of a cache directory with a suffix (nothing if cache is
+    None or missing).
+    """
+    if cache is not None and os.path.isdir(cache):
+        for fn in os.listdir(cache):
+            if fn.endswith(suffix):
+                os.remove(os.path.join(cache, fn))
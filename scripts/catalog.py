@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Catalog query layer for the xrw sqlite database (``paths`` table).
+
+xrw.get_cmip_paths is called in tight loops from notebooks, so queries go
+through this module instead of opening a new connection and building SQL
+strings on every call:
+
+    - one reusable read-only connection per database file (opened lazily,
+      shared across threads and guarded by a lock)
+    - parameterized queries on a whitelist of facet columns
+    - only the columns needed for de-duplication are selected
+    - a small LRU cache of query results, invalidated when the database file
+      changes (its mtime is part of the cache key)
+    - composite indexes on the facet columns, created once with
+      create_indexes (requires write access)
+
+Example Usage:
+-------------
+    import catalog
+
+    catalog.create_indexes('/p/user_pub/xclim/persist/xml.db')
+    headers, rows = catalog.query_paths('/p/user_pub/xclim/persist/xml.db',
+                                        variable='tas', experiment='historical')
+"""
+
+from __future__ import annotations
+
+import functools
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_DB = '/p/user_pub/xclim/persist/xml.db'
+
+# The facet columns that can be searched on.
+FACETS = [
+    'mip_era',
+    'activity',
+    'experiment',
+    'realm',
+    'frequency',
+    'variable',
+    'model',
+    'member',
+    'gridLabel',
+]
+
+# The columns needed by xrw.trimModelList, selected after the path (the first
+# column of the table). Metadata columns (cdate, publish, tpoints and the
+# meta_mtime they were read at, see metadata.py) are added when the table has
+# them.
+QUERY_COLUMNS = ['model', 'member', 'version']
+META_COLUMNS = ['cdate', 'publish', 'tpoints', 'meta_mtime']
+
+# Composite indexes on the facet columns. The leading columns are the facets
+# nearly every query constrains, so sqlite can use the index prefix.
+INDEXES = {
+    'paths_facets_idx': ['variable', 'experiment', 'frequency', 'mip_era',
+                         'model', 'member'],
+    'paths_model_idx': ['model', 'member'],
+}
+
+# The maximum number of query results kept in the LRU cache.
+CACHE_SIZE = 128
+
+_connections: Dict[str, sqlite3.Connection] = {}
+_lock = threading.RLock()
+
+
+def get_connection(db: str = DEFAULT_DB) -> sqlite3.Connection:
+    """Get the shared read-only connection to a catalog database.
+
+    Parameters
+    ----------
+    db : str, optional
+        The path to the sqlite database file, by default ``DEFAULT_DB``.
+
+    Returns
+    -------
+    sqlite3.Connection
+        The connection, which is reused by every call with the same ``db``.
+    """
+    db = os.path.abspath(db)
+
+    with _lock:
+        if db not in _connections:
+            if not os.path.exists(db):
+                raise FileNotFoundError(f"The catalog database {db!r} does not exist.")
+
+            _connections[db] = sqlite3.connect(
+                f'file:{db}?mode=ro', uri=True, check_same_thread=False
+            )
+
+        return _connections[db]
+
+
+def close_connections():
+    """Close the shared connections and clear the query cache."""
+    with _lock:
+        for con in _connections.values():
+            con.close()
+
+        _connections.clear()
+        _query_cached.cache_clear()
+
+
+def clear_cache():
+    """Clear the query cache (e.g., after writing to the database)."""
+    _query_cached.cache_clear()
+
+
+def create_indexes(db: str = DEFAULT_DB):
+    """Create the composite facet indexes on the ``paths`` table (if needed).
+
+    This opens a separate read-write connection, so it must be run by a user
+    with write access to the database (e.g., after the catalog is rebuilt).
+    """
+    con = sqlite3.connect(db)
+    try:
+        for name, columns in INDEXES.items():
+            con.execute(
+                f'create index if not exists {name} on paths ({", ".join(columns)})'
+            )
+        con.execute('analyze paths')
+        con.commit()
+    finally:
+        con.close()
+
+
+def get_columns(db: str = DEFAULT_DB) -> List[str]:
+    """Get the column names of the ``paths`` table."""
+    con = get_connection(db)
+
+    with _lock:
+        return [row[1] for row in con.execute('pragma table_info(paths)')]
+
+
+def query_paths(
+    db: str = DEFAULT_DB, **facets: Optional[str]
+) -> Tuple[List[str], List[tuple]]:
+    """Query the catalog for paths matching the facets.
+
+    Retired and ignored paths are always excluded. Facets that are None or '*'
+    are not constrained.
+
+    Parameters
+    ----------
+    db : str, optional
+        The path to the sqlite database file, by default ``DEFAULT_DB``.
+    **facets : Optional[str]
+        Facet constraints (see ``FACETS``), e.g., ``variable='tas'``.
+
+    Returns
+    -------
+    Tuple[List[str], List[tuple]]
+        The selected column names (``path`` first) and the matching rows.
+        The rows are shared with the cache and must not be modified.
+    """
+    unknown = set(facets) - set(FACETS)
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown catalog facets: {sorted(unknown)}")
+
+    constraints = tuple(
+        sorted((k, v) for k, v in facets.items() if v is not None and v != '*')
+    )
+    db = os.path.abspath(db)
+
+    return _query_cached(db, os.path.getmtime(db), constraints)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _query_cached(
+    db: str, mtime: float, constraints: Tuple[Tuple[str, str], ...]
+) -> Tuple[List[str], List[tuple]]:
+    available = get_columns(db)
+    columns = [available[0]] + QUERY_COLUMNS
+    columns += [c for c in META_COLUMNS if c in available]
+
+    where = [f'{key} = ?' for key, _ in constraints]
+    where += ['retired = 0', 'ignored = 0']
+    query = f'select {", ".join(columns)} from paths where {" and ".join(where)}'
+
+    con = get_connection(db)
+    with _lock:
+        rows = con.execute(query, [value for _, value in constraints]).fetchall()
+
+    return columns, rows
+
+
+def cache_info():
+    """Get the hits, misses and size of the query cache."""
+    return _query_cached.cache_info()
@@ -17,6 +17,10 @@ import numpy as np
 import cdms2
 import glob
 
+import dedup
+import metadata
+import xmlindex
+
 
 def filterXmls(files, keyMap, crit):
     """
@@ -125,7 +129,8 @@ def getFileMeta(fn):
 
 def trimModelList(files,
                   criteria=['cdate', 'ver', 'tpoints'],
-                  verbose=False):
+                  verbose=False,
+                  cache=metadata.DEFAULT_CACHE):
     """
     FilesOut = trimModelList(files).
 
@@ -145,70 +150,51 @@ def trimModelList(files,
 
     An additional optional argument is verbose (boolean), which will output
     diagnostic information during execution. By default verbose is False.
+
+    File metadata (cdate, tpoints, publish) is only read for files that are
+    still tied when a criterion needs it (e.g., after ver, if ver comes
+    first), concurrently and cached on disk by path and modification time
+    (see metadata.get_file_metadata). The cache file can be set with the
+    optional argument cache (None disables the cache).
     """
     keyMap = {}
-    models = []
-    rips = []
-    # loop over files and store metadata
+    # loop over files and store filename metadata
     for fn in files:
         # get metadata for sorting
-        model = fn.split('/')[-1].split('.')[4]
-        rip = fn.split('/')[-1].split('.')[5]
-        ver = versionWeight(fn.split('/')[-1].split('.')[10])
-        cdate, publish, tpoints = getFileMeta(fn)
-        if 0 in (cdate, publish, tpoints):
-            # If case of getFileMeta cdms2.open() fail skip to next file
-            continue
-        # collect all models and rips
-        models.append(model)
-        rips.append(rip)
+        fields = fn.split('/')[-1].split('.')
+        model = fields[4]
+        rip = fields[5]
+        ver = versionWeight(fields[10])
         # store data in dictionary
-        keyMap[fn] = {'model': model, 'rip': rip, 'ver': ver, 'cdate': cdate,
-                      'publish': publish, 'tpoints': tpoints}
-    # get unique models / rips
-    rips = list(set(rips))
-    models = list(set(models))
-    models.sort()
-    rips.sort()
-
-    # loop over each model + realization and filter by /criteria/
-    filesOut = []
-    for model in models:
-        for rip in rips:
-            # subset files for each model / realization
-            subFiles = [fn for fn in keyMap.keys() if
-                        (keyMap[fn]['model'] == model
-                         and keyMap[fn]['rip'] == rip)]
-            # continue whittling down file list until only one is left
-            # by iteratively using each criteria
-            for crit in criteria:
-                subFiles = filterXmls(subFiles, keyMap, crit)
-            # if more than one file is left after criteria is applied,
-            # choose first one
-            if len(subFiles) > 0:
-                filesOut.append(subFiles[0])
+        keyMap[fn] = {'model': model, 'rip': rip, 'ver': ver}
+
+    # bucket files by model + realization once, then filter each bucket
+    # by /criteria/ (see dedup.py)
+    groups = dedup.group_by_member(keyMap)
+
+    def prefetch(crit, subFiles):
+        # read file metadata for all tied files in one concurrent batch
+        if crit not in metadata.META_CRITERIA:
+            return
+        need = [fn for fn in subFiles if crit not in keyMap[fn]]
+        meta = metadata.get_file_metadata(need, getFileMeta, cache=cache)
+        for fn, (cdate, publish, tpoints) in meta.items():
+            keyMap[fn]['cdate'] = cdate
+            keyMap[fn]['publish'] = publish
+            keyMap[fn]['tpoints'] = tpoints
+
+    def filterFunc(subFiles, crit):
+        if crit in metadata.META_CRITERIA:
+            # If case of getFileMeta cdms2.open() fail skip the file
+            subFiles = [fn for fn in subFiles
+                        if 0 not in [keyMap[fn][k] for k in metadata.META_CRITERIA]]
+        return filterXmls(subFiles, keyMap, crit)
+
+    filesOut = dedup.select(groups, criteria, filterFunc, prefetch=prefetch)
 
     # if verbose mode, print off files and selection (*)
     if verbose:
-        # loop over models / rips and see if files are in output list
-        # print files used with asterisk and unchosen files next
-        for model in models:
-            for rip in rips:
-                subFiles = [fn for fn in keyMap.keys()
-                            if (keyMap[fn]['model'] == model
-                                and keyMap[fn]['rip'] == rip)]
-                if len(subFiles) > 1:
-                    lowFiles = []
-                    for fn in subFiles:
-                        if fn in filesOut:
-                            fn1 = fn
-                        else:
-                            lowFiles.append(fn)
-                    print('* ' + fn1)
-                    for fn in lowFiles:
-                        print(fn)
-                elif len(subFiles) == 1:
-                    print('* ' + subFiles[0])
+        dedup.print_selection(groups, filesOut)
 
     return filesOut
 
@@ -232,6 +218,11 @@ def getXmlFiles(**kwargs):
         realization : realization for CMIP data
         gridLabel : grid label for CMIP data
         trim : Boolean to trim off duplicate files (default True)
+        criteria : list of criteria used to trim duplicate files (default
+                   ['cdate', 'ver', 'tpoints'], see trimModelList)
+        index : path to the xml filename index (default
+                xmlindex.DEFAULT_INDEX, see xmlindex.py), or None to glob the
+                xml tree instead
 
     Example Usage:
     -------------
@@ -263,6 +254,8 @@ def getXmlFiles(**kwargs):
                 'realization': '*',
                 'gridLabel': '*',
                 'trim': True,
+                'criteria': ['cdate', 'ver', 'tpoints'],
+                'index': xmlindex.DEFAULT_INDEX,
                 'verbose': True}
 
     #  Ensure search arguments were provided
@@ -279,26 +272,27 @@ def getXmlFiles(**kwargs):
             pathDict[key] = kwargs[key]
 
     #  Construct path to search
-    pathString = '{0}/{1}/{2}/{3}/{4}\
-                  /{5}/{6}/*.{7}.{8}\
-                  .*.{9}.*.xml'.format(pathDict['base'],
-                                       pathDict['mip_era'],
-                                       pathDict['activity'],
-                                       pathDict['experiment'],
-                                       pathDict['realm'],
-                                       pathDict['frequency'],
-                                       pathDict['variable'],
-                                       pathDict['model'],
-                                       pathDict['realization'],
-                                       pathDict['gridLabel'])
-    pathString = pathString.replace(' ', '')  # Remove white space
-
-    # Find xml files
-    files = glob.glob(pathString)
+    patterns = xmlindex.get_patterns(pathDict['mip_era'],
+                                     pathDict['activity'],
+                                     pathDict['experiment'],
+                                     pathDict['realm'],
+                                     pathDict['frequency'],
+                                     pathDict['variable'],
+                                     pathDict['model'],
+                                     pathDict['realization'],
+                                     pathDict['gridLabel'])
+    base = pathDict['base'].replace(' ', '')  # Remove white space
+    pathString = base + '/' + '/'.join(patterns)
+
+    # Find xml files (index lookup, unless the index is disabled)
+    if pathDict['index'] is None:
+        files = glob.glob(pathString)
+    else:
+        files = xmlindex.query(base, patterns, index=pathDict['index'])
 
     #  Trim Model List
     if pathDict['trim']:
-        files = trimModelList(files)
+        files = trimModelList(files, criteria=pathDict['criteria'])
 
     if (len(files) == 0) & (pathDict['verbose']):
         print(pathString)
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental climatologies and departures for records that grow over time.
+
+``departure_from_baseline_clim.ipynb`` and
+``seasonal_departure_from_baseline_clim.ipynb`` recompute
+``ds.temporal.climatology`` over the reference period and
+``ds.temporal.departures`` over the whole record every time, although
+operational monitoring of a long record (e.g., HadISST) only appends one month
+at a time. Here:
+
+    - accumulate keeps the state of a climatology as a dataset of per-group
+      (month or season) sums of the weighted values, sums of the weights and
+      counts of the valid values (and optionally the weighted sums of squared
+      deviations, updated with the parallel Welford algorithm), so appending
+      time steps costs O(new data). Time steps up to the last one already
+      accumulated are skipped, and only the time steps in the reference
+      period (if any) are accumulated
+    - climatology and departures give the results of ``ds.temporal.climatology``
+      and ``ds.temporal.departures`` (weighted by the time bounds or not,
+      with missing values skipped) from the state, the departures only for
+      the given (e.g., new) time steps, averaged by period first like xCDAT
+      (with the grouping indexes of ``grouping``)
+    - save and load persist the state as netCDF (written atomically, see
+      arraycache.write_atomic), and
+      append does load, accumulate, save and departures in one call
+
+The seasons are the default ones of xCDAT (see ``grouping``, with incomplete
+seasons kept).
+
+Example Usage:
+-------------
+    import climatology
+    import xcdat as xc
+
+    ds = xc.open_dataset('HadISST_sst.nc')
+    state = climatology.accumulate(ds, 'sst', reference_period=('1981-01-01', '2010-12-31'))
+    climatology.save(state, 'HadISST_sst_clim.nc')
+
+    # every month
+    ds_new = xc.open_dataset('HadISST_sst_202609.nc')
+    ds_anom = climatology.append('HadISST_sst_clim.nc', ds_new, 'sst')
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Optional, Tuple
+
+import cftime
+import numpy as np
+import xarray as xr
+
+import arraycache
+import grouping
+
+# The supported frequencies of the climatologies.
+FREQS = grouping.FREQS['climatology']
+
+# The accumulated variables of the states.
+STATE_VARS = ['sum', 'weight', 'count', 'm2']
+
+# The units of the encoded times of the state.
+TIME_UNITS = 'days since 1970-01-01'
+
+# The default memory budget of each time block (in MB of float64 values).
+MAX_BLOCK_MB = 256.0
+
+
+def _encode(times: np.ndarray, calendar: str) -> np.ndarray:
+    # the times as days since TIME_UNITS (datetime64 or cftime)
+    num, _, _ = xr.coding.times.encode_cf_datetime(np.asarray(times), TIME_UNITS,
+                                                   calendar)
+
+    return np.asarray(num, dtype=np.float64)
+
+
+def _empty_state(ds: xr.Dataset,
+                 var_key: str,
+                 freq: str,
+                 weighted: bool,
+                 reference_period: Optional[Tuple[str, str]],
+                 variance: bool) -> xr.Dataset:
+    if freq not in FREQS:
+        raise ValueError(f'Unsupported freq {freq!r}, use one of {FREQS}.')
+
+    data = ds[var_key]
+    dims = ('group',) + tuple(dim for dim in data.dims if dim != 'time')
+    shape = (12 if freq == 'month' else 4,) + tuple(data.sizes[d] for d in dims[1:])
+    names = STATE_VARS if variance else STATE_VARS[:-1]
+
+    state = xr.Dataset(
+        {name: (dims, np.zeros(shape, dtype=np.int64 if name == 'count' else np.float64))
+         for name in names},
+        coords={'group': np.arange(1, 13) if freq == 'month' else grouping.SEASONS},
+    )
+    # the grid of the data (e.g., lat, lon and their bounds)
+    state = state.assign_coords({key: coord for key, coord in data.coords.items()
+                                 if 'time' not in coord.dims})
+    state = state.assign({key: var for key, var in ds.data_vars.items()
+                          if key != var_key and 'time' not in var.dims})
+    state.attrs.update({
+        'var_key': var_key,
+        'freq': freq,
+        'weighted': int(weighted),
+        'calendar': data['time'].dt.calendar,
+        'reference_start': reference_period[0] if reference_period else '',
+        'reference_end': reference_period[1] if reference_period else '',
+        'time_units': TIME_UNITS,
+        'last_time': -np.inf,
+    })
+    state['sum'].attrs.update(data.attrs)
+
+    return state
+
+
+def _accumulate_block(state: xr.Dataset,
+                      values: np.ndarray,
+                      codes: np.ndarray,
+                      weights: np.ndarray):
+    # add a (time, ...) block of values to the state, in place
+    for group in np.unique(codes):
+        x = values[codes == group]
+        valid = np.isfinite(x)
+        w = np.where(valid, weights[codes == group].reshape((-1,) + (1,) * (x.ndim - 1)),
+                     0.)
+        x = np.where(valid, x, 0.)
+        w_sum = w.sum(axis=0)
+        x_sum = (w * x).sum(axis=0)
+
+        if 'm2' in state:
+            # the parallel (Chan et al.) update of the weighted Welford sums
+            w_old = state['weight'].values[group]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean_old = state['sum'].values[group] / w_old
+                mean_new = x_sum / w_sum
+                m2_new = (w * (x - np.where(w_sum > 0, mean_new, 0.))**2).sum(axis=0)
+                delta = np.where((w_old > 0) & (w_sum > 0), mean_new - mean_old, 0.)
+                total = np.where(w_old + w_sum > 0, w_old + w_sum, 1.)
+            state['m2'].values[group] += m2_new + delta**2 * w_old * w_sum / total
+
+        state['sum'].values[group] += x_sum
+        state['weight'].values[group] += w_sum
+        state['count'].values[group] += valid.sum(axis=0)
+
+
+def accumulate(ds: xr.Dataset,
+               var_key: Optional[str] = None,
+               freq: str = 'month',
+               weighted: bool = True,
+               reference_period: Optional[Tuple[str, str]] = None,
+               variance: bool = False,
+               state: Optional[xr.Dataset] = None,
+               max_block_mb: float = MAX_BLOCK_MB) -> xr.Dataset:
+    """Accumulate the time steps of a dataset into a climatology state.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        The dataset, with time bounds if weighted (NumPy or Dask, read one
+        block of time steps at a time).
+    var_key : Optional[str], optional
+        The data variable, by default the one of the state.
+    freq : str, optional
+        The frequency of the climatology, "month" or "season", by default
+        "month" (ignored if a state is given, like weighted,
+        reference_period and variance).
+    weighted : bool, optional
+        Whether to weight the time steps by the length of their time bounds,
+        by default True.
+    reference_period : Optional[Tuple[str, str]], optional
+        The (start, end) dates of the reference period (e.g., ("1981-01-01",
+        "2010-12-31")), by default None (every time step).
+    variance : bool, optional
+        Whether to also accumulate the weighted sums of squared deviations
+        (see ``variance``), by default False.
+    state : Optional[xr.Dataset], optional
+        The state to update (in place), by default a new one.
+    max_block_mb : float, optional
+        The memory budget of the blocks of time steps, by default
+        ``MAX_BLOCK_MB``.
+
+    Returns
+    -------
+    xr.Dataset
+        The state, with its "last_time" attribute updated to the last time
+        step of ds.
+    """
+    if state is None:
+        if var_key is None:
+            raise ValueError('var_key is required to start a new state.')
+        state = _empty_state(ds, var_key, freq, weighted, reference_period, variance)
+    var_key = state.attrs['var_key']
+    calendar = state.attrs['calendar']
+
+    # skip the time steps already accumulated (e.g., overlapping appends)
+    times = _encode(ds['time'].values, calendar)
+    last_time = float(state.attrs['last_time'])
+    ds = ds.isel(time=np.flatnonzero(times > last_time))
+    if not ds.sizes['time']:
+        return state
+    state.attrs['last_time'] = float(times.max())
+
+    if state.attrs['reference_start'] or state.attrs['reference_end']:
+        ds = ds.sel(time=slice(state.attrs['reference_start'] or None,
+                               state.attrs['reference_end'] or None))
+        if not ds.sizes['time']:
+            return state
+
+    data = ds[var_key].transpose('time', ...)
+    groups = grouping.get_groups(ds, state.attrs['freq'], 'climatology',
+                                 bool(state.attrs['weighted']))
+    codes, weights = groups.cycle[groups.codes], groups.lengths
+
+    step_mb = max(np.prod(data.shape[1:]) * 8 / 1024**2, 1e-6)
+    block_size = max(1, int(max_block_mb / step_mb / 4))
+    for start in range(0, data.sizes['time'], block_size):
+        block = slice(start, start + block_size)
+        values = np.asarray(data[block].values, dtype=np.float64)
+        _accumulate_block(state, values, codes[block], weights[block])
+
+    return state
+
+
+def climatology(state: xr.Dataset) -> xr.Dataset:
+    """
+    ds_climo = climatology(state).
+
+    Returns the climatology of a state like ``ds.temporal.climatology``: the
+    (weighted) mean of the valid values of every group, with a time
+    coordinate of year 1 (e.g., 0001-01-01 to 0001-12-01 for months, or
+    the middle month of every season), and the grid of the data.
+    """
+    var_key, freq = state.attrs['var_key'], state.attrs['freq']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = state['sum'] / state['weight'].where(state['weight'] > 0)
+
+    months = list(range(1, 13)) if freq == 'month' else grouping.SEASON_MONTHS
+    time = [cftime.datetime(1, month, 1, calendar=state.attrs['calendar'])
+            for month in months]
+    mean = mean.rename({'group': 'time'}).assign_coords(time=('time', time, {'axis': 'T'}))
+    mean.attrs.update(state['sum'].attrs)
+    mean.attrs.update({'operation': 'temporal_avg', 'mode': 'climatology',
+                       'freq': freq, 'weighted': str(bool(state.attrs['weighted']))})
+
+    grid = state.drop_vars(STATE_VARS + ['group'], errors='ignore')
+
+    return grid.assign({var_key: mean})
+
+
+def variance(state: xr.Dataset, ddof: int = 0) -> xr.DataArray:
+    """
+    var = variance(state, ddof).
+
+    Returns the weighted variance of every group (the sum of squared
+    deviations over the sum of the weights, minus ddof for unweighted
+    states), for states accumulated with variance=True.
+    """
+    if 'm2' not in state:
+        raise ValueError('The state has no variance, use accumulate(..., variance=True).')
+
+    weight = state['weight'] - (0 if state.attrs['weighted'] else ddof)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return state['m2'] / weight.where(weight > 0)
+
+
+def departures(state: xr.Dataset, ds: xr.Dataset) -> xr.Dataset:
+    """
+    ds_departs = departures(state, ds).
+
+    Returns the departures of the time steps of ds (e.g., the new ones) from
+    the climatology of a state like ``ds.temporal.departures``: the data are
+    averaged by period (e.g., month or season of every year) first, and the
+    climatology of their group is subtracted.
+    """
+    var_key, freq = state.attrs['var_key'], state.attrs['freq']
+    weighted = bool(state.attrs['weighted'])
+    groups = grouping.get_groups(ds, freq, 'average', weighted)
+    ds_avg = grouping.group_average(ds, var_key, freq, weighted, groups=groups)
+
+    ds_departs = grouping.subtract(ds_avg, climatology(state)[var_key], var_key, groups)
+    grid = state.drop_vars(STATE_VARS + ['group'], errors='ignore')
+
+    return grid.assign({var_key: ds_departs[var_key]})
+
+
+def save(state: xr.Dataset, path: str):
+    """
+    save(state, path).
+
+    Writes a state to a netCDF file (atomically, so readers never see a
+    partial state).
+    """
+    arraycache.write_atomic(path, state.to_netcdf)
+
+
+def load(path: str) -> xr.Dataset:
+    """
+    state = load(path).
+
+    Reads a state written by save (into memory, so the file can be replaced).
+    """
+    with xr.open_dataset(path) as ds:
+        return ds.load()
+
+
+def append(path: str,
+           ds: xr.Dataset,
+           var_key: Optional[str] = None,
+           **kwargs) -> xr.Dataset:
+    """Append new time steps to a saved state and get their departures.
+
+    Parameters
+    ----------
+    path : str
+        The netCDF file of the state, created if it does not exist.
+    ds : xr.Dataset
+        The new time steps (time steps already accumulated are skipped).
+    var_key : Optional[str], optional
+        The data variable, by default the one of the state.
+    **kwargs
+        The options of a new state (see ``accumulate``).
+
+    Returns
+    -------
+    xr.Dataset
+        The departures of the time steps of ds.
+    """
+    state = load(path) if os.path.exists(path) else None
+    state = accumulate(ds, var_key, state=state, **kwargs)
+    save(state, path)
+
+    return departures(state, ds)
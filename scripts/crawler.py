@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental, parallel crawler that builds and refreshes the xrw catalog.
+
+crawl walks CMIP directory trees (DRS layout) with a thread pool, one tree
+level at a time, and writes every dataset directory (a directory with
+netCDF files) to the ``paths`` table that xrw.get_cmip_paths queries. The
+facets (mip_era, activity, experiment, realm, frequency, variable, model,
+member, gridLabel, version) are parsed from the path components.
+
+The modification time and subdirectories of every directory are stored in a
+``dirs`` snapshot table of the same database. A directory's mtime only
+changes when entries are added, removed or renamed in it, so on a re-crawl
+directories with an unchanged mtime reuse their snapshot listing: a re-crawl
+costs one stat per directory, and only the changed directories are listed and
+only their datasets are rewritten. Datasets that disappeared are marked as
+retired (not deleted). The ignored flag and the stored tie-break metadata
+(see metadata.py) of existing rows are left untouched.
+
+Example Usage:
+-------------
+    import crawler
+
+    stats = crawler.crawl(['/p/css03/esgf_publish/CMIP6'],
+                          db='/p/user_pub/xclim/persist/xml.db')
+
+or from the command line:
+
+    python crawler.py /p/css03/esgf_publish/CMIP6 --db xml.db
+"""
+
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import catalog
+
+# The default number of threads (crawling is bound by filesystem latency).
+MAX_WORKERS = 16
+
+# The number of directories visited per task.
+BATCH_SIZE = 256
+
+# The columns of the paths table, in order (the path is the first column).
+PATHS_COLUMNS = ['path'] + catalog.FACETS + ['version', 'retired', 'ignored']
+
+# CMIP6 DRS, after the mip_era directory:
+# activity/institution/model/experiment/member/table/variable/grid/version
+CMIP6_DRS = ['activity', 'institution', 'model', 'experiment', 'member',
+             'table', 'variable', 'gridLabel', 'version']
+# CMIP5 DRS, after the mip_era directory:
+# product/institute/model/experiment/frequency/realm/table/member/version/variable
+CMIP5_DRS = ['product', 'institution', 'model', 'experiment', 'frequency',
+             'realm', 'table', 'member', 'version', 'variable']
+
+# CMIP6 table prefixes and frequencies, used to derive the realm and frequency
+# (which are not part of the CMIP6 DRS). Tables without a known prefix (e.g.,
+# Amon, day, CFmon, Emon) are atmospheric.
+TABLE_REALMS = [('SI', 'seaIce'), ('LI', 'landIce'), ('AER', 'aerosol'),
+                ('O', 'ocean'), ('L', 'land')]
+TABLE_FREQUENCIES = ['subhr', '1hr', '3hr', '6hr', 'day', 'mon', 'yr', 'dec',
+                     'fx']
+
+# A type annotation for a visited directory: mtime, subdirectories, number
+# of data files, whether it was listed (i.e., changed) and the names of the
+# data files (None if it was not listed).
+Visit = Tuple[float, List[str], int, bool, Optional[List[str]]]
+
+
+def parse_table(table: str) -> Tuple[str, Optional[str]]:
+    """
+    realm, frequency = parse_table(table).
+
+    Derives the realm and frequency of a CMIP6 table id (e.g., Omon is
+    ('ocean', 'mon') and 6hrPlevPt is ('atmos', '6hr')).
+    """
+    realm = 'atmos'
+    for prefix, name in TABLE_REALMS:
+        if table.startswith(prefix):
+            realm = name
+            break
+
+    frequency = None
+    for freq in TABLE_FREQUENCIES:
+        if freq in table:
+            frequency = freq
+            break
+
+    return realm, frequency
+
+
+def parse_drs(dpath: str) -> Optional[Dict[str, str]]:
+    """
+    facets = parse_drs(dpath).
+
+    Parses the facets of a CMIP5 or CMIP6 dataset directory from its path.
+    Returns None if the path does not follow either DRS.
+    """
+    parts = [p for p in dpath.split('/') if p != '']
+    for i, part in enumerate(parts):
+        if part.upper() == 'CMIP6' and len(parts) - i - 1 == len(CMIP6_DRS):
+            facets = dict(zip(CMIP6_DRS, parts[i + 1:]))
+            facets['mip_era'] = 'CMIP6'
+            facets['realm'], facets['frequency'] = parse_table(facets['table'])
+            return facets
+        if part.upper() == 'CMIP5' and len(parts) - i - 1 == len(CMIP5_DRS):
+            facets = dict(zip(CMIP5_DRS, parts[i + 1:]))
+            facets['mip_era'] = 'CMIP5'
+            # CMIP5 has no activity, its experiments are grouped under CMIP
+            facets['activity'] = 'CMIP'
+            facets['gridLabel'] = None
+            return facets
+
+    return None
+
+
+def _visit(dpath: str, snap: Optional[Visit], suffix: str) -> Optional[Visit]:
+    # stat a directory and list it only if it changed since the snapshot
+    try:
+        mtime = os.stat(dpath).st_mtime
+    except OSError:
+        return None
+
+    if snap is not None and snap[0] == mtime:
+        return mtime, snap[1], snap[2], False, None
+
+    children = []
+    files = []
+    try:
+        with os.scandir(dpath) as it:
+            for entry in it:
+                # skip hidden entries (like glob) and do not follow symlinks
+                # (e.g., latest -> v20190101)
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    children.append(entry.name)
+                elif entry.name.endswith(suffix):
+                    files.append(entry.name)
+    except OSError:
+        return None
+
+    return mtime, sorted(children), len(files), True, sorted(files)
+
+
+def walk(roots: List[str],
+         snapshot: Dict[str, Visit],
+         suffix: str = '.nc',
+         max_depth: Optional[int] = None,
+         max_workers: int = MAX_WORKERS,
+         verbose: bool = False,
+         patterns: Optional[List[str]] = None) -> Dict[str, Visit]:
+    """Walk directory trees in parallel, listing only changed directories.
+
+    Parameters
+    ----------
+    roots : List[str]
+        The (absolute) root directories.
+    snapshot : Dict[str, Visit]
+        The snapshot of a previous walk (see ``load_snapshot``). Directories
+        with an unchanged mtime reuse their snapshot subdirectories.
+    suffix : str, optional
+        The suffix of the data files, by default '.nc'.
+    max_depth : Optional[int], optional
+        The maximum depth (number of levels below the roots) to visit, by
+        default None (no limit).
+    max_workers : int, optional
+        The number of threads, by default ``MAX_WORKERS``.
+    verbose : bool, optional
+        Print progress for each tree level, by default False.
+    patterns : Optional[List[str]], optional
+        The glob patterns of the subdirectories to visit at each level below
+        the roots (matched with fnmatch, like glob), by default None (all
+        subdirectories). Levels beyond the patterns are not filtered.
+
+    Returns
+    -------
+    Dict[str, Visit]
+        The visited directories.
+    """
+    # visit the trees one level at a time
+    visited: Dict[str, Visit] = {}
+    frontier = roots
+
+    def visit_batch(batch: List[str]) -> List[Optional[Visit]]:
+        return [_visit(dpath, snapshot.get(dpath), suffix) for dpath in batch]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        level = 0
+        while len(frontier) > 0:
+            batches = [frontier[i:i + BATCH_SIZE]
+                       for i in range(0, len(frontier), BATCH_SIZE)]
+            if len(batches) == 1:
+                # small levels (e.g., of walks with patterns) are not worth
+                # starting threads for
+                results = visit_batch(batches[0])
+            else:
+                results = [v for r in executor.map(visit_batch, batches)
+                           for v in r]
+
+            nextFrontier = []
+            for dpath, result in zip(frontier, results):
+                if result is None:
+                    continue
+                visited[dpath] = result
+                if max_depth is None or level < max_depth:
+                    children = result[1]
+                    if patterns is not None and level < len(patterns):
+                        children = [c for c in children if
+                                    fnmatch.fnmatchcase(c, patterns[level])]
+                    nextFrontier.extend(dpath + '/' + c for c in children)
+
+            if verbose:
+                print(f'level {level}: {len(frontier)} directories')
+            frontier = nextFrontier
+            level += 1
+
+    return visited
+
+
+def create_snapshot_table(con: sqlite3.Connection):
+    """Create the dirs snapshot table if needed.
+
+    leaf is the number of data files in the directory.
+    """
+    con.execute('create table if not exists dirs (path text primary key, '
+                'mtime real, children text, leaf integer)')
+
+
+def load_snapshot(con: sqlite3.Connection,
+                  roots: List[str],
+                  patterns: Optional[List[str]] = None) -> Dict[str, Visit]:
+    """Load the snapshot of the directories under the (absolute) roots.
+
+    With patterns, only the directories a walk with the same patterns visits
+    (see ``walk``) are loaded, by descending their snapshot subdirectories.
+    """
+    snapshot = {}
+    for root in roots:
+        if patterns is None:
+            # a range on the primary key ('0' sorts right after '/')
+            rows = con.execute('select path, mtime, children, leaf from dirs '
+                               'where path = ? or (path > ? and path < ?)',
+                               (root, root + '/', root + '0')).fetchall()
+            levels = [rows]
+        else:
+            levels = _load_levels(con, root, patterns)
+
+        for rows in levels:
+            for path, mtime, children, leaf in rows:
+                children = children.split('\n') if children else []
+                snapshot[path] = (mtime, children, leaf, False, None)
+
+    return snapshot
+
+
+def _load_levels(con: sqlite3.Connection, root: str, patterns: List[str]):
+    # yield the snapshot rows of the directories matching the patterns, one
+    # level at a time
+    frontier = [root]
+    level = 0
+    while len(frontier) > 0:
+        rows = []
+        for i in range(0, len(frontier), BATCH_SIZE):
+            batch = frontier[i:i + BATCH_SIZE]
+            rows.extend(con.execute(
+                'select path, mtime, children, leaf from dirs where path in '
+                f'({", ".join("?" * len(batch))})', batch
+            ))
+        yield rows
+
+        frontier = []
+        for path, _, children, _ in rows:
+            children = children.split('\n') if children else []
+            if level < len(patterns):
+                children = [c for c in children if
+                            fnmatch.fnmatchcase(c, patterns[level])]
+            frontier.extend(path + '/' + c for c in children)
+        level += 1
+
+
+def removed_dirs(visited: Dict[str, Visit],
+                 snapshot: Dict[str, Visit]) -> List[str]:
+    """
+    removed = removed_dirs(visited, snapshot).
+
+    Returns the directories of the snapshot that were removed: those that
+    were not visited and the subdirectories that are no longer listed in
+    their (changed) parent, which a walk with patterns may not have loaded.
+    Their subdirectories are removed too.
+    """
+    removed = {dpath for dpath in snapshot if dpath not in visited}
+    for dpath, v in visited.items():
+        if v[3] and dpath in snapshot:
+            removed.update(dpath + '/' + c
+                           for c in set(snapshot[dpath][1]) - set(v[1]))
+
+    return sorted(removed)
+
+
+def save_snapshot(con: sqlite3.Connection,
+                  visited: Dict[str, Visit],
+                  snapshot: Dict[str, Visit]):
+    """Update the snapshot of listed (changed) and removed directories."""
+    con.executemany(
+        'insert or replace into dirs values (?, ?, ?, ?)',
+        [(dpath, v[0], '\n'.join(v[1]), v[2])
+         for dpath, v in visited.items() if v[3]],
+    )
+    con.executemany('delete from dirs where path = ? or (path > ? and path < ?)',
+                    [(dpath, dpath + '/', dpath + '0')
+                     for dpath in removed_dirs(visited, snapshot)])
+
+
+def _create_tables(con: sqlite3.Connection) -> bool:
+    # create the paths and dirs tables if needed, returns True if the paths
+    # table is new
+    new = con.execute("select count(*) from sqlite_master where type = 'table' "
+                      "and name = 'paths'").fetchone()[0] == 0
+    if new:
+        con.execute('create table paths (path text primary key, '
+                    + ', '.join(f'{c} text' for c in PATHS_COLUMNS[1:-2])
+                    + ', retired integer, ignored integer)')
+    else:
+        # upserts need a unique path (the first column of the table)
+        path_column = con.execute('pragma table_info(paths)').fetchone()[1]
+        con.execute('create unique index if not exists paths_path_idx on '
+                    f'paths ({path_column})')
+    create_snapshot_table(con)
+
+    return new
+
+
+def crawl(roots: List[str],
+          db: str = catalog.DEFAULT_DB,
+          max_workers: int = MAX_WORKERS,
+          verbose: bool = False) -> Dict[str, int]:
+    """Crawl directory trees and refresh the catalog incrementally.
+
+    Parameters
+    ----------
+    roots : List[str]
+        The root directories to crawl (e.g., /p/css03/esgf_publish/CMIP6).
+        Only the snapshot and datasets under these roots are updated.
+    db : str, optional
+        The path to the sqlite database file, by default
+        ``catalog.DEFAULT_DB``. It is created if it does not exist.
+    max_workers : int, optional
+        The number of threads, by default ``MAX_WORKERS``.
+    verbose : bool, optional
+        Print progress for each tree level, by default False.
+
+    Returns
+    -------
+    Dict[str, int]
+        Crawl statistics: the number of directories visited ("dirs") and
+        listed ("listed"), the number of datasets ("datasets"), the number of
+        datasets written ("written") and retired ("retired") and the number
+        of dataset directories that do not follow the DRS ("unparsed").
+    """
+    roots = [os.path.abspath(root) for root in roots]
+
+    con = sqlite3.connect(db, timeout=30)
+    try:
+        new = _create_tables(con)
+        snapshot = load_snapshot(con, roots)
+        visited = walk(roots, snapshot, max_workers=max_workers, verbose=verbose)
+
+        # datasets (directories with netCDF files) to write and retire
+        rows = []
+        unparsed = 0
+        for dpath, (_, _, nfiles, listed, _) in visited.items():
+            if nfiles > 0 and listed:
+                facets = parse_drs(dpath)
+                if facets is None:
+                    unparsed += 1
+                    continue
+                rows.append(tuple([dpath + '/'] + [facets[c] for c in PATHS_COLUMNS[1:-2]]))
+
+        retired = [dpath + '/' for dpath, snap in snapshot.items()
+                   if snap[2] > 0 and (dpath not in visited or visited[dpath][2] == 0)]
+
+        path_column = con.execute('pragma table_info(paths)').fetchone()[1]
+        columns = [path_column] + PATHS_COLUMNS[1:-2]
+        updates = ', '.join(f'{c} = excluded.{c}' for c in columns[1:])
+        con.executemany(
+            f'insert into paths ({", ".join(columns)}, retired, ignored) '
+            f'values ({", ".join("?" * len(columns))}, 0, 0) '
+            f'on conflict({path_column}) do update set {updates}, retired = 0',
+            rows,
+        )
+        con.executemany(f'update paths set retired = 1 where {path_column} = ?',
+                        [(dpath,) for dpath in retired])
+
+        save_snapshot(con, visited, snapshot)
+        con.commit()
+    finally:
+        con.close()
+
+    if new:
+        catalog.create_indexes(db)
+    catalog.clear_cache()
+
+    stats = {
+        'dirs': len(visited),
+        'listed': sum(v[3] for v in visited.values()),
+        'datasets': sum(v[2] > 0 for v in visited.values()),
+        'written': len(rows),
+        'retired': len(retired),
+        'unparsed': unparsed,
+    }
+    if verbose:
+        print(stats)
+
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('roots', nargs='+', help='The root directories to crawl.')
+    parser.add_argument('--db', default=catalog.DEFAULT_DB,
+                        help='The catalog database (created if needed).')
+    parser.add_argument('--max-workers', type=int, default=MAX_WORKERS,
+                        help='The number of threads.')
+    args = parser.parse_args()
+
+    crawl(args.roots, db=args.db, max_workers=args.max_workers, verbose=True)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+De-duplication engine shared by xrw.trimModelList and cdw.trimModelList.
+
+Both functions pick one path per model and realization (rip) by applying a
+cascade of criteria (e.g., ver, cdate, tpoints, publish). Instead of scanning
+every path for every (model, rip) pair, paths are bucketed by (model, rip)
+once and the cascade is applied to each bucket, so the cost is linear in the
+number of paths.
+
+The selection is the same as the original nested loops: buckets are visited
+in sorted (model, rip) order, paths keep their input order within a bucket
+and the first path left after the cascade is selected.
+
+Example Usage:
+-------------
+    import dedup
+
+    groups = dedup.group_by_member(keyMap)
+    dpathsOut = dedup.select(groups, criteria,
+                             lambda dpaths, crit: filterXmls(dpaths, keyMap, crit))
+"""
+
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+# A type annotation for (model, rip) buckets of paths.
+Groups = Dict[Tuple[str, str], List[str]]
+# A criterion filter takes the paths of a bucket and a criterion, and returns
+# the paths with the best value of that criterion.
+FilterFunc = Callable[[List[str], str], List[str]]
+# A prefetch function takes a criterion and the paths it is about to be
+# applied to (e.g., to fetch their metadata concurrently).
+PrefetchFunc = Callable[[str, List[str]], None]
+
+
+def group_by_member(keyMap: Dict[str, Dict]) -> Groups:
+    """
+    groups = group_by_member(keyMap).
+
+    Buckets the paths of keyMap (paths are keys, linking to metadata with
+    'model' and 'rip' entries) by (model, rip) in one pass. Paths keep their
+    keyMap order within each bucket.
+    """
+    groups: Groups = {}
+    for fn, meta in keyMap.items():
+        groups.setdefault((meta['model'], meta['rip']), []).append(fn)
+
+    return groups
+
+
+def select(groups: Groups,
+           criteria: List[str],
+           filterFunc: FilterFunc,
+           prefetch: Optional[PrefetchFunc] = None,
+           verbose: bool = False) -> List[str]:
+    """
+    dpathsOut = select(groups, criteria, filterFunc).
+
+    Applies the cascade of criteria to each (model, rip) bucket with
+    filterFunc and returns the first remaining path of each bucket, in sorted
+    (model, rip) order. If verbose, each model is printed.
+
+    Each criterion is applied to every bucket before moving on to the next
+    one. If prefetch is given, it is called before each criterion with the
+    paths of all buckets that still have more than one candidate, so their
+    metadata can be fetched in one (concurrent) batch. Buckets with a single
+    candidate are never filtered.
+    """
+    # copy so the caller's buckets are not modified by filterFunc
+    candidates = {key: list(groups[key]) for key in groups}
+    for crit in criteria:
+        tied = [key for key in candidates if len(candidates[key]) > 1]
+        if len(tied) == 0:
+            break
+        if prefetch is not None:
+            prefetch(crit, [fn for key in tied for fn in candidates[key]])
+        # continue whittling down path lists until only one is left
+        for key in tied:
+            candidates[key] = filterFunc(candidates[key], crit)
+
+    dpathsOut = []
+    model: Optional[str] = None
+    for key in sorted(candidates):
+        if verbose and key[0] != model:
+            model = key[0]
+            print('  ' + model)
+        # if more than one path is left after criteria is applied,
+        # choose first one
+        if len(candidates[key]) > 0:
+            dpathsOut.append(candidates[key][0])
+
+    return dpathsOut
+
+
+def print_selection(groups: Groups, dpathsOut: List[str]):
+    """
+    print_selection(groups, dpathsOut).
+
+    Prints the paths of each (model, rip) bucket in sorted order, with the
+    selected path first (marked with an asterisk) and the unchosen paths
+    after it.
+    """
+    selected = set(dpathsOut)
+    for key in sorted(groups):
+        subdpaths = groups[key]
+        if len(subdpaths) > 1:
+            lowdpaths = []
+            for fn in subdpaths:
+                if fn in selected:
+                    print('* ' + fn)
+                else:
+                    lowdpaths.append(fn)
+            for fn in lowdpaths:
+                print(fn)
+        elif len(subdpaths) == 1:
+            print('* ' + subdpaths[0])
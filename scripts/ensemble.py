@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent ensemble processing for catalog search results.
+
+run_ensemble takes the dpaths returned by a catalog search (e.g.,
+``xrw.get_cmip_paths``) and a per-member pipeline function, runs the members
+concurrently and stacks the results along a ``member`` dimension.
+
+Members are run in a bounded thread pool. Each thread builds its member's lazy
+graph and computes it, so all members share whatever Dask scheduler is active
+(e.g., one ``dask.distributed.Client`` for the whole ensemble). A member that
+raises is recorded as a failure instead of aborting the ensemble.
+
+Example Usage:
+-------------
+    from dask.distributed import Client
+    import ensemble
+    import xrw
+
+    dpaths = xrw.get_cmip_paths(mip_era='CMIP6', experiment='historical',
+                                variable='tas', frequency='mon')
+    with Client():
+        gmsat, failures = ensemble.run_ensemble(dpaths, ensemble.gmsat_anomaly)
+"""
+
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import xarray as xr
+
+import opener
+
+# A type annotation for per-member pipelines.
+Pipeline = Callable[[str], xr.DataArray]
+
+
+def run_ensemble(
+    dpaths: List[str],
+    pipeline: Pipeline,
+    max_concurrency: int = 4,
+    label: Optional[Callable[[str], str]] = None,
+    client=None,
+    member_dim: str = "member",
+    verbose: bool = True,
+) -> Tuple[Optional[xr.DataArray], Dict[str, str]]:
+    """Run a pipeline on every dpath concurrently and stack the results.
+
+    Parameters
+    ----------
+    dpaths : List[str]
+        The data paths of the ensemble members.
+    pipeline : Pipeline
+        A function that takes a dpath and returns a (lazy or computed)
+        DataArray for that member. Results must be alignable across members
+        (e.g., use a calendar-independent time coordinate for multi-model
+        ensembles, as ``gmsat_anomaly`` does).
+    max_concurrency : int, optional
+        The maximum number of members processed at the same time, by default
+        4. This bounds the number of open datasets and in-flight graphs.
+    label : Optional[Callable[[str], str]], optional
+        A function that maps a dpath to its member label, by default
+        ``member_label``.
+    client : dask.distributed.Client, optional
+        The shared Dask client to compute members on, by default None which
+        uses the active scheduler.
+    member_dim : str, optional
+        The name of the stacked dimension, by default "member".
+    verbose : bool, optional
+        Whether to print progress, by default True.
+
+    Returns
+    -------
+    Tuple[Optional[xr.DataArray], Dict[str, str]]
+        The stacked results (None if every member failed) and a dictionary
+        mapping each failed dpath to its error message.
+    """
+    label = member_label if label is None else label
+
+    results: Dict[str, xr.DataArray] = {}
+    runtimes: Dict[str, float] = {}
+    failures: Dict[str, str] = {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {
+            executor.submit(_run_member, pipeline, dpath, client): dpath
+            for dpath in dpaths
+        }
+
+        for future in as_completed(futures):
+            dpath = futures[future]
+
+            try:
+                results[dpath], runtimes[dpath] = future.result()
+            except Exception as e:
+                failures[dpath] = f"{type(e).__name__}: {e}"
+
+                if verbose:
+                    print("problem processing, member skipped:\n", dpath, "\n", e)
+                continue
+
+            if verbose:
+                print(f"  {label(dpath)} ({runtimes[dpath]:.1f} s)")
+
+    # Keep the input order so the member dimension is deterministic.
+    ok_dpaths = [dpath for dpath in dpaths if dpath in results]
+    if len(ok_dpaths) == 0:
+        return None, failures
+
+    members = [
+        results[dpath].expand_dims({member_dim: [label(dpath)]})
+        for dpath in ok_dpaths
+    ]
+    da = xr.concat(members, dim=member_dim, join="outer", combine_attrs="drop")
+
+    # Provenance of each member.
+    da = da.assign_coords(
+        dpath=(member_dim, ok_dpaths),
+        runtime=(member_dim, [runtimes[dpath] for dpath in ok_dpaths]),
+    )
+    da.attrs["ensemble_pipeline"] = getattr(pipeline, "__name__", repr(pipeline))
+    da.attrs["ensemble_size"] = len(dpaths)
+    da.attrs["ensemble_failed"] = len(failures)
+    da.attrs["ensemble_created"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    return da, failures
+
+
+def _run_member(
+    pipeline: Pipeline, dpath: str, client
+) -> Tuple[xr.DataArray, float]:
+    start = time.perf_counter()
+
+    da = pipeline(dpath)
+    if client is not None:
+        da = client.compute(da).result()
+    else:
+        da = da.compute()
+
+    return da, time.perf_counter() - start
+
+
+def member_label(dpath: str) -> str:
+    """
+    label = member_label(dpath).
+
+    Returns a label of the form model.member for a CMIP DRS dpath, e.g.,
+    /p/css03/esgf_publish/CMIP6/CMIP/NCAR/CESM2/historical/r1i1p1f1/Amon/tas/gn/v20190308/
+    returns 'CESM2.r1i1p1f1'. The dpath is returned unchanged if it does not
+    have a CMIP5 or CMIP6 DRS layout.
+    """
+    parts = [p for p in dpath.split("/") if p != ""]
+    for i, p in enumerate(parts):
+        # CMIP6: .../CMIP6/activity/institute/model/experiment/member/table/...
+        if p == "CMIP6" and len(parts) > i + 5:
+            return parts[i + 3] + "." + parts[i + 5]
+        # CMIP5: .../cmip5/product/institute/model/experiment/freq/realm/table/member/...
+        if p.lower() == "cmip5" and len(parts) > i + 8:
+            return parts[i + 3] + "." + parts[i + 8]
+
+    return dpath
+
+
+def gmsat_anomaly(
+    dpath: str,
+    var_key: str = "tas",
+    start: str = "1979-01-01",
+    end: str = "2014-12-31",
+) -> xr.DataArray:
+    """
+    tasma = gmsat_anomaly(dpath).
+
+    The per-member pipeline of io_example.py: subsets the satellite era, takes
+    the cos(lat) weighted global mean and removes the monthly climatology.
+
+    The time coordinate is replaced with a decimal year (mid-month), so
+    members on different calendars can be stacked. The global mean is
+    computed (with the active scheduler) before the files of the member are
+    closed.
+    """
+    with opener.open_dataset(dpath, var_key=var_key) as ds:
+        tas = ds[var_key].sel(time=slice(start, end))
+
+        weights = np.cos(np.deg2rad(tas.lat))
+        weights.name = "weights"
+        tasm = tas.weighted(weights).mean(("lon", "lat")).load()
+
+    climatology = tasm.groupby("time.month").mean("time")
+    tasma = tasm.groupby("time.month") - climatology
+    tasma = tasma.drop_vars("month")
+
+    year = tasma.time.dt.year.values + (tasma.time.dt.month.values - 0.5) / 12.0
+    tasma = tasma.assign_coords(time=year)
+    tasma.time.attrs["units"] = "decimal year"
+    tasma.name = var_key
+
+    return tasma
@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+"""
+Time grouping indexes shared by group averages, climatologies and departures.
+
+The cookbook notebooks call ``ds.temporal.group_average(freq='season')``,
+``ds.temporal.climatology(freq='season')`` and ``groupby('time.season')``
+arithmetic on the same time axis, and every call derives the season labels,
+the DJF handling and the time bounds weights again, which is slow for long
+sub-daily cftime axes (e.g., 105,192 3-hourly time steps). Here:
+
+    - get_groups computes the grouping index of a time axis and frequency
+      once: the integer group of every time step, the time bounds lengths and
+      their weights (normalized in every group, like xCDAT), the time labels
+      of the groups (like xCDAT) and their position in the annual cycle and
+      season names. Groups are cached in memory by the time index object of
+      the dataset (shared by the datasets and variables derived from it, e.g.,
+      ``ds[var]`` or ``ds.isel(lat=0)``), frequency and options, and time
+      bounds lengths by the time bounds variable (so new time bounds with the
+      same time index get new weights)
+    - group_average, climatology and departures compute the (weighted, with
+      missing values skipped) results of the ``ds.temporal`` functions with
+      one sparse (group x time) matrix multiply per chunk with
+      xr.apply_ufunc (NumPy or Dask, with the whole time axis in every
+      chunk), from a given index or the cached one, and the climatology of a
+      reference period reuses the index of the whole axis
+
+Seasons are DJF, MAM, JJA and SON, with December in the DJF season of the
+next year (dec_mode='DJF', the xCDAT default) or of the same year
+(dec_mode='JFD').
+
+Example Usage:
+-------------
+    import grouping
+    import xcdat as xc
+
+    ds = xc.open_mfdataset('tas_3hr_*.nc', use_cftime=True)
+    ds_season = grouping.group_average(ds, 'tas', 'season')
+    ds_climo = grouping.climatology(ds, 'tas', 'season')
+    ds_anom = grouping.departures(ds, 'tas', 'season')  # reuses both indexes
+"""
+
+from __future__ import annotations
+
+import threading
+import weakref
+from collections import OrderedDict, namedtuple
+from typing import Dict, List, Optional, Tuple
+
+import cftime
+import numpy as np
+import xarray as xr
+
+# The frequencies of every mode.
+FREQS: Dict[str, List[str]] = {
+    'average': ['year', 'season', 'month', 'day', 'hour'],
+    'climatology': ['season', 'month'],
+}
+
+# The December modes of the seasons.
+DEC_MODES = ['DJF', 'JFD']
+
+# The season names and middle months (the months of their time labels, like
+# xCDAT), and the season of every month.
+SEASONS = ['DJF', 'MAM', 'JJA', 'SON']
+SEASON_MONTHS = [1, 4, 7, 10]
+MONTH_SEASONS = np.array([0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0])
+
+# The memory budget of the blocks of fields averaged at once (in MB of float64
+# temporaries).
+MAX_BLOCK_MB = 64.0
+
+# The maximum number of indexes kept in memory.
+MEMORY_CACHE_SIZE = 32
+
+# The grouping index of a time axis: the frequency and mode, the group of
+# every time step, the time bounds lengths (in days, ones if unweighted) and
+# weights (normalized in every group) of every time step, and the time
+# labels, positions in the annual cycle (months or seasons from 0, None for
+# the other frequencies) and season names (None for the other frequencies) of
+# every group.
+TimeGroups = namedtuple('TimeGroups', ['freq', 'mode', 'codes', 'lengths', 'weights',
+                                       'time', 'cycle', 'names'])
+
+_groups: OrderedDict[tuple, Tuple[weakref.ref, TimeGroups]] = OrderedDict()
+_lengths: OrderedDict[int, Tuple[xr.Variable, np.ndarray]] = OrderedDict()
+_lock = threading.Lock()
+
+
+def _get_bounds(ds: xr.Dataset) -> xr.DataArray:
+    key = ds['time'].attrs.get('bounds', 'time_bnds')
+    if key not in ds:
+        raise KeyError(f'No time bounds ({key!r}) in the dataset, which are '
+                       'needed for weighted averages.')
+
+    return ds[key]
+
+
+def time_lengths(bounds: np.ndarray) -> np.ndarray:
+    """
+    lengths = time_lengths(bounds).
+
+    Returns the lengths (in days) of (time, 2) time bounds (datetime64 or
+    cftime).
+    """
+    lengths = bounds[:, 1] - bounds[:, 0]
+    if lengths.dtype == object:
+        lengths = lengths.astype('timedelta64[ns]')
+
+    return lengths / np.timedelta64(1, 'D')
+
+
+def _get_keys(time: xr.DataArray, freq: str, mode: str, dec_mode: str) -> np.ndarray:
+    # the (integer) group keys of the time steps
+    month = time.dt.month.values - 1
+    if mode == 'climatology':
+        return month if freq == 'month' else MONTH_SEASONS[month]
+
+    year = time.dt.year.values.astype(np.int64)
+    if freq == 'year':
+        return year
+    if freq == 'season':
+        return (year + ((month == 11) & (dec_mode == 'DJF'))) * 4 + MONTH_SEASONS[month]
+
+    keys = year * 12 + month
+    if freq in ['day', 'hour']:
+        keys = keys * 31 + time.dt.day.values - 1
+    if freq == 'hour':
+        keys = keys * 24 + time.dt.hour.values
+
+    return keys
+
+
+def _get_labels(time: xr.DataArray,
+                keys: np.ndarray,
+                first: np.ndarray,
+                freq: str,
+                mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    # the time labels and cycle positions of the groups (with their keys and
+    # first time steps)
+    calendar = time.dt.calendar
+    if mode == 'climatology':
+        months = keys + 1 if freq == 'month' else np.array(SEASON_MONTHS)[keys]
+        labels = [cftime.datetime(1, month, 1, calendar=calendar) for month in months]
+
+        return np.array(labels), keys
+
+    if freq == 'season':
+        years, cycle = keys // 4, keys % 4
+        labels = [cftime.datetime(year, SEASON_MONTHS[season], 1, calendar=calendar)
+                  for year, season in zip(years, cycle)]
+
+        return np.array(labels), cycle
+
+    time = time.isel(time=first)
+    years, months = time.dt.year.values, time.dt.month.values
+    days = time.dt.day.values if freq in ['day', 'hour'] else np.ones_like(months)
+    hours = time.dt.hour.values if freq == 'hour' else np.zeros_like(months)
+    if freq == 'year':
+        months = np.ones_like(months)
+    labels = [cftime.datetime(*date, calendar=calendar)
+              for date in zip(years, months, days, hours)]
+
+    return np.array(labels), months - 1 if freq == 'month' else None
+
+
+def _normalize(codes: np.ndarray, lengths: np.ndarray, n_groups: int) -> np.ndarray:
+    # the weights of the time steps, normalized in every group
+    totals = np.bincount(codes, weights=lengths, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return lengths / totals[codes]
+
+
+def _compute_groups(ds: xr.Dataset,
+                    freq: str,
+                    mode: str,
+                    dec_mode: str) -> TimeGroups:
+    # the index of the time axis, without lengths and weights
+    keys = _get_keys(ds['time'], freq, mode, dec_mode)
+    unique, first, codes = np.unique(keys, return_index=True, return_inverse=True)
+
+    time, cycle = _get_labels(ds['time'], unique, first, freq, mode)
+    names = None if freq != 'season' else np.array(SEASONS)[cycle]
+
+    return TimeGroups(freq, mode, codes.reshape(-1), None, None, time, cycle, names)
+
+
+def _get_lengths(ds: xr.Dataset) -> np.ndarray:
+    # the time bounds lengths, cached by the time bounds variable (kept in the
+    # cache, so that its id is not reused, and shared by the datasets derived
+    # from ds unless their time bounds are replaced)
+    bounds = ds.variables[_get_bounds(ds).name]
+
+    with _lock:
+        entry = _lengths.get(id(bounds))
+        if entry is not None and entry[0] is bounds:
+            _lengths.move_to_end(id(bounds))
+            return entry[1]
+
+    lengths = time_lengths(bounds.values)
+
+    with _lock:
+        _lengths[id(bounds)] = (bounds, lengths)
+        _lengths.move_to_end(id(bounds))
+        while len(_lengths) > MEMORY_CACHE_SIZE:
+            _lengths.popitem(last=False)
+
+    return lengths
+
+
+def get_groups(ds: xr.Dataset,
+               freq: str,
+               mode: str = 'average',
+               weighted: bool = True,
+               dec_mode: str = 'DJF') -> TimeGroups:
+    """Get the grouping index of the time axis of a dataset, computed once.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        The dataset, with time bounds if weighted.
+    freq : str
+        The frequency of the groups (see ``FREQS``).
+    mode : str, optional
+        "average" (groups of every year, like ``ds.temporal.group_average``)
+        or "climatology" (groups of the annual cycle, like
+        ``ds.temporal.climatology``), by default "average".
+    weighted : bool, optional
+        Whether to weight the time steps by the length of their time bounds,
+        by default True.
+    dec_mode : str, optional
+        The year of the December of DJF seasons, "DJF" (the next year) or
+        "JFD" (the same year), by default "DJF".
+
+    Returns
+    -------
+    TimeGroups
+        The grouping index. The groups are cached by the time index of ds,
+        and the time bounds lengths by the time bounds variable of ds; the
+        weights are normalized again in every call.
+    """
+    if mode not in FREQS:
+        raise ValueError(f'Unsupported mode {mode!r}, use one of {list(FREQS)}.')
+    if freq not in FREQS[mode]:
+        raise ValueError(f'Unsupported freq {freq!r}, use one of {FREQS[mode]}.')
+    if dec_mode not in DEC_MODES:
+        raise ValueError(f'Unsupported dec_mode {dec_mode!r}, use one of {DEC_MODES}.')
+
+    index = ds.indexes['time']
+    key = (id(index), freq, mode, dec_mode)
+
+    with _lock:
+        entry = _groups.get(key)
+        if entry is not None and entry[0]() is index:
+            _groups.move_to_end(key)
+            groups = entry[1]
+        else:
+            groups = None
+
+    if groups is None:
+        groups = _compute_groups(ds, freq, mode, dec_mode)
+        with _lock:
+            _groups[key] = (weakref.ref(index), groups)
+            _groups.move_to_end(key)
+            while len(_groups) > MEMORY_CACHE_SIZE:
+                _groups.popitem(last=False)
+
+    lengths = _get_lengths(ds) if weighted else np.ones(len(groups.codes))
+
+    weights = _normalize(groups.codes, lengths, len(groups.time))
+
+    return groups._replace(lengths=lengths, weights=weights)
+
+
+def _subset(groups: TimeGroups, mask: np.ndarray) -> TimeGroups:
+    # the index of some time steps (e.g., a reference period), with the
+    # groups without any time step dropped and the weights normalized again
+    kept, codes = np.unique(groups.codes[mask], return_inverse=True)
+    lengths = groups.lengths[mask]
+
+    return groups._replace(
+        codes=codes, lengths=lengths, weights=_normalize(codes, lengths, len(kept)),
+        time=groups.time[kept],
+        cycle=None if groups.cycle is None else groups.cycle[kept],
+        names=None if groups.names is None else groups.names[kept],
+    )
+
+
+def _reference_mask(ds: xr.Dataset,
+                    reference_period: Optional[Tuple[str, str]]) -> Optional[np.ndarray]:
+    if reference_period is None:
+        return None
+
+    mask = np.zeros(ds.sizes['time'], dtype=bool)
+    mask[ds.indexes['time'].slice_indexer(*reference_period)] = True
+
+    return mask
+
+
+def _get_matrix(groups: TimeGroups):
+    # the sparse (group, time) matrix of the weights
+    import scipy.sparse
+
+    return scipy.sparse.csr_matrix(
+        (groups.weights, (groups.codes, np.arange(len(groups.codes)))),
+        shape=(len(groups.time), len(groups.codes)),
+    )
+
+
+def _average_groups(x: np.ndarray, matrix) -> np.ndarray:
+    # the weighted means of the valid values of x (on the last axis, time) in
+    # every group, vectorized over blocks of fields
+    shape = x.shape[:-1]
+    x = x.reshape(-1, x.shape[-1])
+    out = np.empty((matrix.shape[0], len(x)))
+
+    block_size = max(1, int(MAX_BLOCK_MB * 1024**2 // (x.shape[-1] * 8 * 3)))
+    for start in range(0, len(x), block_size):
+        block = x[start:start + block_size]
+        valid = np.isfinite(block)
+        total = matrix @ np.where(valid, block, 0.).T
+        weight = matrix @ valid.T.astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[:, start:start + block_size] = np.where(weight > 0, total / weight,
+                                                        np.nan)
+
+    return out.T.reshape(shape + (matrix.shape[0],))
+
+
+def _average(data: xr.DataArray, groups: TimeGroups) -> xr.DataArray:
+    # the weighted means of the valid values of every group, with one sparse
+    # matrix multiply per chunk (of the whole time axis)
+    data = data.drop_vars([c for c in data.coords if 'time' in data[c].dims])
+    if data.chunks is not None:
+        data = data.chunk({'time': -1})
+
+    mean = xr.apply_ufunc(
+        _average_groups,
+        data,
+        input_core_dims=[['time']],
+        output_core_dims=[['time']],
+        exclude_dims={'time'},
+        kwargs={'matrix': _get_matrix(groups)},
+        dask='parallelized',
+        output_dtypes=[np.float64],
+        dask_gufunc_kwargs={'output_sizes': {'time': len(groups.time)}},
+        keep_attrs=True,
+    )
+    mean = mean.assign_coords(time=('time', groups.time, {'axis': 'T'}))
+
+    return mean.transpose(*data.dims)
+
+
+def _to_dataset(ds: xr.Dataset,
+                var_key: str,
+                data: xr.DataArray,
+                groups: TimeGroups,
+                mode: str,
+                weighted: bool) -> xr.Dataset:
+    data.attrs.update({'operation': 'temporal_avg', 'mode': mode,
+                       'freq': groups.freq, 'weighted': str(weighted)})
+    grid = ds[[key for key, var in ds.data_vars.items()
+               if key != var_key and 'time' not in var.dims]]
+
+    return grid.drop_dims('time', errors='ignore').assign({var_key: data})
+
+
+def group_average(ds: xr.Dataset,
+                  var_key: str,
+                  freq: str,
+                  weighted: bool = True,
+                  groups: Optional[TimeGroups] = None,
+                  dec_mode: str = 'DJF') -> xr.Dataset:
+    """
+    ds_avg = group_average(ds, var_key, freq, weighted, groups, dec_mode).
+
+    Returns the averages of a variable over the groups of every year (e.g.,
+    the seasons of every year) like ``ds.temporal.group_average``, with the
+    given grouping index (mode "average") or the cached one.
+    """
+    if groups is None:
+        groups = get_groups(ds, freq, 'average', weighted, dec_mode)
+
+    return _to_dataset(ds, var_key, _average(ds[var_key], groups), groups,
+                       'group_average', weighted)
+
+
+def climatology(ds: xr.Dataset,
+                var_key: str,
+                freq: str,
+                weighted: bool = True,
+                reference_period: Optional[Tuple[str, str]] = None,
+                groups: Optional[TimeGroups] = None) -> xr.Dataset:
+    """
+    ds_climo = climatology(ds, var_key, freq, weighted, reference_period, groups).
+
+    Returns the climatology of a variable like ``ds.temporal.climatology``
+    (optionally over a (start, end) reference period), with the given grouping
+    index of the whole time axis (mode "climatology") or the cached one.
+    """
+    if groups is None:
+        groups = get_groups(ds, freq, 'climatology', weighted)
+    data = ds[var_key]
+
+    mask = _reference_mask(ds, reference_period)
+    if mask is not None:
+        groups = _subset(groups, mask)
+        data = data.isel(time=np.flatnonzero(mask))
+
+    return _to_dataset(ds, var_key, _average(data, groups), groups, 'climatology',
+                       weighted)
+
+
+def departures(ds: xr.Dataset,
+               var_key: str,
+               freq: str,
+               weighted: bool = True,
+               reference_period: Optional[Tuple[str, str]] = None,
+               dec_mode: str = 'DJF') -> xr.Dataset:
+    """
+    ds_departs = departures(ds, var_key, freq, weighted, reference_period, dec_mode).
+
+    Returns the departures of a variable from its climatology like
+    ``ds.temporal.departures``: the group averages of every year (see
+    group_average) minus the climatology of their group, with the cached
+    grouping indexes of the time axis.
+    """
+    ds_avg = group_average(ds, var_key, freq, weighted, dec_mode=dec_mode)
+    ds_climo = climatology(ds, var_key, freq, weighted, reference_period)
+
+    return subtract(ds_avg, ds_climo[var_key], var_key,
+                    get_groups(ds, freq, 'average', weighted, dec_mode))
+
+
+def subtract(ds_avg: xr.Dataset,
+             climo: xr.DataArray,
+             var_key: str,
+             groups: TimeGroups) -> xr.Dataset:
+    """
+    ds_departs = subtract(ds_avg, climo, var_key, groups).
+
+    Returns the departures of group averages (with their grouping index) from
+    a climatology (with a time label per month or season, e.g., of
+    climatology), NaN for the groups missing from the climatology.
+    """
+    if groups.freq not in FREQS['climatology']:
+        raise ValueError(f'Unsupported freq {groups.freq!r} for departures, use one '
+                         f"of {FREQS['climatology']}.")
+
+    months = [label.month for label in climo['time'].values]
+    position = np.full(12, -1)
+    for idx, month in enumerate(months):
+        position[month - 1 if groups.freq == 'month' else SEASON_MONTHS.index(month)] = idx
+    position = xr.DataArray(position[groups.cycle], dims='time')
+
+    matched = climo.isel(time=np.maximum(position, 0)).drop_vars('time')
+    departs = ds_avg[var_key] - matched.where(position >= 0)
+    departs.attrs.update(ds_avg[var_key].attrs)
+    departs.attrs['mode'] = 'departures'
+
+    return ds_avg.assign({var_key: departs.transpose(*ds_avg[var_key].dims)})
+
+
+def clear_cache():
+    """Drop the indexes and time bounds lengths kept in memory."""
+    with _lock:
+        _groups.clear()
+        _lengths.clear()
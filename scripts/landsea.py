@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Land-sea fraction of lat/lon grids, cached by grid fingerprint.
+
+validation/prototyping/landsea_mask/landsea_mask.ipynb generates the mask of
+a dataset with cdutil.generateLandSeaMask on one time step (regridding the
+1/6 degree navy land fraction with regrid2 for every call), then rebuilds
+xarray objects from Python lists of the cdms2 axes. Here:
+
+    - generate_fraction computes the land fraction of any lat/lon grid
+      directly from its coordinates (and bounds): the area-weighted average of
+      a high resolution source (the navy land fraction of cdutil by default)
+      over each cell, as regrid2 does. For rectilinear grids the area overlaps
+      are separable, so this is two sparse matrix multiplies
+    - the fractions are cached by grid fingerprint (opener.grid_fingerprint)
+      and source, in memory and as small .npz files in a cache directory
+      (written atomically, see arraycache)
+    - apply_mask masks a (lazy) time series with a broadcast where on the
+      fraction, which shares the coordinates of the data, so there is no
+      alignment copy and no per-timestep Python work
+
+The fraction is the area-weighted source fraction, without the coastline
+adjustments of cdutil.generateLandSeaMask (threshold_1 and threshold_2), so
+a few coastal cells differ from cdutil.
+
+Example Usage:
+-------------
+    import landsea
+    import xarray as xr
+
+    ds = xr.open_dataset('ts_Amon_ACCESS1-0_historical_r1i1p1_185001-200512.nc',
+                         chunks={'time': 120})
+    sftlf = landsea.generate_fraction(ds)
+    ts_ocean = landsea.apply_mask(ds['ts'], sftlf, keep='ocean')
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sys
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import xarray as xr
+
+import arraycache
+import opener
+
+# The default source: the navy 1/6 degree land fraction shipped with cdutil.
+DEFAULT_SOURCE = os.path.join(sys.prefix, 'share', 'cdutil', 'navy_land.nc')
+
+# The default fraction cache directory.
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+                             'xcdat-validation', 'landsea')
+
+# The maximum number of fractions kept in memory.
+MEMORY_CACHE_SIZE = 16
+
+_fractions = arraycache.memory_cache()
+_sources = arraycache.memory_cache()
+
+
+def open_source(path: str = DEFAULT_SOURCE, var_key: str = 'sftlf') -> xr.DataArray:
+    """
+    source = open_source(path, var_key).
+
+    Returns the (loaded) land fraction of a high resolution source file, as a
+    fraction from 0 to 1 (percentages are divided by 100). The last source is
+    kept in memory.
+    """
+    key = _source_key(path, var_key)
+
+    source = arraycache.get(_sources, key)
+    if source is not None:
+        return source
+
+    with xr.open_dataset(path) as ds:
+        source = ds[var_key].load()
+    if np.nanmax(source.values) > 1.0:
+        source = source / 100.0
+
+    return arraycache.put(_sources, key, source, 1)
+
+
+def _source_key(source: Union[str, xr.DataArray], var_key: str = 'sftlf') -> str:
+    # a file source is identified by its path, size and mtime, an in-memory
+    # source by its grid and values
+    h = hashlib.sha1()
+    if isinstance(source, str):
+        st = os.stat(source)
+        h.update(str((os.path.abspath(source), var_key, st.st_size,
+                      st.st_mtime)).encode())
+    else:
+        h.update(opener.grid_fingerprint(get_grid(source), bounds=True).encode())
+        h.update(np.ascontiguousarray(source.values).tobytes())
+
+    return h.hexdigest()
+
+
+def get_grid(obj: Union[xr.Dataset, xr.DataArray]) -> xr.Dataset:
+    """
+    grid = get_grid(obj).
+
+    Returns the lat and lon of a dataset or data array, and their bounds if
+    it is a dataset that has them, as a dataset.
+    """
+    grid = xr.Dataset(coords={'lat': obj['lat'], 'lon': obj['lon']})
+    if isinstance(obj, xr.Dataset):
+        for key in ['lat', 'lon']:
+            bounds = obj[key].attrs.get('bounds', f'{key}_bnds')
+            if bounds in obj.variables:
+                # open_mfdataset may concatenate the bounds along time
+                var = obj[bounds]
+                grid[bounds] = var.isel({dim: 0 for dim in var.dims
+                                         if dim not in [key, var.dims[-1]]})
+
+    return grid
+
+
+def get_bounds(grid: xr.Dataset, key: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    lower, upper = get_bounds(grid, key).
+
+    Returns the lower and upper edges (in degrees) of the cells of the lat or
+    lon axis of a grid, from its bounds or halfway between the centers (with
+    lat clipped to +-90).
+    """
+    bounds = grid[key].attrs.get('bounds', f'{key}_bnds')
+    if bounds in grid.variables:
+        values = np.asarray(grid[bounds].values, dtype=np.float64)
+        return values.min(axis=1), values.max(axis=1)
+
+    centers = np.asarray(grid[key].values, dtype=np.float64)
+    if len(centers) == 1:
+        edges = np.array([-90., 90.]) if key == 'lat' else np.array([0., 360.])
+    else:
+        mid = (centers[:-1] + centers[1:]) / 2
+        edges = np.concatenate([[2 * centers[0] - mid[0]], mid,
+                                [2 * centers[-1] - mid[-1]]])
+    if key == 'lat':
+        edges = np.clip(edges, -90., 90.)
+
+    return np.minimum(edges[:-1], edges[1:]), np.maximum(edges[:-1], edges[1:])
+
+
+def _overlap(target: Tuple[np.ndarray, np.ndarray],
+             source: Tuple[np.ndarray, np.ndarray],
+             period: Optional[float] = None):
+    # the sparse (n_target, n_source) matrix of the overlap lengths of the
+    # target and source cells (shifting the source by a period, if any)
+    import scipy.sparse
+
+    lo_t, hi_t = target[0][:, None], target[1][:, None]
+    shifts = [0.] if period is None else [-period, 0., period]
+    overlap = 0.
+    for shift in shifts:
+        lo_s, hi_s = source[0][None, :] + shift, source[1][None, :] + shift
+        overlap = overlap + np.clip(np.minimum(hi_t, hi_s) - np.maximum(lo_t, lo_s),
+                                    0., None)
+
+    return scipy.sparse.csr_matrix(overlap)
+
+
+def _compute_fraction(grid: xr.Dataset, source: xr.DataArray) -> np.ndarray:
+    # the area-weighted average of the source over each cell of the grid
+    source = source.transpose('lat', 'lon')
+    src_grid = get_grid(source)
+
+    # the area of a lat band is proportional to the difference of the sines
+    # of its edges
+    lat_t = [np.sin(np.deg2rad(e)) for e in get_bounds(grid, 'lat')]
+    lat_s = [np.sin(np.deg2rad(e)) for e in get_bounds(src_grid, 'lat')]
+    w_lat = _overlap(lat_t, lat_s)
+    w_lon = _overlap(get_bounds(grid, 'lon'), get_bounds(src_grid, 'lon'),
+                     period=360.)
+
+    values = np.nan_to_num(np.asarray(source.values, dtype=np.float64))
+    total = w_lat @ (w_lon @ values.T).T
+    area = np.outer(np.asarray(w_lat.sum(axis=1)).ravel(),
+                    np.asarray(w_lon.sum(axis=1)).ravel())
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = total / area
+
+    return np.clip(fraction, 0., 1.)
+
+
+def generate_fraction(obj: Union[xr.Dataset, xr.DataArray],
+                      source: Union[str, xr.DataArray] = DEFAULT_SOURCE,
+                      cache: Optional[str] = DEFAULT_CACHE) -> xr.DataArray:
+    """Generate the land fraction of the grid of a dataset or data array.
+
+    Parameters
+    ----------
+    obj : Union[xr.Dataset, xr.DataArray]
+        The data on the target grid (its lat and lon, and their bounds if it
+        is a dataset that has them). The data itself is never read.
+    source : Union[str, xr.DataArray], optional
+        The high resolution land fraction (a file with a "sftlf" variable or
+        a data array on lat and lon, in fraction or percent), by default
+        ``DEFAULT_SOURCE``.
+    cache : Optional[str], optional
+        The cache directory, by default ``DEFAULT_CACHE``. If None, the
+        fractions are only cached in memory.
+
+    Returns
+    -------
+    xr.DataArray
+        The land fraction (0 to 1) "sftlf", on the lat and lon coordinates of
+        obj.
+    """
+    grid = get_grid(obj)
+    h = hashlib.sha1()
+    h.update(opener.grid_fingerprint(grid, bounds=True).encode())
+    h.update(_source_key(source).encode())
+    key = h.hexdigest()
+    path = None if cache is None else os.path.join(cache, key + '.npz')
+
+    fraction = arraycache.get(_fractions, key)
+    if fraction is None:
+        arrays = arraycache.load_npz(path, ['sftlf'])
+        if arrays is None:
+            if isinstance(source, str):
+                source = open_source(source)
+            fraction = _compute_fraction(grid, source)
+            arraycache.save_npz(path, {'sftlf': fraction})
+        else:
+            fraction = arrays['sftlf']
+
+        arraycache.put(_fractions, key, fraction, MEMORY_CACHE_SIZE)
+
+    return xr.DataArray(fraction, dims=('lat', 'lon'),
+                        coords={'lat': grid['lat'], 'lon': grid['lon']},
+                        name='sftlf',
+                        attrs={'units': '1', 'long_name': 'Land Area Fraction'})
+
+
+def apply_mask(data: Union[xr.DataArray, xr.Dataset],
+               fraction: Optional[xr.DataArray] = None,
+               keep: str = 'ocean',
+               threshold: float = 0.5,
+               **kwargs) -> Union[xr.DataArray, xr.Dataset]:
+    """
+    masked = apply_mask(data, fraction, keep, threshold).
+
+    Masks the land (keep='ocean', fraction < threshold is kept) or the ocean
+    (keep='land', fraction >= threshold is kept) of data with a broadcast
+    where, which stays lazy for Dask arrays. The fraction is generated from
+    the grid of data (with the generate_fraction kwargs) if not given.
+    """
+    if keep not in ['land', 'ocean']:
+        raise ValueError(f'Unsupported keep {keep!r}, use "land" or "ocean".')
+    if fraction is None:
+        fraction = generate_fraction(data, **kwargs)
+
+    mask = fraction >= threshold if keep == 'land' else fraction < threshold
+
+    return data.where(mask)
+
+
+def clear_cache(cache: Optional[str] = None):
+    """
+    clear_cache(cache).
+
+    Clears the in-memory fractions and sources, and removes the entries of a
+    cache directory if one is given.
+    """
+    arraycache.clear(_fractions)
+    arraycache.clear(_sources)
+    arraycache.remove_files(cache)
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Header-only dataset metadata used to break ties when de-duplicating paths.
+
+xrw.trimModelList breaks ties between paths of the same model and
+realization with their creation date (cdate), whether they were republished
+(publish) and their number of time steps (tpoints). Reading those with
+xr.open_mfdataset decodes and combines every file of the dataset. Here they
+are read from the netCDF file headers only (global attributes and the length
+of the time dimension), concurrently across a thread pool.
+
+The results are stored keyed by path and the modification time of the
+path, so later calls reuse them and never reopen datasets unless the
+directory changed. By default, they are stored in a small per-user sqlite
+cache (DEFAULT_CACHE). With write_back=True (and write access to the
+catalog), they are written back into the catalog's paths table instead
+(cdate, publish, tpoints and meta_mtime columns), so every user of the
+catalog reuses them; if the catalog is read-only, they go to the cache.
+
+cdw.trimModelList reads the same metadata from CDAT xml files with
+cdw.getFileMeta. get_file_metadata runs any such reader in a process pool
+(cdms2 is neither thread-safe nor I/O-bound when parsing xml) and caches the
+results in the same sqlite cache.
+
+Example Usage:
+-------------
+    import metadata
+
+    meta = metadata.get_metadata(dpaths, db='/p/user_pub/xclim/persist/xml.db',
+                                 write_back=True)
+    cdate, publish, tpoints = meta[dpaths[0]]
+
+    meta = metadata.get_file_metadata(files, cdw.getFileMeta)
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import catalog
+
+# The tie-break criteria that need dataset metadata.
+META_CRITERIA = ('cdate', 'publish', 'tpoints')
+
+# The default creation date (PCMDI dawn of time, 9am Monday 6th March 1989).
+DEFAULT_CDATE = '1989-03-06T17:00:00Z'
+
+# The default number of threads (or processes) used to read metadata.
+MAX_WORKERS = 8
+
+# The default on-disk cache of get_metadata and get_file_metadata.
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+                             'xcdat-validation', 'filemeta.db')
+
+# A type annotation for (cdate, publish, tpoints).
+Meta = Tuple[int, bool, int]
+
+# netCDF-C / HDF5 are not thread-safe, so the library calls are serialized.
+# Listing and stat-ing directories (the slow part on network filesystems)
+# still runs concurrently.
+_nc_lock = threading.Lock()
+
+
+def parse_cdate(cdate: str) -> int:
+    """
+    cdate = parse_cdate(creation_date).
+
+    Converts a creation_date attribute to an int of the form YYYYMMDD. Most
+    dates are of the form 2012-02-13T00:40:33Z, some are of the form
+    Thu Aug 11 22:49:09 EST 2011, which is converted to 20110101.
+    """
+    if cdate[0].isalpha():
+        return int(cdate.split(' ')[-1] + '0101')
+
+    return int(cdate.split('T')[0].replace('-', ''))
+
+
+def read_header_metadata(dpath: str) -> Meta:
+    """
+    cdate, publish, tpoints = read_header_metadata(dpath).
+
+    Reads the metadata of the dataset in dpath from its file headers. The
+    creation date is read from the first file (in sorted order) and tpoints is
+    the total length of the time dimension across files. Returns zeros if the
+    files cannot be read.
+    """
+    # imported here so cdw (CDAT environments) can use this module without it
+    import netCDF4
+
+    try:
+        files = sorted(glob.glob(dpath + '*'))
+        if len(files) == 0:
+            raise OSError('no files to open')
+
+        cdate = None
+        tpoints = 0
+        for fn in files:
+            with _nc_lock:
+                with netCDF4.Dataset(fn) as fh:
+                    if cdate is None:
+                        cdate = getattr(fh, 'creation_date', DEFAULT_CDATE)
+                    if 'time' in fh.dimensions and 'time' in fh.variables:
+                        tpoints += len(fh.dimensions['time'])
+    except Exception:
+        print('problem opening, path skipped:\n', dpath)
+        return 0, 0, 0
+
+    cdate = parse_cdate(str(cdate))
+    # check if republished
+    publish = bool(dpath.find('publish'))
+
+    return cdate, publish, tpoints
+
+
+def get_metadata(
+    dpaths: List[str],
+    db: Optional[str] = None,
+    stored: Optional[Dict[str, tuple]] = None,
+    max_workers: int = MAX_WORKERS,
+    write_back: bool = False,
+    cache: Optional[str] = DEFAULT_CACHE,
+) -> Dict[str, Meta]:
+    """Get the metadata of many paths, reusing stored values when valid.
+
+    Parameters
+    ----------
+    dpaths : List[str]
+        The data paths.
+    db : Optional[str], optional
+        The catalog database to write newly read metadata back to if
+        write_back, by default None.
+    stored : Optional[Dict[str, tuple]], optional
+        Stored (cdate, publish, tpoints, meta_mtime) of paths, e.g., from the
+        catalog query. They are used if the path's mtime is unchanged.
+    max_workers : int, optional
+        The number of threads, by default ``MAX_WORKERS``.
+    write_back : bool, optional
+        Whether to write newly read metadata to the paths table of db (see
+        ``write_metadata``, which alters the table and needs write access),
+        by default False.
+    cache : Optional[str], optional
+        The sqlite cache file, by default ``DEFAULT_CACHE``. Paths without
+        valid stored values are looked up in it, and newly read metadata is
+        written to it unless it is written back to the catalog. Entries are
+        keyed by path and modification time. If None, nothing is cached.
+
+    Returns
+    -------
+    Dict[str, Meta]
+        The (cdate, publish, tpoints) of each path (zeros if unreadable).
+    """
+    stored = {} if stored is None else stored
+
+    def _mtime(dpath: str) -> Optional[float]:
+        try:
+            return os.stat(dpath).st_mtime
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        mtimes = dict(zip(dpaths, executor.map(_mtime, dpaths)))
+
+        meta: Dict[str, Meta] = {}
+        for dpath, mtime in mtimes.items():
+            m = stored.get(dpath)
+            if m is not None and mtime is not None and m[3] == mtime:
+                meta[dpath] = tuple(m[:3])
+
+        if cache is not None:
+            misses = {dpath: mtimes[dpath] for dpath in dpaths
+                      if dpath not in meta}
+            for dpath, (cdate, publish, tpoints) in _read_cache(cache, misses).items():
+                meta[dpath] = (cdate, bool(publish), tpoints)
+
+        misses = [dpath for dpath in dpaths if dpath not in meta]
+        meta.update(zip(misses, executor.map(read_header_metadata, misses)))
+
+    records = [
+        (dpath, meta[dpath], mtimes[dpath])
+        for dpath in misses
+        if mtimes[dpath] is not None and 0 not in meta[dpath]
+    ]
+    if len(records) > 0:
+        written = False
+        if write_back and db is not None:
+            try:
+                write_metadata(db, records)
+                written = True
+            except sqlite3.Error as e:
+                print('metadata not written back to the catalog:', e)
+
+        if not written and cache is not None:
+            try:
+                _write_cache(cache, records)
+            except sqlite3.Error as e:
+                print('metadata not written to the cache:', e)
+
+    return {dpath: meta[dpath] for dpath in dpaths}
+
+
+def write_metadata(db: str, records: List[Tuple[str, Meta, float]]):
+    """Write (dpath, (cdate, publish, tpoints), mtime) records to the catalog.
+
+    The cdate, publish, tpoints and meta_mtime columns are added to the paths
+    table if they do not exist yet. This needs write access to the database.
+    """
+    con = sqlite3.connect(db, timeout=30)
+    try:
+        columns = [row[1] for row in con.execute('pragma table_info(paths)')]
+        path_column = columns[0]
+        for column, ctype in [('cdate', 'integer'), ('publish', 'integer'),
+                              ('tpoints', 'integer'), ('meta_mtime', 'real')]:
+            if column not in columns:
+                con.execute(f'alter table paths add column {column} {ctype}')
+
+        con.executemany(
+            'update paths set cdate = ?, publish = ?, tpoints = ?, '
+            f'meta_mtime = ? where {path_column} = ?',
+            [(cdate, int(publish), tpoints, mtime, dpath)
+             for dpath, (cdate, publish, tpoints), mtime in records],
+        )
+        con.commit()
+    finally:
+        con.close()
+
+    # the catalog cache is keyed by the database mtime, but make sure the
+    # next query does not see results from within the same mtime tick
+    catalog.clear_cache()
+
+
+def get_file_metadata(
+    files: List[str],
+    reader: Callable[[str], Meta],
+    cache: Optional[str] = DEFAULT_CACHE,
+    max_workers: int = MAX_WORKERS,
+) -> Dict[str, Meta]:
+    """Get the metadata of many files with a reader, cached on disk.
+
+    Parameters
+    ----------
+    files : List[str]
+        The files (e.g., CDAT xml files).
+    reader : Callable[[str], Meta]
+        A module-level function (so it can be sent to worker processes) that
+        returns the (cdate, publish, tpoints) of a file, or zeros if the file
+        cannot be read (e.g., ``cdw.getFileMeta``).
+    cache : Optional[str], optional
+        The sqlite cache file, by default ``DEFAULT_CACHE``. Entries are
+        keyed by path and modification time. If None, nothing is cached.
+    max_workers : int, optional
+        The number of processes, by default ``MAX_WORKERS``.
+
+    Returns
+    -------
+    Dict[str, Meta]
+        The (cdate, publish, tpoints) of each file (zeros if unreadable).
+    """
+    if len(files) == 0:
+        return {}
+
+    def _mtime(fn: str) -> Optional[float]:
+        try:
+            return os.stat(fn).st_mtime
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        mtimes = dict(zip(files, executor.map(_mtime, files)))
+
+    meta: Dict[str, Meta] = {}
+    if cache is not None:
+        for fn, (cdate, publish, tpoints) in _read_cache(cache, mtimes).items():
+            meta[fn] = (cdate, bool(publish), tpoints)
+
+    misses = [fn for fn in files if fn not in meta]
+    if len(misses) == 1 or max_workers == 1:
+        results = [reader(fn) for fn in misses]
+    elif len(misses) > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(misses))) as executor:
+            results = list(executor.map(reader, misses))
+    else:
+        results = []
+    meta.update(zip(misses, results))
+
+    records = [
+        (fn, m, mtimes[fn])
+        for fn, m in zip(misses, results)
+        if mtimes[fn] is not None and 0 not in m
+    ]
+    if cache is not None and len(records) > 0:
+        try:
+            _write_cache(cache, records)
+        except sqlite3.Error as e:
+            print('metadata not written to the cache:', e)
+
+    return {fn: meta[fn] for fn in files}
+
+
+def _connect_cache(cache: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(cache)), exist_ok=True)
+    con = sqlite3.connect(cache, timeout=30)
+    con.execute('create table if not exists filemeta (path text primary key, '
+                'mtime real, cdate integer, publish integer, tpoints integer)')
+
+    return con
+
+
+def _read_cache(cache: str, mtimes: Dict[str, Optional[float]]) -> Dict[str, tuple]:
+    # the cached (cdate, publish, tpoints) of files with an unchanged mtime
+    if not os.path.exists(cache):
+        return {}
+
+    files = [fn for fn, mtime in mtimes.items() if mtime is not None]
+    hits = {}
+    con = _connect_cache(cache)
+    try:
+        # stay below the sqlite limit on the number of parameters
+        for i in range(0, len(files), 500):
+            chunk = files[i:i + 500]
+            rows = con.execute(
+                'select path, mtime, cdate, publish, tpoints from filemeta '
+                f'where path in ({", ".join("?" * len(chunk))})', chunk)
+            for fn, mtime, cdate, publish, tpoints in rows:
+                if mtime == mtimes[fn]:
+                    hits[fn] = (cdate, publish, tpoints)
+    finally:
+        con.close()
+
+    return hits
+
+
+def _write_cache(cache: str, records: List[Tuple[str, Meta, float]]):
+    con = _connect_cache(cache)
+    try:
+        con.executemany(
+            'insert or replace into filemeta values (?, ?, ?, ?, ?)',
+            [(fn, mtime, cdate, int(publish), tpoints)
+             for fn, (cdate, publish, tpoints), mtime in records],
+        )
+        con.commit()
+    finally:
+        con.close()
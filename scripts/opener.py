@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk opener for catalog search results (e.g., ``xrw.get_cmip_paths``).
+
+Opening each dpath with the default ``xr.open_mfdataset(dpath + '*.nc')``
+reads the lat, lon, bounds and time variables of every file, infers the file
+order from the time values and compares the non-concatenated variables of
+every file during the combine. For CMIP datasets, the files of a dataset
+share their grid and their filenames sort in time order, so here:
+
+    - the first file of each dataset is opened fully, the other files are
+      opened without the variables that do not depend on time (they are
+      never read)
+    - files are concatenated along time in filename order, without comparing
+      or aligning the other variables (they are taken from the first file)
+    - the lat/lon bounds of each distinct grid (fingerprinted by the lat and
+      lon values) are read once and shared in memory by every dataset on
+      that grid
+    - the files of all dpaths are listed in a thread pool, and the datasets
+      are assembled from the variables of their files directly. Closing a
+      dataset (or using it as a context manager) closes its files, like
+      ``xr.open_mfdataset``
+
+netCDF-C / HDF5 are not thread-safe, so opening files (reading their
+headers) is serialized by a lock; reading the data later goes through
+xarray's own locks. The data variables stay lazy (dask) arrays.
+
+Example Usage:
+-------------
+    import opener
+    import xrw
+
+    dpaths = xrw.get_cmip_paths(mip_era='CMIP6', experiment='historical',
+                                variable='tas', frequency='mon')
+    datasets, failures = opener.open_datasets(dpaths, var_key='tas')
+"""
+
+from __future__ import annotations
+
+import functools
+import glob
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+import xarray as xr
+
+# The default number of threads used to open files.
+MAX_WORKERS = 8
+
+# The maximum number of grids kept in the shared grid cache.
+GRID_CACHE_SIZE = 64
+
+# The bounds of each grid fingerprint, as in-memory variables.
+_grids: OrderedDict[str, Dict[str, xr.Variable]] = OrderedDict()
+_grids_lock = threading.Lock()
+
+# netCDF-C / HDF5 are not thread-safe, so opening files is serialized.
+_open_lock = threading.Lock()
+
+
+def get_files(dpath: str) -> List[str]:
+    """Get the netCDF files of a dpath, in filename (i.e., time) order."""
+    return sorted(glob.glob(dpath + '*.nc'))
+
+
+def grid_fingerprint(ds: xr.Dataset, bounds: bool = False) -> Optional[str]:
+    """
+    fingerprint = grid_fingerprint(ds, bounds).
+
+    Returns a hash of the lat and lon coordinate values of a dataset (None if
+    it does not have both) and, if bounds, of their bounds (if any), so grids
+    with the same centers but different cells have different fingerprints.
+    """
+    if 'lat' not in ds.coords or 'lon' not in ds.coords:
+        return None
+
+    h = hashlib.sha1()
+    for key in ['lat', 'lon']:
+        keys = [key]
+        if bounds:
+            bounds_key = ds[key].attrs.get('bounds', f'{key}_bnds')
+            if bounds_key in ds.variables:
+                keys.append(bounds_key)
+        for k in keys:
+            values = ds[k].values
+            h.update(str((k, values.dtype, values.shape)).encode())
+            h.update(values.tobytes())
+
+    return h.hexdigest()
+
+
+def _get_bounds_keys(ds: xr.Dataset, keys: List[str] = ['lat', 'lon']) -> List[str]:
+    bounds_keys = []
+    for key in keys:
+        if key not in ds.variables:
+            continue
+        bounds = ds[key].attrs.get('bounds', f'{key}_bnds')
+        if bounds in ds.variables:
+            bounds_keys.append(bounds)
+
+    return bounds_keys
+
+
+def _get_grid_bounds(ds: xr.Dataset) -> Dict[str, xr.Variable]:
+    # the in-memory lat/lon bounds of the grid of ds, read once per grid
+    fingerprint = grid_fingerprint(ds)
+    keys = [key for key in _get_bounds_keys(ds) if 'time' not in ds[key].dims]
+    if fingerprint is None or len(keys) == 0:
+        return {}
+
+    with _grids_lock:
+        bounds = _grids.get(fingerprint)
+        if bounds is None or set(bounds) != set(keys):
+            with _open_lock:
+                bounds = {key: ds.variables[key].load() for key in keys}
+            _grids[fingerprint] = bounds
+            if len(_grids) > GRID_CACHE_SIZE:
+                _grids.popitem(last=False)
+        else:
+            _grids.move_to_end(fingerprint)
+
+    return bounds
+
+
+def _combine_files(dsets: List[xr.Dataset]) -> xr.Dataset:
+    # concatenate the variables that depend on time, take the other variables
+    # (e.g., lat, lon and the grid bounds) from the first file
+    first = dsets[0]
+    variables = dict(first.variables)
+    if len(dsets) > 1:
+        for key, var in first.variables.items():
+            if 'time' in var.dims:
+                variables[key] = xr.Variable.concat(
+                    [ds.variables[key] for ds in dsets], dim='time'
+                )
+    variables.update(_get_grid_bounds(first))
+
+    coords = {key: variables.pop(key) for key in first.coords}
+
+    return xr.Dataset(variables, coords=coords, attrs=first.attrs)
+
+
+def _close_all(dsets: List[xr.Dataset]):
+    # the close hook of datasets assembled from other (per-file) datasets
+    for ds in dsets:
+        ds.close()
+
+
+def open_datasets(
+    dpaths: List[str],
+    var_key: Optional[str] = None,
+    chunks: Optional[Dict[str, int]] = None,
+    max_workers: int = MAX_WORKERS,
+    combine: bool = False,
+    member_dim: str = 'member',
+    verbose: bool = True,
+) -> Tuple[Union[Dict[str, xr.Dataset], xr.Dataset, None], Dict[str, str]]:
+    """Open the netCDF files of many dpaths as lazy datasets.
+
+    Parameters
+    ----------
+    dpaths : List[str]
+        The data paths (directories with a trailing slash, as returned by
+        ``xrw.get_cmip_paths``).
+    var_key : Optional[str], optional
+        The data variable to keep (with the bounds), by default None (keep
+        all data variables).
+    chunks : Optional[Dict[str, int]], optional
+        The dask chunks of each file, by default None (one chunk per file).
+    max_workers : int, optional
+        The number of threads used to open files, by default ``MAX_WORKERS``.
+    combine : bool, optional
+        Whether to concatenate the datasets along ``member_dim`` (they must
+        share a grid), by default False.
+    member_dim : str, optional
+        The name of the concatenated dimension, by default "member".
+    verbose : bool, optional
+        Whether to print the dpaths that could not be opened, by default True.
+
+    Returns
+    -------
+    Tuple[Union[Dict[str, xr.Dataset], xr.Dataset, None], Dict[str, str]]
+        The dataset of each dpath (in input order), or the combined dataset
+        if ``combine`` (None if every dpath failed), and a dictionary mapping
+        each failed dpath to its error message.
+    """
+    chunks = {} if chunks is None else chunks
+    failures: Dict[str, str] = {}
+
+    def _open_first(dpath: str) -> xr.Dataset:
+        if len(files[dpath]) == 0:
+            raise OSError('no netCDF files found')
+
+        with _open_lock:
+            return xr.open_dataset(files[dpath][0], chunks=chunks)
+
+    def _open_rest(fn: str, drop: List[str]) -> xr.Dataset:
+        with _open_lock:
+            return xr.open_dataset(fn, chunks=chunks, drop_variables=drop)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        files = dict(zip(dpaths, executor.map(get_files, dpaths)))
+
+        # the first file of each dpath (with the coordinates and bounds)
+        firsts = dict(zip(dpaths, [executor.submit(_open_first, d) for d in dpaths]))
+        first: Dict[str, xr.Dataset] = {}
+        for dpath, future in firsts.items():
+            try:
+                first[dpath] = future.result()
+            except Exception as e:
+                failures[dpath] = f'{type(e).__name__}: {e}'
+
+        # the other files, without the variables that do not depend on time
+        rests = {}
+        for dpath, ds in first.items():
+            drop = [key for key in ds.variables if 'time' not in ds[key].dims]
+            rests[dpath] = [executor.submit(_open_rest, fn, drop)
+                            for fn in files[dpath][1:]]
+
+        datasets: Dict[str, xr.Dataset] = {}
+        for dpath in dpaths:
+            if dpath not in first:
+                continue
+            dsets, errors = [first[dpath]], []
+            for future in rests[dpath]:
+                try:
+                    dsets.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+            try:
+                if len(errors) > 0:
+                    raise errors[0]
+                ds = _combine_files(dsets)
+                if var_key is not None:
+                    ds = ds[[var_key] + _get_bounds_keys(ds, ['lat', 'lon', 'time'])]
+                # the per-file datasets hold the file handles (subsetting
+                # drops the close hook, so it is set last)
+                ds.set_close(functools.partial(_close_all, dsets))
+                datasets[dpath] = ds
+            except Exception as e:
+                _close_all(dsets)
+                failures[dpath] = f'{type(e).__name__}: {e}'
+
+    if verbose:
+        for dpath, error in failures.items():
+            print('problem opening, path skipped:\n', dpath, '\n', error)
+
+    if not combine:
+        return datasets, failures
+    if len(datasets) == 0:
+        return None, failures
+
+    fingerprints = {grid_fingerprint(ds) for ds in datasets.values()}
+    if len(fingerprints) > 1:
+        _close_all(list(datasets.values()))
+        raise ValueError('The datasets are on different grids and cannot be '
+                         'combined. Regrid them first or use combine=False.')
+
+    # the bounds are taken from the first dataset, like the coordinates
+    first = next(iter(datasets.values()))
+    data_vars = [key for key in first.data_vars if key not in _get_bounds_keys(first)]
+    combined = xr.concat(
+        list(datasets.values()),
+        dim=member_dim,
+        data_vars=data_vars,
+        coords='minimal',
+        compat='override',
+        join='outer',
+        combine_attrs='drop_conflicts',
+    )
+    combined = combined.assign_coords({member_dim: list(datasets)})
+    combined.set_close(functools.partial(_close_all, list(datasets.values())))
+
+    return combined, failures
+
+
+def open_dataset(dpath: str,
+                 var_key: Optional[str] = None,
+                 chunks: Optional[Dict[str, int]] = None) -> xr.Dataset:
+    """
+    ds = open_dataset(dpath).
+
+    Opens the netCDF files of one dpath like ``open_datasets`` (sharing the
+    bounds of grids that were already opened). Raises if it cannot be
+    opened.
+    """
+    datasets, failures = open_datasets([dpath], var_key=var_key, chunks=chunks,
+                                       verbose=False)
+    if dpath in failures:
+        raise OSError(f'Could not open {dpath!r}: {failures[dpath]}')
+
+    return datasets[dpath]
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Decode-and-reduce path for packed (scale_factor/_FillValue) variables.
+
+Packed variables such as GISTEMP ``tempanomaly`` are stored as int16 with a
+``scale_factor``, an optional ``add_offset`` and a ``_FillValue``. Decoding
+them with xarray (``mask_and_scale=True``, the default) builds a float copy of
+the whole array, which is 2-4x the size of the packed data and dominates the
+runtime of a simple spatial average.
+
+Because decoding is linear, a weighted mean of the decoded values equals the
+decoded weighted mean of the packed integers:
+
+    sum(w * (scale * raw + offset)) / sum(w) = scale * sum(w * raw) / sum(w) + offset
+
+spatial_average keeps the data as integers through masking (raw == _FillValue
+or missing_value) and the sums, streaming over blocks of time steps: the
+cells of each distinct weight (e.g., the latitude rows of a regular lat/lon
+grid) are summed as int64, and the float weights are only applied to those
+(time, weight) sums. The scale factor and offset are applied once, to the
+reduced result. Grids where most cells have their own weight fall back to a
+float64 matrix-vector product per block, which upcasts the masked integers.
+It is opt-in: open the file with ``mask_and_scale=False`` so the variable
+keeps its packed integers and its packing attributes.
+
+Example Usage:
+-------------
+    import packed
+
+    ds = xr.open_dataset(fn, mask_and_scale=False)
+    weights = reference.area_weights(lat_bnds, lon_bnds)
+    ts = packed.spatial_average(ds['tempanomaly'], weights)
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# The default memory budget of each time block (in MB of temporaries).
+MAX_BLOCK_MB = 64.0
+
+
+def get_packing(da) -> Dict[str, Any]:
+    """
+    packing = get_packing(da).
+
+    Returns the packing of a variable opened with mask_and_scale=False as a
+    dictionary with scale_factor (default 1), add_offset (default 0) and
+    fill_values (the _FillValue and missing_value, if any). Packing
+    attributes are read from da.attrs, falling back to da.encoding.
+    """
+    attrs = {**getattr(da, "encoding", {}), **getattr(da, "attrs", {})}
+
+    fill_values = []
+    for key in ("_FillValue", "missing_value"):
+        if key in attrs:
+            fill_values.extend(np.atleast_1d(attrs[key]).tolist())
+
+    return {
+        "scale_factor": float(attrs.get("scale_factor", 1.0)),
+        "add_offset": float(attrs.get("add_offset", 0.0)),
+        "fill_values": fill_values,
+    }
+
+
+def spatial_average(
+    data,
+    weights,
+    packing: Optional[Dict[str, Any]] = None,
+    block_size: Optional[int] = None,
+    max_block_mb: float = MAX_BLOCK_MB,
+) -> np.ndarray:
+    """Compute the weighted spatial average of packed integer data.
+
+    Parameters
+    ----------
+    data : array-like
+        The packed (time, lat, lon) integer data, e.g., a DataArray opened with
+        ``mask_and_scale=False``. Only one block of time steps is loaded at a
+        time.
+    weights : array-like
+        The 2D (lat, lon) weights.
+    packing : Optional[Dict[str, Any]], optional
+        The packing of the data (see ``get_packing``), by default None which
+        reads it from the data's attributes.
+    block_size : Optional[int], optional
+        The number of time steps per block, by default None which sizes blocks
+        to ``max_block_mb``.
+    max_block_mb : float, optional
+        The memory budget per block when ``block_size`` is None, by default
+        ``MAX_BLOCK_MB``.
+
+    Returns
+    -------
+    np.ndarray
+        The decoded float64 spatial average for each time step (NaN for time
+        steps where every value is missing).
+    """
+    if packing is None:
+        packing = get_packing(data)
+
+    weights = np.asarray(weights, dtype=np.float64)
+    ntime = data.shape[0]
+
+    if weights.shape != tuple(data.shape[1:]):
+        raise ValueError(
+            f"The weights shape {weights.shape} does not match the spatial "
+            f"shape of the data {tuple(data.shape[1:])}."
+        )
+
+    if block_size is None:
+        block_size = max(1, int(max_block_mb * 1024**2 // (weights.nbytes * 2)))
+
+    weights_flat = weights.ravel()
+    numerator = np.empty(ntime, dtype=np.float64)
+    denominator = np.empty(ntime, dtype=np.float64)
+
+    # the cells ordered by weight, and the start of the cells of each weight
+    classes, inverse = np.unique(weights_flat, return_inverse=True)
+    by_class = len(classes) <= weights_flat.size // 2
+    if by_class:
+        order = np.argsort(inverse, kind="stable")
+        starts = np.flatnonzero(np.diff(inverse[order], prepend=-1))
+
+    for t0 in range(0, ntime, block_size):
+        t1 = min(t0 + block_size, ntime)
+        raw = np.asarray(data[t0:t1]).reshape(t1 - t0, -1)
+
+        if not np.issubdtype(raw.dtype, np.integer):
+            raise TypeError(
+                f"Expected packed integer data, got {raw.dtype}. Open the "
+                "dataset with `mask_and_scale=False`."
+            )
+
+        if by_class:
+            raw = raw[:, order]
+
+        valid = np.ones(raw.shape, dtype=bool)
+        for fill_value in packing["fill_values"]:
+            valid &= raw != fill_value
+
+        # the missing values are set to 0 in an integer copy of the block
+        # (raw itself is untouched)
+        raw = np.where(valid, raw, 0)
+        if by_class:
+            # exact int64 sums and counts per weight, then the weights are
+            # applied to the small (time, weight) arrays
+            sums = np.add.reduceat(raw, starts, axis=1, dtype=np.int64)
+            counts = np.add.reduceat(valid, starts, axis=1, dtype=np.int64)
+            numerator[t0:t1] = sums @ classes
+            denominator[t0:t1] = counts @ classes
+        else:
+            # the matrix-vector products upcast the block (and the mask) to
+            # float64 temporaries
+            numerator[t0:t1] = raw @ weights_flat
+            denominator[t0:t1] = valid @ weights_flat
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = numerator / denominator
+
+    return mean * packing["scale_factor"] + packing["add_offset"]
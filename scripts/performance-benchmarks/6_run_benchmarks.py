@@ -0,0 +1,95 @@
+"""Run the registered benchmark cases and append the results to the store.
+
+Refer to the "Registered benchmark cases" section in the `README.md` for more
+information.
+
+Example usage:
+
+    python scripts/performance-benchmarks/6_run_benchmarks.py --suite workflows
+    python scripts/performance-benchmarks/6_run_benchmarks.py \
+        --suite workflows --dataset synthetic_small --repeat 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import warnings
+
+import xarray as xr
+
+from harness import (
+    CASES,
+    RESULTS_PATH,
+    SCRIPTS_DIR,
+    append_results,
+    compare_impls,
+    run_cases,
+)
+
+# Make `xrw.py`, `cdw.py`, etc. importable by the case modules.
+sys.path.insert(0, SCRIPTS_DIR)
+
+# The modules that register cases and datasets on import.
+CASE_MODULES = [
+    "datasets",
+    "cases_workflows",
+    "cases_oracles",
+    "cases_packed",
+    "catalogs",
+    "cases_catalog",
+    "cases_crawler",
+    "cases_opener",
+    "cases_regrid",
+    "cases_vertical",
+    "cases_landsea",
+    "cases_regions",
+    "cases_unstructured",
+    "cases_remap",
+    "cases_topology",
+    "cases_raster",
+    "cases_climatology",
+    "cases_grouping",
+]
+
+# Logger configs
+# --------------------------
+warnings.filterwarnings(
+    action="ignore", category=xr.SerializationWarning, module=".*conventions"
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--suite", action="append", help="Suite(s) to run (default: all)."
+    )
+    parser.add_argument(
+        "--dataset", action="append", help="Dataset(s) to run on (default: all)."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of runtime samples."
+    )
+    parser.add_argument(
+        "--output", default=RESULTS_PATH, help="Path to the CSV results store."
+    )
+    args = parser.parse_args()
+
+    for module in CASE_MODULES:
+        __import__(module)
+
+    print(f"Running benchmark cases ({len(CASES)} registered)")
+    print("---------------------------------------------------------------------")
+    df_results = run_cases(
+        suites=args.suite, datasets=args.dataset, repeat=args.repeat
+    )
+
+    if len(df_results) > 0:
+        print(compare_impls(df_results).to_string())
+
+        append_results(df_results, args.output)
+        print(f"Appended {len(df_results)} rows to {args.output!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""Catalog query and de-duplication cases (``xrw`` and ``cdw``).
+
+Runs a loop of facet queries (like a notebook looping over models) against a
+synthetic catalog with:
+
+- "legacy": the original query code of ``xrw.get_cmip_paths`` (a new
+  connection per call, SQL built by string concatenation, ``select *`` and a
+  nested dict per row) on an unindexed catalog.
+- "pooled": ``xrw.get_cmip_paths`` with the ``catalog`` query layer on an
+  indexed catalog, with an empty query cache (cold).
+- "pooled_cached": the same loop repeated, so every query hits the LRU cache.
+
+The same loop is also run end to end with the de-duplication of each result
+(``xrw.get_cmip_paths(trim=True)``, "query_and_trim"), and ``versionWeight``
+(``xrw`` and ``cdw``) is timed on every version string of the catalog.
+
+It also runs the de-duplication of query results (``xrw.trimModelList``) with
+the original nested loops ("legacy", quadratic, so only up to 10k paths) and
+the bucketed ``dedup`` engine ("grouped"), and the de-duplication of xml
+files (``cdw.trimModelList``) on 10k-1M synthetic file lists. Up to 10k
+paths, the "grouped" selections are checked (untimed) to equal those of the
+original nested loops.
+
+The xml search of ``cdw.getXmlFiles`` is run with a wildcard glob of the xml
+tree ("glob"), with lookups in the persisted ``xmlindex`` ("index", each
+with the incremental refresh of the directories matching the query that
+query does by default, and checked to find the same files as glob) and with
+``cdw.getXmlFiles`` itself (index lookups and trimming, "trimmed") on
+synthetic xml trees, along with building ("full") and refreshing an
+unchanged ("refresh") index.
+
+Only the "ver" criterion is used for de-duplication, since the synthetic
+paths and xml files have no data to read cdate or tpoints from. ``cdw``
+requires cdms2, so it is imported by the cases that use it.
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import sqlite3
+from typing import Any, Dict, List
+
+import catalog
+import xmlindex
+import xrw
+from harness import Recorder, Spec, register_case
+
+SUITE = "catalog"
+CATALOG_DATASETS = ("catalog_10k", "catalog_100k", "catalog_1m")
+PATH_DICT_DATASETS = ("paths_1k", "paths_10k", "paths_100k", "paths_1m")
+XML_TREE_DATASETS = ("xmls_10k", "xmls_100k", "xmls_1m")
+XML_FILES_DATASETS = ("xml_files_10k", "xml_files_100k", "xml_files_1m")
+
+# The datasets small enough for the quadratic legacy de-duplication.
+LEGACY_TRIM_DATASETS = PATH_DICT_DATASETS[:2] + XML_FILES_DATASETS[:1]
+
+
+def _legacy_get_cmip_paths(db: str, **kwargs: str) -> List[str]:
+    # The query code of `xrw.get_cmip_paths` before the `catalog` module.
+    constraints = [key + "='" + kwargs[key] + "'" for key in kwargs.keys()]
+    constraints = " and ".join(constraints) + " and retired = 0 and ignored = 0;"
+    query = "select * from paths where " + constraints
+
+    con = sqlite3.connect(db)
+    cur = con.cursor()
+    cur.execute(query)
+    headers = list(map(lambda x: x[0], cur.description))
+    result = cur.fetchall()
+    con.close()
+
+    pathDict: Dict[str, Dict[str, Any]] = {}
+    for l in result:
+        dpath = l[0]
+        pathDict[dpath] = {}
+        for i, h in enumerate(headers[1:]):
+            pathDict[dpath][h] = l[i + 1]
+
+    return list(pathDict.keys())
+
+
+@register_case(SUITE, "get_cmip_paths", "legacy", datasets=CATALOG_DATASETS)
+def get_cmip_paths_legacy(spec: Spec, rec: Recorder) -> int:
+    n_paths = 0
+
+    with rec.stage("query_loop"):
+        for query in spec["queries"]:
+            n_paths += len(_legacy_get_cmip_paths(spec["db"], **query))
+
+        rec.metric("n_queries", len(spec["queries"]))
+        rec.metric("n_paths", n_paths)
+
+    return n_paths
+
+
+@register_case(SUITE, "get_cmip_paths", "pooled", datasets=CATALOG_DATASETS)
+def get_cmip_paths_pooled(spec: Spec, rec: Recorder) -> int:
+    catalog.close_connections()
+    n_paths = 0
+
+    with rec.stage("query_loop"):
+        for query in spec["queries"]:
+            dpaths = xrw.get_cmip_paths(
+                db=spec["db_indexed"], trim=False, verbose=False, **query
+            )
+            n_paths += len(dpaths)
+
+        rec.metric("n_queries", len(spec["queries"]))
+        rec.metric("n_paths", n_paths)
+
+    return n_paths
+
+
+@register_case(SUITE, "get_cmip_paths", "pooled_cached", datasets=CATALOG_DATASETS)
+def get_cmip_paths_pooled_cached(spec: Spec, rec: Recorder) -> int:
+    catalog.close_connections()
+    for query in spec["queries"]:
+        xrw.get_cmip_paths(db=spec["db_indexed"], trim=False, verbose=False, **query)
+
+    n_paths = 0
+    with rec.stage("query_loop"):
+        for query in spec["queries"]:
+            dpaths = xrw.get_cmip_paths(
+                db=spec["db_indexed"], trim=False, verbose=False, **query
+            )
+            n_paths += len(dpaths)
+
+        info = catalog.cache_info()
+        rec.metric("cache_hit_rate", info.hits / max(1, info.hits + info.misses))
+
+    return n_paths
+
+
+@register_case(SUITE, "query_and_trim", "pooled", datasets=CATALOG_DATASETS)
+def query_and_trim_pooled(spec: Spec, rec: Recorder) -> int:
+    catalog.close_connections()
+    n_selected = 0
+
+    with rec.stage("query_loop"):
+        for query in spec["queries"]:
+            dpaths = xrw.get_cmip_paths(
+                db=spec["db_indexed"], criteria=["ver"], verbose=False, **query
+            )
+            n_selected += len(dpaths)
+
+        rec.metric("n_selected", n_selected)
+
+    return n_selected
+
+
+def _get_versions(db: str) -> List[str]:
+    con = sqlite3.connect(db)
+    try:
+        return [row[0] for row in con.execute("select version from paths")]
+    finally:
+        con.close()
+
+
+@register_case(SUITE, "version_weight", "xrw", datasets=CATALOG_DATASETS)
+def version_weight_xrw(spec: Spec, rec: Recorder) -> int:
+    versions = _get_versions(spec["db"])
+
+    with rec.stage("weights"):
+        latest = max(xrw.versionWeight(v) for v in versions)
+        rec.metric("n_versions", len(versions))
+
+    return latest
+
+
+@register_case(SUITE, "version_weight", "cdw", datasets=CATALOG_DATASETS)
+def version_weight_cdw(spec: Spec, rec: Recorder) -> int:
+    import cdw
+
+    versions = _get_versions(spec["db"])
+
+    with rec.stage("weights"):
+        latest = max(cdw.versionWeight(v) for v in versions)
+        rec.metric("n_versions", len(versions))
+
+    return latest
+
+
+def _legacy_trim_model_list(pathDict: Dict[str, Dict[str, Any]], criteria: List[str]):
+    # The nested loops of `xrw.trimModelList` before the `dedup` module.
+    keyMap = {}
+    models = []
+    rips = []
+    for dpath in pathDict.keys():
+        model = pathDict[dpath]["model"]
+        rip = pathDict[dpath]["member"]
+        ver = xrw.versionWeight(pathDict[dpath]["version"])
+        models.append(model)
+        rips.append(rip)
+        keyMap[dpath] = {"model": model, "rip": rip, "ver": ver}
+    rips = list(set(rips))
+    models = list(set(models))
+    models.sort()
+    rips.sort()
+
+    dpathsOut = []
+    for model in models:
+        for rip in rips:
+            subdpaths = [
+                fn
+                for fn in keyMap.keys()
+                if (keyMap[fn]["model"] == model and keyMap[fn]["rip"] == rip)
+            ]
+            for crit in criteria:
+                subdpaths, keyMap = xrw.filter_dpaths(subdpaths, keyMap, crit)
+            if len(subdpaths) > 0:
+                dpathsOut.append(subdpaths[0])
+
+    return dpathsOut
+
+
+def _legacy_cdw_trim_model_list(files: List[str], criteria: List[str]) -> List[str]:
+    # The nested loops of `cdw.trimModelList` before the `dedup` module,
+    # without the cdms2 metadata reads (only "ver" is used).
+    import cdw
+
+    keyMap = {}
+    models = []
+    rips = []
+    for fn in files:
+        fields = fn.split("/")[-1].split(".")
+        models.append(fields[4])
+        rips.append(fields[5])
+        keyMap[fn] = {
+            "model": fields[4],
+            "rip": fields[5],
+            "ver": cdw.versionWeight(fields[10]),
+        }
+    rips = sorted(set(rips))
+    models = sorted(set(models))
+
+    filesOut = []
+    for model in models:
+        for rip in rips:
+            subFiles = [
+                fn
+                for fn in keyMap.keys()
+                if (keyMap[fn]["model"] == model and keyMap[fn]["rip"] == rip)
+            ]
+            for crit in criteria:
+                subFiles = cdw.filterXmls(subFiles, keyMap, crit)
+            if len(subFiles) > 0:
+                filesOut.append(subFiles[0])
+
+    return filesOut
+
+
+def _check_legacy(spec: Spec, selected: List[str], legacy: List[str]):
+    # the selections of the dedup engine and the legacy loops (untimed)
+    if selected != legacy:
+        raise AssertionError(
+            f"The grouped and legacy de-duplication of {spec['name']!r} differ "
+            f"({len(selected)} and {len(legacy)} paths selected)."
+        )
+
+
+@register_case(SUITE, "trim_model_list", "legacy", datasets=PATH_DICT_DATASETS[:2])
+def trim_model_list_legacy(spec: Spec, rec: Recorder) -> List[str]:
+    with rec.stage("trim"):
+        dpaths = _legacy_trim_model_list(spec["pathDict"], criteria=["ver"])
+        rec.metric("n_selected", len(dpaths))
+
+    return dpaths
+
+
+@register_case(SUITE, "trim_model_list", "grouped", datasets=PATH_DICT_DATASETS)
+def trim_model_list_grouped(spec: Spec, rec: Recorder) -> List[str]:
+    with rec.stage("trim"):
+        dpaths = xrw.trimModelList(spec["pathDict"], criteria=["ver"])
+        rec.metric("n_selected", len(dpaths))
+
+    if spec["name"] in LEGACY_TRIM_DATASETS:
+        legacy = _legacy_trim_model_list(spec["pathDict"], criteria=["ver"])
+        _check_legacy(spec, dpaths, legacy)
+
+    return dpaths
+
+
+@register_case(SUITE, "cdw_trim_model_list", "grouped", datasets=XML_FILES_DATASETS)
+def cdw_trim_model_list_grouped(spec: Spec, rec: Recorder) -> List[str]:
+    import cdw
+
+    with rec.stage("trim"):
+        files = cdw.trimModelList(spec["files"], criteria=["ver"])
+        rec.metric("n_selected", len(files))
+
+    if spec["name"] in LEGACY_TRIM_DATASETS:
+        legacy = _legacy_cdw_trim_model_list(spec["files"], criteria=["ver"])
+        _check_legacy(spec, files, legacy)
+
+    return files
+
+
+def _get_index(spec: Spec, name: str, remove: bool = False) -> str:
+    os.makedirs(spec["index_dir"], exist_ok=True)
+    index = os.path.join(spec["index_dir"], f"{name}.db")
+    if remove and os.path.exists(index):
+        os.remove(index)
+
+    return index
+
+
+@register_case(SUITE, "get_xml_files", "glob", datasets=XML_TREE_DATASETS)
+def get_xml_files_glob(spec: Spec, rec: Recorder) -> int:
+    n_files = 0
+
+    with rec.stage("query_loop"):
+        for query in spec["queries"]:
+            patterns = xmlindex.get_patterns(**query)
+            n_files += len(glob.glob(spec["base"] + "/" + "/".join(patterns)))
+
+        rec.metric("n_files", n_files)
+
+    return n_files
+
+
+@register_case(SUITE, "get_xml_files", "index", datasets=XML_TREE_DATASETS)
+def get_xml_files_index(spec: Spec, rec: Recorder) -> int:
+    index = _get_index(spec, "query")
+    xmlindex.refresh(spec["base"], index=index)
+    results = []
+
+    with rec.stage("query_loop"):
+        for query in spec["queries"]:
+            patterns = xmlindex.get_patterns(**query)
+            results.append(xmlindex.query(spec["base"], patterns, index=index))
+
+        n_files = sum(len(files) for files in results)
+        rec.metric("n_files", n_files)
+
+    for query, files in zip(spec["queries"], results):
+        patterns = xmlindex.get_patterns(**query)
+        if files != sorted(glob.glob(spec["base"] + "/" + "/".join(patterns))):
+            raise AssertionError(f"The index and glob differ for {query}.")
+
+    return n_files
+
+
+@register_case(SUITE, "get_xml_files", "trimmed", datasets=XML_TREE_DATASETS)
+def get_xml_files_trimmed(spec: Spec, rec: Recorder) -> int:
+    import cdw
+
+    index = _get_index(spec, "query")
+    xmlindex.refresh(spec["base"], index=index)
+    n_files = 0
+
+    with rec.stage("query_loop"):
+        for query in spec["queries"]:
+            files = cdw.getXmlFiles(
+                base=spec["base"], index=index, criteria=["ver"], verbose=False, **query
+            )
+            n_files += len(files)
+
+        rec.metric("n_files", n_files)
+
+    return n_files
+
+
+@register_case(SUITE, "xml_index", "full", datasets=XML_TREE_DATASETS)
+def xml_index_full(spec: Spec, rec: Recorder) -> Dict[str, int]:
+    index = _get_index(spec, "full", remove=True)
+
+    with rec.stage("build"):
+        stats = xmlindex.refresh(spec["base"], index=index)
+
+        for key, value in stats.items():
+            rec.metric(key, value)
+
+    return stats
+
+
+@register_case(SUITE, "xml_index", "refresh", datasets=XML_TREE_DATASETS)
+def xml_index_refresh(spec: Spec, rec: Recorder) -> Dict[str, int]:
+    index = _get_index(spec, "refresh")
+    xmlindex.refresh(spec["base"], index=index)
+
+    with rec.stage("build"):
+        stats = xmlindex.refresh(spec["base"], index=index)
+
+        for key, value in stats.items():
+            rec.metric(key, value)
+
+    return stats
@@ -0,0 +1,166 @@
+"""Incremental climatology cases (``departure_from_baseline_clim.ipynb``).
+
+The "append_month" case treats the last month of a monthly record as newly
+appended, and gets its departure from the 1981-2010 climatology, with:
+
+- "xcdat": ``ds.temporal.departures(freq="month", reference_period=...)`` on
+  the whole record, as the notebook does after every append, then the last
+  month.
+- "xarray": ``groupby("time.month")`` mean over the reference period and
+  departures of the whole record, then the last month.
+- "accumulator": ``climatology.accumulate`` of the new month into the state
+  saved for the rest of the record (loaded and saved again as netCDF), and
+  ``climatology.departures`` of the new month only, opening only the last
+  file of the record.
+
+The state without the last month is written once per dataset, and copied
+before every run (untimed). The "accumulator" departures are checked against
+the departures of a climatology weighted by the time bounds like xCDAT's,
+computed with xarray (once per dataset, untimed), and the maximum absolute
+difference is recorded. The "synthetic_packed" record has missing cells.
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import shutil
+from typing import Dict
+
+import numpy as np
+import xarray as xr
+
+import climatology
+import grouping
+from datasets import SYNTHETIC_DIR
+from harness import Recorder, Spec, register_case
+
+SUITE = "climatology"
+CLIMATOLOGY_DATASETS = ("synthetic_small", "synthetic_large", "synthetic_packed")
+
+# The reference period of the climatologies.
+REFERENCE_PERIOD = ("1981-01-01", "2010-12-31")
+
+# The state directory of the cases.
+STATE_DIR = os.path.join(SYNTHETIC_DIR, "climatology-state")
+
+# The reference departures of the last month of every dataset.
+_expected: Dict[str, np.ndarray] = {}
+
+
+def _open(spec: Spec) -> xr.Dataset:
+    return xr.open_mfdataset(spec["dir_path"] + "*.nc", chunks=spec.get("chunks"))
+
+
+def _departures_xarray(ds: xr.Dataset, var_key: str) -> xr.DataArray:
+    ref = ds[var_key].sel(time=slice(*REFERENCE_PERIOD))
+    climo = ref.groupby("time.month").mean("time")
+
+    return ds[var_key].groupby("time.month") - climo
+
+
+def _departures_reference(ds: xr.Dataset, var_key: str) -> xr.DataArray:
+    # the departures from the climatology weighted by the time bounds lengths
+    # (of the valid values), like ``ds.temporal.departures(weighted=True)``
+    ref = ds.sel(time=slice(*REFERENCE_PERIOD))
+    bounds = ref[ref["time"].attrs.get("bounds", "time_bnds")]
+    lengths = xr.DataArray(
+        grouping.time_lengths(bounds.values), coords={"time": ref["time"]}
+    )
+    weights = lengths.where(ref[var_key].notnull())
+    climo = (ref[var_key] * weights).groupby("time.month").sum("time") / (
+        weights.groupby("time.month").sum("time")
+    )
+
+    return ds[var_key].groupby("time.month") - climo
+
+
+def _state_path(spec: Spec) -> str:
+    # a copy of the state of the record without its last month
+    base_path = os.path.join(STATE_DIR, f"{spec['name']}.base.nc")
+    if not os.path.exists(base_path):
+        os.makedirs(STATE_DIR, exist_ok=True)
+        with _open(spec) as ds:
+            state = climatology.accumulate(
+                ds.isel(time=slice(None, -1)),
+                spec["var_key"],
+                reference_period=REFERENCE_PERIOD,
+            )
+        climatology.save(state, base_path)
+
+    path = os.path.join(STATE_DIR, f"{spec['name']}.nc")
+    shutil.copyfile(base_path, path)
+
+    return path
+
+
+@register_case(SUITE, "append_month", "xcdat", datasets=CLIMATOLOGY_DATASETS)
+def append_month_xcdat(spec: Spec, rec: Recorder) -> np.ndarray:
+    import xcdat as xc
+
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = xc.open_mfdataset(spec["dir_path"], chunks=spec.get("chunks"))
+
+    with rec.stage("departures"):
+        ds_anom = ds.temporal.departures(
+            var_key, freq="month", weighted=True, reference_period=REFERENCE_PERIOD
+        )
+        rec.tasks(ds_anom[var_key])
+
+    with rec.stage("compute"):
+        result = ds_anom[var_key].isel(time=-1).values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "append_month", "xarray", datasets=CLIMATOLOGY_DATASETS)
+def append_month_xarray(spec: Spec, rec: Recorder) -> np.ndarray:
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("departures"):
+        anom = rec.tasks(_departures_xarray(ds, spec["var_key"]))
+
+    with rec.stage("compute"):
+        result = anom.isel(time=-1).values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "append_month", "accumulator", datasets=CLIMATOLOGY_DATASETS)
+def append_month_accumulator(spec: Spec, rec: Recorder) -> np.ndarray:
+    path = _state_path(spec)
+
+    with rec.stage("open"):
+        # the new month, from the last file of the record only
+        ds_new = xr.open_dataset(sorted(glob.glob(spec["dir_path"] + "*.nc"))[-1])
+        ds_new = ds_new.isel(time=slice(-1, None))
+
+    with rec.stage("update"):
+        state = climatology.load(path)
+        state = climatology.accumulate(ds_new, state=state)
+        climatology.save(state, path)
+
+    with rec.stage("departures"):
+        result = climatology.departures(state, ds_new)[spec["var_key"]].values[0]
+
+    # check against the reference departures of the dataset (untimed)
+    if spec["name"] not in _expected:
+        with _open(spec) as ds:
+            _expected[spec["name"]] = (
+                _departures_reference(ds, spec["var_key"]).isel(time=-1).values
+            )
+    np.testing.assert_allclose(result, _expected[spec["name"]], rtol=1e-5, atol=1e-6)
+    diff = float(np.nanmax(np.abs(result - _expected[spec["name"]])))
+    with rec.stage("departures"):
+        rec.metric("max_abs_diff_reference", diff)
+
+    ds_new.close()
+
+    return result
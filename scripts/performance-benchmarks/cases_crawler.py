@@ -0,0 +1,86 @@
+"""Catalog crawler cases (``scripts/crawler.py``).
+
+Builds an xrw catalog from a synthetic DRS tree (``catalogs.py``) with:
+
+- "full_serial": a full crawl (no snapshot) with a single thread.
+- "full_parallel": a full crawl with the default thread pool.
+- "incremental_unchanged": a re-crawl of an unchanged tree, which only stats
+  directories and reuses the snapshot listings.
+- "incremental_changed": a re-crawl after new versions landed in (or were
+  removed from) 1% of the CMIP6 datasets.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+from typing import Dict
+
+import crawler
+from harness import Recorder, Spec, register_case
+
+SUITE = "crawler"
+TREE_DATASETS = ("tree_10k", "tree_100k")
+
+# The fraction of CMIP6 datasets that get a new version in "incremental_changed".
+CHANGED_FRACTION = 0.01
+NEW_VERSION = "v29990101"
+
+
+def _get_db(spec: Spec, impl: str, remove: bool = False) -> str:
+    os.makedirs(spec["db_dir"], exist_ok=True)
+    db = os.path.join(spec["db_dir"], f"{impl}.db")
+    if remove and os.path.exists(db):
+        os.remove(db)
+
+    return db
+
+
+def _crawl(spec: Spec, rec: Recorder, db: str, **kwargs) -> Dict[str, int]:
+    with rec.stage("crawl"):
+        stats = crawler.crawl([spec["root"]], db=db, **kwargs)
+
+        for key, value in stats.items():
+            rec.metric(key, value)
+
+    return stats
+
+
+@register_case(SUITE, "crawl", "full_serial", datasets=TREE_DATASETS)
+def crawl_full_serial(spec: Spec, rec: Recorder) -> Dict[str, int]:
+    db = _get_db(spec, "full_serial", remove=True)
+
+    return _crawl(spec, rec, db, max_workers=1)
+
+
+@register_case(SUITE, "crawl", "full_parallel", datasets=TREE_DATASETS)
+def crawl_full_parallel(spec: Spec, rec: Recorder) -> Dict[str, int]:
+    db = _get_db(spec, "full_parallel", remove=True)
+
+    return _crawl(spec, rec, db)
+
+
+@register_case(SUITE, "crawl", "incremental_unchanged", datasets=TREE_DATASETS)
+def crawl_incremental_unchanged(spec: Spec, rec: Recorder) -> Dict[str, int]:
+    db = _get_db(spec, "incremental")
+    crawler.crawl([spec["root"]], db=db)
+
+    return _crawl(spec, rec, db)
+
+
+@register_case(SUITE, "crawl", "incremental_changed", datasets=TREE_DATASETS)
+def crawl_incremental_changed(spec: Spec, rec: Recorder) -> Dict[str, int]:
+    db = _get_db(spec, "incremental")
+    crawler.crawl([spec["root"]], db=db)
+
+    # Add a new version next to every 100th dataset (or remove it if the
+    # previous run added it), which changes the mtime of the parent directory.
+    step = int(1 / CHANGED_FRACTION)
+    for dpath in spec["dataset_dirs"][::step]:
+        new_dpath = os.path.join(os.path.dirname(dpath), NEW_VERSION)
+        if os.path.exists(new_dpath):
+            shutil.rmtree(new_dpath)
+        else:
+            shutil.copytree(dpath, new_dpath)
+
+    return _crawl(spec, rec, db)
@@ -0,0 +1,167 @@
+"""Time grouping cases (the seasonal cookbook calls on one time axis).
+
+The "season_calls" case computes, on the same dataset, the seasonal group
+averages, the seasonal climatology and the seasonal departures, like the
+cookbook notebooks, with:
+
+- "xcdat": ``ds.temporal.group_average``, ``ds.temporal.climatology`` and
+  ``ds.temporal.departures`` (``freq="season"``).
+- "xarray": ``resample(time="QS-DEC")``, ``groupby("time.season")`` and
+  ``groupby("time.season")`` arithmetic (unweighted), only on monthly data:
+  the arithmetic builds a graph of ~420,000 Dask tasks for the 3-hourly
+  data, which takes minutes.
+- "grouping_nocache": ``grouping.group_average``, ``grouping.climatology``
+  and ``grouping.departures`` with the cache cleared before every call, so
+  every call derives its grouping index again.
+- "grouping": the same with the grouping indexes computed once (in the first
+  call that needs them) and shared by the calls.
+
+The "climatology_10" case calls the seasonal climatology 10 times on the same
+dataset, as a notebook re-run or a loop over variables would. The cases run on
+3-hourly (105,120 time steps, noleap calendar) and monthly synthetic data.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import xarray as xr
+
+import grouping
+from harness import Recorder, Spec, register_case
+
+SUITE = "grouping"
+GROUPING_DATASETS = ("synthetic_3hr", "synthetic_small")
+
+# The number of calls of the "climatology_10" case.
+N_CALLS = 10
+
+
+def _open(spec: Spec) -> xr.Dataset:
+    return xr.open_mfdataset(spec["dir_path"] + "*.nc", chunks=spec.get("chunks"))
+
+
+def _season_calls(spec: Spec, rec: Recorder, clear: bool) -> np.ndarray:
+    var_key = spec["var_key"]
+    grouping.clear_cache()
+
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("group_average"):
+        ds_avg = grouping.group_average(ds, var_key, "season")
+        ds_avg[var_key].values
+
+    if clear:
+        grouping.clear_cache()
+
+    with rec.stage("climatology"):
+        ds_climo = grouping.climatology(ds, var_key, "season")
+        ds_climo[var_key].values
+
+    if clear:
+        grouping.clear_cache()
+
+    with rec.stage("departures"):
+        ds_anom = grouping.departures(ds, var_key, "season")
+        result = ds_anom[var_key].values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "season_calls", "xcdat", datasets=GROUPING_DATASETS)
+def season_calls_xcdat(spec: Spec, rec: Recorder) -> np.ndarray:
+    import xcdat as xc
+
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = xc.open_mfdataset(spec["dir_path"], chunks=spec.get("chunks"))
+
+    with rec.stage("group_average"):
+        ds.temporal.group_average(var_key, freq="season")[var_key].values
+
+    with rec.stage("climatology"):
+        ds.temporal.climatology(var_key, freq="season")[var_key].values
+
+    with rec.stage("departures"):
+        result = ds.temporal.departures(var_key, freq="season")[var_key].values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "season_calls", "xarray", datasets=("synthetic_small",))
+def season_calls_xarray(spec: Spec, rec: Recorder) -> np.ndarray:
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("group_average"):
+        ds[var_key].resample(time="QS-DEC").mean().values
+
+    with rec.stage("climatology"):
+        ds[var_key].groupby("time.season").mean().values
+
+    with rec.stage("departures"):
+        climo = ds[var_key].groupby("time.season").mean()
+        result = (ds[var_key].groupby("time.season") - climo).values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "season_calls", "grouping_nocache", datasets=GROUPING_DATASETS)
+def season_calls_grouping_nocache(spec: Spec, rec: Recorder) -> np.ndarray:
+    return _season_calls(spec, rec, clear=True)
+
+
+@register_case(SUITE, "season_calls", "grouping", datasets=GROUPING_DATASETS)
+def season_calls_grouping(spec: Spec, rec: Recorder) -> np.ndarray:
+    return _season_calls(spec, rec, clear=False)
+
+
+@register_case(SUITE, "climatology_10", "xcdat", datasets=GROUPING_DATASETS)
+def climatology_10_xcdat(spec: Spec, rec: Recorder) -> np.ndarray:
+    import xcdat as xc
+
+    var_key = spec["var_key"]
+    ds = xc.open_mfdataset(spec["dir_path"], chunks=spec.get("chunks"))
+
+    with rec.stage("climatology"):
+        for _ in range(N_CALLS):
+            result = ds.temporal.climatology(var_key, freq="season")[var_key].values
+
+    ds.close()
+
+    return result
+
+
+def _climatology_10(spec: Spec, rec: Recorder, clear: bool) -> np.ndarray:
+    var_key = spec["var_key"]
+    ds = _open(spec)
+    grouping.clear_cache()
+
+    with rec.stage("climatology"):
+        for _ in range(N_CALLS):
+            if clear:
+                grouping.clear_cache()
+            result = grouping.climatology(ds, var_key, "season")[var_key].values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "climatology_10", "grouping_nocache", datasets=GROUPING_DATASETS)
+def climatology_10_grouping_nocache(spec: Spec, rec: Recorder) -> np.ndarray:
+    return _climatology_10(spec, rec, clear=True)
+
+
+@register_case(SUITE, "climatology_10", "grouping", datasets=GROUPING_DATASETS)
+def climatology_10_grouping(spec: Spec, rec: Recorder) -> np.ndarray:
+    return _climatology_10(spec, rec, clear=False)
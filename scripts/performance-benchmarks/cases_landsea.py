@@ -0,0 +1,155 @@
+"""Land-sea mask cases (``landsea_mask.ipynb``).
+
+The "generate" case computes the land fraction of the grid of a dataset with:
+
+- "cdutil": ``cdutil.generateLandSeaMask`` on the first time step read with
+  cdms2, as the notebook does.
+- "cold": ``landsea.generate_fraction`` with an empty cache, which computes
+  and stores the fraction.
+- "disk": the same from the cache directory, as a new process would.
+- "memory": the same from memory.
+
+The "apply" case masks the land of the whole time series (fraction < 0.5)
+with:
+
+- "notebook": the loaded data and fraction rebuilt as ``xr.DataArray`` with
+  ``coords=[list(time), list(lat), list(lon)]``, then ``where``.
+- "landsea": ``landsea.apply_mask`` on the lazy (Dask) data, then computed.
+
+Both cases run on the ACCESS1-0 demo data of the notebook and on the 1 and
+0.25 degree synthetic datasets. Every impl uses the same source
+(``datasets.get_land_source``): the navy land fraction of cdutil if it is
+installed, or a synthetic 1/6 degree land fraction. cdms2 and cdutil are
+imported by the cases that use them, so the other cases run without them.
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import shutil
+
+import numpy as np
+import xarray as xr
+
+import landsea
+from datasets import SYNTHETIC_DIR, get_land_source, get_paths
+from harness import Recorder, Spec, register_case
+
+SUITE = "landsea"
+LANDSEA_DATASETS = ("access1_0_ts", "synthetic_1deg", "synthetic_0p25deg")
+
+# The fraction cache directory of the cases.
+CACHE_DIR = os.path.join(SYNTHETIC_DIR, "landsea-cache")
+
+
+def _open(spec: Spec) -> xr.Dataset:
+    return xr.open_mfdataset(get_paths(spec), chunks=spec.get("chunks"))
+
+
+def _generate(spec: Spec, rec: Recorder, cache: str) -> np.ndarray:
+    source = get_land_source()
+
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("generate"):
+        fraction = landsea.generate_fraction(ds, source=source, cache=cache)
+
+    ds.close()
+
+    return fraction.values
+
+
+@register_case(SUITE, "generate", "cdutil", datasets=LANDSEA_DATASETS)
+def generate_cdutil(spec: Spec, rec: Recorder) -> np.ndarray:
+    import cdms2
+    import cdutil
+
+    fsource = cdms2.open(get_land_source())
+    source = fsource("sftlf")
+    fsource.close()
+
+    with rec.stage("open"):
+        fin = cdms2.open(sorted(glob.glob(get_paths(spec)))[0])
+        var = fin(spec["var_key"], time=slice(0, 1))
+
+    with rec.stage("generate"):
+        fraction = cdutil.generateLandSeaMask(var, source=source)
+
+    fin.close()
+
+    return np.ma.filled(fraction, 1.0)
+
+
+@register_case(SUITE, "generate", "cold", datasets=LANDSEA_DATASETS)
+def generate_cold(spec: Spec, rec: Recorder) -> np.ndarray:
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+    landsea.clear_cache()
+
+    return _generate(spec, rec, CACHE_DIR)
+
+
+@register_case(SUITE, "generate", "disk", datasets=LANDSEA_DATASETS)
+def generate_disk(spec: Spec, rec: Recorder) -> np.ndarray:
+    # fill the cache directory, then forget the fractions like a new process
+    with _open(spec) as ds:
+        landsea.generate_fraction(ds, source=get_land_source(), cache=CACHE_DIR)
+    landsea.clear_cache()
+
+    return _generate(spec, rec, CACHE_DIR)
+
+
+@register_case(SUITE, "generate", "memory", datasets=LANDSEA_DATASETS)
+def generate_memory(spec: Spec, rec: Recorder) -> np.ndarray:
+    landsea.clear_cache()
+    with _open(spec) as ds:
+        landsea.generate_fraction(ds, source=get_land_source(), cache=None)
+
+    return _generate(spec, rec, None)
+
+
+@register_case(SUITE, "apply", "notebook", datasets=LANDSEA_DATASETS)
+def apply_notebook(spec: Spec, rec: Recorder) -> np.ndarray:
+    with _open(spec) as ds:
+        fraction = landsea.generate_fraction(ds, source=get_land_source(), cache=None)
+
+    with rec.stage("open"):
+        ds = _open(spec).load()
+        data = ds[spec["var_key"]]
+
+    with rec.stage("convert"):
+        time, lat, lon = data["time"].values, data["lat"].values, data["lon"].values
+        data_xr = xr.DataArray(
+            data.values,
+            coords=[list(time), list(lat), list(lon)],
+            dims=["time", "lat", "lon"],
+        )
+        fraction_xr = xr.DataArray(
+            fraction.values, coords=[list(lat), list(lon)], dims=["lat", "lon"]
+        )
+
+    with rec.stage("mask"):
+        result = data_xr.where(fraction_xr < 0.5).values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "apply", "landsea", datasets=LANDSEA_DATASETS)
+def apply_landsea(spec: Spec, rec: Recorder) -> np.ndarray:
+    with _open(spec) as ds:
+        fraction = landsea.generate_fraction(ds, source=get_land_source(), cache=None)
+
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("mask"):
+        result = landsea.apply_mask(ds[spec["var_key"]], fraction, keep="ocean")
+        result = rec.tasks(result).values
+
+    ds.close()
+
+    return result
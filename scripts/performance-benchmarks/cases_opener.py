@@ -0,0 +1,121 @@
+"""Bulk opener cases (``scripts/opener.py``).
+
+Opens every member of a synthetic ensemble (like a 100-member catalog search
+result) with:
+
+- "open_mfdataset": the current path, ``xr.open_mfdataset(dpath + "*.nc")``
+  for each dpath in turn (as in ``ensemble.gmsat_anomaly``).
+- "bulk": ``opener.open_datasets``, which only reads the coordinates and
+  bounds of the first file of each member, skips the coordinate comparisons
+  and shares the bounds of each grid.
+
+The "gmsat_anomaly" case runs ``ensemble.gmsat_anomaly`` on every member
+with ``ensemble.run_ensemble`` (as in ``scripts/io_example.py``).
+
+The "spatial_avg" stage computes the cos(lat) weighted mean of the first year
+of every member, so both paths are checked to read the same data. After the
+datasets are closed, the cases check that none of their files are still open
+(on Linux, from ``/proc/self/fd``).
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import xarray as xr
+
+import ensemble
+import opener
+from harness import Recorder, Spec, register_case
+
+SUITE = "opener"
+ENSEMBLE_DATASETS = ("ensemble_100",)
+
+
+def _n_open_files() -> Optional[int]:
+    # the number of open netCDF files of this process (None without /proc)
+    fd_dir = "/proc/self/fd"
+    if not os.path.isdir(fd_dir):
+        return None
+
+    n_files = 0
+    for fd in os.listdir(fd_dir):
+        try:
+            n_files += os.readlink(os.path.join(fd_dir, fd)).endswith(".nc")
+        except OSError:
+            continue
+
+    return n_files
+
+
+def _check_closed(n_before: Optional[int]):
+    n_after = _n_open_files()
+    if n_before is not None and n_after != n_before:
+        raise AssertionError(
+            f"{n_after - n_before} files are still open after closing the datasets."
+        )
+
+
+def _spatial_avg(datasets: List[xr.Dataset], var_key: str) -> np.ndarray:
+    means = []
+    for ds in datasets:
+        da = ds[var_key].isel(time=slice(0, 12))
+        weights = np.cos(np.deg2rad(da.lat))
+        means.append(da.weighted(weights).mean(("lat", "lon")).values)
+
+    return np.stack(means)
+
+
+@register_case(SUITE, "open_ensemble", "open_mfdataset", datasets=ENSEMBLE_DATASETS)
+def open_ensemble_mfdataset(spec: Spec, rec: Recorder) -> np.ndarray:
+    n_files = _n_open_files()
+    with rec.stage("open"):
+        datasets = [
+            xr.open_mfdataset(dpath + "*.nc", combine="by_coords")
+            for dpath in spec["dpaths"]
+        ]
+        rec.metric("n_members", len(datasets))
+
+    with rec.stage("spatial_avg"):
+        result = _spatial_avg(datasets, spec["var_key"])
+
+    for ds in datasets:
+        ds.close()
+
+    _check_closed(n_files)
+    return result
+
+
+@register_case(SUITE, "open_ensemble", "bulk", datasets=ENSEMBLE_DATASETS)
+def open_ensemble_bulk(spec: Spec, rec: Recorder) -> np.ndarray:
+    n_files = _n_open_files()
+    with rec.stage("open"):
+        datasets: Dict[str, xr.Dataset]
+        datasets, _ = opener.open_datasets(spec["dpaths"], var_key=spec["var_key"])
+        rec.metric("n_members", len(datasets))
+
+    with rec.stage("spatial_avg"):
+        result = _spatial_avg(list(datasets.values()), spec["var_key"])
+
+    for ds in datasets.values():
+        ds.close()
+
+    _check_closed(n_files)
+    return result
+
+
+@register_case(SUITE, "gmsat_anomaly", "run_ensemble", datasets=ENSEMBLE_DATASETS)
+def gmsat_anomaly_run_ensemble(spec: Spec, rec: Recorder) -> xr.DataArray:
+    n_files = _n_open_files()
+    with rec.stage("run_ensemble"):
+        result, failures = ensemble.run_ensemble(
+            spec["dpaths"],
+            lambda dpath: ensemble.gmsat_anomaly(dpath, var_key=spec["var_key"]),
+            verbose=False,
+        )
+        rec.metric("n_failures", len(failures))
+
+    _check_closed(n_files)
+    return result
@@ -0,0 +1,73 @@
+"""Reference (oracle) spatial average cases.
+
+Compares the tiled-weights oracle used by ``validation/v0.3.0/spatial_average/
+qa_steve.py`` and ``validation/v0.3.1/spatial_average_comparison.ipynb`` with
+the streaming oracle in ``scripts/reference.py``. The streaming oracle's peak
+memory should stay flat as the length of the time axis grows.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import xarray as xr
+
+import reference
+from datasets import get_paths
+from harness import Recorder, Spec, register_case
+
+SUITE = "oracles"
+ORACLE_DATASETS = ("synthetic_small", "synthetic_large", "gistemp")
+
+
+def _open(spec: Spec) -> xr.Dataset:
+    return xr.open_mfdataset(
+        get_paths(spec),
+        chunks=spec.get("chunks"),
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+    )
+
+
+def _get_weights(ds: xr.Dataset) -> np.ndarray:
+    if "lat_bnds" in ds and "lon_bnds" in ds:
+        return reference.area_weights(ds.lat_bnds.values, ds.lon_bnds.values)
+
+    coslat = np.cos(np.deg2rad(ds.lat.values))
+
+    return np.tile(coslat[:, None], (1, ds.sizes["lon"]))
+
+
+@register_case(SUITE, "reference_spatial_avg", "tiled", datasets=ORACLE_DATASETS)
+def tiled_spatial_avg(spec: Spec, rec: Recorder) -> np.ndarray:
+    ds = _open(spec)
+    data = ds[spec["var_key"]]
+    weights = _get_weights(ds)
+
+    with rec.stage("spatial_avg"):
+        values = data.values
+        ntime = values.shape[0]
+        weights = np.tile(np.expand_dims(weights, axis=0), (ntime, 1, 1))
+        weights = np.where(~np.isnan(values), weights, 0.0)
+
+        numerator = np.nansum(weights * values, axis=(1, 2))
+        denominator = np.sum(weights, axis=(1, 2))
+        result = np.array(numerator / denominator)
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "reference_spatial_avg", "streaming", datasets=ORACLE_DATASETS)
+def streaming_spatial_avg(spec: Spec, rec: Recorder) -> np.ndarray:
+    ds = _open(spec)
+    data = ds[spec["var_key"]]
+    weights = _get_weights(ds)
+
+    with rec.stage("spatial_avg"):
+        result = reference.spatial_average(data, weights)
+
+    ds.close()
+
+    return result
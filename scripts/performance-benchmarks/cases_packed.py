@@ -0,0 +1,94 @@
+"""Packed (int16 + scale_factor/_FillValue) spatial average cases.
+
+Compares the default path, where xarray decodes the whole packed variable to
+floats before the weighted mean, with ``scripts/packed.py``, which keeps the
+data as integers through masking and the sums per weight and decodes only the
+reduced result. The "packed" result is checked against the "decoded" weighted
+mean (computed once per dataset, untimed), and the maximum absolute
+difference is recorded.
+"""
+
+from __future__ import annotations
+
+from typing import Dict
+
+import numpy as np
+import xarray as xr
+
+import packed
+import reference
+from datasets import get_paths
+from harness import Recorder, Spec, register_case
+
+SUITE = "packed"
+PACKED_DATASETS = ("synthetic_packed", "gistemp")
+
+# The decoded spatial average of every dataset.
+_expected: Dict[str, np.ndarray] = {}
+
+
+def _open(spec: Spec, mask_and_scale: bool) -> xr.Dataset:
+    return xr.open_mfdataset(
+        get_paths(spec),
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+        mask_and_scale=mask_and_scale,
+    )
+
+
+def _get_weights(ds: xr.Dataset) -> np.ndarray:
+    if "lat_bnds" in ds and "lon_bnds" in ds:
+        return reference.area_weights(ds.lat_bnds.values, ds.lon_bnds.values)
+
+    coslat = np.cos(np.deg2rad(ds.lat.values))
+
+    return np.tile(coslat[:, None], (1, ds.sizes["lon"]))
+
+
+def _decoded_average(ds: xr.Dataset, var_key: str) -> np.ndarray:
+    weights = xr.DataArray(_get_weights(ds), dims=("lat", "lon"))
+
+    return ds[var_key].load().weighted(weights).mean(("lat", "lon")).values
+
+
+@register_case(SUITE, "packed_spatial_avg", "decoded", datasets=PACKED_DATASETS)
+def decoded_spatial_avg(spec: Spec, rec: Recorder) -> np.ndarray:
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = _open(spec, mask_and_scale=True)
+
+    with rec.stage("spatial_avg"):
+        result = _decoded_average(ds, var_key)
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "packed_spatial_avg", "packed", datasets=PACKED_DATASETS)
+def packed_spatial_avg(spec: Spec, rec: Recorder) -> np.ndarray:
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = _open(spec, mask_and_scale=False)
+        weights = _get_weights(ds)
+
+    with rec.stage("spatial_avg"):
+        result = packed.spatial_average(ds[var_key], weights)
+
+    ds.close()
+
+    # check against the decoded spatial average of the dataset (untimed)
+    if spec["name"] not in _expected:
+        with _open(spec, mask_and_scale=True) as ds_decoded:
+            _expected[spec["name"]] = _decoded_average(ds_decoded, var_key)
+    expected = _expected[spec["name"]]
+    np.testing.assert_allclose(result, expected, rtol=1e-6, atol=1e-6)
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+    diff = float(np.nanmax(np.abs(result - expected)))
+    with rec.stage("spatial_avg"):
+        rec.metric("max_abs_diff_decoded", diff)
+
+    return result
@@ -0,0 +1,186 @@
+"""Unstructured grid rendering cases (``uxarray_practicum_notebook.ipynb``).
+
+The "render" case draws a field on the faces of a grid to a 1200x600 image
+(an Agg canvas, without any display), with:
+
+- "polygons": one polygon per face in a matplotlib ``PolyCollection`` (the
+  vector path of ``uxds[...].plot.polygons()``, with faces unwrapped across
+  the antimeridian).
+- "uxarray": ``plot.polygons(rasterize=False)`` of uxarray, rendered with the
+  matplotlib backend of holoviews.
+- "raster_cold": ``raster.get_lookup`` with an empty cache directory (which
+  computes the face-to-pixel lookup of the grid and view), then
+  ``raster.rasterize`` at full resolution and ``imshow``.
+- "raster_warm": the same with the lookup read from the cache directory, as a
+  new process would.
+- "raster_lod": the same with the automatic level of detail and method (an
+  area-weighted mean of the faces of every pixel for meshes with more faces
+  than pixels).
+
+The "build" stage builds the polygons or gets the lookup, and the "draw"
+stage fills the image and draws the canvas. The topology of the grids is read
+(from a ``topology`` sidecar) before the stages. The cases run on the sample
+grids of the workshop and on synthetic cubed spheres up to ne240pg2 (1.4M
+faces). uxarray and holoviews are only needed by the impl that uses them.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+
+import numpy as np
+
+import raster
+import topology
+from datasets import GRID_CONFIGS, REAL_GRIDS, SYNTHETIC_DIR
+from harness import Recorder, Spec, register_case
+
+SUITE = "raster"
+RASTER_DATASETS = tuple(REAL_GRIDS) + tuple(GRID_CONFIGS)
+
+# The lookup and topology cache directories of the cases.
+CACHE_DIR = os.path.join(SYNTHETIC_DIR, "raster-cache")
+TOPOLOGY_CACHE_DIR = os.path.join(SYNTHETIC_DIR, "topology-cache")
+
+# The (width, height) of the images, in pixels, and their DPI.
+SIZE = (1200, 600)
+DPI = 100
+
+
+def _get_topology(spec: Spec) -> topology.Topology:
+    return topology.get_topology(spec["grid_path"], cache=TOPOLOGY_CACHE_DIR)
+
+
+def _values(topo: topology.Topology) -> np.ndarray:
+    # a smooth synthetic field on the faces
+    lat = np.deg2rad(np.asarray(topo.face_lat))
+    lon = np.deg2rad(np.asarray(topo.face_lon))
+
+    return (np.cos(lat) ** 2 * np.sin(3 * lon) + np.sin(2 * lat)).astype(np.float32)
+
+
+def _canvas():
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(SIZE[0] / DPI, SIZE[1] / DPI), dpi=DPI)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes((0, 0, 1, 1))
+    ax.set_axis_off()
+    ax.set_xlim(raster.DEFAULT_EXTENT[:2])
+    ax.set_ylim(raster.DEFAULT_EXTENT[2:])
+
+    return canvas, ax
+
+
+def _draw_raster(spec: Spec, rec: Recorder, **kwargs) -> np.ndarray:
+    topo = _get_topology(spec)
+    values = _values(topo)
+    canvas, ax = _canvas()
+
+    with rec.stage("build"):
+        lookup = raster.get_lookup(
+            spec["grid_path"],
+            size=SIZE,
+            cache=CACHE_DIR,
+            topology_cache=TOPOLOGY_CACHE_DIR,
+        )
+
+    with rec.stage("draw"):
+        image = raster.rasterize(values, lookup, areas=topo.face_areas, **kwargs)
+        ax.imshow(
+            image,
+            origin="lower",
+            extent=lookup.extent,
+            interpolation="nearest",
+            aspect="auto",
+        )
+        canvas.draw()
+        rec.metric("n_faces", len(values))
+        rec.metric("image_shape", image.shape)
+
+    return np.asarray(canvas.buffer_rgba())
+
+
+def _fill_cache(spec: Spec):
+    # write the lookup of the grid, then forget it like a new process
+    raster.get_lookup(
+        spec["grid_path"],
+        size=SIZE,
+        cache=CACHE_DIR,
+        topology_cache=TOPOLOGY_CACHE_DIR,
+    )
+    raster.clear_cache()
+
+
+@register_case(SUITE, "render", "polygons", datasets=RASTER_DATASETS)
+def render_polygons(spec: Spec, rec: Recorder) -> np.ndarray:
+    from matplotlib.collections import PolyCollection
+
+    topo = _get_topology(spec)
+    values = _values(topo)
+    canvas, ax = _canvas()
+
+    with rec.stage("build"):
+        face_nodes = np.asarray(topo.face_nodes)
+        nodes = np.where(face_nodes >= 0, face_nodes, face_nodes[:, :1])
+        lon = np.asarray(topo.node_lon)[nodes]
+        lat = np.asarray(topo.node_lat)[nodes]
+        # unwrap the faces crossing the antimeridian around their centers
+        face_lon = np.asarray(topo.face_lon)[:, None]
+        lon = face_lon + (lon - face_lon + 180.0) % 360.0 - 180.0
+        collection = PolyCollection(
+            np.stack([lon, lat], axis=-1), array=values, edgecolors="face"
+        )
+
+    with rec.stage("draw"):
+        ax.add_collection(collection)
+        canvas.draw()
+        rec.metric("n_faces", len(values))
+
+    return np.asarray(canvas.buffer_rgba())
+
+
+@register_case(SUITE, "render", "uxarray", datasets=RASTER_DATASETS)
+def render_uxarray(spec: Spec, rec: Recorder) -> np.ndarray:
+    import holoviews as hv
+    import uxarray as ux
+    import xarray as xr
+
+    topo = _get_topology(spec)
+    grid = topology.open_grid(spec["grid_path"], cache=TOPOLOGY_CACHE_DIR)
+    uxda = ux.UxDataArray(xr.DataArray(_values(topo), dims=["n_face"]), uxgrid=grid)
+
+    with rec.stage("build"):
+        plot = uxda.plot.polygons(rasterize=False, width=SIZE[0], height=SIZE[1])
+
+    with rec.stage("draw"):
+        fig = hv.render(plot, backend="matplotlib")
+        fig.canvas.draw()
+        rec.metric("n_faces", grid.n_face)
+
+    return np.asarray(fig.canvas.buffer_rgba())
+
+
+@register_case(SUITE, "render", "raster_cold", datasets=RASTER_DATASETS)
+def render_raster_cold(spec: Spec, rec: Recorder) -> np.ndarray:
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+    raster.clear_cache()
+
+    return _draw_raster(spec, rec, level=0, method="nearest")
+
+
+@register_case(SUITE, "render", "raster_warm", datasets=RASTER_DATASETS)
+def render_raster_warm(spec: Spec, rec: Recorder) -> np.ndarray:
+    _fill_cache(spec)
+
+    return _draw_raster(spec, rec, level=0, method="nearest")
+
+
+@register_case(SUITE, "render", "raster_lod", datasets=RASTER_DATASETS)
+def render_raster_lod(spec: Spec, rec: Recorder) -> np.ndarray:
+    _fill_cache(spec)
+
+    return _draw_raster(spec, rec)
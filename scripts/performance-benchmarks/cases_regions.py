@@ -0,0 +1,137 @@
+"""Multi-region spatial averaging cases.
+
+Averages a monthly time series over 30 regions ("regions_30": land and
+ocean of 12 degree latitude bands) and 100 regions ("regions_100": land and
+ocean of 18 x 72 degree boxes), with:
+
+- "xcdat": ``ds.spatial.average`` with the lat_bounds and lon_bounds of each
+  box, on the data masked with the land or ocean ``where`` of
+  ``landsea_mask.ipynb``, computed one region at a time.
+- "per_region": ``DataArray.weighted(...).mean`` with the weights of each
+  region (a row of the ``regions.get_weights`` matrix), computed one region
+  at a time, so every region reads the data again.
+- "single_pass": ``regions.average``, which reads every chunk once and
+  computes all regions with one sparse matrix multiply.
+
+The land fraction comes from ``landsea.generate_fraction`` with the source
+of ``datasets.get_land_source``, in the "weights" stage (it is read from the
+fraction cache after the first run).
+"""
+
+from __future__ import annotations
+
+from typing import Dict
+
+import numpy as np
+import xarray as xr
+
+import landsea
+import regions
+from datasets import get_land_source, get_paths
+from harness import Recorder, Spec, register_case
+
+SUITE = "regions"
+REGIONS_DATASETS = ("synthetic_small", "synthetic_large")
+
+# The region sets of the cases.
+REGION_SETS: Dict[str, Dict[str, regions.Region]] = {
+    "regions_30": regions.split_land_ocean(regions.latitude_bands(range(-90, 91, 12))),
+    "regions_100": regions.split_land_ocean(
+        {
+            f"{lat}/{lon}": {"lat": (lat, lat + 18), "lon": (lon, lon + 72)}
+            for lat in range(-90, 90, 18)
+            for lon in range(0, 360, 72)
+        }
+    ),
+}
+
+
+def _open(spec: Spec) -> xr.Dataset:
+    return xr.open_mfdataset(get_paths(spec), chunks=spec.get("chunks"))
+
+
+def _get_fraction(ds: xr.Dataset) -> xr.DataArray:
+    return landsea.generate_fraction(ds, source=get_land_source())
+
+
+def _xcdat(spec: Spec, rec: Recorder, case: str) -> np.ndarray:
+    import xcdat as xc
+
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = xc.open_mfdataset(spec["dir_path"], chunks=spec.get("chunks"))
+
+    with rec.stage("weights"):
+        land = _get_fraction(ds) >= 0.5
+
+    with rec.stage("average"):
+        results = []
+        for region in REGION_SETS[case].values():
+            ds_region = ds.copy()
+            mask = land if region["mask"] == "land" else ~land
+            ds_region[var_key] = ds[var_key].where(mask)
+            result = ds_region.spatial.average(
+                var_key, lat_bounds=region["lat"], lon_bounds=region.get("lon")
+            )[var_key]
+            results.append(result.values)
+
+    ds.close()
+
+    return np.stack(results, axis=-1)
+
+
+def _per_region(spec: Spec, rec: Recorder, case: str) -> np.ndarray:
+    with rec.stage("open"):
+        ds = _open(spec)
+        data = ds[spec["var_key"]]
+
+    with rec.stage("weights"):
+        weights = regions.get_weights(ds, REGION_SETS[case], fraction=_get_fraction(ds))
+
+    with rec.stage("average"):
+        shape = (ds.sizes["lat"], ds.sizes["lon"])
+        results = []
+        for row in range(len(weights.names)):
+            area = weights.matrix[row].toarray().reshape(shape)
+            area = xr.DataArray(area, dims=("lat", "lon"))
+            results.append(data.weighted(area).mean(("lat", "lon")).values)
+
+    ds.close()
+
+    return np.stack(results, axis=-1)
+
+
+def _single_pass(spec: Spec, rec: Recorder, case: str) -> np.ndarray:
+    regions.clear_cache()
+
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("weights"):
+        weights = regions.get_weights(ds, REGION_SETS[case], fraction=_get_fraction(ds))
+
+    with rec.stage("average"):
+        result = rec.tasks(regions.average(ds[spec["var_key"]], weights)).values
+
+    ds.close()
+
+    return result
+
+
+def _register(case: str):
+    @register_case(SUITE, case, "xcdat", datasets=REGIONS_DATASETS)
+    def _xcdat_case(spec: Spec, rec: Recorder) -> np.ndarray:
+        return _xcdat(spec, rec, case)
+
+    @register_case(SUITE, case, "per_region", datasets=REGIONS_DATASETS)
+    def _per_region_case(spec: Spec, rec: Recorder) -> np.ndarray:
+        return _per_region(spec, rec, case)
+
+    @register_case(SUITE, case, "single_pass", datasets=REGIONS_DATASETS)
+    def _single_pass_case(spec: Spec, rec: Recorder) -> np.ndarray:
+        return _single_pass(spec, rec, case)
+
+
+for _case in REGION_SETS:
+    _register(_case)
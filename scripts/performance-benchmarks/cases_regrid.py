@@ -0,0 +1,301 @@
+"""Horizontal regridding cases (``regrid_cdat_xcdat.ipynb``).
+
+Regrids a synthetic monthly dataset between uniform 2.5, 1 and 0.25 degree
+grids (``datasets.REGRID_CONFIGS``) with every xESMF method and with regrid2.
+Each xESMF case ("xesmf_<method>") has the implementations:
+
+- "xcdat": ``ds.regridder.horizontal(..., tool="xesmf")``, as users run it,
+  which generates the weights and applies them in one "regrid" stage.
+- "serial": ``xesmf.Regridder`` weight generation ("weights") and their
+  application to the loaded data ("apply"), timed separately.
+- "dask": the same weights applied to the data chunked by time step, so the
+  time steps are regridded in parallel by the Dask scheduler.
+- "cdat": cdms2 ``var.regrid(..., regrid_tool="esmf")`` with the matching
+  ESMF method, where there is one.
+
+The "regrid2" case runs ``ds.regridder.horizontal(..., tool="regrid2")`` on
+loaded ("serial") and chunked ("dask") data, and cdms2 with
+``regrid_tool="regrid2"`` ("cdat"). regrid2 computes its weights as part of
+each call, so it only has a "regrid" stage.
+
+The "weight_cache" case gets the "conservative_normed" weights with
+``regrid.get_weights`` from an empty cache ("cold", which generates and
+stores them), from the cache directory as a new process would ("disk") and
+from memory ("memory"), next to ``xesmf.Regridder`` without a cache
+("generate").
+
+The "multi_variable" case regrids 1, 10 and 100 variables on a shared grid
+(bilinear, with weights already in memory) with one call per variable
+("xcdat" and "per_variable", with ``regrid.horizontal``) and with one
+batched pass (``regrid.horizontal_batch``, "batched").
+
+The peak memory of each stage is traced with ``tracemalloc``, which does not
+see allocations made inside ESMF itself. xESMF and cdms2 are imported by the
+cases that use them, so the other cases run without them.
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import shutil
+from typing import Dict, Optional
+
+import numpy as np
+import xarray as xr
+import xcdat as xc  # noqa: F401 (registers the ``regridder`` accessor)
+
+import regrid
+from datasets import REGRID_CONFIGS, REGRID_VARS_SIZES, get_paths, make_uniform_grid
+from harness import Recorder, Spec, register_case
+
+SUITE = "regrid"
+REGRID_DATASETS = tuple(REGRID_CONFIGS)
+REGRID_VARS_DATASETS = tuple(REGRID_VARS_SIZES)
+
+# The method of the "weight_cache" case (the most expensive weights to make).
+CACHE_METHOD = "conservative_normed"
+
+# The xESMF methods, linked to the matching cdms2 ESMF method (None if there
+# is no cdms2 equivalent).
+XESMF_METHODS: Dict[str, Optional[str]] = {
+    "bilinear": "linear",
+    "conservative": "conservative",
+    "conservative_normed": "conservative",
+    "patch": "patch",
+    "nearest_s2d": None,
+    "nearest_d2s": None,
+}
+
+
+def _open(spec: Spec, chunked: bool) -> xr.Dataset:
+    ds = xr.open_mfdataset(get_paths(spec), chunks=spec["chunks"] if chunked else None)
+    if not chunked:
+        ds = ds.load()
+
+    return ds
+
+
+def _xesmf_regrid(spec: Spec, rec: Recorder, method: str, chunked: bool) -> xr.DataArray:
+    import xesmf
+
+    with rec.stage("open"):
+        ds = _open(spec, chunked)
+        output_grid = make_uniform_grid(*spec["target"])
+
+    with rec.stage("weights"):
+        regridder = xesmf.Regridder(
+            regrid.to_xesmf_grid(ds),
+            regrid.to_xesmf_grid(output_grid),
+            method,
+            periodic=True,
+        )
+        rec.metric("n_weights", regridder.weights.data.nnz)
+
+    with rec.stage("apply"):
+        result = rec.tasks(regridder(ds[spec["var_key"]], keep_attrs=True))
+        result = result.compute()
+
+    ds.close()
+
+    return result
+
+
+def _xcdat_regrid(spec: Spec, rec: Recorder, chunked: bool, **kwargs) -> xr.DataArray:
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = _open(spec, chunked)
+        output_grid = make_uniform_grid(*spec["target"])
+
+    with rec.stage("regrid"):
+        ds_out = ds.regridder.horizontal(var_key, output_grid, **kwargs)
+        result = rec.tasks(ds_out[var_key]).compute()
+
+    ds.close()
+
+    return result
+
+
+def _cdat_regrid(spec: Spec, rec: Recorder, **kwargs) -> np.ndarray:
+    import cdms2
+
+    nlat, nlon = spec["target"]
+    dlat, dlon = 180.0 / nlat, 360.0 / nlon
+
+    with rec.stage("open"):
+        fin = cdms2.open(sorted(glob.glob(get_paths(spec)))[0])
+        var = fin(spec["var_key"])
+        output_grid = cdms2.createUniformGrid(
+            -90.0 + dlat / 2, nlat, dlat, dlon / 2, nlon, dlon
+        )
+
+    with rec.stage("regrid"):
+        result = np.ma.filled(var.regrid(output_grid, **kwargs), np.nan)
+
+    fin.close()
+
+    return result
+
+
+def _register_xesmf(method: str, cdat_method: Optional[str]):
+    case = f"xesmf_{method}"
+
+    @register_case(SUITE, case, "xcdat", datasets=REGRID_DATASETS)
+    def _xcdat(spec: Spec, rec: Recorder) -> xr.DataArray:
+        return _xcdat_regrid(
+            spec, rec, False, tool="xesmf", method=method, periodic=True
+        )
+
+    @register_case(SUITE, case, "serial", datasets=REGRID_DATASETS)
+    def _serial(spec: Spec, rec: Recorder) -> xr.DataArray:
+        return _xesmf_regrid(spec, rec, method, chunked=False)
+
+    @register_case(SUITE, case, "dask", datasets=REGRID_DATASETS)
+    def _dask(spec: Spec, rec: Recorder) -> xr.DataArray:
+        return _xesmf_regrid(spec, rec, method, chunked=True)
+
+    if cdat_method is not None:
+
+        @register_case(SUITE, case, "cdat", datasets=REGRID_DATASETS)
+        def _cdat(spec: Spec, rec: Recorder) -> np.ndarray:
+            return _cdat_regrid(
+                spec, rec, regrid_tool="esmf", regrid_method=cdat_method
+            )
+
+
+for _method, _cdat_method in XESMF_METHODS.items():
+    _register_xesmf(_method, _cdat_method)
+
+
+@register_case(SUITE, "regrid2", "serial", datasets=REGRID_DATASETS)
+def regrid2_serial(spec: Spec, rec: Recorder) -> xr.DataArray:
+    return _xcdat_regrid(spec, rec, False, tool="regrid2")
+
+
+@register_case(SUITE, "regrid2", "dask", datasets=REGRID_DATASETS)
+def regrid2_dask(spec: Spec, rec: Recorder) -> xr.DataArray:
+    return _xcdat_regrid(spec, rec, True, tool="regrid2")
+
+
+@register_case(SUITE, "regrid2", "cdat", datasets=REGRID_DATASETS)
+def regrid2_cdat(spec: Spec, rec: Recorder) -> np.ndarray:
+    return _cdat_regrid(spec, rec, regrid_tool="regrid2")
+
+
+def _get_cache(spec: Spec, remove: bool = False) -> str:
+    cache = os.path.join(os.path.dirname(spec["dir_path"].rstrip(os.sep)), "regrid-weights")
+    if remove and os.path.exists(cache):
+        shutil.rmtree(cache)
+
+    return cache
+
+
+def _cached_weights(spec: Spec, rec: Recorder, cache: Optional[str]) -> int:
+    with rec.stage("open"):
+        ds = _open(spec, chunked=True)
+        output_grid = make_uniform_grid(*spec["target"])
+
+    with rec.stage("weights"):
+        row, _, _, _ = regrid.get_weights(ds, output_grid, CACHE_METHOD, cache=cache)
+
+        info = regrid.cache_info(cache)
+        rec.metric("hit_rate", info.hits / max(1, info.hits + info.misses))
+        rec.metric("saved", info.saved)
+        rec.metric("nbytes", info.nbytes)
+
+    ds.close()
+
+    return len(row)
+
+
+@register_case(SUITE, "weight_cache", "generate", datasets=REGRID_DATASETS)
+def weight_cache_generate(spec: Spec, rec: Recorder) -> int:
+    import xesmf
+
+    with rec.stage("open"):
+        ds = _open(spec, chunked=True)
+        output_grid = make_uniform_grid(*spec["target"])
+
+    with rec.stage("weights"):
+        regridder = xesmf.Regridder(
+            regrid.to_xesmf_grid(ds), regrid.to_xesmf_grid(output_grid), CACHE_METHOD
+        )
+
+    ds.close()
+
+    return regridder.weights.data.nnz
+
+
+@register_case(SUITE, "weight_cache", "cold", datasets=REGRID_DATASETS)
+def weight_cache_cold(spec: Spec, rec: Recorder) -> int:
+    regrid.clear_cache(_get_cache(spec, remove=True))
+
+    return _cached_weights(spec, rec, _get_cache(spec))
+
+
+@register_case(SUITE, "weight_cache", "disk", datasets=REGRID_DATASETS)
+def weight_cache_disk(spec: Spec, rec: Recorder) -> int:
+    # fill the cache directory, then forget the weights like a new process
+    output_grid = make_uniform_grid(*spec["target"])
+    ds = _open(spec, chunked=True)
+    regrid.get_weights(ds, output_grid, CACHE_METHOD, cache=_get_cache(spec))
+    ds.close()
+    regrid.clear_cache()
+
+    return _cached_weights(spec, rec, _get_cache(spec))
+
+
+@register_case(SUITE, "weight_cache", "memory", datasets=REGRID_DATASETS)
+def weight_cache_memory(spec: Spec, rec: Recorder) -> int:
+    regrid.clear_cache()
+    output_grid = make_uniform_grid(*spec["target"])
+    ds = _open(spec, chunked=True)
+    regrid.get_weights(ds, output_grid, CACHE_METHOD, cache=None)
+    ds.close()
+
+    return _cached_weights(spec, rec, None)
+
+
+@register_case(SUITE, "multi_variable", "xcdat", datasets=REGRID_VARS_DATASETS)
+def multi_variable_xcdat(spec: Spec, rec: Recorder) -> xr.Dataset:
+    ds, output_grid = spec["ds"], make_uniform_grid(*spec["target"])
+
+    with rec.stage("regrid"):
+        outputs = {
+            key: ds.regridder.horizontal(
+                key, output_grid, tool="xesmf", method="bilinear", periodic=True
+            )[key]
+            for key in spec["var_keys"]
+        }
+
+    return xr.Dataset(outputs)
+
+
+@register_case(SUITE, "multi_variable", "per_variable", datasets=REGRID_VARS_DATASETS)
+def multi_variable_per_variable(spec: Spec, rec: Recorder) -> xr.Dataset:
+    ds, output_grid = spec["ds"], make_uniform_grid(*spec["target"])
+    regrid.get_weights(ds, output_grid, "bilinear", periodic=True, cache=None)
+
+    with rec.stage("regrid"):
+        outputs = {
+            key: regrid.horizontal(
+                ds, key, output_grid, "bilinear", periodic=True, cache=None
+            )[key]
+            for key in spec["var_keys"]
+        }
+
+    return xr.Dataset(outputs)
+
+
+@register_case(SUITE, "multi_variable", "batched", datasets=REGRID_VARS_DATASETS)
+def multi_variable_batched(spec: Spec, rec: Recorder) -> xr.Dataset:
+    ds, output_grid = spec["ds"], make_uniform_grid(*spec["target"])
+    regrid.get_weights(ds, output_grid, "bilinear", periodic=True, cache=None)
+
+    with rec.stage("regrid"):
+        result = regrid.horizontal_batch(
+            ds, spec["var_keys"], output_grid, "bilinear", periodic=True, cache=None
+        )
+
+    return result
@@ -0,0 +1,202 @@
+"""Map file remapping cases (``xcdat_practicum_notebook.ipynb``).
+
+The "remap" case remaps "TREFHT" of a monthly h0 archive from ne30pg2 to a 1
+degree grid with the map file of the dataset, and loads the result. The
+"global_mean" case then averages it over the globe with
+``ds.spatial.average``. Both compare:
+
+- "ncremap": ``ncremap -m <map> -v TREFHT`` on the h0 files, which writes
+  the remapped files to disk, then ``xr.open_mfdataset`` (or
+  ``xc.open_mfdataset``) on them, as in the notebook.
+- "in_process": ``remap.apply_map`` on the lazy h0 archive, with the map file
+  read once, without any remapped file.
+
+The "remap" stage of each impl records the bytes read and written (as the
+sizes of the files read and written, including the reopened ncremap
+output). The "in_process" impl of the "remap" case is checked against the
+ncremap output of the dataset if the "ncremap" impl has written it, and
+otherwise against a reference that adds up the links (S, row, col) of the
+map file for every time step, and records the maximum absolute difference
+(untimed). ncremap (NCO) and xcdat are only needed by the impls that use
+them.
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import shutil
+import subprocess
+from typing import Dict, List
+
+import numpy as np
+import xarray as xr
+
+import remap
+from datasets import SYNTHETIC_DIR, UNSTRUCTURED_CONFIGS, get_paths
+from harness import Recorder, Spec, register_case
+
+SUITE = "remap"
+REMAP_DATASETS = tuple(UNSTRUCTURED_CONFIGS) + ("e3sm_v3_h0",)
+
+# The ncremap output directory of the cases (one subdirectory per dataset).
+OUTPUT_DIR = os.path.join(SYNTHETIC_DIR, "ncremap")
+
+# The reference remapped data of every dataset (without ncremap output).
+_expected: Dict[str, np.ndarray] = {}
+
+
+def _open(spec: Spec) -> xr.Dataset:
+    return xr.open_mfdataset(
+        get_paths(spec),
+        combine="nested",
+        concat_dim="time",
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+        chunks=spec.get("chunks"),
+    )
+
+
+def _nbytes(paths: List[str]) -> int:
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def _remap_links(spec: Spec, shape: tuple) -> np.ndarray:
+    # the reference remap: the weighted source values of the links of the
+    # map file added up into their destination cells, time step by time step
+    # (missing values contribute nothing, cells without any are missing)
+    with xr.open_dataset(spec["map_path"]) as ds_map:
+        S = ds_map["S"].values
+        row = ds_map["row"].values - 1
+        col = ds_map["col"].values - 1
+
+    with _open(spec) as ds:
+        data = ds[spec["var_key"]].values
+
+    out = np.zeros((data.shape[0], int(np.prod(shape[1:]))))
+    for t in range(data.shape[0]):
+        x = data[t, col].astype(np.float64)
+        links = ~np.isnan(x)
+        np.add.at(out[t], row[links], S[links] * x[links])
+        n_valid = np.bincount(row[links], minlength=out.shape[1])
+        out[t, n_valid == 0] = np.nan
+
+    return out.reshape(shape)
+
+
+def _ncremap(spec: Spec, rec: Recorder) -> str:
+    # remap the h0 files to a fresh output directory, like the notebook
+    if shutil.which("ncremap") is None:
+        raise RuntimeError("ncremap (NCO) is not installed.")
+
+    paths = sorted(glob.glob(get_paths(spec)))
+    out_dir = os.path.join(OUTPUT_DIR, spec["name"])
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+    with rec.stage("remap"):
+        subprocess.run(
+            ["ncremap", "-m", spec["map_path"], "-t", "1", "-v", spec["var_key"]]
+            + ["-O", out_dir]
+            + paths,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        written = _nbytes(glob.glob(os.path.join(out_dir, "*.nc")))
+        rec.metric("bytes_read", _nbytes(paths) + written)
+        rec.metric("bytes_written", written)
+
+    return out_dir
+
+
+def _in_process(spec: Spec, rec: Recorder) -> xr.Dataset:
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("remap"):
+        ds_remap = remap.apply_map(ds, spec["map_path"], var_keys=[spec["var_key"]])
+        rec.tasks(ds_remap[spec["var_key"]])
+        rec.metric("bytes_read", _nbytes(glob.glob(get_paths(spec))))
+        rec.metric("bytes_written", 0)
+
+    return ds_remap
+
+
+@register_case(SUITE, "remap", "ncremap", datasets=REMAP_DATASETS)
+def remap_ncremap(spec: Spec, rec: Recorder) -> np.ndarray:
+    out_dir = _ncremap(spec, rec)
+
+    with rec.stage("open"):
+        ds = xr.open_mfdataset(os.path.join(out_dir, "*.nc"))
+
+    with rec.stage("compute"):
+        result = ds[spec["var_key"]].transpose("time", "lat", "lon").values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "remap", "in_process", datasets=REMAP_DATASETS)
+def remap_in_process(spec: Spec, rec: Recorder) -> np.ndarray:
+    remap.clear_cache()
+    ds_remap = _in_process(spec, rec)
+
+    with rec.stage("compute"):
+        result = ds_remap[spec["var_key"]].values
+
+    # check against the ncremap output of the dataset, or the reference
+    # (untimed)
+    out_dir = os.path.join(OUTPUT_DIR, spec["name"])
+    if glob.glob(os.path.join(out_dir, "*.nc")):
+        with xr.open_mfdataset(os.path.join(out_dir, "*.nc")) as ds:
+            expected = ds[spec["var_key"]].transpose("time", "lat", "lon").values
+        metric = "max_abs_diff_ncremap"
+    else:
+        if spec["name"] not in _expected:
+            _expected[spec["name"]] = _remap_links(spec, result.shape)
+        expected = _expected[spec["name"]]
+        metric = "max_abs_diff_reference"
+
+    np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6)
+    diff = float(np.nanmax(np.abs(result - expected)))
+    with rec.stage("compute"):
+        rec.metric(metric, diff)
+
+    return result
+
+
+@register_case(SUITE, "global_mean", "ncremap", datasets=REMAP_DATASETS)
+def global_mean_ncremap(spec: Spec, rec: Recorder) -> np.ndarray:
+    import xcdat as xc
+
+    out_dir = _ncremap(spec, rec)
+
+    with rec.stage("open"):
+        ds = xc.open_mfdataset(out_dir)
+
+    with rec.stage("average"):
+        result = ds.spatial.average(spec["var_key"], axis=["X", "Y"])[
+            spec["var_key"]
+        ].values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "global_mean", "in_process", datasets=REMAP_DATASETS)
+def global_mean_in_process(spec: Spec, rec: Recorder) -> np.ndarray:
+    import xcdat as xc  # noqa: F401 (registers the ``spatial`` accessor)
+
+    ds_remap = _in_process(spec, rec)
+
+    with rec.stage("average"):
+        result = ds_remap.spatial.average(spec["var_key"], axis=["X", "Y"])[
+            spec["var_key"]
+        ].values
+
+    return result
@@ -0,0 +1,165 @@
+"""Unstructured grid topology cases (``uxarray_practicum_notebook.ipynb``).
+
+The "open_grid" case opens a grid file and gets its face areas with:
+
+- "uxarray": ``ux.open_grid(grid_path).face_areas``, which parses the grid
+  file, as every ``ux.open_dataset`` call of the notebook does.
+- "parse": ``topology.read_topology`` without any cache.
+- "cold": ``topology.get_topology`` with an empty cache directory, which
+  parses the grid file and writes its sidecar.
+- "warm": the same from the sidecar (memory-mapped), as a new process would.
+- "warm_copy": the same, reading the arrays into memory (``mmap=False``).
+- "uxarray_cached": ``topology.open_grid``, the uxarray Grid built from the
+  sidecar.
+
+The "use" stage sums the face areas and the connectivity, so the pages of
+memory-mapped arrays are read. The "open_100" case opens the same grid 100
+times, as a job over 100 data files would, with "parse" (every time),
+"warm" (from the sidecar, every open being a new process) and "memory" (one
+process). The cases run on the sample grids of the workshop and on
+synthetic cubed spheres up to ne240pg2 (1.4M faces). uxarray is only needed
+by the impls that use it.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+
+import numpy as np
+
+import topology
+from datasets import GRID_CONFIGS, REAL_GRIDS, SYNTHETIC_DIR
+from harness import Recorder, Spec, register_case
+
+SUITE = "topology"
+TOPOLOGY_DATASETS = tuple(REAL_GRIDS) + tuple(GRID_CONFIGS)
+
+# The sidecar cache directory of the cases.
+CACHE_DIR = os.path.join(SYNTHETIC_DIR, "topology-cache")
+
+# The number of opens of the "open_100" case.
+N_OPENS = 100
+
+
+def _fill_cache(spec: Spec):
+    # write the sidecar of the grid, then forget it like a new process
+    topology.get_topology(spec["grid_path"], cache=CACHE_DIR)
+    topology.clear_cache()
+
+
+def _sidecar_bytes() -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, fn))
+        for root, _, fns in os.walk(CACHE_DIR)
+        for fn in fns
+    )
+
+
+def _use(topo: topology.Topology, rec: Recorder) -> np.ndarray:
+    with rec.stage("use"):
+        areas = np.array(topo.face_areas)
+        rec.metric("face_nodes_sum", int(np.asarray(topo.face_nodes).sum()))
+
+    return areas
+
+
+@register_case(SUITE, "open_grid", "uxarray", datasets=TOPOLOGY_DATASETS)
+def open_grid_uxarray(spec: Spec, rec: Recorder) -> np.ndarray:
+    import uxarray as ux
+
+    with rec.stage("open"):
+        grid = ux.open_grid(spec["grid_path"])
+
+    with rec.stage("use"):
+        areas = grid.face_areas.values
+        rec.metric("face_nodes_sum", int(grid.face_node_connectivity.values.sum()))
+
+    return areas
+
+
+@register_case(SUITE, "open_grid", "parse", datasets=TOPOLOGY_DATASETS)
+def open_grid_parse(spec: Spec, rec: Recorder) -> np.ndarray:
+    with rec.stage("open"):
+        topo = topology.read_topology(spec["grid_path"])
+
+    return _use(topo, rec)
+
+
+@register_case(SUITE, "open_grid", "cold", datasets=TOPOLOGY_DATASETS)
+def open_grid_cold(spec: Spec, rec: Recorder) -> np.ndarray:
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+    topology.clear_cache()
+
+    with rec.stage("open"):
+        topo = topology.get_topology(spec["grid_path"], cache=CACHE_DIR)
+        rec.metric("sidecar_bytes", _sidecar_bytes())
+
+    return _use(topo, rec)
+
+
+@register_case(SUITE, "open_grid", "warm", datasets=TOPOLOGY_DATASETS)
+def open_grid_warm(spec: Spec, rec: Recorder) -> np.ndarray:
+    _fill_cache(spec)
+
+    with rec.stage("open"):
+        topo = topology.get_topology(spec["grid_path"], cache=CACHE_DIR)
+
+    return _use(topo, rec)
+
+
+@register_case(SUITE, "open_grid", "warm_copy", datasets=TOPOLOGY_DATASETS)
+def open_grid_warm_copy(spec: Spec, rec: Recorder) -> np.ndarray:
+    _fill_cache(spec)
+
+    with rec.stage("open"):
+        topo = topology.get_topology(spec["grid_path"], cache=CACHE_DIR, mmap=False)
+
+    return _use(topo, rec)
+
+
+@register_case(SUITE, "open_grid", "uxarray_cached", datasets=TOPOLOGY_DATASETS)
+def open_grid_uxarray_cached(spec: Spec, rec: Recorder) -> np.ndarray:
+    _fill_cache(spec)
+
+    with rec.stage("open"):
+        grid = topology.open_grid(spec["grid_path"], cache=CACHE_DIR)
+
+    with rec.stage("use"):
+        areas = np.array(topology.get_topology(spec["grid_path"], cache=CACHE_DIR).face_areas)
+        rec.metric("face_nodes_sum", int(grid.face_node_connectivity.values.sum()))
+
+    return areas
+
+
+@register_case(SUITE, "open_100", "parse", datasets=TOPOLOGY_DATASETS)
+def open_100_parse(spec: Spec, rec: Recorder) -> np.ndarray:
+    with rec.stage("open"):
+        for _ in range(N_OPENS):
+            topo = topology.read_topology(spec["grid_path"])
+
+    return np.array(topo.face_areas)
+
+
+@register_case(SUITE, "open_100", "warm", datasets=TOPOLOGY_DATASETS)
+def open_100_warm(spec: Spec, rec: Recorder) -> np.ndarray:
+    _fill_cache(spec)
+
+    with rec.stage("open"):
+        for _ in range(N_OPENS):
+            topology.clear_cache()
+            topo = topology.get_topology(spec["grid_path"], cache=CACHE_DIR)
+
+    return np.array(topo.face_areas)
+
+
+@register_case(SUITE, "open_100", "memory", datasets=TOPOLOGY_DATASETS)
+def open_100_memory(spec: Spec, rec: Recorder) -> np.ndarray:
+    _fill_cache(spec)
+
+    with rec.stage("open"):
+        for _ in range(N_OPENS):
+            topo = topology.get_topology(spec["grid_path"], cache=CACHE_DIR)
+
+    return np.array(topo.face_areas)
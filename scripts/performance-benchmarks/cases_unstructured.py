@@ -0,0 +1,221 @@
+"""Unstructured grid averaging cases (``uxarray_practicum_notebook.ipynb``).
+
+The "face_areas" case computes the face areas of the grid with:
+
+- "exact": ``unstructured.face_areas`` without a cache (spherical polygons).
+- "cached": the same from the cache directory, as a new process would.
+- "uxarray": ``ux.open_grid(grid_path).face_areas``, as in the notebook.
+
+The "global_mean" case averages "TREFHT" of a monthly h0 archive over the
+globe, and the "regional_means" case over 12 latitude bands, with:
+
+- "unstructured": ``unstructured.average`` with the cached face areas (and
+  the band masks), in one pass over the time chunks of the archive.
+- "uxarray": ``UxDataArray.weighted_mean`` on ``ux.open_mfdataset``
+  ("global_mean" only).
+- "per_mask": ``DataArray.weighted(...).mean`` with the face areas of each
+  band, computed one band at a time ("regional_means" only).
+- "remap_xcdat": ``remap.apply_map`` with the map file of the dataset (to a 1
+  degree grid, in place of ``ncremap``) then ``ds.spatial.average`` (with the
+  lat_bounds of each band).
+
+uxarray and xcdat are imported by the cases that use them, so the other cases
+run without them.
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import shutil
+from typing import Dict
+
+import numpy as np
+import xarray as xr
+
+import regions
+import remap
+import unstructured
+from datasets import SYNTHETIC_DIR, UNSTRUCTURED_CONFIGS, get_paths
+from harness import Recorder, Spec, register_case
+
+SUITE = "unstructured"
+UNSTRUCTURED_DATASETS = tuple(UNSTRUCTURED_CONFIGS) + ("e3sm_v3_h0",)
+
+# The face area cache directory of the cases.
+CACHE_DIR = os.path.join(SYNTHETIC_DIR, "face-areas-cache")
+
+# The latitude bands of the "regional_means" case.
+BANDS: Dict[str, regions.Region] = regions.latitude_bands(range(-90, 91, 15))
+
+
+def _open(spec: Spec) -> xr.Dataset:
+    return xr.open_mfdataset(
+        get_paths(spec),
+        combine="nested",
+        concat_dim="time",
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+        chunks=spec.get("chunks"),
+    )
+
+
+def _get_masks(ds: xr.Dataset) -> Dict[str, np.ndarray]:
+    return {
+        name: unstructured.box_mask(ds["lat"], ds["lon"], band["lat"])
+        for name, band in BANDS.items()
+    }
+
+
+@register_case(SUITE, "face_areas", "exact", datasets=UNSTRUCTURED_DATASETS)
+def face_areas_exact(spec: Spec, rec: Recorder) -> np.ndarray:
+    unstructured.clear_cache()
+
+    with rec.stage("areas"):
+        areas = unstructured.face_areas(spec["grid_path"], cache=None)
+
+    return areas
+
+
+@register_case(SUITE, "face_areas", "cached", datasets=UNSTRUCTURED_DATASETS)
+def face_areas_cached(spec: Spec, rec: Recorder) -> np.ndarray:
+    # fill the cache directory, then forget the areas like a new process
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+    unstructured.face_areas(spec["grid_path"], cache=CACHE_DIR)
+    unstructured.clear_cache()
+
+    with rec.stage("areas"):
+        areas = unstructured.face_areas(spec["grid_path"], cache=CACHE_DIR)
+
+    return areas
+
+
+@register_case(SUITE, "face_areas", "uxarray", datasets=UNSTRUCTURED_DATASETS)
+def face_areas_uxarray(spec: Spec, rec: Recorder) -> np.ndarray:
+    import uxarray as ux
+
+    with rec.stage("areas"):
+        areas = ux.open_grid(spec["grid_path"]).face_areas.values
+
+    return areas
+
+
+@register_case(SUITE, "global_mean", "unstructured", datasets=UNSTRUCTURED_DATASETS)
+def global_mean_unstructured(spec: Spec, rec: Recorder) -> np.ndarray:
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("areas"):
+        unstructured.face_areas(spec["grid_path"], cache=CACHE_DIR)
+
+    with rec.stage("average"):
+        result = unstructured.average(ds[spec["var_key"]], spec["grid_path"], cache=CACHE_DIR)
+        result = rec.tasks(result).values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "global_mean", "uxarray", datasets=UNSTRUCTURED_DATASETS)
+def global_mean_uxarray(spec: Spec, rec: Recorder) -> np.ndarray:
+    import uxarray as ux
+
+    with rec.stage("open"):
+        uxds = ux.open_mfdataset(
+            spec["grid_path"], sorted(glob.glob(get_paths(spec))), chunks=spec.get("chunks")
+        )
+
+    with rec.stage("average"):
+        result = uxds[spec["var_key"]].weighted_mean().values
+
+    return result
+
+
+@register_case(SUITE, "global_mean", "remap_xcdat", datasets=UNSTRUCTURED_DATASETS)
+def global_mean_remap_xcdat(spec: Spec, rec: Recorder) -> np.ndarray:
+    import xcdat as xc  # noqa: F401 (registers the ``spatial`` accessor)
+
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("remap"):
+        ds_remap = remap.apply_map(ds, spec["map_path"], var_keys=[var_key])
+
+    with rec.stage("average"):
+        result = ds_remap.spatial.average(var_key, axis=["X", "Y"])[var_key].values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "regional_means", "unstructured", datasets=UNSTRUCTURED_DATASETS)
+def regional_means_unstructured(spec: Spec, rec: Recorder) -> np.ndarray:
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("areas"):
+        masks = _get_masks(ds)
+        unstructured.face_areas(spec["grid_path"], cache=CACHE_DIR)
+
+    with rec.stage("average"):
+        result = unstructured.average(
+            ds[spec["var_key"]], spec["grid_path"], masks=masks, cache=CACHE_DIR
+        )
+        result = rec.tasks(result).values
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "regional_means", "per_mask", datasets=UNSTRUCTURED_DATASETS)
+def regional_means_per_mask(spec: Spec, rec: Recorder) -> np.ndarray:
+    with rec.stage("open"):
+        ds = _open(spec)
+        data = ds[spec["var_key"]]
+
+    with rec.stage("areas"):
+        masks = _get_masks(ds)
+        areas = unstructured.face_areas(spec["grid_path"], cache=CACHE_DIR)
+
+    with rec.stage("average"):
+        face_dim = ds["lat"].dims[0]
+        results = [
+            data.weighted(xr.DataArray(areas * mask, dims=face_dim)).mean(face_dim).values
+            for mask in masks.values()
+        ]
+
+    ds.close()
+
+    return np.stack(results, axis=-1)
+
+
+@register_case(SUITE, "regional_means", "remap_xcdat", datasets=UNSTRUCTURED_DATASETS)
+def regional_means_remap_xcdat(spec: Spec, rec: Recorder) -> np.ndarray:
+    import xcdat as xc  # noqa: F401 (registers the ``spatial`` accessor)
+
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("remap"):
+        ds_remap = remap.apply_map(ds, spec["map_path"], var_keys=[var_key])
+
+    with rec.stage("average"):
+        results = [
+            ds_remap.spatial.average(var_key, axis=["X", "Y"], lat_bounds=band["lat"])[
+                var_key
+            ].values
+            for band in BANDS.values()
+        ]
+
+    ds.close()
+
+    return np.stack(results, axis=-1)
@@ -0,0 +1,258 @@
+"""Vertical interpolation cases (``Vertical_interp.ipynb``).
+
+Interpolates temperature on hybrid sigma-pressure levels to the mandatory
+pressure levels, linearly in pressure ("hybrid_to_pressure_linear") and in
+log-pressure ("hybrid_to_pressure_log"), with:
+
+- "vertical": ``scripts/vertical.py`` on the lazy (Dask) data, chunked by
+  year, without any transposes.
+- "metpy": ``metpy.interpolate.interpolate_1d`` (``log_interpolate_1d``) on
+  the loaded NumPy arrays, with the pressure transposed to the data order.
+- "xgcm": ``xgcm.Grid.transform`` with the pressure as the target data.
+- "cdutil": ``cdutil.vertical.linearInterpolation``
+  (``logLinearInterpolation``) on each file read with cdms2.
+
+The "multi_variable" case interpolates 1, 4 and 16 variables sharing PS
+(``datasets.HYBRID_VARS_SIZES``) to the mandatory levels, with:
+
+- "per_variable": ``vertical.interp_to_pressure`` for each variable, computed
+  one after the other, so the pressure field and the bracketing search are
+  recomputed for every variable.
+- "plan": one lazy ``vertical.get_plan`` applied to every variable with
+  ``vertical.apply_plan`` and computed together, so Dask computes each chunk
+  of the plan once.
+- "persisted": ``vertical.get_plan(..., persist=True)`` (the "plan" stage),
+  then each variable computed one after the other with the plan in memory.
+
+metpy, xgcm and cdms2/cdutil are imported by the cases that use them, so the
+other cases run without them.
+"""
+
+from __future__ import annotations
+
+import glob
+
+import numpy as np
+import xarray as xr
+
+import vertical
+from datasets import HYBRID_VARS_SIZES, get_paths
+from harness import Recorder, Spec, register_case
+
+SUITE = "vertical"
+HYBRID_DATASETS = ("hybrid_20yr", "e3sm_T_hybrid")
+HYBRID_VARS_DATASETS = tuple(HYBRID_VARS_SIZES)
+
+# The cases, linked to their vertical.py method.
+METHODS = {"hybrid_to_pressure_linear": "linear", "hybrid_to_pressure_log": "log"}
+
+
+def _open(spec: Spec) -> xr.Dataset:
+    return xr.open_mfdataset(
+        get_paths(spec),
+        chunks=spec.get("chunks"),
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+    )
+
+
+def _get_p0(ds: xr.Dataset) -> float:
+    return float(ds["P0"]) if "P0" in ds else 100000.0
+
+
+def _vertical(spec: Spec, rec: Recorder, method: str) -> np.ndarray:
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("pressure"):
+        pressure = rec.tasks(
+            vertical.pressure_from_hybrid(ds["PS"], ds["hyam"], ds["hybm"], _get_p0(ds))
+        )
+
+    with rec.stage("interp"):
+        result = vertical.interp_to_pressure(
+            ds[spec["var_key"]], pressure, vertical.MANDATORY_LEVELS, method=method
+        )
+        result = rec.tasks(result).values
+
+    ds.close()
+
+    return result
+
+
+def _metpy(spec: Spec, rec: Recorder, method: str) -> np.ndarray:
+    import metpy.interpolate
+
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = _open(spec).load()
+
+    with rec.stage("pressure"):
+        pressure = vertical.pressure_from_hybrid(
+            ds["PS"], ds["hyam"], ds["hybm"], _get_p0(ds)
+        )
+        # metpy needs NumPy arrays in the same dimension order
+        pressure = pressure.transpose(*ds[var_key].dims)
+
+    with rec.stage("interp"):
+        interpolate = {
+            "linear": metpy.interpolate.interpolate_1d,
+            "log": metpy.interpolate.log_interpolate_1d,
+        }[method]
+        result = interpolate(
+            vertical.MANDATORY_LEVELS,
+            pressure.values,
+            ds[var_key].values,
+            axis=ds[var_key].dims.index("lev"),
+        )
+
+    ds.close()
+
+    return np.asarray(result)
+
+
+def _xgcm(spec: Spec, rec: Recorder, method: str) -> np.ndarray:
+    from xgcm import Grid
+
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("pressure"):
+        ds["pressure"] = vertical.pressure_from_hybrid(
+            ds["PS"], ds["hyam"], ds["hybm"], _get_p0(ds)
+        )
+        grid = Grid(ds, coords={"lev": {"center": "lev"}}, periodic=False)
+
+    with rec.stage("interp"):
+        result = grid.transform(
+            ds[var_key],
+            "lev",
+            vertical.MANDATORY_LEVELS,
+            target_data=ds["pressure"],
+            method=method,
+        )
+        result = rec.tasks(result).values
+
+    ds.close()
+
+    return result
+
+
+def _cdutil(spec: Spec, rec: Recorder, method: str) -> np.ndarray:
+    import cdms2
+    import cdutil
+
+    interpolate = {
+        "linear": cdutil.vertical.linearInterpolation,
+        "log": cdutil.vertical.logLinearInterpolation,
+    }[method]
+    results = []
+
+    for fn in sorted(glob.glob(get_paths(spec))):
+        with rec.stage("open"):
+            fin = cdms2.open(fn)
+            var = fin(spec["var_key"])
+            ps, hyam, hybm = fin("PS"), fin("hyam"), fin("hybm")
+            p0 = float(fin("P0")) if "P0" in fin.variables else 100000.0
+
+        with rec.stage("pressure"):
+            levels = cdutil.vertical.reconstructPressureFromHybrid(
+                ps, hyam, hybm, p0
+            )
+            levels.units = "Pa"
+
+        with rec.stage("interp"):
+            result = interpolate(var, levels, list(vertical.MANDATORY_LEVELS))
+            results.append(np.ma.filled(result, np.nan))
+
+        fin.close()
+
+    return np.concatenate(results)
+
+
+def _register(case: str, method: str):
+    @register_case(SUITE, case, "vertical", datasets=HYBRID_DATASETS)
+    def _vertical_case(spec: Spec, rec: Recorder) -> np.ndarray:
+        return _vertical(spec, rec, method)
+
+    @register_case(SUITE, case, "metpy", datasets=HYBRID_DATASETS)
+    def _metpy_case(spec: Spec, rec: Recorder) -> np.ndarray:
+        return _metpy(spec, rec, method)
+
+    @register_case(SUITE, case, "xgcm", datasets=HYBRID_DATASETS)
+    def _xgcm_case(spec: Spec, rec: Recorder) -> np.ndarray:
+        return _xgcm(spec, rec, method)
+
+    @register_case(SUITE, case, "cdutil", datasets=HYBRID_DATASETS)
+    def _cdutil_case(spec: Spec, rec: Recorder) -> np.ndarray:
+        return _cdutil(spec, rec, method)
+
+
+for _case, _method in METHODS.items():
+    _register(_case, _method)
+
+
+@register_case(SUITE, "multi_variable", "per_variable", datasets=HYBRID_VARS_DATASETS)
+def multi_variable_per_variable(spec: Spec, rec: Recorder) -> xr.Dataset:
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("pressure"):
+        pressure = vertical.pressure_from_hybrid(
+            ds["PS"], ds["hyam"], ds["hybm"], _get_p0(ds)
+        )
+
+    with rec.stage("interp"):
+        outputs = {
+            key: vertical.interp_to_pressure(ds[key], pressure).compute()
+            for key in spec["var_keys"]
+        }
+
+    ds.close()
+
+    return xr.Dataset(outputs)
+
+
+@register_case(SUITE, "multi_variable", "plan", datasets=HYBRID_VARS_DATASETS)
+def multi_variable_plan(spec: Spec, rec: Recorder) -> xr.Dataset:
+    vertical.clear_cache()
+
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("plan"):
+        plan = vertical.get_plan(ds["PS"], ds["hyam"], ds["hybm"], p0=_get_p0(ds))
+
+    with rec.stage("interp"):
+        result = rec.tasks(vertical.apply_plan(ds[spec["var_keys"]], plan)).compute()
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "multi_variable", "persisted", datasets=HYBRID_VARS_DATASETS)
+def multi_variable_persisted(spec: Spec, rec: Recorder) -> xr.Dataset:
+    vertical.clear_cache()
+
+    with rec.stage("open"):
+        ds = _open(spec)
+
+    with rec.stage("plan"):
+        plan = vertical.get_plan(
+            ds["PS"], ds["hyam"], ds["hybm"], p0=_get_p0(ds), persist=True
+        )
+
+    with rec.stage("interp"):
+        outputs = {
+            key: vertical.apply_plan(ds[key], plan).compute()
+            for key in spec["var_keys"]
+        }
+
+    ds.close()
+
+    return xr.Dataset(outputs)
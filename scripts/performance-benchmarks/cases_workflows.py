@@ -0,0 +1,148 @@
+"""End-to-end workflow cases, comparing xarray-only and xCDAT implementations.
+
+Each case is a stage-by-stage copy of an existing workflow script so the
+runtimes can be traced back to the code users actually run:
+
+- "vo_departures": ``11-9-23-steve-joss-paper/vo_xarray.py`` and
+  ``vo_xcdat.py`` (monthly departures -> global mean -> annual mean).
+- "gmsat_anomaly": ``scripts/io_example.py`` (satellite era subset -> global
+  mean -> monthly anomaly).
+
+The stages before "compute" only build the (lazy) Dask graph, so they capture
+the Python overhead of each API (e.g., xCDAT bounds handling, weight generation
+and accessors). The "compute" stage executes the graph.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import xarray as xr
+import xcdat as xc
+
+from harness import Recorder, Spec, register_case
+
+SUITE = "workflows"
+WORKFLOW_DATASETS = (
+    "synthetic_small",
+    "synthetic_large",
+    "e3sm_ts_mon",
+    "cesm2_tas_mon",
+)
+
+
+@register_case(SUITE, "vo_departures", "xarray", datasets=WORKFLOW_DATASETS)
+def vo_departures_xarray(spec: Spec, rec: Recorder) -> xr.DataArray:
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = xr.open_mfdataset(spec["dir_path"] + "*.nc", chunks=spec.get("chunks"))
+
+    with rec.stage("departures"):
+        ts_mon = ds[var_key].groupby("time.month")
+        ts_mon_clim = ts_mon.mean(dim="time")
+        ts_anom = rec.tasks(ts_mon - ts_mon_clim)
+
+    with rec.stage("spatial_avg"):
+        coslat = np.cos(np.deg2rad(ds.lat))
+        ts_anom_wgt = ts_anom.weighted(coslat)
+        ts_anom_global = rec.tasks(ts_anom_wgt.mean(dim="lat").mean(dim="lon"))
+
+    with rec.stage("annual_avg"):
+        mon_len = ts_anom_global.time.dt.days_in_month
+        mon_len_by_year = mon_len.groupby("time.year")
+        wgts = mon_len_by_year / mon_len_by_year.sum()
+
+        temp_sum = ts_anom_global * wgts
+        temp_sum = temp_sum.resample(time="YS").sum(dim="time")
+        denom_sum = (wgts).resample(time="YS").sum(dim="time")
+
+        ts_anom_global_ann = rec.tasks(temp_sum / denom_sum)
+
+    with rec.stage("compute"):
+        result = ts_anom_global_ann.compute()
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "vo_departures", "xcdat", datasets=WORKFLOW_DATASETS)
+def vo_departures_xcdat(spec: Spec, rec: Recorder) -> xr.DataArray:
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = xc.open_mfdataset(spec["dir_path"], chunks=spec.get("chunks"))
+
+    with rec.stage("departures"):
+        ds_anom = ds.temporal.departures(var_key, freq="month")
+        rec.tasks(ds_anom[var_key])
+
+    with rec.stage("spatial_avg"):
+        ds_anom_glb = ds_anom.spatial.average(var_key)
+        rec.tasks(ds_anom_glb[var_key])
+
+    with rec.stage("annual_avg"):
+        ds_anom_glb_ann = ds_anom_glb.temporal.group_average(var_key, freq="year")
+        rec.tasks(ds_anom_glb_ann[var_key])
+
+    with rec.stage("compute"):
+        result = ds_anom_glb_ann[var_key].compute()
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "gmsat_anomaly", "xarray", datasets=WORKFLOW_DATASETS)
+def gmsat_anomaly_xarray(spec: Spec, rec: Recorder) -> xr.DataArray:
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = xr.open_mfdataset(
+            spec["dir_path"] + "*.nc", combine="by_coords", chunks=spec.get("chunks")
+        )
+
+    with rec.stage("subset"):
+        tas = ds[var_key].sel(time=slice("1979-01-01", "2014-12-31"))
+
+    with rec.stage("spatial_avg"):
+        weights = np.cos(np.deg2rad(tas.lat))
+        weights.name = "weights"
+        tasm = rec.tasks(tas.weighted(weights).mean(("lon", "lat")))
+
+    with rec.stage("departures"):
+        climatology = tasm.groupby("time.month").mean("time")
+        tasma = rec.tasks(tasm.groupby("time.month") - climatology)
+
+    with rec.stage("compute"):
+        result = tasma.compute()
+
+    ds.close()
+
+    return result
+
+
+@register_case(SUITE, "gmsat_anomaly", "xcdat", datasets=WORKFLOW_DATASETS)
+def gmsat_anomaly_xcdat(spec: Spec, rec: Recorder) -> xr.DataArray:
+    var_key = spec["var_key"]
+
+    with rec.stage("open"):
+        ds = xc.open_mfdataset(spec["dir_path"], chunks=spec.get("chunks"))
+
+    with rec.stage("subset"):
+        ds = ds.sel(time=slice("1979-01-01", "2014-12-31"))
+
+    with rec.stage("spatial_avg"):
+        ds_glb = ds.spatial.average(var_key, axis=["X", "Y"])
+        rec.tasks(ds_glb[var_key])
+
+    with rec.stage("departures"):
+        ds_anom = ds_glb.temporal.departures(var_key, freq="month")
+        rec.tasks(ds_anom[var_key])
+
+    with rec.stage("compute"):
+        result = ds_anom[var_key].compute()
+
+    ds.close()
+
+    return result
@@ -0,0 +1,514 @@
+"""Synthetic xrw catalogs (sqlite ``paths`` tables) for the catalog benchmarks.
+
+The facet distributions are skewed like the LLNL archive: a few models,
+variables and members (e.g., r1i1p1f1) are much more common than the rest,
+~20% of datasets have more than one version (duplicate members to
+de-duplicate) and a few percent of paths are retired or ignored.
+
+The same rows are also written as synthetic CMIP5/CMIP6 DRS directory trees
+(one empty netCDF file per dataset) for the crawler benchmarks, and as
+synthetic CDAT xml trees (one empty xml file per dataset, like
+/p/user_pub/xclim) for the ``cdw.getXmlFiles`` benchmarks, and as in-memory
+lists of xml files for the ``cdw.trimModelList`` benchmarks.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import sqlite3
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import catalog
+from harness import ROOT_DIR, Spec, register_dataset
+
+CATALOG_DIR = os.path.join(ROOT_DIR, "input-datasets", "synthetic", "catalogs")
+TREE_DIR = os.path.join(ROOT_DIR, "input-datasets", "synthetic", "trees")
+XML_TREE_DIR = os.path.join(ROOT_DIR, "input-datasets", "synthetic", "xmls")
+
+# The number of rows of each registered synthetic catalog.
+CATALOG_SIZES: Dict[str, int] = {
+    "catalog_10k": 10_000,
+    "catalog_100k": 100_000,
+    "catalog_1m": 1_000_000,
+}
+
+# The number of paths of each registered synthetic ``pathDict`` (query result).
+PATH_DICT_SIZES: Dict[str, int] = {
+    "paths_1k": 1_000,
+    "paths_10k": 10_000,
+    "paths_100k": 100_000,
+    "paths_1m": 1_000_000,
+}
+
+# The number of datasets of each registered synthetic DRS tree.
+TREE_SIZES: Dict[str, int] = {
+    "tree_10k": 10_000,
+    "tree_100k": 100_000,
+}
+
+# The number of xml files of each registered synthetic xml tree.
+XML_TREE_SIZES: Dict[str, int] = {
+    "xmls_10k": 10_000,
+    "xmls_100k": 100_000,
+    "xmls_1m": 1_000_000,
+}
+
+# The number of xml files of each registered synthetic list of xml files (a
+# ``cdw.getXmlFiles`` result before trimming, not written to disk).
+XML_FILES_SIZES: Dict[str, int] = {
+    "xml_files_10k": 10_000,
+    "xml_files_100k": 100_000,
+    "xml_files_1m": 1_000_000,
+}
+
+# The CMIP6 table prefix of each realm (e.g., "Omon"), see ``crawler.parse_table``.
+TABLE_PREFIXES = {"atmos": "A", "ocean": "O", "seaIce": "SI", "land": "L"}
+
+# The columns of the ``paths`` table, in order (the path is the first column).
+PATHS_COLUMNS = [
+    "path",
+    "mip_era",
+    "activity",
+    "experiment",
+    "realm",
+    "frequency",
+    "variable",
+    "model",
+    "member",
+    "gridLabel",
+    "version",
+    "retired",
+    "ignored",
+]
+
+EXPERIMENTS = {
+    "historical": "CMIP",
+    "piControl": "CMIP",
+    "amip": "CMIP",
+    "abrupt-4xCO2": "CMIP",
+    "1pctCO2": "CMIP",
+    "ssp126": "ScenarioMIP",
+    "ssp245": "ScenarioMIP",
+    "ssp370": "ScenarioMIP",
+    "ssp585": "ScenarioMIP",
+    "hist-GHG": "DAMIP",
+    "hist-aer": "DAMIP",
+    "hist-nat": "DAMIP",
+    "lgm": "PMIP",
+    "midHolocene": "PMIP",
+    "amip-4xCO2": "CFMIP",
+    "amip-p4K": "CFMIP",
+}
+COMMON_VARIABLES = {
+    "tas": "atmos",
+    "pr": "atmos",
+    "ts": "atmos",
+    "ta": "atmos",
+    "ua": "atmos",
+    "va": "atmos",
+    "hus": "atmos",
+    "psl": "atmos",
+    "rlut": "atmos",
+    "rsut": "atmos",
+    "tos": "ocean",
+    "thetao": "ocean",
+    "so": "ocean",
+    "siconc": "seaIce",
+    "mrso": "land",
+}
+FREQUENCIES = ["mon", "day", "3hr", "6hr", "fx"]
+GRID_LABELS = ["gn", "gr", "gr1"]
+
+
+def _zipf_weights(n: int, a: float = 1.1) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1) ** a
+
+    return weights / weights.sum()
+
+
+def make_synthetic_rows(n_rows: int, seed: int = 0) -> List[tuple]:
+    """Make about ``n_rows`` synthetic ``paths`` rows with realistic facets.
+
+    Parameters
+    ----------
+    n_rows : int
+        The approximate number of rows (paths are unique, so a few random
+        duplicates are dropped).
+    seed : int, optional
+        The random seed, by default 0.
+
+    Returns
+    -------
+    List[tuple]
+        The rows, with values in the order of ``PATHS_COLUMNS``.
+    """
+    rng = np.random.default_rng(seed)
+
+    experiments = list(EXPERIMENTS)
+    variables = list(COMMON_VARIABLES) + [f"var{i:03d}" for i in range(135)]
+    realms = list(COMMON_VARIABLES.values()) + ["atmos"] * 135
+    models = [f"MODEL-{i:03d}" for i in range(120)]
+    members = [f"r{i + 1}i1p1f1" for i in range(50)]
+
+    # ~20% of datasets have 2-3 versions, so draw datasets first.
+    n_versions = rng.choice([1, 2, 3], size=n_rows, p=[0.8, 0.15, 0.05])
+    n_datasets = int(np.searchsorted(np.cumsum(n_versions), n_rows)) + 1
+    n_versions = n_versions[:n_datasets]
+
+    def draw(n: int, p: Optional[np.ndarray] = None) -> np.ndarray:
+        return rng.choice(n, size=n_datasets, p=p)
+
+    i_mip = draw(2, [0.8, 0.2])
+    i_exp = draw(len(experiments), _zipf_weights(len(experiments)))
+    i_var = draw(len(variables), _zipf_weights(len(variables)))
+    i_freq = draw(len(FREQUENCIES), [0.55, 0.3, 0.05, 0.05, 0.05])
+    i_model = draw(len(models), _zipf_weights(len(models), 0.8))
+    i_member = draw(len(members), _zipf_weights(len(members), 1.5))
+    i_grid = draw(len(GRID_LABELS), [0.7, 0.25, 0.05])
+
+    rows = []
+    for d in range(n_datasets):
+        mip_era = "CMIP6" if i_mip[d] == 0 else "CMIP5"
+        experiment = experiments[i_exp[d]]
+        activity = EXPERIMENTS[experiment]
+        variable = variables[i_var[d]]
+        realm = realms[i_var[d]]
+        frequency = FREQUENCIES[i_freq[d]]
+        model = models[i_model[d]]
+        member = members[i_member[d]]
+        if mip_era == "CMIP5":
+            member = member.replace("f1", "")
+        grid = GRID_LABELS[i_grid[d]]
+
+        for _ in range(n_versions[d]):
+            day = rng.integers(0, 6 * 365)
+            version = "v" + str(np.datetime64("2015-01-01") + day).replace("-", "")
+            path = (
+                f"/p/css03/esgf_publish/{mip_era}/{activity}/INST/{model}/"
+                f"{experiment}/{member}/{frequency}/{variable}/{grid}/{version}/"
+            )
+            retired = int(rng.random() < 0.03)
+            ignored = int(rng.random() < 0.02)
+
+            rows.append(
+                (
+                    path,
+                    mip_era,
+                    activity,
+                    experiment,
+                    realm,
+                    frequency,
+                    variable,
+                    model,
+                    member,
+                    grid,
+                    version,
+                    retired,
+                    ignored,
+                )
+            )
+
+    return rows[:n_rows]
+
+
+def write_catalog(db_path: str, rows: List[tuple]):
+    """Write rows to a new sqlite catalog with a ``paths`` table (no indexes)."""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    con = sqlite3.connect(db_path)
+    try:
+        con.execute(
+            "create table paths (path text primary key, "
+            + ", ".join(f"{c} text" for c in PATHS_COLUMNS[1:-2])
+            + ", retired integer, ignored integer)"
+        )
+        placeholders = ", ".join("?" * len(PATHS_COLUMNS))
+        con.executemany(f"insert or ignore into paths values ({placeholders})", rows)
+        con.commit()
+    finally:
+        con.close()
+
+
+def make_synthetic_catalog(name: str, n_rows: int) -> Dict[str, Any]:
+    """Write an unindexed and an indexed copy of a synthetic catalog, once.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The spec with the "db" (unindexed, like the catalog today) and
+        "db_indexed" (with ``catalog.create_indexes``) paths, and sample
+        "queries" (facet dictionaries) drawn from the catalog.
+    """
+    db = os.path.join(CATALOG_DIR, f"{name}.db")
+    db_indexed = os.path.join(CATALOG_DIR, f"{name}-indexed.db")
+
+    if not os.path.exists(db_indexed):
+        rows = make_synthetic_rows(n_rows)
+        write_catalog(db, rows)
+
+        shutil.copyfile(db, db_indexed)
+        catalog.create_indexes(db_indexed)
+
+    return {
+        "db": db,
+        "db_indexed": db_indexed,
+        "n_rows": n_rows,
+        "queries": sample_queries(db),
+    }
+
+
+def sample_queries(db: str, n: int = 50, seed: int = 0) -> List[Dict[str, str]]:
+    """Sample facet queries like the ones notebooks run in loops.
+
+    Each query constrains mip_era, experiment, frequency, variable and model
+    (like ``io_example.py``), drawn from existing rows.
+    """
+    con = sqlite3.connect(db)
+    try:
+        rows = con.execute(
+            "select mip_era, experiment, frequency, variable, model from paths "
+            "where rowid % 97 = 0"
+        ).fetchall()
+    finally:
+        con.close()
+
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(rows), size=min(n, len(rows)), replace=False)
+    keys = ["mip_era", "experiment", "frequency", "variable", "model"]
+
+    return [dict(zip(keys, rows[i])) for i in picks]
+
+
+def make_synthetic_path_dict(n_paths: int, seed: int = 0) -> Dict[str, Dict[str, str]]:
+    """Make a synthetic ``pathDict`` like ``xrw.get_cmip_paths`` builds.
+
+    The paths are the result of one query (a single variable and experiment)
+    across many models and members, so (model, member) buckets hold the
+    1-3 versions of one dataset. Versions within a bucket are distinct, so the
+    "ver" criterion alone picks one path without opening any datasets.
+
+    Parameters
+    ----------
+    n_paths : int
+        The number of paths.
+    seed : int, optional
+        The random seed, by default 0.
+
+    Returns
+    -------
+    Dict[str, Dict[str, str]]
+        The paths, linking to their "model", "member" and "version".
+    """
+    rng = np.random.default_rng(seed)
+
+    # Grow the number of models with the catalog, with up to 100 members each.
+    n_models = max(10, n_paths // 250)
+    n_versions = rng.choice([1, 2, 3], size=n_paths, p=[0.8, 0.15, 0.05])
+
+    pathDict: Dict[str, Dict[str, str]] = {}
+    dataset = 0
+    while len(pathDict) < n_paths:
+        model = f"MODEL-{dataset % n_models:05d}"
+        member = f"r{dataset // n_models + 1}i1p1f1"
+
+        for v in range(n_versions[dataset]):
+            version = f"v2019{v + 1:02d}01"
+            path = (
+                f"/p/css03/esgf_publish/CMIP6/CMIP/INST/{model}/historical/"
+                f"{member}/Amon/tas/gn/{version}/"
+            )
+            pathDict[path] = {"model": model, "member": member, "version": version}
+
+        dataset += 1
+
+    # Shuffle, since catalog rows are not ordered by model and member.
+    keys = list(pathDict)[:n_paths]
+    order = rng.permutation(len(keys))
+
+    return {keys[i]: pathDict[keys[i]] for i in order}
+
+
+def _register_catalog(name: str, n_rows: int):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return make_synthetic_catalog(name, n_rows)
+
+
+for _name, _n_rows in CATALOG_SIZES.items():
+    _register_catalog(_name, _n_rows)
+
+
+def _register_path_dict(name: str, n_paths: int):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {"n_paths": n_paths, "pathDict": make_synthetic_path_dict(n_paths)}
+
+
+for _name, _n_paths in PATH_DICT_SIZES.items():
+    _register_path_dict(_name, _n_paths)
+
+
+def get_tree_path(row: tuple) -> str:
+    """Get the DRS directory (relative to the tree root) of a synthetic row."""
+    facets = dict(zip(PATHS_COLUMNS, row))
+    table = TABLE_PREFIXES[facets["realm"]] + facets["frequency"]
+
+    if facets["mip_era"] == "CMIP6":
+        keys = ["activity", "institution", "model", "experiment", "member",
+                "table", "variable", "gridLabel", "version"]
+    else:
+        keys = ["product", "institution", "model", "experiment", "frequency",
+                "realm", "table", "member", "version", "variable"]
+
+    facets.update(product="output1", institution="INST", table=table)
+
+    return "/".join([facets["mip_era"]] + [facets[k] for k in keys])
+
+
+def make_synthetic_tree(name: str, n_datasets: int) -> Dict[str, Any]:
+    """Write a synthetic DRS directory tree, once.
+
+    Every dataset directory of ``make_synthetic_rows`` gets one empty netCDF
+    file. CMIP6 datasets follow the CMIP6 DRS and CMIP5 datasets the CMIP5
+    DRS, so the tree has several directories per dataset.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The spec with the tree "root", the "db_dir" to write crawled catalogs
+        to and the CMIP6 "dataset_dirs" (absolute paths).
+    """
+    root = os.path.join(TREE_DIR, name)
+    done_path = os.path.join(TREE_DIR, f"{name}.done")
+
+    rows = make_synthetic_rows(n_datasets)
+    dataset_dirs = [os.path.join(root, get_tree_path(row)) for row in rows]
+
+    if not os.path.exists(done_path):
+        if os.path.exists(root):
+            shutil.rmtree(root)
+
+        for dpath, row in zip(dataset_dirs, rows):
+            os.makedirs(dpath, exist_ok=True)
+            variable = row[PATHS_COLUMNS.index("variable")]
+            open(os.path.join(dpath, f"{variable}_185001-201412.nc"), "w").close()
+
+        open(done_path, "w").close()
+
+    return {
+        "root": root,
+        "db_dir": os.path.join(TREE_DIR, f"{name}-catalogs"),
+        "n_datasets": n_datasets,
+        "dataset_dirs": [d for d in dataset_dirs if "/CMIP6/" in d],
+    }
+
+
+def _register_tree(name: str, n_datasets: int):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return make_synthetic_tree(name, n_datasets)
+
+
+for _name, _n_datasets in TREE_SIZES.items():
+    _register_tree(_name, _n_datasets)
+
+
+def get_xml_path(row: tuple) -> str:
+    """Get the xml file (relative to the tree base) of a synthetic row."""
+    f = dict(zip(PATHS_COLUMNS, row))
+    dirs = [f["mip_era"], f["activity"], f["experiment"], f["realm"]]
+    dirs += [f["frequency"], f["variable"]]
+    filename = ".".join(
+        dirs[:3]
+        + ["INST", f["model"], f["member"], f["frequency"], f["variable"]]
+        + [f["realm"], f["gridLabel"], f["version"], "0000000", "0", "xml"]
+    )
+
+    return "/".join(dirs + [filename])
+
+
+def make_synthetic_xml_tree(name: str, n_files: int) -> Dict[str, Any]:
+    """Write a synthetic xml tree (like /p/user_pub/xclim), once.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The spec with the tree "base", the "index_dir" to write xml indexes
+        to and sample "queries" (``cdw.getXmlFiles`` facets) drawn from the
+        tree.
+    """
+    base = os.path.join(XML_TREE_DIR, name)
+    done_path = os.path.join(XML_TREE_DIR, f"{name}.done")
+
+    rows = make_synthetic_rows(n_files)
+
+    if not os.path.exists(done_path):
+        if os.path.exists(base):
+            shutil.rmtree(base)
+
+        for row in rows:
+            fn = os.path.join(base, get_xml_path(row))
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            open(fn, "w").close()
+
+        open(done_path, "w").close()
+
+    # Queries like the getXmlFiles docstring, with some facets left as '*'.
+    rng = np.random.default_rng(0)
+    keys = ["mip_era", "experiment", "frequency", "variable", "model"]
+    queries = []
+    for i in rng.choice(len(rows), size=min(50, len(rows)), replace=False):
+        f = dict(zip(PATHS_COLUMNS, rows[i]))
+        query = {k: f[k] for k in keys}
+        query["realization"] = f["member"] if i % 2 == 0 else "*"
+        queries.append(query)
+
+    return {
+        "base": base + "/",
+        "index_dir": os.path.join(XML_TREE_DIR, f"{name}-indexes"),
+        "n_files": n_files,
+        "queries": queries,
+    }
+
+
+def _register_xml_tree(name: str, n_files: int):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return make_synthetic_xml_tree(name, n_files)
+
+
+for _name, _n_files in XML_TREE_SIZES.items():
+    _register_xml_tree(_name, _n_files)
+
+
+def make_synthetic_xml_files(n_files: int) -> List[str]:
+    """Make a synthetic list of xml files, like an untrimmed ``cdw.getXmlFiles``.
+
+    The files are one query (a single variable and experiment) across many
+    models and members, from the same synthetic ``pathDict`` as the
+    ``xrw.trimModelList`` benchmarks.
+    """
+    files = []
+    for f in make_synthetic_path_dict(n_files).values():
+        files.append(
+            "/p/user_pub/xclim/CMIP6/CMIP/historical/atmos/mon/tas/"
+            f"CMIP6.CMIP.historical.INST.{f['model']}.{f['member']}.mon.tas."
+            f"atmos.gn.{f['version']}.0000000.0.xml"
+        )
+
+    return files
+
+
+def _register_xml_files(name: str, n_files: int):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {"n_files": n_files, "files": make_synthetic_xml_files(n_files)}
+
+
+for _name, _n_files in XML_FILES_SIZES.items():
+    _register_xml_files(_name, _n_files)
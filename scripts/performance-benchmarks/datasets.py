@@ -0,0 +1,1113 @@
+"""Input datasets for the registered benchmark cases.
+
+Two kinds of datasets are registered:
+
+1. Synthetic datasets (and ensembles of them), which are generated once and
+   written to ``input-datasets/synthetic/`` so every machine can run the
+   benchmarks.
+2. Real datasets on the LLNL Climate Program filesystem (or downloaded with
+   ``1_esgf_download_datasets.py``), which are skipped if they don't exist.
+
+Every spec has at least a "var_key" and a "dir_path" storing the netCDF files,
+which can be opened with ``xr.open_mfdataset(dir_path + "*.nc")`` or
+``xc.open_mfdataset(dir_path)``. Specs of datasets that share a directory with
+other files also have a "pattern" (see ``get_paths``). Ensemble specs have the
+"dpaths" of their members instead of a "dir_path". Regridding specs also have
+the "target" (nlat, nlon) of a uniform grid to regrid to; the multi-variable
+ones hold their in-memory "ds" and "var_keys" instead of a "dir_path".
+Unstructured grid specs (E3SM h0 archives) also have the "grid_path" of their
+grid file and the "map_path" of a map file to a lat/lon grid. Grid specs only
+have the "grid_path" of a grid file.
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from harness import ROOT_DIR, Spec, register_dataset
+
+SYNTHETIC_DIR = os.path.join(ROOT_DIR, "input-datasets", "synthetic")
+
+# The synthetic dataset configurations (monthly data).
+SYNTHETIC_CONFIGS: Dict[str, Dict[str, Any]] = {
+    # 36 years (1979-2014) on a 2.5 degree grid (~18 MB).
+    "synthetic_small": {
+        "nyears": 36,
+        "nlat": 72,
+        "nlon": 144,
+        "start": "1979-01-01",
+    },
+    # 165 years (1850-2014) on a 1 degree grid (~510 MB).
+    "synthetic_large": {
+        "nyears": 165,
+        "nlat": 180,
+        "nlon": 360,
+        "start": "1850-01-01",
+    },
+    # "synthetic_large" packed as int16 with missing cells, like GISTEMP
+    # (~255 MB packed, ~1 GB decoded as float64).
+    "synthetic_packed": {
+        "nyears": 165,
+        "nlat": 180,
+        "nlon": 360,
+        "start": "1850-01-01",
+        "packed": True,
+    },
+    # 2 years on 2.5, 1 and 0.25 degree grids, the source grids of the
+    # regridding benchmarks (~2 MB, ~12 MB and ~200 MB).
+    "synthetic_2p5deg": {
+        "nyears": 2,
+        "nlat": 72,
+        "nlon": 144,
+        "start": "2013-01-01",
+    },
+    "synthetic_1deg": {
+        "nyears": 2,
+        "nlat": 180,
+        "nlon": 360,
+        "start": "2013-01-01",
+    },
+    "synthetic_0p25deg": {
+        "nyears": 2,
+        "nlat": 720,
+        "nlon": 1440,
+        "start": "2013-01-01",
+    },
+}
+
+# The regridding benchmark datasets: a synthetic source dataset (in
+# ``SYNTHETIC_CONFIGS``) and the (nlat, nlon) of the uniform target grid.
+REGRID_CONFIGS: Dict[str, Dict[str, Any]] = {
+    "regrid_2p5deg_to_1deg": {"source": "synthetic_2p5deg", "target": (180, 360)},
+    "regrid_1deg_to_2p5deg": {"source": "synthetic_1deg", "target": (72, 144)},
+    "regrid_1deg_to_0p25deg": {"source": "synthetic_1deg", "target": (720, 1440)},
+    "regrid_0p25deg_to_1deg": {"source": "synthetic_0p25deg", "target": (180, 360)},
+    "regrid_0p25deg_to_2p5deg": {"source": "synthetic_0p25deg", "target": (72, 144)},
+}
+
+# The synthetic ensemble configurations (monthly data, one directory of files
+# per member, like a catalog search result).
+ENSEMBLE_CONFIGS: Dict[str, Dict[str, Any]] = {
+    # 100 members of 10 years in 5-year files, 80 on a 5 degree grid and 20 on
+    # a 4 degree grid (~125 MB).
+    "ensemble_100": {
+        "n_members": 100,
+        "nyears": 10,
+        "years_per_file": 5,
+        "grids": [(36, 72)] * 4 + [(45, 90)],
+        "start": "2005-01-01",
+    },
+}
+
+# The number of variables of the multi-variable regridding datasets (1 year on
+# a 1 degree grid, regridded to 2.5 degrees, kept in memory).
+REGRID_VARS_SIZES: Dict[str, int] = {
+    "regrid_vars_1": 1,
+    "regrid_vars_10": 10,
+    "regrid_vars_100": 100,
+}
+
+# The synthetic hybrid sigma-pressure level configurations (monthly "T" with
+# "PS", "hyam", "hybm" and "P0", like E3SM/CAM output).
+HYBRID_CONFIGS: Dict[str, Dict[str, Any]] = {
+    # 20 years (1995-2014), 30 levels on a 2.5 degree grid (~300 MB).
+    "hybrid_20yr": {
+        "nyears": 20,
+        "nlev": 30,
+        "nlat": 72,
+        "nlon": 144,
+        "start": "1995-01-01",
+    },
+    # 2 years, 30 levels on a 2.5 degree grid with 16 variables (~480 MB),
+    # for the multi-variable cases (``HYBRID_VARS_SIZES``).
+    "hybrid_vars": {
+        "nyears": 2,
+        "nlev": 30,
+        "nlat": 72,
+        "nlon": 144,
+        "start": "2013-01-01",
+        "nvars": 16,
+    },
+}
+
+# The number of variables of the multi-variable hybrid level datasets (the
+# first variables of "hybrid_vars").
+HYBRID_VARS_SIZES: Dict[str, int] = {
+    "hybrid_vars_1": 1,
+    "hybrid_vars_4": 4,
+    "hybrid_vars_16": 16,
+}
+
+# The synthetic E3SM-like monthly h0 archives on unstructured grids (one file
+# per month, with "TREFHT" on "ncol") and their SCRIP grid file (an
+# equiangular cubed sphere with ne elements of npg x npg cells per edge).
+UNSTRUCTURED_CONFIGS: Dict[str, Dict[str, Any]] = {
+    # 20 years (240 files) on ne30pg2 (21600 faces, ~21 MB), with a map file
+    # to a 1 degree grid.
+    "ne30pg2_20yr": {
+        "ne": 30,
+        "npg": 2,
+        "nyears": 20,
+        "start": "1995-01-01",
+        "target": (180, 360),
+    },
+    # 50 years (600 files) on ne30pg2 (~52 MB).
+    "ne30pg2_50yr": {
+        "ne": 30,
+        "npg": 2,
+        "nyears": 50,
+        "start": "1965-01-01",
+        "target": (180, 360),
+    },
+}
+
+# The packing of "packed" synthetic datasets.
+PACKED_ENCODING: Dict[str, Any] = {
+    "dtype": "int16",
+    "scale_factor": np.float32(0.01),
+    "add_offset": 250.0,
+    "_FillValue": np.int16(32767),
+}
+
+# The synthetic grid files (equiangular cubed spheres, see above) of the
+# topology cases, from ne30pg2 (21600 faces) to ne240pg2 (1.4M faces).
+GRID_CONFIGS: Dict[str, Dict[str, int]] = {
+    "ne30pg2_grid": {"ne": 30, "npg": 2},
+    "ne120pg2_grid": {"ne": 120, "npg": 2},
+    "ne240pg2_grid": {"ne": 240, "npg": 2},
+}
+
+# The sample grid files of the 2024 E3SM workshop uxarray practicum.
+REAL_GRIDS: Dict[str, str] = {
+    "outCSne30_grid": os.path.join(
+        ROOT_DIR, "..", "..", "demos", "2024-e3sm-workshop", "sample_data", "outCSne30.grid.ug"
+    ),
+    "oQU480_grid": os.path.join(
+        ROOT_DIR, "..", "..", "demos", "2024-e3sm-workshop", "sample_data", "oQU480.grid.nc"
+    ),
+}
+
+# The synthetic sub-daily dataset configurations (one file per year, with a
+# cftime calendar).
+SUBDAILY_CONFIGS: Dict[str, Dict[str, Any]] = {
+    # 36 years (1979-2014) of 3-hourly data (105,120 time steps) in the noleap
+    # calendar on a 20 degree grid (~70 MB), the time axis of the 3-hourly
+    # cookbook cases.
+    "synthetic_3hr": {
+        "nyears": 36,
+        "nlat": 9,
+        "nlon": 18,
+        "hours": 3,
+        "start": "1979-01-01",
+        "calendar": "noleap",
+    },
+}
+
+# Real monthly datasets used by the JOSS paper workflow scripts.
+REAL_DATASETS: Dict[str, Dict[str, str]] = {
+    "e3sm_ts_mon": {
+        "var_key": "ts",
+        "dir_path": "/p/user_pub/work/CMIP6/CMIP/E3SM-Project/E3SM-2-0/historical/r1i1p1f1/Amon/ts/gr/v20220830/",
+    },
+    "cesm2_tas_mon": {
+        "var_key": "tas",
+        "dir_path": "/p/css03/esgf_publish/CMIP6/CMIP/NCAR/CESM2/historical/r1i1p1f1/Amon/tas/gn/v20190308/",
+    },
+    # The E3SM hybrid level temperature of `validation/v0.6.0/vertical_interp/`.
+    "e3sm_T_hybrid": {
+        "var_key": "T",
+        "dir_path": "/p/user_pub/e3sm/zhang40/xcdat_test_e3sm/",
+        "pattern": "T_185001_201312.nc",
+    },
+    # The CMIP5 demo data of `validation/prototyping/landsea_mask/`.
+    "access1_0_ts": {
+        "var_key": "ts",
+        "dir_path": os.path.join(
+            ROOT_DIR,
+            "..",
+            "..",
+            "validation",
+            "prototyping",
+            "landsea_mask",
+            "demo_data",
+            "CMIP5_demo_data",
+            "",
+        ),
+        "pattern": "ts_Amon_ACCESS1-0_historical_r1i1p1_185001-200512.nc",
+    },
+    # The E3SM v3 h0 archive and grid of the 2024 E3SM workshop uxarray
+    # practicum (`demos/2024-e3sm-workshop/`).
+    "e3sm_v3_h0": {
+        "var_key": "TREFHT",
+        "dir_path": "/global/cfs/cdirs/e3sm/www/Tutorials/2024/simulations/extendedOutput.v3.LR.historical_0101/archive/atm/hist/",
+        "pattern": "*.h0.*.nc",
+        "grid_path": "/global/cfs/cdirs/e3sm/diagnostics/grids/ne30pg2.nc",
+        "map_path": "/global/cfs/cdirs/e3sm/diagnostics/maps/map_ne30pg2_to_cmip6_180x360_aave.20200201.nc",
+    },
+    # The packed (int16) GISTEMP sample used by `validation/v0.3.0/`.
+    "gistemp": {
+        "var_key": "tempanomaly",
+        "dir_path": "/p/user_pub/climate_work/pochedley1/surface/",
+        "pattern": "gistemp1200_GHCNv4_ERSSTv5.nc",
+    },
+}
+
+
+def make_synthetic_dataset(
+    nyears: int,
+    nlat: int,
+    nlon: int,
+    var_key: str = "ts",
+    start: str = "1850-01-01",
+    seed: int = 0,
+) -> xr.Dataset:
+    """Make a synthetic monthly dataset with lat, lon and time bounds.
+
+    The data variable is a seasonal cycle plus a latitudinal gradient, a linear
+    trend and noise, so departures and averages are not trivially zero.
+
+    Parameters
+    ----------
+    nyears : int
+        The number of years of monthly data.
+    nlat : int
+        The number of latitude cells (uniform, spanning -90 to 90).
+    nlon : int
+        The number of longitude cells (uniform, spanning 0 to 360).
+    var_key : str, optional
+        The name of the data variable, by default "ts".
+    start : str, optional
+        The start date, by default "1850-01-01".
+    seed : int, optional
+        The random seed for the noise, by default 0.
+
+    Returns
+    -------
+    xr.Dataset
+        The synthetic dataset (float32 data variable).
+    """
+    lat_edges = np.linspace(-90.0, 90.0, nlat + 1)
+    lon_edges = np.linspace(0.0, 360.0, nlon + 1)
+    lat = (lat_edges[:-1] + lat_edges[1:]) / 2
+    lon = (lon_edges[:-1] + lon_edges[1:]) / 2
+
+    time_edges = pd.date_range(start, periods=nyears * 12 + 1, freq="MS")
+    time = time_edges[:-1] + (time_edges[1:] - time_edges[:-1]) / 2
+
+    rng = np.random.default_rng(seed)
+    month = np.arange(nyears * 12) % 12
+    cycle = 10.0 * np.cos(2 * np.pi * month / 12.0)
+    trend = np.linspace(0.0, 0.01 * nyears, nyears * 12)
+    gradient = 30.0 * np.cos(np.deg2rad(lat))
+
+    data = (
+        250.0
+        + (cycle + trend)[:, None, None]
+        + gradient[None, :, None]
+        + rng.standard_normal((nyears * 12, nlat, nlon))
+    ).astype("float32")
+
+    ds = xr.Dataset(
+        data_vars={
+            var_key: (
+                ("time", "lat", "lon"),
+                data,
+                {"units": "K", "long_name": "Synthetic temperature"},
+            ),
+            "lat_bnds": (
+                ("lat", "bnds"),
+                np.stack([lat_edges[:-1], lat_edges[1:]], axis=1),
+            ),
+            "lon_bnds": (
+                ("lon", "bnds"),
+                np.stack([lon_edges[:-1], lon_edges[1:]], axis=1),
+            ),
+            "time_bnds": (
+                ("time", "bnds"),
+                np.stack([time_edges[:-1], time_edges[1:]], axis=1),
+            ),
+        },
+        coords={
+            "lat": (
+                "lat",
+                lat,
+                {"axis": "Y", "units": "degrees_north", "bounds": "lat_bnds"},
+            ),
+            "lon": (
+                "lon",
+                lon,
+                {"axis": "X", "units": "degrees_east", "bounds": "lon_bnds"},
+            ),
+            "time": ("time", time, {"axis": "T", "bounds": "time_bnds"}),
+        },
+    )
+    ds.time.encoding["units"] = f"hours since {start}"
+    ds.time_bnds.encoding["units"] = f"hours since {start}"
+
+    return ds
+
+
+def make_subdaily_dataset(
+    nyears: int,
+    nlat: int,
+    nlon: int,
+    hours: int = 3,
+    var_key: str = "tas",
+    start: str = "1979-01-01",
+    calendar: str = "noleap",
+    seed: int = 0,
+) -> xr.Dataset:
+    """Make a synthetic sub-daily dataset with lat, lon and time bounds.
+
+    The data variable is a seasonal and diurnal cycle plus a latitudinal
+    gradient and noise, on a cftime time axis.
+
+    Parameters
+    ----------
+    nyears : int
+        The number of years of data.
+    nlat : int
+        The number of latitude cells (uniform, spanning -90 to 90).
+    nlon : int
+        The number of longitude cells (uniform, spanning 0 to 360).
+    hours : int, optional
+        The time step in hours, by default 3.
+    var_key : str, optional
+        The name of the data variable, by default "tas".
+    start : str, optional
+        The start date, by default "1979-01-01".
+    calendar : str, optional
+        The cftime calendar, by default "noleap".
+    seed : int, optional
+        The random seed for the noise, by default 0.
+
+    Returns
+    -------
+    xr.Dataset
+        The synthetic dataset (float32 data variable).
+    """
+    grid = make_uniform_grid(nlat, nlon)
+
+    end = f"{int(start[:4]) + nyears}{start[4:]}"
+    time_edges = xr.date_range(
+        start, end, freq=f"{hours}h", calendar=calendar, use_cftime=True
+    ).values
+    time = time_edges[:-1] + (time_edges[1:] - time_edges[:-1]) / 2
+    ntime = len(time)
+
+    rng = np.random.default_rng(seed)
+    step = np.arange(ntime) * hours / 24.0
+    cycle = 10.0 * np.cos(2 * np.pi * step / 365.0) + 3.0 * np.cos(2 * np.pi * step)
+    gradient = 30.0 * np.cos(np.deg2rad(grid.lat.values))
+
+    data = (
+        250.0
+        + cycle[:, None, None]
+        + gradient[None, :, None]
+        + rng.standard_normal((ntime, nlat, nlon))
+    ).astype("float32")
+
+    ds = grid.assign(
+        {
+            var_key: (
+                ("time", "lat", "lon"),
+                data,
+                {"units": "K", "long_name": "Synthetic temperature"},
+            ),
+            "time_bnds": (
+                ("time", "bnds"),
+                np.stack([time_edges[:-1], time_edges[1:]], axis=1),
+            ),
+        }
+    ).assign_coords(time=("time", time, {"axis": "T", "bounds": "time_bnds"}))
+    ds.time.encoding["units"] = f"hours since {start}"
+    ds.time_bnds.encoding["units"] = f"hours since {start}"
+
+    return ds
+
+
+def make_uniform_grid(nlat: int, nlon: int) -> xr.Dataset:
+    """Make a uniform lat/lon grid (spanning the globe) with bounds.
+
+    The cells are laid out like ``make_synthetic_dataset``, so a synthetic
+    dataset with the same nlat and nlon is on this grid.
+    """
+    lat_edges = np.linspace(-90.0, 90.0, nlat + 1)
+    lon_edges = np.linspace(0.0, 360.0, nlon + 1)
+
+    return xr.Dataset(
+        data_vars={
+            "lat_bnds": (
+                ("lat", "bnds"),
+                np.stack([lat_edges[:-1], lat_edges[1:]], axis=1),
+            ),
+            "lon_bnds": (
+                ("lon", "bnds"),
+                np.stack([lon_edges[:-1], lon_edges[1:]], axis=1),
+            ),
+        },
+        coords={
+            "lat": (
+                "lat",
+                (lat_edges[:-1] + lat_edges[1:]) / 2,
+                {"axis": "Y", "units": "degrees_north", "bounds": "lat_bnds"},
+            ),
+            "lon": (
+                "lon",
+                (lon_edges[:-1] + lon_edges[1:]) / 2,
+                {"axis": "X", "units": "degrees_east", "bounds": "lon_bnds"},
+            ),
+        },
+    )
+
+
+def make_multivariable_dataset(
+    n_vars: int, nyears: int, nlat: int, nlon: int
+) -> xr.Dataset:
+    """Make a synthetic monthly dataset with n_vars variables on one grid.
+
+    The variables ("var000", "var001", ...) are ``make_synthetic_dataset``
+    data with a different random seed each.
+    """
+    ds = make_synthetic_dataset(nyears, nlat, nlon, var_key="var000")
+    for i in range(1, n_vars):
+        key = f"var{i:03d}"
+        ds[key] = make_synthetic_dataset(nyears, nlat, nlon, var_key=key, seed=i)[key]
+
+    return ds
+
+
+def write_synthetic_dataset(name: str, var_key: str = "ts") -> str:
+    """Write a synthetic dataset to netCDF files (one per decade), once.
+
+    Parameters
+    ----------
+    name : str
+        The name of the synthetic dataset config in ``SYNTHETIC_CONFIGS``.
+    var_key : str, optional
+        The name of the data variable, by default "ts".
+
+    Returns
+    -------
+    str
+        The directory path storing the netCDF files (with a trailing slash).
+    """
+    dir_path = os.path.join(SYNTHETIC_DIR, name) + os.sep
+    done_path = os.path.join(dir_path, ".done")
+
+    if os.path.exists(done_path):
+        return dir_path
+
+    os.makedirs(dir_path, exist_ok=True)
+    config = dict(SYNTHETIC_CONFIGS[name])
+    packed = config.pop("packed", False)
+    ds = make_synthetic_dataset(var_key=var_key, **config)
+
+    if packed:
+        # Mask ~30% of the cells (e.g., no station coverage) for all time steps.
+        rng = np.random.default_rng(1)
+        missing = rng.random((config["nlat"], config["nlon"])) < 0.3
+        ds[var_key] = ds[var_key].where(~missing)
+        ds[var_key].encoding.update(PACKED_ENCODING)
+
+    for idx in range(0, ds.sizes["time"], 120):
+        ds_decade = ds.isel(time=slice(idx, idx + 120))
+        years = ds_decade.time.dt.year.values
+        filename = f"{var_key}_synthetic_{years[0]}01-{years[-1]}12.nc"
+        ds_decade.to_netcdf(os.path.join(dir_path, filename))
+
+    open(done_path, "w").close()
+
+    return dir_path
+
+
+def write_subdaily_dataset(name: str, var_key: str = "tas") -> str:
+    """Write a synthetic sub-daily dataset (one file per year), once.
+
+    Returns
+    -------
+    str
+        The directory path storing the netCDF files (with a trailing slash).
+    """
+    dir_path = os.path.join(SYNTHETIC_DIR, name) + os.sep
+    done_path = os.path.join(dir_path, ".done")
+
+    if os.path.exists(done_path):
+        return dir_path
+
+    os.makedirs(dir_path, exist_ok=True)
+    ds = make_subdaily_dataset(var_key=var_key, **SUBDAILY_CONFIGS[name])
+
+    years = ds.time.dt.year.values
+    for year in np.unique(years):
+        filename = f"{var_key}_3hr_synthetic_{year}.nc"
+        ds.isel(time=years == year).to_netcdf(os.path.join(dir_path, filename))
+
+    open(done_path, "w").close()
+
+    return dir_path
+
+
+def write_synthetic_ensemble(name: str, var_key: str = "tas") -> List[str]:
+    """Write a synthetic ensemble (one directory per member), once.
+
+    Parameters
+    ----------
+    name : str
+        The name of the synthetic ensemble config in ``ENSEMBLE_CONFIGS``.
+    var_key : str, optional
+        The name of the data variable, by default "tas".
+
+    Returns
+    -------
+    List[str]
+        The directory path of each member (with a trailing slash).
+    """
+    config = ENSEMBLE_CONFIGS[name]
+    dir_path = os.path.join(SYNTHETIC_DIR, name)
+    done_path = os.path.join(dir_path, ".done")
+    dpaths = [
+        os.path.join(dir_path, f"member{i:03d}") + os.sep
+        for i in range(config["n_members"])
+    ]
+
+    if os.path.exists(done_path):
+        return dpaths
+
+    steps = config["years_per_file"] * 12
+    for i, dpath in enumerate(dpaths):
+        os.makedirs(dpath, exist_ok=True)
+        nlat, nlon = config["grids"][i % len(config["grids"])]
+        ds = make_synthetic_dataset(
+            config["nyears"], nlat, nlon, var_key, config["start"], seed=i
+        )
+
+        for idx in range(0, ds.sizes["time"], steps):
+            ds_file = ds.isel(time=slice(idx, idx + steps))
+            years = ds_file.time.dt.year.values
+            filename = f"{var_key}_member{i:03d}_{years[0]}01-{years[-1]}12.nc"
+            ds_file.to_netcdf(os.path.join(dpath, filename))
+
+    open(done_path, "w").close()
+
+    return dpaths
+
+
+def make_hybrid_dataset(
+    nyears: int,
+    nlev: int,
+    nlat: int,
+    nlon: int,
+    start: str = "1850-01-01",
+    seed: int = 0,
+    nvars: int = 1,
+) -> xr.Dataset:
+    """Make a synthetic monthly temperature on hybrid sigma-pressure levels.
+
+    The levels go from the model top (~2 hPa, pure pressure) to the surface
+    (pure sigma), like CAM. "T" decreases with height from a surface value
+    with a latitudinal gradient and noise, and "PS" varies around 985 hPa.
+    With nvars > 1, the other variables ("var001", ...) are scaled copies of
+    "T".
+    """
+    ds = make_synthetic_dataset(nyears, nlat, nlon, "TS", start, seed)
+    rng = np.random.default_rng(seed)
+
+    eta = np.linspace(0.002, 0.995, nlev)
+    hybm = np.clip((eta - 0.2) / 0.8, 0.0, None) ** 1.5
+    hyam = eta - hybm
+    ps = 98500.0 + 1500.0 * rng.standard_normal((ds.sizes["time"], nlat, nlon))
+
+    pressure = hyam[None, :, None, None] * 100000.0 + hybm[None, :, None, None] * ps[:, None]
+    temperature = ds["TS"].values[:, None] * (pressure / ps[:, None]) ** 0.19
+
+    ds = ds.drop_vars("TS")
+    ds["T"] = (
+        ("time", "lev", "lat", "lon"),
+        temperature.astype("float32"),
+        {"units": "K", "long_name": "Temperature"},
+    )
+    for idx in range(1, nvars):
+        ds[f"var{idx:03d}"] = (
+            ("time", "lev", "lat", "lon"),
+            (temperature * (1.0 + 0.01 * idx)).astype("float32"),
+        )
+    ds["PS"] = (("time", "lat", "lon"), ps.astype("float32"), {"units": "Pa"})
+    ds["hyam"] = ("lev", hyam, {"long_name": "hybrid A coefficient at layer midpoints"})
+    ds["hybm"] = ("lev", hybm, {"long_name": "hybrid B coefficient at layer midpoints"})
+    ds["P0"] = ((), 100000.0, {"units": "Pa"})
+    ds = ds.assign_coords(lev=("lev", 1000.0 * eta, {"units": "hPa", "positive": "down"}))
+
+    return ds
+
+
+def write_land_source(nlat: int = 1080, nlon: int = 2160, seed: int = 0) -> str:
+    """Write a synthetic high resolution land fraction ("sftlf"), once.
+
+    The land is a thresholded smooth random field (~30% land) on a 1/6 degree
+    grid by default, like the navy land fraction of cdutil, for the land-sea
+    cases on machines without cdutil.
+
+    Returns
+    -------
+    str
+        The path of the netCDF file.
+    """
+    path = os.path.join(SYNTHETIC_DIR, "land_source", f"sftlf_{nlat}x{nlon}.nc")
+    if os.path.exists(path):
+        return path
+
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(-90.0, 90.0, nlat, endpoint=False) + 90.0 / nlat
+    lon = np.linspace(0.0, 360.0, nlon, endpoint=False) + 180.0 / nlon
+
+    # a sum of a few random waves, which is periodic in longitude
+    field = np.zeros((nlat, nlon))
+    for _ in range(12):
+        k_lat, k_lon = rng.integers(1, 4), rng.integers(1, 6)
+        phase = rng.random(2) * 2 * np.pi
+        field += np.outer(
+            np.cos(2 * k_lat * np.deg2rad(lat) + phase[0]),
+            np.cos(k_lon * np.deg2rad(lon) + phase[1]),
+        )
+    sftlf = (field > np.quantile(field, 0.7)).astype("float32")
+
+    ds = xr.Dataset(
+        {"sftlf": (("lat", "lon"), sftlf, {"units": "1"})},
+        coords={
+            "lat": ("lat", lat, {"units": "degrees_north"}),
+            "lon": ("lon", lon, {"units": "degrees_east"}),
+        },
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ds.to_netcdf(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+    return path
+
+
+def get_land_source() -> str:
+    """Get the land fraction source of the land-sea and region cases.
+
+    This is the navy land fraction of cdutil if it is installed, or else the
+    synthetic one of ``write_land_source``.
+    """
+    import landsea
+
+    if os.path.exists(landsea.DEFAULT_SOURCE):
+        return landsea.DEFAULT_SOURCE
+
+    return write_land_source()
+
+
+def write_hybrid_dataset(name: str) -> str:
+    """Write a synthetic hybrid level dataset (one file per decade), once.
+
+    Returns
+    -------
+    str
+        The directory path storing the netCDF files (with a trailing slash).
+    """
+    dir_path = os.path.join(SYNTHETIC_DIR, name) + os.sep
+    done_path = os.path.join(dir_path, ".done")
+
+    if os.path.exists(done_path):
+        return dir_path
+
+    os.makedirs(dir_path, exist_ok=True)
+    ds = make_hybrid_dataset(**HYBRID_CONFIGS[name])
+
+    for idx in range(0, ds.sizes["time"], 120):
+        ds_decade = ds.isel(time=slice(idx, idx + 120))
+        years = ds_decade.time.dt.year.values
+        filename = f"T_synthetic_{years[0]}01-{years[-1]}12.nc"
+        ds_decade.to_netcdf(os.path.join(dir_path, filename))
+
+    open(done_path, "w").close()
+
+    return dir_path
+
+
+def make_cubed_sphere_grid(ne: int, npg: int = 2) -> xr.Dataset:
+    """Make the SCRIP grid of an equiangular cubed sphere (e.g., ne30pg2).
+
+    Each cube face has ne x ne elements of npg x npg cells, so the grid has
+    6 * (ne * npg) ** 2 faces with 4 corners each.
+    """
+    n = ne * npg
+    edges = np.tan(np.linspace(-np.pi / 4, np.pi / 4, n + 1))
+    a, b = np.meshgrid(edges, edges, indexing="ij")
+    one = np.ones_like(a)
+
+    corners = []
+    for x, y, z in [
+        (one, a, b),
+        (-a, one, b),
+        (-one, -a, b),
+        (a, -one, b),
+        (-b, a, one),
+        (b, a, -one),
+    ]:
+        xyz = np.stack([x, y, z], axis=-1)
+        xyz /= np.linalg.norm(xyz, axis=-1, keepdims=True)
+        cells = np.stack([xyz[:-1, :-1], xyz[1:, :-1], xyz[1:, 1:], xyz[:-1, 1:]], axis=2)
+        corners.append(cells.reshape(-1, 4, 3))
+    corners = np.concatenate(corners)
+    centers = corners.mean(axis=1)
+    centers /= np.linalg.norm(centers, axis=-1, keepdims=True)
+
+    def _lat_lon(xyz: np.ndarray):
+        lat = np.rad2deg(np.arcsin(np.clip(xyz[..., 2], -1.0, 1.0)))
+        lon = np.rad2deg(np.arctan2(xyz[..., 1], xyz[..., 0])) % 360.0
+        return lat, lon
+
+    center_lat, center_lon = _lat_lon(centers)
+    corner_lat, corner_lon = _lat_lon(corners)
+
+    return xr.Dataset(
+        {
+            "grid_dims": ("grid_rank", np.array([len(corners)], dtype="int32")),
+            "grid_center_lat": ("grid_size", center_lat, {"units": "degrees"}),
+            "grid_center_lon": ("grid_size", center_lon, {"units": "degrees"}),
+            "grid_corner_lat": (("grid_size", "grid_corners"), corner_lat, {"units": "degrees"}),
+            "grid_corner_lon": (("grid_size", "grid_corners"), corner_lon, {"units": "degrees"}),
+            "grid_imask": ("grid_size", np.ones(len(corners), dtype="int32")),
+        }
+    )
+
+
+def write_cubed_sphere_grid(ne: int, npg: int = 2) -> str:
+    """Write the SCRIP grid file of a cubed sphere, once.
+
+    Returns
+    -------
+    str
+        The path of the grid file.
+    """
+    grid_path = os.path.join(SYNTHETIC_DIR, "grids", f"ne{ne}pg{npg}.nc")
+
+    if not os.path.exists(grid_path):
+        os.makedirs(os.path.dirname(grid_path), exist_ok=True)
+        make_cubed_sphere_grid(ne, npg).to_netcdf(grid_path + ".tmp")
+        os.replace(grid_path + ".tmp", grid_path)
+
+    return grid_path
+
+
+def make_cubed_sphere_map(
+    ne: int, npg: int, nlat: int, nlon: int, samples: int = 8
+) -> xr.Dataset:
+    """Make an ESMF/NCO "aave" map file from a cubed sphere to a uniform grid.
+
+    The overlap of every destination cell with the source faces of
+    ``make_cubed_sphere_grid`` is estimated with samples x samples points of
+    equal area in the cell, each located on its face by gnomonic projection,
+    so S is the fraction of the destination cell covered by each face.
+    """
+    n = ne * npg
+    edges = np.tan(np.linspace(-np.pi / 4, np.pi / 4, n + 1))
+    grid = make_uniform_grid(nlat, nlon)
+    lat_bnds, lon_bnds = grid["lat_bnds"].values, grid["lon_bnds"].values
+
+    # the equal area sample points of every destination cell, in sin(lat)
+    offsets = (np.arange(samples) + 0.5) / samples
+    sin_bnds = np.sin(np.deg2rad(lat_bnds))
+    sin_lat = sin_bnds[:, :1] + offsets * (sin_bnds[:, 1:] - sin_bnds[:, :1])
+    lon = lon_bnds[:, :1] + offsets * (lon_bnds[:, 1:] - lon_bnds[:, :1])
+    shape = (nlat, nlon, samples, samples)
+    sin_lat = np.broadcast_to(sin_lat[:, None, :, None], shape)
+    lon = np.deg2rad(np.broadcast_to(lon[None, :, None, :], shape))
+    cos_lat = np.sqrt(1.0 - sin_lat**2)
+    x, y, z = (cos_lat * np.cos(lon)).ravel(), (cos_lat * np.sin(lon)).ravel(), sin_lat.ravel()
+
+    # the cube face and its (a, b) gnomonic coordinates (see
+    # make_cubed_sphere_grid for the orientation of the faces)
+    ax, ay, az = np.abs(x), np.abs(y), np.abs(z)
+    face = np.select(
+        [(ax >= ay) & (ax >= az) & (x > 0), (ay >= az) & (ay >= ax) & (y > 0),
+         (ax >= ay) & (ax >= az), (ay >= az) & (ay >= ax), z > 0],
+        [0, 1, 2, 3, 4],
+        5,
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = np.choose(face, [y / x, -x / y, y / x, -x / y, y / z, -y / z])
+        b = np.choose(face, [z / x, z / y, -z / x, -z / y, -x / z, -x / z])
+    i = np.clip(np.searchsorted(edges, a) - 1, 0, n - 1)
+    j = np.clip(np.searchsorted(edges, b) - 1, 0, n - 1)
+
+    col = face * n * n + i * n + j
+    row = np.repeat(np.arange(nlat * nlon), samples * samples)
+    pairs, counts = np.unique(row * (6 * n * n) + col, return_counts=True)
+    row, col = np.divmod(pairs, 6 * n * n)
+    S = counts / samples**2
+
+    source = make_cubed_sphere_grid(ne, npg)
+    lat_2d, lon_2d = np.meshgrid(grid["lat"].values, grid["lon"].values, indexing="ij")
+    corners_lat = np.stack(
+        [lat_bnds[:, 0], lat_bnds[:, 0], lat_bnds[:, 1], lat_bnds[:, 1]], axis=-1
+    )
+    corners_lon = np.stack(
+        [lon_bnds[:, 0], lon_bnds[:, 1], lon_bnds[:, 1], lon_bnds[:, 0]], axis=-1
+    )
+    area_b = np.outer(
+        sin_bnds[:, 1] - sin_bnds[:, 0], np.deg2rad(lon_bnds[:, 1] - lon_bnds[:, 0])
+    )
+    area_a = np.bincount(col, weights=S * area_b.ravel()[row], minlength=6 * n * n)
+
+    return xr.Dataset(
+        {
+            "S": ("n_s", S),
+            "row": ("n_s", (row + 1).astype("int32")),
+            "col": ("n_s", (col + 1).astype("int32")),
+            "src_grid_dims": ("src_grid_rank", np.array([6 * n * n], dtype="int32")),
+            "dst_grid_dims": ("dst_grid_rank", np.array([nlon, nlat], dtype="int32")),
+            "xc_a": ("n_a", source["grid_center_lon"].values),
+            "yc_a": ("n_a", source["grid_center_lat"].values),
+            "xv_a": (("n_a", "nv_a"), source["grid_corner_lon"].values),
+            "yv_a": (("n_a", "nv_a"), source["grid_corner_lat"].values),
+            "xc_b": ("n_b", lon_2d.ravel()),
+            "yc_b": ("n_b", lat_2d.ravel()),
+            "xv_b": (
+                ("n_b", "nv_b"),
+                np.broadcast_to(corners_lon[None], (nlat, nlon, 4)).reshape(-1, 4),
+            ),
+            "yv_b": (
+                ("n_b", "nv_b"),
+                np.broadcast_to(corners_lat[:, None], (nlat, nlon, 4)).reshape(-1, 4),
+            ),
+            "area_a": ("n_a", area_a),
+            "area_b": ("n_b", area_b.ravel()),
+            "frac_a": ("n_a", np.ones(6 * n * n)),
+            "frac_b": ("n_b", np.ones(nlat * nlon)),
+        },
+        attrs={"map_method": "Conservative remapping", "normalization": "destarea"},
+    )
+
+
+def write_map_file(name: str) -> str:
+    """Write the map file of a synthetic unstructured dataset, once.
+
+    Returns
+    -------
+    str
+        The path of the map file.
+    """
+    config = UNSTRUCTURED_CONFIGS[name]
+    nlat, nlon = config["target"]
+    map_path = os.path.join(
+        SYNTHETIC_DIR,
+        "maps",
+        f"map_ne{config['ne']}pg{config['npg']}_to_{nlat}x{nlon}_aave.nc",
+    )
+
+    if not os.path.exists(map_path):
+        os.makedirs(os.path.dirname(map_path), exist_ok=True)
+        ds = make_cubed_sphere_map(config["ne"], config["npg"], nlat, nlon)
+        ds.to_netcdf(map_path + ".tmp")
+        os.replace(map_path + ".tmp", map_path)
+
+    return map_path
+
+
+def write_unstructured_dataset(name: str) -> Dict[str, str]:
+    """Write a synthetic h0 archive (one file per month) and its grid, once.
+
+    Returns
+    -------
+    Dict[str, str]
+        The directory path storing the h0 files (with a trailing slash) and
+        the path of the grid file ("dir_path" and "grid_path").
+    """
+    config = UNSTRUCTURED_CONFIGS[name]
+    grid_path = write_cubed_sphere_grid(config["ne"], config["npg"])
+    dir_path = os.path.join(SYNTHETIC_DIR, name) + os.sep
+    done_path = os.path.join(dir_path, ".done")
+
+    if not os.path.exists(done_path):
+        os.makedirs(dir_path, exist_ok=True)
+        with xr.open_dataset(grid_path) as grid:
+            lat = grid["grid_center_lat"].values
+            lon = grid["grid_center_lon"].values
+
+        rng = np.random.default_rng(0)
+        time_edges = pd.date_range(config["start"], periods=config["nyears"] * 12 + 1, freq="MS")
+        for idx in range(config["nyears"] * 12):
+            cycle = 10.0 * np.cos(2 * np.pi * (idx % 12) / 12.0) * np.sin(np.deg2rad(lat))
+            trefht = 288.0 - 40.0 * np.sin(np.deg2rad(lat)) ** 2 + cycle
+            trefht += rng.standard_normal(len(lat))
+            ds = xr.Dataset(
+                {
+                    "TREFHT": (
+                        ("time", "ncol"),
+                        trefht[None].astype("float32"),
+                        {"units": "K", "long_name": "Reference height temperature"},
+                    ),
+                    "time_bnds": (("time", "nbnd"), time_edges[idx : idx + 2].values[None]),
+                    "lat": ("ncol", lat, {"units": "degrees_north"}),
+                    "lon": ("ncol", lon, {"units": "degrees_east"}),
+                },
+                coords={"time": ("time", time_edges[idx + 1 : idx + 2], {"bounds": "time_bnds"})},
+            )
+            month = time_edges[idx]
+            ds.to_netcdf(
+                os.path.join(dir_path, f"{name}.eam.h0.{month.year:04d}-{month.month:02d}.nc")
+            )
+
+        open(done_path, "w").close()
+
+    return {"dir_path": dir_path, "grid_path": grid_path}
+
+
+def get_paths(spec: Spec) -> str:
+    """Get the glob pattern of the netCDF files of a dataset spec."""
+    return spec["dir_path"] + spec.get("pattern", "*.nc")
+
+
+def _register_synthetic(name: str):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {
+            "var_key": "ts",
+            "dir_path": write_synthetic_dataset(name),
+            "chunks": {"time": "auto"},
+        }
+
+
+def _register_subdaily(name: str):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {
+            "var_key": "tas",
+            "dir_path": write_subdaily_dataset(name),
+            "chunks": {"time": "auto"},
+        }
+
+
+def _register_ensemble(name: str):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {"var_key": "tas", "dpaths": write_synthetic_ensemble(name)}
+
+
+def _register_regrid(name: str, config: Dict[str, Any]):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {
+            "var_key": "ts",
+            "dir_path": write_synthetic_dataset(config["source"]),
+            "chunks": {"time": 1},
+            "target": config["target"],
+        }
+
+
+def _register_regrid_vars(name: str, n_vars: int):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {
+            "var_keys": [f"var{i:03d}" for i in range(n_vars)],
+            "ds": make_multivariable_dataset(n_vars, 1, 180, 360),
+            "target": (72, 144),
+        }
+
+
+def _register_hybrid(name: str):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {
+            "var_key": "T",
+            "dir_path": write_hybrid_dataset(name),
+            "chunks": {"time": 12},
+        }
+
+
+def _register_hybrid_vars(name: str, n_vars: int):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {
+            "var_keys": ["T"] + [f"var{idx:03d}" for idx in range(1, n_vars)],
+            "dir_path": write_hybrid_dataset("hybrid_vars"),
+            "chunks": {"time": 12},
+        }
+
+
+def _register_unstructured(name: str):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {
+            "var_key": "TREFHT",
+            "pattern": "*.h0.*.nc",
+            "chunks": {"time": 12},
+            "map_path": write_map_file(name),
+            **write_unstructured_dataset(name),
+        }
+
+
+def _register_grid(name: str, config: Dict[str, int]):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        return {"grid_path": write_cubed_sphere_grid(config["ne"], config["npg"])}
+
+
+def _register_real_grid(name: str, grid_path: str):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        if not os.path.exists(grid_path):
+            return None
+
+        return {"grid_path": grid_path}
+
+
+def _register_real(name: str, info: Dict[str, str]):
+    @register_dataset(name)
+    def _provider() -> Optional[Spec]:
+        if not os.path.isdir(info["dir_path"]):
+            return None
+
+        if "pattern" in info and not glob.glob(os.path.join(info["dir_path"], info["pattern"])):
+            return None
+
+        for key in ["grid_path", "map_path"]:
+            if key in info and not os.path.exists(info[key]):
+                return None
+
+        return {**info, "chunks": {"time": "auto"}}
+
+
+for _name in SYNTHETIC_CONFIGS:
+    _register_synthetic(_name)
+
+for _name in SUBDAILY_CONFIGS:
+    _register_subdaily(_name)
+
+for _name in ENSEMBLE_CONFIGS:
+    _register_ensemble(_name)
+
+for _name, _config in REGRID_CONFIGS.items():
+    _register_regrid(_name, _config)
+
+for _name, _n_vars in REGRID_VARS_SIZES.items():
+    _register_regrid_vars(_name, _n_vars)
+
+for _name in HYBRID_CONFIGS:
+    _register_hybrid(_name)
+
+for _name, _n_vars in HYBRID_VARS_SIZES.items():
+    _register_hybrid_vars(_name, _n_vars)
+
+for _name in UNSTRUCTURED_CONFIGS:
+    _register_unstructured(_name)
+
+for _name, _config in GRID_CONFIGS.items():
+    _register_grid(_name, _config)
+
+for _name, _grid_path in REAL_GRIDS.items():
+    _register_real_grid(_name, _grid_path)
+
+for _name, _info in REAL_DATASETS.items():
+    _register_real(_name, _info)
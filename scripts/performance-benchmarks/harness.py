@@ -0,0 +1,374 @@
+"""Benchmark harness for registered benchmark cases.
+
+Cases are plain functions registered with ``register_case``. Each case receives
+an input spec (a dictionary returned by a registered dataset provider) and a
+``Recorder``, and wraps each step of its workflow in ``rec.stage(...)`` so the
+harness can report per-stage runtimes, peak memory and Dask task counts.
+
+Runtimes are taken from ``repeat`` untraced runs (the minimum is recorded, same
+as ``3_perf_benchmark.py``). Peak memory is measured in one additional run with
+``tracemalloc`` enabled, because tracing inflates runtimes. ``tracemalloc`` only
+sees allocations in the current process, so peak memory is only meaningful for
+the serial and threaded Dask schedulers.
+
+Results are appended to a single CSV results store (``RESULTS_PATH``) so runs of
+different suites can be compared over time.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import statistics
+import time
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+# Example: `/home/vo13/xCDAT/xcdat-validation/scripts/performance-benchmarks/`
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+# The `scripts/` directory, which stores `xrw.py`, `cdw.py`, etc.
+SCRIPTS_DIR = os.path.dirname(ROOT_DIR)
+RESULTS_PATH = os.path.join(ROOT_DIR, "results", "benchmark-results.csv")
+
+# The columns of the results store, in order.
+RESULT_COLUMNS = [
+    "timestamp",
+    "suite",
+    "case",
+    "impl",
+    "dataset",
+    "stage",
+    "repeat",
+    "runtime_min",
+    "runtime_median",
+    "peak_mem_mb",
+    "n_tasks",
+    "extra",
+]
+
+# A type annotation for input specs passed to cases.
+Spec = Dict[str, Any]
+CaseFunc = Callable[[Spec, "Recorder"], Any]
+
+# Registered cases, keyed by "<suite>/<case>/<impl>".
+CASES: Dict[str, Dict[str, Any]] = {}
+# Registered dataset providers, keyed by dataset name.
+DATASETS: Dict[str, Callable[[], Optional[Spec]]] = {}
+# Specs that have already been built by a provider.
+_DATASET_SPECS: Dict[str, Optional[Spec]] = {}
+
+
+def register_case(
+    suite: str, case: str, impl: str, datasets: Tuple[str, ...]
+) -> Callable[[CaseFunc], CaseFunc]:
+    """Register a benchmark case.
+
+    Parameters
+    ----------
+    suite : str
+        The benchmark suite (e.g., "workflows").
+    case : str
+        The name of the workflow being benchmarked (e.g., "vo_departures").
+        Implementations of the same case are compared against each other.
+    impl : str
+        The implementation (e.g., "xarray", "xcdat").
+    datasets : Tuple[str, ...]
+        The names of the registered datasets the case runs on.
+
+    Returns
+    -------
+    Callable[[CaseFunc], CaseFunc]
+        A decorator that registers the case function and returns it unchanged.
+    """
+
+    def decorator(func: CaseFunc) -> CaseFunc:
+        key = f"{suite}/{case}/{impl}"
+        if key in CASES:
+            raise ValueError(f"The benchmark case {key!r} is already registered.")
+
+        CASES[key] = {
+            "suite": suite,
+            "case": case,
+            "impl": impl,
+            "datasets": datasets,
+            "func": func,
+        }
+        return func
+
+    return decorator
+
+
+def register_dataset(
+    name: str,
+) -> Callable[[Callable[[], Optional[Spec]]], Callable[[], Optional[Spec]]]:
+    """Register a dataset provider.
+
+    A provider returns the input spec for the dataset, or None if the dataset
+    is not available on this machine (e.g., real data outside of LLNL).
+    Providers are only called once, the first time a case needs the dataset.
+
+    Parameters
+    ----------
+    name : str
+        The name of the dataset (e.g., "synthetic_small", "7_gb").
+    """
+
+    def decorator(
+        func: Callable[[], Optional[Spec]]
+    ) -> Callable[[], Optional[Spec]]:
+        DATASETS[name] = func
+        return func
+
+    return decorator
+
+
+def get_dataset(name: str) -> Optional[Spec]:
+    """Get the input spec for a registered dataset (None if unavailable)."""
+    if name not in _DATASET_SPECS:
+        spec = DATASETS[name]()
+        if spec is not None:
+            spec = {"name": name, **spec}
+
+        _DATASET_SPECS[name] = spec
+
+    return _DATASET_SPECS[name]
+
+
+class Recorder:
+    """Records per-stage runtimes, peak memory, Dask task counts and metrics.
+
+    Parameters
+    ----------
+    trace_memory : bool
+        Whether to trace peak memory with ``tracemalloc`` in each stage.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self._current: Optional[str] = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a stage of a workflow.
+
+        Entering the same stage more than once accumulates its runtime.
+        """
+        entry = self.stages.setdefault(
+            name, {"runtime": 0.0, "peak_mem_mb": float("nan"), "n_tasks": 0}
+        )
+        self._current = name
+
+        if self.trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            entry["runtime"] += timeit.default_timer() - start
+
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] / 1024**2
+                tracemalloc.stop()
+
+                prev = entry["peak_mem_mb"]
+                entry["peak_mem_mb"] = peak if prev != prev else max(prev, peak)
+
+            self._current = None
+
+    def tasks(self, obj: Any) -> Any:
+        """Record the number of Dask tasks needed to compute an object.
+
+        Call this inside a stage on the lazy result of that stage. Objects that
+        are not backed by Dask count as zero tasks.
+
+        Returns
+        -------
+        Any
+            The object, unchanged.
+        """
+        graph = obj.__dask_graph__() if hasattr(obj, "__dask_graph__") else None
+        n_tasks = len(graph) if graph is not None else 0
+
+        self._get_current()["n_tasks"] = n_tasks
+
+        return obj
+
+    def metric(self, name: str, value: Any):
+        """Record an extra metric (e.g., a cache hit rate) for the stage."""
+        self._get_current().setdefault("extra", {})[name] = value
+
+    def _get_current(self) -> Dict[str, Any]:
+        if self._current is None:
+            raise RuntimeError("Recorder methods must be called inside a stage.")
+
+        return self.stages[self._current]
+
+
+def run_case(key: str, spec: Spec, repeat: int) -> List[Dict[str, Any]]:
+    """Run a registered case on a dataset and summarize each stage.
+
+    Parameters
+    ----------
+    key : str
+        The registered case key ("<suite>/<case>/<impl>").
+    spec : Spec
+        The input spec of the dataset.
+    repeat : int
+        Number of untraced samples to take for runtimes.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        One results row per stage, plus a "total" row.
+    """
+    case = CASES[key]
+    func = case["func"]
+
+    runtimes: Dict[str, List[float]] = {}
+    for _ in range(repeat):
+        rec = Recorder(trace_memory=False)
+        func(spec, rec)
+
+        for stage, entry in rec.stages.items():
+            runtimes.setdefault(stage, []).append(entry["runtime"])
+
+        runtimes.setdefault("total", []).append(
+            sum(entry["runtime"] for entry in rec.stages.values())
+        )
+
+    rec_mem = Recorder(trace_memory=True)
+    func(spec, rec_mem)
+
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    rows = []
+    for stage, stage_runtimes in runtimes.items():
+        if stage == "total":
+            entries = rec_mem.stages.values()
+            peak = max((e["peak_mem_mb"] for e in entries), default=float("nan"))
+            n_tasks = max((e["n_tasks"] for e in entries), default=0)
+            extra: Dict[str, Any] = {}
+        else:
+            entry = rec_mem.stages.get(stage, {})
+            peak = entry.get("peak_mem_mb", float("nan"))
+            n_tasks = entry.get("n_tasks", 0)
+            extra = entry.get("extra", {})
+
+        rows.append(
+            {
+                "timestamp": timestamp,
+                "suite": case["suite"],
+                "case": case["case"],
+                "impl": case["impl"],
+                "dataset": spec["name"],
+                "stage": stage,
+                "repeat": repeat,
+                "runtime_min": min(stage_runtimes),
+                "runtime_median": statistics.median(stage_runtimes),
+                "peak_mem_mb": peak,
+                "n_tasks": n_tasks,
+                "extra": json.dumps(extra, default=str) if extra else "",
+            }
+        )
+
+    return rows
+
+
+def run_cases(
+    suites: Optional[List[str]] = None,
+    datasets: Optional[List[str]] = None,
+    repeat: int = 5,
+) -> pd.DataFrame:
+    """Run the registered cases, filtered by suite and dataset name.
+
+    Cases are skipped for datasets that are unavailable on this machine.
+
+    Parameters
+    ----------
+    suites : Optional[List[str]]
+        The suites to run, by default all registered suites.
+    datasets : Optional[List[str]]
+        The datasets to run on, by default all datasets of each case.
+    repeat : int
+        Number of untraced samples to take for runtimes, by default 5.
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame of results rows with the ``RESULT_COLUMNS``.
+    """
+    rows: List[Dict[str, Any]] = []
+
+    for key, case in CASES.items():
+        if suites is not None and case["suite"] not in suites:
+            continue
+
+        for name in case["datasets"]:
+            if datasets is not None and name not in datasets:
+                continue
+
+            spec = get_dataset(name)
+            if spec is None:
+                print(f"  * Skipping {key} on {name!r} (dataset unavailable)")
+                continue
+
+            print(f"  * Running {key} on {name!r}")
+            try:
+                case_rows = run_case(key, spec, repeat)
+            except Exception as e:
+                print(f"    * Failed: {e!r}")
+                continue
+
+            for row in case_rows:
+                print(
+                    f"    * {row['stage']}: {row['runtime_min']:.4f} s, "
+                    f"{row['peak_mem_mb']:.1f} MB, {row['n_tasks']} tasks"
+                )
+
+            rows.extend(case_rows)
+
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+
+def append_results(df: pd.DataFrame, path: str = RESULTS_PATH):
+    """Append results to the CSV results store, creating it if needed."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_header = not os.path.exists(path)
+
+    df[RESULT_COLUMNS].to_csv(path, mode="a", header=write_header, index=False)
+
+
+def load_results(path: str = RESULTS_PATH) -> pd.DataFrame:
+    """Load the CSV results store."""
+    return pd.read_csv(path)
+
+
+def compare_impls(df: pd.DataFrame, column: str = "runtime_min") -> pd.DataFrame:
+    """Pivot results so implementations of each case are side by side.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Results rows (e.g., from ``run_cases`` or ``load_results``).
+    column : str, optional
+        The column to compare, by default "runtime_min".
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame indexed by (suite, case, dataset, stage) with one column
+        per implementation.
+    """
+    return df.pivot_table(
+        index=["suite", "case", "dataset", "stage"],
+        columns="impl",
+        values=column,
+        aggfunc="last",
+        sort=False,
+    )
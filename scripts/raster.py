@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Rasterized quick-look plots of data on unstructured grids.
+
+``uxds['TREFHT'].isel(time=0).plot.polygons()`` and
+``uxds['bottomDepth'].plot()`` (see demos/2024-e3sm-workshop/) build a vector
+polygon for every face, so the rendering time grows with the number of
+faces, although a quick-look plot only has a screen's worth of pixels.
+Here:
+
+    - get_lookup computes, once for a grid and a view (the lon/lat extent
+      and the pixel size of the image), the face of every pixel (the face
+      whose spherical polygon contains the pixel center, -1 outside the
+      mesh, e.g., on the land of ocean meshes) and the pixel of every face
+      center. It is cached by grid file and view, in memory and as .npz
+      files in a cache directory (written atomically, see arraycache)
+    - rasterize turns the face values into an image with one gather (or, for
+      meshes with more faces than pixels, an area-weighted mean of the faces
+      of every pixel, with np.bincount)
+    - the level of detail decimates the image by 2 ** level in each direction
+      from the same lookup; by default it is the coarsest level that keeps
+      about PIXELS_PER_FACE pixels per visible face
+    - plot shows the image with ``imshow``, so the drawing time only depends
+      on the number of pixels
+
+Example Usage:
+-------------
+    import matplotlib.pyplot as plt
+    import raster
+    import xarray as xr
+
+    ds = xr.open_dataset('extendedOutput.v3.LR.historical_0101.eam.h0.2000-01.nc')
+    raster.plot(ds['TREFHT'].isel(time=0), 'ne30pg2.nc', cmap='RdBu_r')
+    plt.show()
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from collections import namedtuple
+from typing import Any, Optional, Tuple, Union
+
+import numpy as np
+import xarray as xr
+
+import arraycache
+import topology
+
+# The default lookup cache directory.
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+                             'xcdat-validation', 'raster')
+
+# The maximum number of lookups kept in memory.
+MEMORY_CACHE_SIZE = 8
+
+# The default (width, height) of images, in pixels.
+DEFAULT_SIZE = (1200, 600)
+
+# The default (lon_min, lon_max, lat_min, lat_max) extent of images.
+DEFAULT_EXTENT = (0., 360., -90., 90.)
+
+# The number of pixels per visible face of the automatic level of detail.
+PIXELS_PER_FACE = 4
+
+# The maximum level of detail (a decimation by 2 ** MAX_LEVEL).
+MAX_LEVEL = 4
+
+# The methods of rasterize.
+METHODS = ['nearest', 'mean']
+
+# The nearest face centers tested for every pixel in get_lookup.
+N_CANDIDATES = 8
+
+# The pixels located at once in get_lookup.
+PIXEL_BLOCK = 2**16
+
+# The face of every pixel (-1 outside the mesh, with shape (height, width),
+# from the bottom row), the pixel of every face center (a flat index, -1
+# outside the view), the (height, width) of the image and its extent.
+Lookup = namedtuple('Lookup', ['pixel_faces', 'face_pixels', 'shape', 'extent'])
+
+_lookups = arraycache.memory_cache()
+
+
+def _get_key(grid_path: str,
+             size: Tuple[int, int],
+             extent: Tuple[float, float, float, float]) -> str:
+    st = os.stat(grid_path)
+    h = hashlib.sha1()
+    h.update(str((os.path.abspath(grid_path), st.st_size, st.st_mtime,
+                  tuple(size), tuple(float(e) for e in extent))).encode())
+
+    return h.hexdigest()
+
+
+def _edge_normals(topo: topology.Topology) -> np.ndarray:
+    # the (n_face, max_nodes, 3) normals of the great circles of the edges of
+    # every face (zero for the padding)
+    face_nodes = np.asarray(topo.face_nodes)
+    n_nodes = np.asarray(topo.n_nodes).astype(np.int64)
+    valid = face_nodes != topology.FILL_VALUE
+    xyz = topology.to_xyz(np.asarray(topo.node_lat), np.asarray(topo.node_lon))
+
+    k = np.arange(face_nodes.shape[1])
+    following = np.take_along_axis(
+        face_nodes, (k[None] + 1) % np.maximum(n_nodes[:, None], 1), axis=1)
+    normals = np.cross(xyz[np.where(valid, face_nodes, 0)],
+                       xyz[np.where(valid, following, 0)])
+
+    return normals * valid[..., None]
+
+
+def _locate(points: np.ndarray,
+            candidates: np.ndarray,
+            normals: np.ndarray) -> np.ndarray:
+    # the first candidate face (or -1) whose polygon contains each point: a
+    # point is inside a convex spherical polygon if it is on the same side of
+    # all its edges (whatever the orientation of the polygon)
+    faces = np.full(len(points), -1, dtype=np.int64)
+    for k in range(candidates.shape[1]):
+        todo = np.flatnonzero(faces < 0)
+        if not len(todo):
+            break
+        face = candidates[todo, k]
+        side = np.einsum('pmi,pi->pm', normals[face], points[todo])
+        eps = 1e-12
+        inside = (side >= -eps).all(axis=1) | (side <= eps).all(axis=1)
+        faces[todo[inside]] = face[inside]
+
+    return faces
+
+
+def _compute_lookup(grid_path: str,
+                    size: Tuple[int, int],
+                    extent: Tuple[float, float, float, float],
+                    topo: topology.Topology) -> Lookup:
+    from scipy.spatial import cKDTree
+
+    width, height = size
+    lon_min, lon_max, lat_min, lat_max = extent
+
+    # the pixel centers, from the bottom row (like imshow(origin='lower'))
+    lon = lon_min + (np.arange(width) + 0.5) * (lon_max - lon_min) / width
+    lat = lat_min + (np.arange(height) + 0.5) * (lat_max - lat_min) / height
+    lat, lon = np.meshgrid(lat, lon, indexing='ij')
+    points = topology.to_xyz(lat.ravel(), lon.ravel())
+
+    face_lat, face_lon = np.asarray(topo.face_lat), np.asarray(topo.face_lon)
+    tree = cKDTree(topology.to_xyz(face_lat, face_lon))
+    normals = _edge_normals(topo)
+    n_candidates = min(N_CANDIDATES, len(face_lat))
+
+    pixel_faces = np.empty(len(points), dtype=np.int32)
+    for start in range(0, len(points), PIXEL_BLOCK):
+        block = points[start:start + PIXEL_BLOCK]
+        _, candidates = tree.query(block, k=n_candidates)
+        candidates = candidates.reshape(len(block), n_candidates)
+        pixel_faces[start:start + PIXEL_BLOCK] = _locate(block, candidates, normals)
+
+    # the pixel of every face center (in the extent, with lon shifted into it)
+    col = np.floor(((face_lon - lon_min) % 360.) / (lon_max - lon_min) * width)
+    row = np.floor((face_lat - lat_min) / (lat_max - lat_min) * height)
+    inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+    face_pixels = np.where(inside, row * width + col, -1).astype(np.int32)
+
+    return Lookup(pixel_faces.reshape(height, width), face_pixels,
+                  (height, width), tuple(float(e) for e in extent))
+
+
+def get_lookup(grid_path: str,
+               size: Tuple[int, int] = DEFAULT_SIZE,
+               extent: Tuple[float, float, float, float] = DEFAULT_EXTENT,
+               cache: Optional[str] = DEFAULT_CACHE,
+               topology_cache: Optional[str] = topology.DEFAULT_CACHE) -> Lookup:
+    """Get the face-to-pixel lookup of a grid and a view, computed once.
+
+    Parameters
+    ----------
+    grid_path : str
+        The grid file (see ``topology.read_topology``).
+    size : Tuple[int, int], optional
+        The (width, height) of the image in pixels, by default
+        ``DEFAULT_SIZE``.
+    extent : Tuple[float, float, float, float], optional
+        The (lon_min, lon_max, lat_min, lat_max) of the image, by default the
+        globe.
+    cache : Optional[str], optional
+        The cache directory, by default ``DEFAULT_CACHE``. If None, the
+        lookups are only cached in memory.
+    topology_cache : Optional[str], optional
+        The cache directory of the topology of the grid (see
+        ``topology.get_topology``), by default ``topology.DEFAULT_CACHE``.
+
+    Returns
+    -------
+    Lookup
+        The face of every pixel and the pixel of every face center.
+    """
+    key = _get_key(grid_path, size, extent)
+    path = None if cache is None else os.path.join(cache, key + '.npz')
+
+    lookup = arraycache.get(_lookups, key)
+    if lookup is not None:
+        return lookup
+
+    arrays = arraycache.load_npz(path, ['pixel_faces', 'face_pixels', 'extent'])
+    if arrays is None:
+        topo = topology.get_topology(grid_path, cache=topology_cache)
+        lookup = _compute_lookup(grid_path, size, extent, topo)
+        arraycache.save_npz(path, {'pixel_faces': lookup.pixel_faces,
+                                   'face_pixels': lookup.face_pixels,
+                                   'extent': np.array(lookup.extent)})
+    else:
+        lookup = Lookup(arrays['pixel_faces'], arrays['face_pixels'],
+                        tuple(arrays['pixel_faces'].shape),
+                        tuple(float(e) for e in arrays['extent']))
+
+    return arraycache.put(_lookups, key, lookup, MEMORY_CACHE_SIZE)
+
+
+def choose_level(lookup: Lookup) -> int:
+    """
+    level = choose_level(lookup).
+
+    Returns the coarsest level of detail (up to MAX_LEVEL) whose image still
+    has PIXELS_PER_FACE pixels per face visible in the view.
+    """
+    n_faces = max(int((lookup.face_pixels >= 0).sum()), 1)
+    height, width = lookup.shape
+    level = 0
+    while (level < MAX_LEVEL
+           and (height >> (level + 1)) * (width >> (level + 1))
+           >= PIXELS_PER_FACE * n_faces):
+        level += 1
+
+    return level
+
+
+def rasterize(values: Union[xr.DataArray, np.ndarray],
+              lookup: Lookup,
+              level: Optional[int] = None,
+              method: Optional[str] = None,
+              areas: Optional[np.ndarray] = None) -> np.ndarray:
+    """Rasterize face values with a lookup.
+
+    Parameters
+    ----------
+    values : Union[xr.DataArray, np.ndarray]
+        The values on the faces (the last dimension, with any others before
+        it, e.g., time).
+    lookup : Lookup
+        The lookup of the grid and view (see ``get_lookup``).
+    level : Optional[int], optional
+        The level of detail (the image is decimated by 2 ** level), by
+        default ``choose_level(lookup)``.
+    method : Optional[str], optional
+        "nearest" (the value of the face of each pixel center) or "mean" (the
+        mean of the faces whose centers are in each pixel, weighted by the
+        areas if given, and the nearest value for pixels without any), by
+        default "mean" if the view has more faces than pixels.
+    areas : Optional[np.ndarray], optional
+        The face areas for the "mean" method, by default None (equal
+        weights).
+
+    Returns
+    -------
+    np.ndarray
+        The (float) image, with shape (..., height, width) from the bottom
+        row, and NaN outside the mesh.
+    """
+    values = np.asarray(values)
+    if level is None:
+        level = choose_level(lookup)
+    step = 2**level
+    height, width = lookup.shape
+    if method is None:
+        n_faces = int((lookup.face_pixels >= 0).sum())
+        method = 'mean' if n_faces > (height // step) * (width // step) else 'nearest'
+    if method not in METHODS:
+        raise ValueError(f'Unsupported method {method!r}, use one of {METHODS}.')
+
+    values = values.astype(np.result_type(values.dtype, np.float32), copy=False)
+    pixel_faces = lookup.pixel_faces[step // 2::step, step // 2::step]
+    image = np.where(pixel_faces >= 0, values[..., np.maximum(pixel_faces, 0)], np.nan)
+    if method == 'nearest':
+        return image
+
+    # the mean of the faces whose centers are in each (decimated) pixel
+    shape = image.shape[-2:]
+    face_pixels = lookup.face_pixels
+    inside = face_pixels >= 0
+    row = (face_pixels // width) // step
+    col = (face_pixels % width) // step
+    inside &= (row < shape[0]) & (col < shape[1])
+    pixels = row[inside] * shape[1] + col[inside]
+    weights = np.ones(len(face_pixels)) if areas is None else np.asarray(areas)
+    weights = weights[inside]
+
+    flat = values[..., inside].reshape(-1, len(pixels))
+    out = image.reshape(-1, shape[0] * shape[1])
+    for field, field_out in zip(flat, out):
+        valid = np.isfinite(field)
+        total = np.bincount(pixels[valid], weights=(weights * field)[valid],
+                            minlength=len(field_out))
+        count = np.bincount(pixels[valid], weights=weights[valid],
+                            minlength=len(field_out))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            field_out[:] = np.where(count > 0, total / count, field_out)
+
+    return out.reshape(image.shape)
+
+
+def plot(values: Union[xr.DataArray, np.ndarray],
+         grid_path: str,
+         ax: Any = None,
+         size: Tuple[int, int] = DEFAULT_SIZE,
+         extent: Tuple[float, float, float, float] = DEFAULT_EXTENT,
+         level: Optional[int] = None,
+         method: Optional[str] = None,
+         cache: Optional[str] = DEFAULT_CACHE,
+         topology_cache: Optional[str] = topology.DEFAULT_CACHE,
+         **kwargs: Any):
+    """Plot face values as a rasterized image.
+
+    Parameters
+    ----------
+    values : Union[xr.DataArray, np.ndarray]
+        The values on the faces of the grid (one dimension).
+    grid_path : str
+        The grid file, with faces in the order of values.
+    ax : Any, optional
+        The matplotlib axes, by default the current axes.
+    size, extent, cache, topology_cache
+        The view and the cache directories (see ``get_lookup``).
+    level, method
+        The level of detail and method (see ``rasterize``).
+    **kwargs : Any
+        Other ``imshow`` options (e.g., cmap, vmin and vmax).
+
+    Returns
+    -------
+    matplotlib.image.AxesImage
+        The image.
+    """
+    if ax is None:
+        import matplotlib.pyplot as plt
+
+        ax = plt.gca()
+
+    lookup = get_lookup(grid_path, size=size, extent=extent, cache=cache,
+                        topology_cache=topology_cache)
+    areas = None
+    if method != 'nearest':
+        areas = topology.get_topology(grid_path, cache=topology_cache).face_areas
+    image = rasterize(values, lookup, level=level, method=method, areas=areas)
+    kwargs.setdefault('interpolation', 'nearest')
+    kwargs.setdefault('aspect', 'auto')
+
+    return ax.imshow(image, origin='lower', extent=lookup.extent, **kwargs)
+
+
+def clear_cache(cache: Optional[str] = None):
+    """
+    clear_cache(cache).
+
+    Clears the in-memory lookups, and removes the entries of a cache
+    directory if one is given.
+    """
+    arraycache.clear(_lookups)
+    arraycache.remove_files(cache)
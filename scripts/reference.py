@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Reference (oracle) implementations for validating xCDAT against NumPy.
+
+The validation scripts build reference spatial averages by tiling the 2D
+weights into a full (time, lat, lon) float64 cube and masking it with
+np.where(~np.isnan(data), weights, 0.). That is a straightforward oracle, but
+it holds several (time, lat, lon) float64 copies in memory and cannot be used
+on large files.
+
+spatial_average computes the same reference one block of time steps at a
+time. The 2D weights are broadcast against each block and the NaN mask is
+handled with a second weighted sum (the denominator), so the full weight cube
+is never built and peak memory only depends on the block size. Each time
+step is reduced with exactly the same NumPy operations as the tiled oracle, so
+the results are bit-for-bit identical.
+
+Example Usage:
+-------------
+    import reference
+
+    ds = xcdat.open_dataset(fn)
+    weights = ds.spatial.get_weights(axis=['Y', 'X'])
+    ts_explicit = reference.spatial_average(ds[v], weights)
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+
+# The default memory budget of each time block (in MB of float64 temporaries).
+MAX_BLOCK_MB = 64.0
+
+
+def spatial_average(
+    data,
+    weights,
+    block_size: Optional[int] = None,
+    max_block_mb: float = MAX_BLOCK_MB,
+) -> np.ndarray:
+    """Compute the NaN-aware weighted spatial average, streaming over time.
+
+    Parameters
+    ----------
+    data : array-like
+        The (time, lat, lon) data. Anything that supports slicing along the
+        first axis works (e.g., a NumPy array, a lazily loaded DataArray or a
+        netCDF4 variable), and only one block is loaded at a time.
+    weights : array-like
+        The 2D (lat, lon) weights.
+    block_size : Optional[int], optional
+        The number of time steps per block, by default None which sizes blocks
+        to ``max_block_mb``.
+    max_block_mb : float, optional
+        The memory budget per block when ``block_size`` is None, by default
+        ``MAX_BLOCK_MB``.
+
+    Returns
+    -------
+    np.ndarray
+        The float64 spatial average for each time step (NaN for time steps
+        where every value is missing).
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    ntime = data.shape[0]
+
+    if weights.shape != tuple(data.shape[1:]):
+        raise ValueError(
+            f"The weights shape {weights.shape} does not match the spatial "
+            f"shape of the data {tuple(data.shape[1:])}."
+        )
+
+    if block_size is None:
+        block_size = max(1, int(max_block_mb * 1024**2 // (weights.nbytes * 3)))
+
+    numerator = np.empty(ntime, dtype=np.float64)
+    denominator = np.empty(ntime, dtype=np.float64)
+
+    for t0 in range(0, ntime, block_size):
+        t1 = min(t0 + block_size, ntime)
+        block = np.asarray(data[t0:t1])
+
+        # Masked weights for this block only (broadcast, not tiled).
+        block_weights = np.where(~np.isnan(block), weights, 0.0)
+        denominator[t0:t1] = np.sum(block_weights, axis=(1, 2))
+
+        # Missing values are excluded from the weighted sum, which matches the
+        # skipna summation of the tiled oracle.
+        product = block_weights * block
+        product[np.isnan(product)] = 0.0
+        numerator[t0:t1] = np.sum(product, axis=(1, 2))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return numerator / denominator
+
+
+def area_weights(lat_bnds, lon_bnds) -> np.ndarray:
+    """
+    weights = area_weights(lat_bnds, lon_bnds).
+
+    Returns the 2D (lat, lon) cell area weights for a rectilinear grid from
+    its (nlat, 2) and (nlon, 2) bounds in degrees, proportional to
+    (sin(lat1) - sin(lat0)) * (lon1 - lon0), as in
+    ``ds.spatial.get_weights(axis=['Y', 'X'])``.
+    """
+    lat_bnds = np.deg2rad(np.asarray(lat_bnds, dtype=np.float64))
+    lon_bnds = np.asarray(lon_bnds, dtype=np.float64)
+
+    lat_weights = np.abs(np.sin(lat_bnds[:, 1]) - np.sin(lat_bnds[:, 0]))
+    lon_weights = np.abs(lon_bnds[:, 1] - lon_bnds[:, 0])
+
+    return lat_weights[:, None] * lon_weights[None, :]
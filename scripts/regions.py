@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Area-weighted averages over many regions in one pass over the data.
+
+Regional means used to be computed one region at a time, with lat_bounds and
+lon_bounds in ``ds.spatial.average`` or with a land/ocean ``where`` (see
+validation/prototyping/landsea_mask/landsea_mask.ipynb), so every region read
+and weighted the whole field again. Here:
+
+    - regions are boxes of lat and lon bounds (the lon bounds may cross the
+      prime meridian, e.g. (300, 60)), optionally restricted to land or
+      ocean or multiplied by a (lat, lon) mask
+    - get_weights builds the sparse (region x cell) matrix of the area
+      weights of every region once (cells partly in a box get the weight of
+      the overlapping area, like ``ds.spatial.average``) and keeps it in
+      memory for the grid and regions
+    - average applies the matrix to the data with xr.apply_ufunc, so every
+      chunk of the data is read once and all regional means are computed
+      from it with one sparse matrix multiply (missing values are skipped)
+
+Example Usage:
+-------------
+    import regions
+    import xarray as xr
+
+    ds = xr.open_mfdataset('ts_*.nc', chunks={'time': 120})
+    boxes = regions.split_land_ocean(regions.latitude_bands(range(-90, 91, 30)))
+    boxes['Nino 3.4'] = {'lat': (-5, 5), 'lon': (190, 240)}
+    means = regions.average(ds['ts'], boxes)
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections import namedtuple
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+import numpy as np
+import xarray as xr
+
+import arraycache
+import landsea
+import opener
+
+# The maximum number of weight matrices kept in memory.
+MEMORY_CACHE_SIZE = 8
+
+# The weight matrix of a set of regions: their names and the sparse
+# (n_regions, nlat * nlon) matrix of area weights.
+RegionWeights = namedtuple('RegionWeights', ['names', 'matrix'])
+
+# A region: {'lat': (south, north), 'lon': (west, east), 'mask': mask}, where
+# every key is optional and mask is 'land', 'ocean' or a (lat, lon) array.
+Region = Dict[str, Any]
+
+_weights = arraycache.memory_cache()
+
+
+def latitude_bands(edges: Iterable[float]) -> Dict[str, Region]:
+    """
+    regions = latitude_bands(edges).
+
+    Returns the latitude band regions between consecutive edges, e.g.
+    latitude_bands([-90, -30, 30, 90]) has "90S-30S", "30S-30N" and
+    "30N-90N".
+    """
+    edges = list(edges)
+
+    return {f'{_format_lat(s)}-{_format_lat(n)}': {'lat': (s, n)}
+            for s, n in zip(edges[:-1], edges[1:])}
+
+
+def _format_lat(lat: float) -> str:
+    if lat == 0:
+        return 'EQ'
+
+    return f"{abs(lat):g}{'N' if lat > 0 else 'S'}"
+
+
+def split_land_ocean(regions: Dict[str, Region]) -> Dict[str, Region]:
+    """
+    regions = split_land_ocean(regions).
+
+    Returns the land ("<name> land") and ocean ("<name> ocean") parts of
+    regions.
+    """
+    return {f'{name} {mask}': {**region, 'mask': mask}
+            for name, region in regions.items() for mask in ['land', 'ocean']}
+
+
+def _overlap(lower: np.ndarray,
+             upper: np.ndarray,
+             start: float,
+             end: float,
+             period: Optional[float] = None) -> np.ndarray:
+    # the length of the overlap of each cell with [start, end] (shifted by a
+    # period, if any, so a range crossing the prime meridian wraps)
+    if period is not None and end < start:
+        end += period
+    shifts = [0.] if period is None else [-period, 0., period]
+
+    return sum(np.clip(np.minimum(upper, end + shift)
+                       - np.maximum(lower, start + shift), 0., None)
+               for shift in shifts)
+
+
+def _get_mask(mask: Union[str, xr.DataArray, np.ndarray],
+              fraction: Optional[xr.DataArray],
+              threshold: float) -> np.ndarray:
+    # the (lat, lon) weight factor of a region mask
+    if isinstance(mask, str):
+        if mask not in ['land', 'ocean']:
+            raise ValueError(f'Unsupported mask {mask!r}, use "land", "ocean" '
+                             'or an array.')
+        values = fraction.values >= threshold
+        return values if mask == 'land' else ~values
+
+    if isinstance(mask, xr.DataArray):
+        mask = mask.transpose('lat', 'lon').values
+
+    return np.nan_to_num(np.asarray(mask, dtype=np.float64))
+
+
+def _get_key(grid: xr.Dataset,
+             regions: Dict[str, Region],
+             fraction: Optional[xr.DataArray],
+             threshold: float) -> str:
+    # a hash of the grid fingerprint, the regions (with the values of their
+    # masks) and the land fraction
+    h = hashlib.sha1()
+    h.update(opener.grid_fingerprint(grid, bounds=True).encode())
+    for name, region in regions.items():
+        h.update(name.encode())
+        for key in sorted(region):
+            value = region[key]
+            if isinstance(value, (xr.DataArray, np.ndarray)):
+                value = np.ascontiguousarray(np.asarray(value)).tobytes()
+            h.update(f'{key}={value!r}'.encode())
+    if fraction is not None:
+        h.update(np.ascontiguousarray(fraction.values).tobytes())
+    h.update(str(threshold).encode())
+
+    return h.hexdigest()
+
+
+def get_weights(obj: Union[xr.Dataset, xr.DataArray],
+                regions: Dict[str, Region],
+                fraction: Optional[xr.DataArray] = None,
+                threshold: float = 0.5) -> RegionWeights:
+    """Get the area weight matrix of regions on the grid of the data.
+
+    Parameters
+    ----------
+    obj : Union[xr.Dataset, xr.DataArray]
+        The data on the grid (its lat and lon, and their bounds if it is a
+        dataset that has them). The data itself is never read.
+    regions : Dict[str, Region]
+        The regions, by name. Each region has optional "lat" (south, north)
+        and "lon" (west, east) bounds, by default the globe, and an optional
+        "mask": "land", "ocean" or a (lat, lon) array of weight factors (e.g.,
+        a boolean mask).
+    fraction : Optional[xr.DataArray], optional
+        The land fraction of the grid for the "land" and "ocean" masks, by
+        default None (``landsea.generate_fraction`` of the grid, if needed).
+    threshold : float, optional
+        The land fraction of land cells, by default 0.5.
+
+    Returns
+    -------
+    RegionWeights
+        The region names and the sparse (n_regions, nlat * nlon) matrix of the
+        area weights of each region, with cells in (lat, lon) order.
+    """
+    import scipy.sparse
+
+    grid = landsea.get_grid(obj)
+    if fraction is None and any(isinstance(r.get('mask'), str)
+                                for r in regions.values()):
+        fraction = landsea.generate_fraction(grid)
+    if fraction is not None:
+        fraction = fraction.transpose('lat', 'lon')
+
+    key = _get_key(grid, regions, fraction, threshold)
+    weights = arraycache.get(_weights, key)
+    if weights is not None:
+        return weights
+
+    # the area of a cell is proportional to the difference of the sines of
+    # its lat edges times the difference of its lon edges
+    lat_lower, lat_upper = landsea.get_bounds(grid, 'lat')
+    lon_lower, lon_upper = landsea.get_bounds(grid, 'lon')
+    sin_lower, sin_upper = np.sin(np.deg2rad(lat_lower)), np.sin(np.deg2rad(lat_upper))
+    nlat, nlon = len(lat_lower), len(lon_lower)
+
+    rows, cols, values = [], [], []
+    for idx, region in enumerate(regions.values()):
+        south, north = region.get('lat', (-90., 90.))
+        west, east = region.get('lon', (0., 360.))
+        lat_weights = _overlap(sin_lower, sin_upper, np.sin(np.deg2rad(south)),
+                               np.sin(np.deg2rad(north)))
+        if 'lon' in region:
+            lon_weights = _overlap(lon_lower, lon_upper, west, east, period=360.)
+        else:
+            lon_weights = lon_upper - lon_lower
+
+        area = np.outer(lat_weights, lon_weights)
+        if region.get('mask') is not None:
+            area = area * _get_mask(region['mask'], fraction, threshold)
+
+        cells = np.flatnonzero(area)
+        rows.append(np.full(len(cells), idx))
+        cols.append(cells)
+        values.append(area.ravel()[cells])
+
+    matrix = scipy.sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(regions), nlat * nlon),
+    )
+    weights = RegionWeights(list(regions), matrix)
+
+    return arraycache.put(_weights, key, weights, MEMORY_CACHE_SIZE)
+
+
+def _average_cells(x: np.ndarray,
+                   matrix,
+                   skipna: bool = True,
+                   ndim: int = 2) -> np.ndarray:
+    # the weighted averages of the fields of x (on the last ndim axes, e.g.
+    # lat and lon) over every region, vectorized over all fields
+    shape = x.shape[:-ndim]
+    x = x.reshape(-1, int(np.prod(x.shape[-ndim:])))
+
+    missing = np.isnan(x) if skipna and x.dtype.kind == 'f' else None
+    if missing is not None and missing.any():
+        total = matrix @ np.where(missing, 0., x).T
+        area = matrix @ (~missing).T.astype(np.float64)
+    else:
+        total = matrix @ x.T
+        area = np.asarray(matrix.sum(axis=1))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = total / area
+
+    return out.T.reshape(shape + (matrix.shape[0],))
+
+
+def average(data: xr.DataArray,
+            regions: Union[Dict[str, Region], RegionWeights],
+            fraction: Optional[xr.DataArray] = None,
+            threshold: float = 0.5,
+            skipna: bool = True,
+            region_dim: str = 'region',
+            dims: Tuple[str, ...] = ('lat', 'lon')) -> xr.DataArray:
+    """Average data over many regions in one pass.
+
+    Parameters
+    ----------
+    data : xr.DataArray
+        The data on lat and lon (any other dimensions, NumPy or Dask). The
+        lat and lon of a Dask array must be in one chunk each (they are
+        rechunked if not).
+    regions : Union[Dict[str, Region], RegionWeights]
+        The regions (see ``get_weights``) or their weights.
+    fraction : Optional[xr.DataArray], optional
+        The land fraction for the "land" and "ocean" masks, by default None
+        (see ``get_weights``).
+    threshold : float, optional
+        The land fraction of land cells, by default 0.5.
+    skipna : bool, optional
+        Whether to skip missing values (the weights of each region are
+        renormalized over the valid cells of each field), by default True.
+    region_dim : str, optional
+        The name of the region dimension of the result, by default "region".
+    dims : Tuple[str, ...], optional
+        The cell dimensions of data, in the cell order of the weight matrix,
+        by default ("lat", "lon"). Weights built for other grids (e.g., the
+        faces of an unstructured grid, see ``unstructured.get_weights``)
+        are applied on their own dimensions.
+
+    Returns
+    -------
+    xr.DataArray
+        The (float64) area-weighted mean of every region, with region_dim in
+        place of the cell dimensions. Regions without any (valid) cell are
+        NaN.
+    """
+    if not isinstance(regions, RegionWeights):
+        regions = get_weights(data, regions, fraction=fraction,
+                              threshold=threshold)
+
+    if data.chunks is not None:
+        data = data.chunk({dim: -1 for dim in dims})
+
+    result = xr.apply_ufunc(
+        _average_cells,
+        data,
+        input_core_dims=[list(dims)],
+        output_core_dims=[[region_dim]],
+        kwargs={'matrix': regions.matrix, 'skipna': skipna, 'ndim': len(dims)},
+        dask='parallelized',
+        output_dtypes=[np.float64],
+        dask_gufunc_kwargs={'output_sizes': {region_dim: len(regions.names)}},
+        keep_attrs=True,
+    )
+
+    return result.assign_coords({region_dim: regions.names})
+
+
+def clear_cache():
+    """Drop the weight matrices kept in memory."""
+    arraycache.clear(_weights)
+
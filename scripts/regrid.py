@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+"""
+Horizontal regridding with a persistent cache of xESMF weights.
+
+Every ``ds.regridder.horizontal(..., tool='xesmf')`` call generates the ESMF
+weights from scratch, although pipelines regrid many variables and files from
+a few model grids to a few analysis grids. Here the weights are cached:
+
+    - the cache key is a hash of the source and destination grid
+      fingerprints (their coordinate and bounds values), the method, the
+      periodic flag and any other ``xesmf.Regridder`` options
+    - each entry is the sparse weight matrix in a compact .npz file (int32
+      row/col indices and float64 weights), written atomically so several
+      processes can share a cache directory (see arraycache)
+    - the cache directory is bounded to max_bytes with LRU eviction (hits
+      touch the file mtime, the oldest files are removed first)
+    - the most recently used weights are also kept in memory
+
+horizontal_batch regrids many variables on a shared grid in one pass: the
+variables are stacked and the weights applied with one sparse matrix multiply
+per block of time steps, instead of one regridder call per variable.
+
+cache_info reports the hits and misses of this process and the weight
+generation time they saved.
+
+Example Usage:
+-------------
+    import regrid
+    import xcdat as xc
+
+    ds = xc.open_dataset(dpath)
+    output_grid = xc.create_uniform_grid(-88.75, 88.76, 2.5, 1.25, 360., 2.5)
+    ds_out = regrid.horizontal(ds, 'TS', output_grid, method='bilinear',
+                               periodic=True)
+    print(regrid.cache_info())
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import xarray as xr
+
+import arraycache
+import opener
+
+# The default weight cache directory.
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+                             'xcdat-validation', 'regrid-weights')
+
+# The default maximum size (in bytes) of the weight cache directory.
+MAX_CACHE_BYTES = 2 * 1024**3
+
+# The maximum number of weight matrices kept in memory.
+MEMORY_CACHE_SIZE = 8
+
+# The default number of time steps per matrix multiply in horizontal_batch
+# (for in-memory data).
+TIME_BLOCK = 1
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'saved', 'entries',
+                                     'nbytes'])
+
+# A weight matrix: (row, col, S, shape), with 0-based row (destination) and
+# col (source) indices.
+Weights = Tuple[np.ndarray, np.ndarray, np.ndarray, Tuple[int, int]]
+
+_weights = arraycache.memory_cache()
+_stats = {'hits': 0, 'misses': 0, 'saved': 0.0}
+_stats_lock = threading.Lock()
+
+
+def get_key(input_grid: xr.Dataset,
+            output_grid: xr.Dataset,
+            method: str,
+            periodic: bool = False,
+            **kwargs: Any) -> str:
+    """
+    key = get_key(input_grid, output_grid, method, periodic).
+
+    Returns the cache key of the weights between two grids, for a method,
+    periodic flag and other ``xesmf.Regridder`` options.
+    """
+    fingerprints = [opener.grid_fingerprint(grid, bounds=True)
+                    for grid in [input_grid, output_grid]]
+    if None in fingerprints:
+        raise ValueError('The grids must have lat and lon coordinates.')
+
+    options = json.dumps(sorted(kwargs.items()), default=str)
+    h = hashlib.sha1()
+    for part in fingerprints + [method, str(bool(periodic)), options]:
+        h.update(part.encode())
+        h.update(b'\0')
+
+    return h.hexdigest()
+
+
+def to_xesmf_grid(ds: xr.Dataset) -> xr.Dataset:
+    """
+    grid = to_xesmf_grid(ds).
+
+    Returns the grid of a rectilinear dataset in the layout xESMF expects,
+    with the cell edges as 1D "lat_b" and "lon_b" (if the dataset has lat
+    and lon bounds).
+    """
+    coords = {'lat': ('lat', ds.lat.values), 'lon': ('lon', ds.lon.values)}
+    for key in ['lat', 'lon']:
+        bounds = ds[key].attrs.get('bounds', f'{key}_bnds')
+        if bounds in ds.variables:
+            b = ds[bounds].values
+            coords[f'{key}_b'] = (f'{key}_b', np.append(b[:, 0], b[-1, 1]))
+
+    return xr.Dataset(coords=coords)
+
+
+def _get_path(cache: str, key: str) -> str:
+    return os.path.join(cache, key + '.npz')
+
+
+def _read_weights(cache: str, key: str) -> Optional[Tuple[Weights, float]]:
+    # None if the entry is missing, or was evicted or corrupted by another
+    # process
+    path = _get_path(cache, key)
+    arrays = arraycache.load_npz(path, ['row', 'col', 'S', 'shape', 'seconds'])
+    if arrays is None:
+        return None
+
+    # touch the entry, so it is evicted last
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    weights = (arrays['row'], arrays['col'], arrays['S'],
+               tuple(int(n) for n in arrays['shape']))
+    return weights, float(arrays['seconds'])
+
+
+def _write_weights(cache: str, key: str, weights: Weights, seconds: float,
+                   max_bytes: int):
+    row, col, S, shape = weights
+    arraycache.save_npz(_get_path(cache, key), {
+        'row': row.astype(np.int32),
+        'col': col.astype(np.int32),
+        'S': S.astype(np.float64),
+        'shape': np.array(shape),
+        'seconds': np.array(seconds),
+    })
+
+    evict(cache, max_bytes)
+
+
+def evict(cache: str = DEFAULT_CACHE, max_bytes: int = MAX_CACHE_BYTES):
+    """
+    evict(cache, max_bytes).
+
+    Removes the least recently used weight files of a cache directory until
+    it is no larger than max_bytes.
+    """
+    entries = []
+    for fn in os.listdir(cache):
+        if not fn.endswith('.npz'):
+            continue
+        try:
+            st = os.stat(os.path.join(cache, fn))
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, fn))
+
+    nbytes = sum(size for _, size, _ in entries)
+    for _, size, fn in sorted(entries):
+        if nbytes <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache, fn))
+        except FileNotFoundError:
+            pass
+        nbytes -= size
+
+
+def get_weights(input_grid: xr.Dataset,
+                output_grid: xr.Dataset,
+                method: str,
+                periodic: bool = False,
+                cache: Optional[str] = DEFAULT_CACHE,
+                max_bytes: int = MAX_CACHE_BYTES,
+                **kwargs: Any) -> Weights:
+    """Get the xESMF weights between two grids, from the cache if possible.
+
+    Parameters
+    ----------
+    input_grid : xr.Dataset
+        The source grid (a dataset with lat and lon and their bounds).
+    output_grid : xr.Dataset
+        The destination grid.
+    method : str
+        The xESMF method (e.g., "bilinear", "conservative_normed").
+    periodic : bool, optional
+        Whether the source grid is periodic in longitude, by default False.
+    cache : Optional[str], optional
+        The cache directory, by default ``DEFAULT_CACHE``. If None, the
+        weights are only cached in memory.
+    max_bytes : int, optional
+        The maximum size of the cache directory, by default
+        ``MAX_CACHE_BYTES``.
+    **kwargs : Any
+        Other ``xesmf.Regridder`` options (e.g., extrap_method), which are
+        part of the cache key.
+
+    Returns
+    -------
+    Weights
+        The 0-based row (destination) and col (source) indices, the weights
+        and the (n_out, n_in) shape of the weight matrix.
+    """
+    key = get_key(input_grid, output_grid, method, periodic, **kwargs)
+
+    entry = arraycache.get(_weights, key)
+    if entry is None and cache is not None:
+        entry = _read_weights(cache, key)
+
+    if entry is not None:
+        weights, seconds = entry
+        with _stats_lock:
+            _stats['hits'] += 1
+            _stats['saved'] += seconds
+    else:
+        import xesmf
+
+        start = time.perf_counter()
+        regridder = xesmf.Regridder(to_xesmf_grid(input_grid),
+                                    to_xesmf_grid(output_grid), method,
+                                    periodic=periodic, **kwargs)
+        w = regridder.weights.data
+        weights = (w.coords[0], w.coords[1], w.data, tuple(w.shape))
+        seconds = time.perf_counter() - start
+
+        if cache is not None:
+            _write_weights(cache, key, weights, seconds, max_bytes)
+        with _stats_lock:
+            _stats['misses'] += 1
+
+    arraycache.put(_weights, key, (weights, seconds), MEMORY_CACHE_SIZE)
+
+    return weights
+
+
+def get_regridder(input_grid: xr.Dataset,
+                  output_grid: xr.Dataset,
+                  method: str,
+                  periodic: bool = False,
+                  cache: Optional[str] = DEFAULT_CACHE,
+                  **kwargs: Any):
+    """
+    regridder = get_regridder(input_grid, output_grid, method).
+
+    Returns an ``xesmf.Regridder`` built from cached weights (see
+    get_weights), which is applied like any other regridder.
+    """
+    import sparse
+    import xesmf
+
+    row, col, S, shape = get_weights(input_grid, output_grid, method,
+                                     periodic=periodic, cache=cache, **kwargs)
+    weights = sparse.COO(np.stack([row, col]), S, shape=shape)
+
+    return xesmf.Regridder(to_xesmf_grid(input_grid), to_xesmf_grid(output_grid),
+                           method, periodic=periodic, weights=weights, **kwargs)
+
+
+def horizontal(ds: xr.Dataset,
+               var_key: str,
+               output_grid: xr.Dataset,
+               method: str = 'bilinear',
+               periodic: bool = False,
+               cache: Optional[str] = DEFAULT_CACHE,
+               **kwargs: Any) -> xr.Dataset:
+    """Regrid a variable with cached xESMF weights.
+
+    Like ``ds.regridder.horizontal(var_key, output_grid, tool='xesmf')``, the
+    result has the regridded variable and the lat/lon (and bounds) of the
+    output grid.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        The dataset with the variable to regrid.
+    var_key : str
+        The variable to regrid.
+    output_grid : xr.Dataset
+        The destination grid.
+    method : str, optional
+        The xESMF method, by default "bilinear".
+    periodic : bool, optional
+        Whether the source grid is periodic in longitude, by default False.
+    cache : Optional[str], optional
+        The cache directory, by default ``DEFAULT_CACHE``.
+    **kwargs : Any
+        Other ``xesmf.Regridder`` options.
+
+    Returns
+    -------
+    xr.Dataset
+        The regridded dataset.
+    """
+    regridder = get_regridder(ds, output_grid, method, periodic=periodic,
+                              cache=cache, **kwargs)
+    output = regridder(ds[var_key], keep_attrs=True)
+
+    return _to_dataset(ds, output_grid, {var_key: output})
+
+
+def horizontal_batch(ds: xr.Dataset,
+                     var_keys: List[str],
+                     output_grid: xr.Dataset,
+                     method: str = 'bilinear',
+                     periodic: bool = False,
+                     cache: Optional[str] = DEFAULT_CACHE,
+                     time_block: int = TIME_BLOCK,
+                     **kwargs: Any) -> xr.Dataset:
+    """Regrid many variables on a shared grid in one pass.
+
+    The variables are stacked into one (time, field, cell) array, where the
+    fields are the variables and their other (e.g., level) dimensions, and
+    the cached weights are applied with one sparse matrix multiply per block
+    of time steps. The grid is fingerprinted and the weights are looked up
+    once for all variables. Like xESMF (with skipna=False), a missing value
+    in a source cell makes the destination cells it contributes to missing.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        The dataset with the variables to regrid.
+    var_keys : List[str]
+        The variables to regrid (with lat and lon dimensions).
+    output_grid : xr.Dataset
+        The destination grid.
+    method : str, optional
+        The xESMF method, by default "bilinear".
+    periodic : bool, optional
+        Whether the source grid is periodic in longitude, by default False.
+    cache : Optional[str], optional
+        The cache directory, by default ``DEFAULT_CACHE``.
+    time_block : int, optional
+        The number of time steps per matrix multiply for in-memory data, by
+        default ``TIME_BLOCK`` (Dask arrays use their time chunks).
+    **kwargs : Any
+        Other ``xesmf.Regridder`` options.
+
+    Returns
+    -------
+    xr.Dataset
+        The regridded dataset, with every variable of var_keys.
+    """
+    import dask.array as da
+    import scipy.sparse
+
+    row, col, S, shape = get_weights(ds, output_grid, method, periodic=periodic,
+                                     cache=cache, **kwargs)
+    weights = scipy.sparse.csr_matrix((S, (row, col)), shape=shape)
+    nlat, nlon = output_grid.sizes['lat'], output_grid.sizes['lon']
+    n_in = ds.sizes['lat'] * ds.sizes['lon']
+
+    # variables with and without a time dimension are stacked separately
+    batches: Dict[bool, List[str]] = {}
+    for key in var_keys:
+        batches.setdefault('time' in ds[key].dims, []).append(key)
+
+    outputs = {}
+    for has_time, keys in batches.items():
+        fields = []
+        for key in keys:
+            var = ds[key].variable
+            other = [d for d in var.dims if d not in ['time', 'lat', 'lon']]
+            order = (['time'] if has_time else []) + other + ['lat', 'lon']
+            data = var.transpose(*order).data
+            if not has_time:
+                data = data[None]
+            fields.append(data.reshape(data.shape[0], -1, n_in))
+
+        lazy = any(isinstance(f, da.Array) for f in fields)
+        if lazy:
+            stacked = da.concatenate([da.asarray(f) for f in fields], axis=1)
+            stacked = stacked.rechunk({1: -1, 2: -1})
+            result = stacked.map_blocks(
+                _apply_weights, weights,
+                chunks=(stacked.chunks[0], stacked.chunks[1], (shape[0],)),
+                dtype=np.result_type(stacked.dtype, weights.dtype),
+            )
+        else:
+            # stack one block of time steps at a time, to bound the copies
+            nt, nfield = fields[0].shape[0], sum(f.shape[1] for f in fields)
+            dtype = np.result_type(*[f.dtype for f in fields], np.float32)
+            result = np.empty((nt, nfield, shape[0]), dtype=dtype)
+            for i in range(0, nt, time_block):
+                block = np.concatenate([f[i:i + time_block] for f in fields], axis=1)
+                result[i:i + time_block] = _apply_weights(block, weights)
+
+        # split the fields back into their variables
+        start = 0
+        for key, data in zip(keys, fields):
+            var = ds[key]
+            other = [d for d in var.dims if d not in ['time', 'lat', 'lon']]
+            dims = (['time'] if has_time else []) + other + ['lat', 'lon']
+            out = result[:, start:start + data.shape[1]]
+            start += data.shape[1]
+            out = out.reshape(
+                [out.shape[0]] + [var.sizes[d] for d in other] + [nlat, nlon]
+            )
+            if not has_time:
+                out = out[0]
+            if var.dtype.kind == 'f':
+                out = out.astype(var.dtype, copy=False)
+
+            coords = {k: c for k, c in var.coords.items()
+                      if not {'lat', 'lon'} & set(c.dims)}
+            outputs[key] = xr.DataArray(out, dims=dims, coords=coords,
+                                        attrs=var.attrs).transpose(*var.dims)
+
+    return _to_dataset(ds, output_grid, outputs)
+
+
+def _apply_weights(block: np.ndarray, weights) -> np.ndarray:
+    # (time, field, cell_in) -> (time, field, cell_out) in one matrix multiply
+    nt, nfield, n_in = block.shape
+    out = weights @ block.reshape(nt * nfield, n_in).T
+
+    return np.ascontiguousarray(out.T).reshape(nt, nfield, weights.shape[0])
+
+
+def _to_dataset(ds: xr.Dataset,
+                output_grid: xr.Dataset,
+                outputs: Dict[str, xr.DataArray]) -> xr.Dataset:
+    # the regridded variables on the output grid, with the other variables
+    # that do not depend on lat/lon (e.g., time bounds)
+    keep = [key for key in ds.data_vars
+            if not {'lat', 'lon'} & set(ds[key].dims)]
+    ds_out = ds[keep].drop_dims(['lat', 'lon'], errors='ignore')
+    ds_out = ds_out.assign_coords(lat=output_grid.lat, lon=output_grid.lon)
+    for key in ['lat', 'lon']:
+        bounds = output_grid[key].attrs.get('bounds', f'{key}_bnds')
+        if bounds in output_grid.variables:
+            ds_out[bounds] = output_grid[bounds]
+
+    return ds_out.assign({
+        key: output.assign_coords(lat=output_grid.lat, lon=output_grid.lon)
+        for key, output in outputs.items()
+    })
+
+
+def cache_info(cache: Optional[str] = DEFAULT_CACHE) -> CacheInfo:
+    """
+    info = cache_info(cache).
+
+    Returns the weight cache hits and misses of this process, the weight
+    generation time (in seconds) the hits saved, and the number of entries
+    and bytes in the cache directory.
+    """
+    entries, nbytes = 0, 0
+    if cache is not None and os.path.isdir(cache):
+        for fn in os.listdir(cache):
+            if fn.endswith('.npz'):
+                entries += 1
+                nbytes += os.path.getsize(os.path.join(cache, fn))
+
+    with _stats_lock:
+        return CacheInfo(_stats['hits'], _stats['misses'], _stats['saved'],
+                         entries, nbytes)
+
+
+def clear_cache(cache: Optional[str] = None):
+    """
+    clear_cache(cache).
+
+    Clears the in-memory weights and the hit statistics, and removes the
+    entries of a cache directory if one is given.
+    """
+    arraycache.clear(_weights)
+    with _stats_lock:
+        _stats.update(hits=0, misses=0, saved=0.0)
+
+    arraycache.remove_files(cache)
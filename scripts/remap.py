@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+In-process application of precomputed ESMF/NCO map files (e.g., the E3SM
+ne30pg2 to 180x360 "aave" maps of ncremap).
+
+demos/2024-e3sm-workshop/xcdat_practicum_notebook.ipynb shells out to
+``ncremap -m map_ne30pg2_to_cmip6_180x360_aave.20200201.nc`` for every
+variable, which writes remapped copies of the h0 files to disk, then reopens
+them with ``xc.open_mfdataset('remapped')``: two full disk round-trips
+before any analysis. Here:
+
+    - read_map reads the sparse weights (S, row, col) of a map file once,
+      with its destination grid (lat, lon and their bounds from the corners
+      of the map), and keeps them in memory by map file (path, size and
+      mtime)
+    - apply_map applies them to the variables of a dataset on the source
+      grid (the ncol faces of E3SM output, or lat and lon) with
+      xr.apply_ufunc: one sparse matrix multiply per chunk, so the time
+      chunks of an h0 archive are remapped lazily and in parallel by Dask
+    - the result is a dataset on the destination grid, with bounds, that
+      feeds ``ds.spatial.average`` and ``ds.temporal.*`` directly, without
+      writing anything to disk
+
+Missing values are handled like ncremap: they contribute nothing to the
+destination cells, and cells without any valid source are missing. With
+rnr_thr (like ``ncremap --rnr_thr``), cells are renormalized by their valid
+weight fraction if it is at least rnr_thr, and missing otherwise.
+
+Example Usage:
+-------------
+    import remap
+    import xarray as xr
+    import xcdat as xc  # noqa: F401
+
+    ds = xr.open_mfdataset('*.eam.h0.*.nc', combine='nested', concat_dim='time',
+                           data_vars='minimal', coords='minimal',
+                           compat='override', chunks={'time': 12})
+    ds_remap = remap.apply_map(ds, 'map_ne30pg2_to_cmip6_180x360_aave.nc',
+                               var_keys=['TREFHT'])
+    gmean = ds_remap.spatial.average('TREFHT')
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from collections import namedtuple
+from typing import List, Optional, Tuple
+
+import numpy as np
+import xarray as xr
+
+import arraycache
+import unstructured
+
+# The maximum number of map files kept in memory.
+MEMORY_CACHE_SIZE = 4
+
+# A map file: the sparse (n_b, n_a) weight matrix, the shapes of the source
+# and destination grids (C order, e.g., (nlat, nlon) or (ncol,)) and the
+# destination grid (with lat and lon, and their bounds if it is rectilinear).
+MapFile = namedtuple('MapFile', ['matrix', 'src_shape', 'dst_shape', 'dst_grid'])
+
+_maps = arraycache.memory_cache()
+
+
+def _get_key(map_path: str) -> str:
+    st = os.stat(map_path)
+    h = hashlib.sha1()
+    h.update(str((os.path.abspath(map_path), st.st_size, st.st_mtime)).encode())
+
+    return h.hexdigest()
+
+
+def _grid_shape(ds: xr.Dataset, side: str, dim: str) -> Tuple[int, ...]:
+    # the grid dims of map files are in Fortran order, e.g., (nlon, nlat)
+    key = f'{side}_grid_dims'
+    if key in ds:
+        return tuple(int(n) for n in ds[key].values[::-1])
+
+    return (ds.sizes[dim],)
+
+
+def _to_bounds(centers: np.ndarray,
+               corners: np.ndarray,
+               period: Optional[float] = None) -> np.ndarray:
+    # the (n, 2) bounds of an axis from the corners of its cells (unwrapped
+    # around the centers, e.g., for cells crossing the prime meridian)
+    if period is not None:
+        corners = centers[:, None] + ((corners - centers[:, None] + period / 2)
+                                      % period) - period / 2
+
+    return np.stack([corners.min(axis=1), corners.max(axis=1)], axis=1)
+
+
+def _to_grid(ds: xr.Dataset, shape: Tuple[int, ...]) -> xr.Dataset:
+    # the destination grid of a map file, as a dataset like the ones of
+    # ncremap (lat and lon with bounds for rectilinear grids)
+    lat, lon = ds['yc_b'].values, ds['xc_b'].values
+    if len(shape) == 1:
+        return xr.Dataset(coords={
+            'lat': ('ncol', lat, {'units': 'degrees_north'}),
+            'lon': ('ncol', lon, {'units': 'degrees_east'}),
+        })
+
+    lat, lon = lat.reshape(shape)[:, 0], lon.reshape(shape)[0]
+    lat_bnds = _to_bounds(lat, ds['yv_b'].values.reshape(shape + (-1,))[:, 0])
+    lon_bnds = _to_bounds(lon, ds['xv_b'].values.reshape(shape + (-1,))[0],
+                          period=360.)
+
+    return xr.Dataset(
+        {'lat_bnds': (('lat', 'nbnd'), lat_bnds),
+         'lon_bnds': (('lon', 'nbnd'), lon_bnds)},
+        coords={
+            'lat': ('lat', lat, {'axis': 'Y', 'units': 'degrees_north',
+                                 'bounds': 'lat_bnds'}),
+            'lon': ('lon', lon, {'axis': 'X', 'units': 'degrees_east',
+                                 'bounds': 'lon_bnds'}),
+        },
+    )
+
+
+def read_map(map_path: str) -> MapFile:
+    """
+    map_file = read_map(map_path).
+
+    Returns the weights and destination grid of an ESMF/NCO map file (S, row
+    and col with 1-based indices, and the grid variables of the destination,
+    xc_b, yc_b, xv_b and yv_b). Map files are read once and kept in memory.
+    """
+    import scipy.sparse
+
+    key = _get_key(map_path)
+    map_file = arraycache.get(_maps, key)
+    if map_file is not None:
+        return map_file
+
+    with xr.open_dataset(map_path) as ds:
+        src_shape = _grid_shape(ds, 'src', 'n_a')
+        dst_shape = _grid_shape(ds, 'dst', 'n_b')
+        matrix = scipy.sparse.csr_matrix(
+            (ds['S'].values.astype(np.float64),
+             (ds['row'].values.astype(np.int64) - 1,
+              ds['col'].values.astype(np.int64) - 1)),
+            shape=(int(np.prod(dst_shape)), int(np.prod(src_shape))),
+        )
+        dst_grid = _to_grid(ds, dst_shape)
+
+    map_file = MapFile(matrix, src_shape, dst_shape, dst_grid)
+
+    return arraycache.put(_maps, key, map_file, MEMORY_CACHE_SIZE)
+
+
+def _remap_cells(x: np.ndarray,
+                 matrix,
+                 dst_shape: Tuple[int, ...],
+                 ndim: int = 1,
+                 rnr_thr: Optional[float] = None) -> np.ndarray:
+    # the remapped fields of x (on the last ndim axes, the source cells),
+    # vectorized over all fields
+    shape = x.shape[:-ndim]
+    x = x.reshape(-1, int(np.prod(x.shape[-ndim:])))
+
+    missing = np.isnan(x) if x.dtype.kind == 'f' else None
+    if missing is not None and missing.any():
+        out = matrix @ np.where(missing, 0., x).T
+        valid = matrix @ (~missing).T.astype(np.float64)
+        if rnr_thr is None:
+            out[valid == 0.] = np.nan
+        else:
+            total = np.asarray(matrix.sum(axis=1))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                fraction = valid / total
+                out = np.where(fraction >= max(rnr_thr, np.finfo(float).tiny),
+                               out / fraction, np.nan)
+    else:
+        out = matrix @ x.T
+    # destination cells outside the source grid (e.g., frac_b = 0)
+    out[np.diff(matrix.indptr) == 0] = np.nan
+
+    return out.T.reshape(shape + dst_shape)
+
+
+def apply_map(ds: xr.Dataset,
+              map_path: str,
+              var_keys: Optional[List[str]] = None,
+              src_dims: Optional[Tuple[str, ...]] = None,
+              rnr_thr: Optional[float] = None) -> xr.Dataset:
+    """Remap the variables of a dataset with a precomputed map file.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        The dataset on the source grid of the map file (NumPy or Dask).
+    map_path : str
+        The ESMF/NCO map file (e.g., map_ne30pg2_to_cmip6_180x360_aave.nc).
+    var_keys : Optional[List[str]], optional
+        The variables to remap, by default every data variable on the source
+        grid (like ncremap without -v).
+    src_dims : Optional[Tuple[str, ...]], optional
+        The source grid dimensions of ds, in the cell order of the map file,
+        by default the one of ``unstructured.FACE_DIMS`` for unstructured
+        source grids, or ("lat", "lon").
+    rnr_thr : Optional[float], optional
+        The renormalization threshold of the valid weight fraction of the
+        destination cells, by default None (no renormalization, see above).
+
+    Returns
+    -------
+    xr.Dataset
+        The (lazy, for Dask data) remapped variables on the destination grid,
+        with its lat and lon (and bounds), and the variables of ds that are
+        not on the source grid (e.g., time_bnds).
+    """
+    map_file = read_map(map_path)
+    if src_dims is None:
+        if len(map_file.src_shape) == 2:
+            src_dims = ('lat', 'lon')
+        else:
+            src_dims = tuple(dim for dim in unstructured.FACE_DIMS if dim in ds.dims)[:1]
+            if not src_dims:
+                raise ValueError(f'No face dimension ({unstructured.FACE_DIMS}) in '
+                                 f'{tuple(ds.dims)}, use src_dims.')
+
+    src_shape = tuple(ds.sizes[dim] for dim in src_dims)
+    if int(np.prod(src_shape)) != map_file.matrix.shape[1]:
+        raise ValueError(f'The map file has {map_file.matrix.shape[1]} source '
+                         f'cells, but {src_dims} have {src_shape}.')
+
+    if var_keys is None:
+        var_keys = [key for key in ds.data_vars
+                    if set(src_dims) <= set(ds[key].dims)
+                    and key not in ['lat', 'lon', 'area']]
+
+    dst_grid = map_file.dst_grid
+    dst_dims = list(dst_grid['lat'].dims) + [dim for dim in dst_grid['lon'].dims
+                                              if dim not in dst_grid['lat'].dims]
+    outputs = {}
+    for key in var_keys:
+        data = ds[key]
+        if data.chunks is not None:
+            data = data.chunk({dim: -1 for dim in src_dims})
+        dtype = np.result_type(data.dtype, np.float32)
+
+        output = xr.apply_ufunc(
+            _remap_cells,
+            data.drop_vars([c for c in data.coords if set(src_dims) & set(ds[c].dims)]),
+            input_core_dims=[list(src_dims)],
+            output_core_dims=[dst_dims],
+            exclude_dims=set(src_dims) & set(dst_dims),
+            kwargs={'matrix': map_file.matrix, 'dst_shape': map_file.dst_shape,
+                    'ndim': len(src_dims), 'rnr_thr': rnr_thr},
+            dask='parallelized',
+            output_dtypes=[np.float64],
+            dask_gufunc_kwargs={'output_sizes': dict(zip(dst_dims,
+                                                         map_file.dst_shape))},
+            keep_attrs=True,
+        )
+        outputs[key] = output.astype(dtype, copy=False)
+
+    # the other variables that are not on the source grid (e.g., time bounds)
+    keep = [key for key in ds.data_vars if not set(src_dims) & set(ds[key].dims)]
+    ds_out = ds[keep].drop_dims(list(src_dims), errors='ignore')
+
+    return xr.merge([ds_out, dst_grid], compat='override').assign(outputs)
+
+
+def clear_cache():
+    """Drop the map files kept in memory."""
+    arraycache.clear(_maps)
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+Parsed unstructured grid topology, persisted as memory-mappable sidecars.
+
+Every ``ux.open_dataset(grid_path, data_path)`` call (see
+demos/2024-e3sm-workshop/) parses the grid file again: it rebuilds the face
+node connectivity and the node coordinates, and the face areas are derived
+from them again, although jobs open hundreds of data files against the same
+few grids (outCSne30, oQU480, ne30pg2). Here:
+
+    - read_topology parses a UGRID (e.g., outCSne30.grid.ug), MPAS (e.g.,
+      oQU480.grid.nc) or SCRIP (e.g., ne30pg2.nc, whose shared corners are
+      merged into nodes) grid file into a Topology: the node lon and lat,
+      the 0-based face node connectivity (padded with FILL_VALUE), the
+      number of nodes of each face, the face centers and the face areas.
+      It is the only grid file parser: read_vertices (used by
+      unstructured.face_areas) returns the face vertices of the same parse
+    - get_topology stores it once per grid file in a cache directory, as a
+      sidecar directory of .npy arrays and a manifest.json with the
+      fingerprint (path, size and mtime) of the grid file, written
+      atomically. Later calls (in any process) memory-map the arrays, so
+      opening a grid only reads the manifest; the pages of the arrays are
+      read when they are used
+    - open_grid and open_dataset build the uxarray Grid (and UxDataset) from
+      the cached topology instead of parsing the grid file
+
+Example Usage:
+-------------
+    import topology
+
+    topo = topology.get_topology('ne30pg2.nc')
+    print(topo.face_nodes.shape, topo.face_areas.sum())
+
+    uxds = topology.open_dataset('outCSne30.grid.ug', 'outCSne30.data.nc')
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import namedtuple
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import xarray as xr
+
+import arraycache
+
+# The default topology cache directory.
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+                             'xcdat-validation', 'topology')
+
+# The maximum number of topologies kept in memory.
+MEMORY_CACHE_SIZE = 8
+
+# The fill value of the face node connectivity (as in uxarray).
+FILL_VALUE = -1
+
+# The version of the sidecar layout (sidecars of other versions are rebuilt).
+VERSION = 1
+
+# The parsed topology of a grid: the node lon and lat (degrees), the 0-based
+# (n_face, max_nodes) face node connectivity, the number of nodes of each
+# face, the face centers lon and lat (degrees) and the face areas
+# (steradians).
+Topology = namedtuple('Topology', ['node_lon', 'node_lat', 'face_nodes',
+                                   'n_nodes', 'face_lon', 'face_lat',
+                                   'face_areas'])
+
+_topologies = arraycache.memory_cache()
+
+
+def _fingerprint(grid_path: str) -> Dict[str, Any]:
+    st = os.stat(grid_path)
+
+    return {'path': os.path.abspath(grid_path), 'size': st.st_size,
+            'mtime': st.st_mtime}
+
+
+def _get_key(fingerprint: Dict[str, Any]) -> str:
+    h = hashlib.sha1()
+    h.update(json.dumps(fingerprint, sort_keys=True).encode())
+
+    return h.hexdigest()
+
+
+def to_xyz(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    xyz = to_xyz(lat, lon).
+
+    Returns the Cartesian unit vectors (on the last axis) of lat and lon (in
+    degrees).
+    """
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon),
+                     np.sin(lat)], axis=-1)
+
+
+def polygon_areas(vertices: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    areas = polygon_areas(vertices, valid).
+
+    Returns the areas (steradians) of spherical polygons, from the (n_face,
+    max_vertices, 3) unit vectors of their vertices and whether each is
+    valid, as the sum of the fan of triangles from their first vertex.
+    """
+    # padded vertices are replaced by the previous valid one, so their
+    # triangles have no area
+    vertices = vertices.copy()
+    for k in range(1, vertices.shape[1]):
+        vertices[:, k] = np.where(valid[:, k, None], vertices[:, k],
+                                  vertices[:, k - 1])
+
+    a = vertices[:, 0]
+    areas = np.zeros(len(vertices))
+    for k in range(1, vertices.shape[1] - 1):
+        b, c = vertices[:, k], vertices[:, k + 1]
+        # Van Oosterom and Strackee: tan(E / 2) = |a.(b x c)| /
+        # (1 + a.b + b.c + c.a)
+        numerator = np.abs(np.einsum('ij,ij->i', a, np.cross(b, c)))
+        denominator = (1. + np.einsum('ij,ij->i', a, b)
+                       + np.einsum('ij,ij->i', b, c) + np.einsum('ij,ij->i', c, a))
+        areas += 2. * np.arctan2(numerator, denominator)
+
+    return areas
+
+
+def _to_lat_lon(xyz: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    lat = np.rad2deg(np.arcsin(np.clip(xyz[..., 2], -1., 1.)))
+    lon = np.rad2deg(np.arctan2(xyz[..., 1], xyz[..., 0])) % 360.
+
+    return lat, lon
+
+
+def _compact(face_nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # drop the padding and the repeated nodes of each face (e.g., the
+    # repeated last corner of pentagons in SCRIP files), keeping the order
+    # of the others, and move the padding to the end of each row
+    valid = face_nodes != FILL_VALUE
+    valid[:, 1:] &= face_nodes[:, 1:] != face_nodes[:, :-1]
+    n_nodes = valid.sum(axis=1)
+    last = face_nodes[np.arange(len(face_nodes)), np.maximum(n_nodes - 1, 0)]
+    valid[:, 1:] &= ~((face_nodes[:, 1:] == face_nodes[:, :1])
+                      & (face_nodes[:, 1:] == last[:, None]))
+
+    order = np.argsort(~valid, axis=1, kind='stable')
+    face_nodes = np.where(np.take_along_axis(valid, order, axis=1),
+                          np.take_along_axis(face_nodes, order, axis=1),
+                          FILL_VALUE)
+    n_nodes = valid.sum(axis=1)
+    face_nodes = face_nodes[:, :max(int(n_nodes.max(initial=0)), 1)]
+
+    return face_nodes.astype(np.int32), n_nodes.astype(np.int16)
+
+
+def _read_scrip(ds: xr.Dataset, merge: bool) -> Dict[str, np.ndarray]:
+    lat, lon = ds['grid_corner_lat'].values, ds['grid_corner_lon'].values
+    center_lat, center_lon = ds['grid_center_lat'].values, ds['grid_center_lon'].values
+    if ds['grid_corner_lat'].attrs.get('units', 'degrees').startswith('rad'):
+        lat, lon = np.rad2deg(lat), np.rad2deg(lon)
+        center_lat, center_lon = np.rad2deg(center_lat), np.rad2deg(center_lon)
+
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    if not merge:
+        # every corner is a node
+        face_nodes = np.where(valid, np.arange(lat.size).reshape(lat.shape),
+                              FILL_VALUE)
+        return {'node_lon': np.where(valid, lon, 0.).ravel(),
+                'node_lat': np.where(valid, lat, 0.).ravel(),
+                'face_nodes': face_nodes, 'face_lon': center_lon % 360.,
+                'face_lat': center_lat}
+
+    # merge the corners shared by faces into nodes: their unit vectors are
+    # rounded to 21 bits per component and packed into one int64 key
+    xyz = to_xyz(np.where(valid, lat, 0.), np.where(valid, lon, 0.))
+    scale = 2**20 - 1
+    rounded = np.round(xyz[valid] * scale).astype(np.int64) + scale
+    keys = (rounded[:, 0] << 42) | (rounded[:, 1] << 21) | rounded[:, 2]
+    _, index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    face_nodes = np.full(lat.shape, FILL_VALUE, dtype=np.int64)
+    face_nodes[valid] = inverse.ravel()
+    node_lat, node_lon = _to_lat_lon(xyz[valid][index])
+
+    return {'node_lon': node_lon, 'node_lat': node_lat,
+            'face_nodes': face_nodes, 'face_lon': center_lon % 360.,
+            'face_lat': center_lat}
+
+
+def _read_mpas(ds: xr.Dataset) -> Dict[str, np.ndarray]:
+    # MPAS meshes: 1-based vertices on cells (0 is padding), in radians
+    nodes = ds['verticesOnCell'].values.astype(np.int64)
+    n_edges = ds['nEdgesOnCell'].values
+    nodes = np.where((nodes > 0) & (np.arange(nodes.shape[1]) < n_edges[:, None]),
+                     nodes - 1, FILL_VALUE)
+
+    return {'node_lon': np.rad2deg(ds['lonVertex'].values) % 360.,
+            'node_lat': np.rad2deg(ds['latVertex'].values),
+            'face_nodes': nodes,
+            'face_lon': np.rad2deg(ds['lonCell'].values) % 360.,
+            'face_lat': np.rad2deg(ds['latCell'].values)}
+
+
+def _read_ugrid(ds: xr.Dataset, grid_path: str) -> Dict[str, np.ndarray]:
+    mesh = next((var for var in ds.variables.values()
+                 if var.attrs.get('cf_role') == 'mesh_topology'), None)
+    if mesh is None:
+        raise ValueError(f'{grid_path!r} is not a UGRID, MPAS or SCRIP grid '
+                         'file.')
+
+    node_lon, node_lat = mesh.attrs['node_coordinates'].split()[:2]
+    if 'lat' in node_lon.lower() or node_lon.lower().endswith('_y'):
+        node_lon, node_lat = node_lat, node_lon
+    faces = ds[mesh.attrs['face_node_connectivity']]
+    start = faces.attrs.get('start_index', 0)
+    fill = faces.encoding.get('_FillValue', faces.attrs.get('_FillValue', -1))
+    nodes = np.asarray(faces.values)
+    # a decoded _FillValue makes the connectivity float, with NaNs
+    valid = np.isfinite(nodes) & (nodes != fill) & (nodes >= start)
+    nodes = np.where(valid, nodes - start, FILL_VALUE).astype(np.int64)
+
+    out = {'node_lon': ds[node_lon].values % 360., 'node_lat': ds[node_lat].values,
+           'face_nodes': nodes}
+    if 'face_coordinates' in mesh.attrs:
+        face_lon, face_lat = mesh.attrs['face_coordinates'].split()[:2]
+        if 'lat' in face_lon.lower() or face_lon.lower().endswith('_y'):
+            face_lon, face_lat = face_lat, face_lon
+        out.update(face_lon=ds[face_lon].values % 360., face_lat=ds[face_lat].values)
+
+    return out
+
+
+def _parse(grid_path: str, merge: bool = True) -> Dict[str, np.ndarray]:
+    # the node coordinates, the face nodes and, if the file has them, the
+    # face centers of a grid file (with the shared corners of SCRIP files
+    # merged into nodes, unless only the vertices are needed)
+    with xr.open_dataset(grid_path) as ds:
+        if 'grid_corner_lat' in ds:
+            parsed = _read_scrip(ds, merge)
+        elif 'verticesOnCell' in ds:
+            parsed = _read_mpas(ds)
+        else:
+            parsed = _read_ugrid(ds, grid_path)
+
+    return parsed
+
+
+def _vertices(parsed: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    valid = parsed['face_nodes'] != FILL_VALUE
+    xyz = to_xyz(parsed['node_lat'], parsed['node_lon'])
+
+    return xyz[np.where(valid, parsed['face_nodes'], 0)], valid
+
+
+def read_vertices(grid_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    vertices, valid = read_vertices(grid_path).
+
+    Returns the (n_face, max_nodes, 3) Cartesian unit vectors of the nodes
+    of every face of a UGRID, MPAS or SCRIP grid file (without any cache),
+    and whether each is valid (faces with fewer nodes are padded).
+    """
+    return _vertices(_parse(grid_path, merge=False))
+
+
+def read_topology(grid_path: str) -> Topology:
+    """
+    topology = read_topology(grid_path).
+
+    Parses the topology of a UGRID, MPAS or SCRIP grid file (without any
+    cache). Face centers missing from the file are the normalized means of
+    the nodes of each face.
+    """
+    parsed = _parse(grid_path)
+    parsed['face_nodes'], parsed['n_nodes'] = _compact(parsed['face_nodes'])
+    vertices, valid = _vertices(parsed)
+    face_areas = polygon_areas(vertices, valid)
+
+    if 'face_lat' not in parsed:
+        centers = (vertices * valid[..., None]).sum(axis=1)
+        centers /= np.linalg.norm(centers, axis=-1, keepdims=True)
+        parsed['face_lat'], parsed['face_lon'] = _to_lat_lon(centers)
+
+    return Topology(
+        node_lon=np.asarray(parsed['node_lon'], dtype=np.float64),
+        node_lat=np.asarray(parsed['node_lat'], dtype=np.float64),
+        face_nodes=parsed['face_nodes'],
+        n_nodes=parsed['n_nodes'],
+        face_lon=np.asarray(parsed['face_lon'], dtype=np.float64),
+        face_lat=np.asarray(parsed['face_lat'], dtype=np.float64),
+        face_areas=face_areas,
+    )
+
+
+def _read_sidecar(path: str,
+                  fingerprint: Dict[str, Any],
+                  mmap: bool) -> Optional[Topology]:
+    # the topology of a sidecar, or None if it is missing, stale or corrupted
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != VERSION or manifest.get('grid') != fingerprint:
+            return None
+        return Topology(**{
+            field: np.load(os.path.join(path, f'{field}.npy'),
+                           mmap_mode='r' if mmap else None)
+            for field in Topology._fields
+        })
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_sidecar(path: str, fingerprint: Dict[str, Any], topology: Topology):
+    # write the arrays and then the manifest to a temporary directory and
+    # rename it, so readers in other processes never see a partial sidecar
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    os.makedirs(tmp, exist_ok=True)
+    for field, values in topology._asdict().items():
+        np.save(os.path.join(tmp, f'{field}.npy'), np.ascontiguousarray(values))
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump({'version': VERSION, 'grid': fingerprint,
+                   'n_face': len(topology.face_nodes),
+                   'n_node': len(topology.node_lon)}, f)
+
+    if os.path.exists(path):
+        # stale or corrupted
+        shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # written by another process in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def get_topology(grid_path: str,
+                 cache: Optional[str] = DEFAULT_CACHE,
+                 mmap: bool = True) -> Topology:
+    """Get the topology of a grid file, parsed once.
+
+    Parameters
+    ----------
+    grid_path : str
+        The grid file (UGRID, MPAS or SCRIP).
+    cache : Optional[str], optional
+        The cache directory, by default ``DEFAULT_CACHE``. If None, the
+        topology is only cached in memory.
+    mmap : bool, optional
+        Whether to memory-map the arrays of the sidecar (read-only), by
+        default True. If False, they are read into memory.
+
+    Returns
+    -------
+    Topology
+        The topology of the grid (with read-only arrays if they are
+        memory-mapped).
+    """
+    fingerprint = _fingerprint(grid_path)
+    key = _get_key(fingerprint)
+
+    topology = arraycache.get(_topologies, key)
+    if topology is not None:
+        return topology
+
+    path = None if cache is None else os.path.join(cache, key)
+    if path is not None and os.path.isdir(path):
+        topology = _read_sidecar(path, fingerprint, mmap)
+
+    if topology is None:
+        topology = read_topology(grid_path)
+        if path is not None:
+            os.makedirs(cache, exist_ok=True)
+            _write_sidecar(path, fingerprint, topology)
+            if mmap:
+                topology = _read_sidecar(path, fingerprint, mmap) or topology
+
+    return arraycache.put(_topologies, key, topology, MEMORY_CACHE_SIZE)
+
+
+def open_grid(grid_path: str, cache: Optional[str] = DEFAULT_CACHE):
+    """
+    grid = open_grid(grid_path, cache).
+
+    Returns the uxarray Grid of a grid file, built from its cached topology
+    (``ux.Grid.from_topology``) instead of parsing the grid file.
+    """
+    import uxarray as ux
+
+    topology = get_topology(grid_path, cache=cache)
+
+    return ux.Grid.from_topology(
+        node_lon=np.asarray(topology.node_lon),
+        node_lat=np.asarray(topology.node_lat),
+        face_node_connectivity=np.asarray(topology.face_nodes),
+        fill_value=FILL_VALUE,
+    )
+
+
+def open_dataset(grid_path: str,
+                 data_path: str,
+                 cache: Optional[str] = DEFAULT_CACHE,
+                 **kwargs: Any):
+    """
+    uxds = open_dataset(grid_path, data_path, cache, **kwargs).
+
+    Returns ``ux.open_dataset(grid_path, data_path)`` with the Grid of
+    ``open_grid`` (the kwargs are passed to ``xr.open_dataset``).
+    """
+    import uxarray as ux
+
+    return ux.UxDataset(xr.open_dataset(data_path, **kwargs),
+                        uxgrid=open_grid(grid_path, cache=cache))
+
+
+def clear_cache(cache: Optional[str] = None):
+    """
+    clear_cache(cache).
+
+    Clears the in-memory topologies, and removes the sidecars of a cache
+    directory if one is given.
+    """
+    arraycache.clear(_topologies)
+
+    if cache is not None and os.path.isdir(cache):
+        for fn in os.listdir(cache):
+            path = os.path.join(cache, fn)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Face-area weighted averages of data on unstructured (e.g., E3SM ne30pg2)
+grids.
+
+demos/2024-e3sm-workshop/uxarray_practicum_notebook.ipynb computes the face
+areas of the grid with uxarray (``grid.face_areas``) every time a grid is
+opened, and has no weighted average over many monthly h0 files. Here:
+
+    - face_areas computes the area of every face of a grid file (SCRIP, with
+      grid_corner_lat/lon, UGRID, with a face_node_connectivity, or MPAS, as
+      parsed by topology.read_vertices) as the exact area of its spherical
+      polygon (a fan of spherical triangles, vectorized over all faces), or
+      with uxarray (method='uxarray')
+    - the areas are cached by grid file (path, size and mtime), in memory and
+      as .npz files in a cache directory (written atomically, see
+      arraycache), so they are computed once per grid
+    - average applies them (and any number of face masks, e.g., from
+      box_mask) to the data with regions.average: one sparse matrix multiply
+      per chunk, so the time chunks of multi-decade h0 archives are averaged
+      in parallel by Dask, in one pass
+
+The faces of the grid file must be in the order of the face (ncol) dimension
+of the data, as for the E3SM physics grids (e.g., ne30pg2.nc).
+
+Example Usage:
+-------------
+    import unstructured
+    import xarray as xr
+
+    ds = xr.open_mfdataset('*.eam.h0.*.nc', combine='nested', concat_dim='time',
+                           data_vars='minimal', coords='minimal',
+                           compat='override')
+    masks = {'tropics': unstructured.box_mask(ds['lat'], ds['lon'], (-30, 30))}
+    means = unstructured.average(ds['TREFHT'], 'ne30pg2.nc', masks=masks)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import xarray as xr
+
+import arraycache
+import regions
+import topology
+
+# The default face area cache directory.
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+                             'xcdat-validation', 'face-areas')
+
+# The maximum number of grids whose face areas are kept in memory.
+MEMORY_CACHE_SIZE = 8
+
+# The face dimensions of unstructured data (uxarray, E3SM, MPAS).
+FACE_DIMS = ['n_face', 'ncol', 'nCells']
+
+# The face area methods.
+METHODS = ['exact', 'uxarray']
+
+_areas = arraycache.memory_cache()
+
+
+def _get_key(grid_path: str, method: str) -> str:
+    st = os.stat(grid_path)
+    h = hashlib.sha1()
+    h.update(str((os.path.abspath(grid_path), st.st_size, st.st_mtime,
+                  method)).encode())
+
+    return h.hexdigest()
+
+
+def face_areas(grid_path: str,
+               method: str = 'exact',
+               cache: Optional[str] = DEFAULT_CACHE) -> np.ndarray:
+    """Get the areas of the faces of an unstructured grid, computed once.
+
+    Parameters
+    ----------
+    grid_path : str
+        The grid file (SCRIP or UGRID, or any grid uxarray reads with
+        method="uxarray").
+    method : str, optional
+        "exact" (spherical polygons) or "uxarray" (``Grid.face_areas``, the
+        order 4 Gaussian quadrature of the notebook), by default "exact".
+    cache : Optional[str], optional
+        The cache directory, by default ``DEFAULT_CACHE``. If None, the areas
+        are only cached in memory.
+
+    Returns
+    -------
+    np.ndarray
+        The area (steradians) of every face, in the order of the grid file.
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unsupported method {method!r}, use one of {METHODS}.')
+
+    key = _get_key(grid_path, method)
+    path = None if cache is None else os.path.join(cache, key + '.npz')
+
+    areas = arraycache.get(_areas, key)
+    if areas is not None:
+        return areas
+
+    arrays = arraycache.load_npz(path, ['areas'])
+    if arrays is None:
+        if method == 'uxarray':
+            import uxarray as ux
+
+            areas = np.asarray(ux.open_grid(grid_path).face_areas.values)
+        else:
+            areas = topology.polygon_areas(*topology.read_vertices(grid_path))
+        arraycache.save_npz(path, {'areas': areas})
+    else:
+        areas = arrays['areas']
+
+    return arraycache.put(_areas, key, areas, MEMORY_CACHE_SIZE)
+
+
+def box_mask(lat: Union[xr.DataArray, np.ndarray],
+             lon: Union[xr.DataArray, np.ndarray],
+             lat_bounds: Tuple[float, float] = (-90., 90.),
+             lon_bounds: Optional[Tuple[float, float]] = None) -> np.ndarray:
+    """
+    mask = box_mask(lat, lon, lat_bounds, lon_bounds).
+
+    Returns whether the face centers (e.g., the lat and lon of E3SM h0
+    files) are in a box. The lon bounds may cross the prime meridian, e.g.
+    (300, 60).
+    """
+    lat, lon = np.asarray(lat), np.asarray(lon) % 360.
+    mask = (lat >= lat_bounds[0]) & (lat <= lat_bounds[1])
+    if lon_bounds is not None:
+        west, east = lon_bounds[0] % 360., lon_bounds[1] % 360.
+        if west <= east and lon_bounds[1] - lon_bounds[0] < 360.:
+            mask &= (lon >= west) & (lon <= east)
+        elif west > east:
+            mask &= (lon >= west) | (lon <= east)
+
+    return mask
+
+
+def get_weights(grid_path: str,
+                masks: Optional[Dict[str, Union[xr.DataArray, np.ndarray]]] = None,
+                method: str = 'exact',
+                cache: Optional[str] = DEFAULT_CACHE) -> regions.RegionWeights:
+    """
+    weights = get_weights(grid_path, masks).
+
+    Returns the (region x face) area weights of the "global" region, or of
+    each mask (booleans or weight factors on the faces), for
+    ``regions.average``.
+    """
+    import scipy.sparse
+
+    areas = face_areas(grid_path, method=method, cache=cache)
+    if masks is None:
+        masks = {'global': np.ones(len(areas))}
+
+    matrix = np.stack([np.nan_to_num(np.asarray(mask, dtype=np.float64)) * areas
+                       for mask in masks.values()])
+
+    return regions.RegionWeights(list(masks), scipy.sparse.csr_matrix(matrix))
+
+
+def average(data: xr.DataArray,
+            grid_path: str,
+            masks: Optional[Dict[str, Union[xr.DataArray, np.ndarray]]] = None,
+            face_dim: Optional[str] = None,
+            method: str = 'exact',
+            skipna: bool = True,
+            cache: Optional[str] = DEFAULT_CACHE) -> xr.DataArray:
+    """Average data on an unstructured grid, weighted by the face areas.
+
+    Parameters
+    ----------
+    data : xr.DataArray
+        The data on the faces (with any other dimensions, e.g., time, NumPy
+        or Dask).
+    grid_path : str
+        The grid file, with faces in the order of the face dimension of data.
+    masks : Optional[Dict[str, Union[xr.DataArray, np.ndarray]]], optional
+        The regions, as masks (booleans or weight factors) on the faces, by
+        default None (the global mean).
+    face_dim : Optional[str], optional
+        The face dimension, by default the one of ``FACE_DIMS`` in data.
+    method : str, optional
+        The face area method (see ``face_areas``), by default "exact".
+    skipna : bool, optional
+        Whether to skip missing values, by default True.
+    cache : Optional[str], optional
+        The face area cache directory, by default ``DEFAULT_CACHE``.
+
+    Returns
+    -------
+    xr.DataArray
+        The (float64) mean of every mask, on a "region" dimension in place of
+        the face dimension, or the global mean (without a region dimension)
+        if masks is None.
+    """
+    if face_dim is None:
+        face_dim = next((dim for dim in FACE_DIMS if dim in data.dims), None)
+        if face_dim is None:
+            raise ValueError(f'No face dimension ({FACE_DIMS}) in {data.dims}, '
+                             'use face_dim.')
+
+    weights = get_weights(grid_path, masks, method=method, cache=cache)
+    if weights.matrix.shape[1] != data.sizes[face_dim]:
+        raise ValueError(f'The grid has {weights.matrix.shape[1]} faces, but '
+                         f'{face_dim!r} has {data.sizes[face_dim]}.')
+
+    result = regions.average(data, weights, skipna=skipna, dims=(face_dim,))
+    if masks is None:
+        result = result.isel(region=0, drop=True)
+
+    return result
+
+
+def clear_cache(cache: Optional[str] = None):
+    """
+    clear_cache(cache).
+
+    Clears the in-memory face areas, and removes the entries of a cache
+    directory if one is given.
+    """
+    arraycache.clear(_areas)
+    arraycache.remove_files(cache)
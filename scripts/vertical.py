@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""
+Vertical interpolation from hybrid sigma-pressure levels to pressure levels.
+
+metpy.interpolate.interpolate_1d only takes NumPy arrays and needs the
+pressure and data dimensions in the same order (see
+validation/v0.6.0/vertical_interp/Vertical_interp.ipynb). Here:
+
+    - pressure_from_hybrid builds the (lazy) pressure of hybrid levels from
+      hyam, hybm, PS and p0, in whatever dimension order broadcasting gives
+    - interp_to_pressure interpolates every column with a vectorized NumPy
+      kernel applied with xr.apply_ufunc, so dimensions are matched by name
+      (no transpose is needed) and Dask arrays are interpolated chunk by chunk
+      (only the level dimension has to be in one chunk)
+    - the interpolation is linear in pressure ("linear") or in log-pressure
+      ("log"), and target levels outside a column's pressure range are
+      missing (NaN), like metpy
+    - get_plan precomputes the bracketing levels and weights of every column
+      (an interpolation "plan") from PS, hyam and hybm, chunk by chunk,
+      without building the pressure field, and caches it; apply_plan
+      interpolates any number of variables with the same plan, so the search
+      is not repeated for each variable (Dask shares the plan chunks between
+      variables computed together, or persist=True keeps them in memory)
+
+Example Usage:
+-------------
+    import vertical
+    import xarray as xr
+
+    ds = xr.open_mfdataset('T_*.nc', chunks={'time': 12})
+    pressure = vertical.pressure_from_hybrid(ds['PS'], ds['hyam'], ds['hybm'])
+    T_p = vertical.interp_to_pressure(ds['T'], pressure, [92500, 80000],
+                                      method='log')
+
+    plan = vertical.get_plan(ds['PS'], ds['hyam'], ds['hybm'])
+    ds_p = vertical.apply_plan(ds[['T', 'Q', 'U', 'V', 'Z3']], plan)
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict, namedtuple
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import xarray as xr
+
+# The mandatory pressure levels (Pa).
+MANDATORY_LEVELS = np.array([
+    1000, 925, 850, 700, 500, 400, 300, 250, 200, 150, 100, 70, 50, 30, 20, 10,
+    7, 5, 3, 2, 1
+], dtype=np.float64) * 100.0
+
+# The supported interpolation methods.
+METHODS = ['linear', 'log']
+
+# The maximum number of interpolation plans kept in memory.
+PLAN_CACHE_SIZE = 8
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'entries'])
+
+# The cached plans, with whether they were persisted.
+_plans: OrderedDict[str, Tuple[xr.Dataset, bool]] = OrderedDict()
+_stats = {'hits': 0, 'misses': 0}
+_lock = threading.Lock()
+
+
+def pressure_from_hybrid(ps: xr.DataArray,
+                         hyam: xr.DataArray,
+                         hybm: xr.DataArray,
+                         p0: float = 100000.) -> xr.DataArray:
+    """
+    pressure = pressure_from_hybrid(ps, hyam, hybm, p0).
+
+    Returns the pressure (in the units of ps and p0, typically Pa) of hybrid
+    sigma-pressure levels: hyam * p0 + hybm * ps. The result stays lazy if ps
+    is a Dask array.
+    """
+    pressure = hyam * p0 + hybm * ps
+    pressure.name = 'pressure'
+
+    return pressure
+
+
+def interp_to_pressure(data: xr.DataArray,
+                       pressure: xr.DataArray,
+                       new_levels: Union[List[float], np.ndarray] = MANDATORY_LEVELS,
+                       lev_dim: str = 'lev',
+                       method: str = 'linear',
+                       plev_dim: str = 'plev') -> xr.DataArray:
+    """Interpolate data on model levels to pressure levels.
+
+    Parameters
+    ----------
+    data : xr.DataArray
+        The data on model levels (any dimension order, NumPy or Dask).
+    pressure : xr.DataArray
+        The pressure of the model levels (e.g., from pressure_from_hybrid),
+        broadcastable against data. Its dimension order does not matter.
+    new_levels : Union[List[float], np.ndarray], optional
+        The target pressure levels (in the units of pressure), by default
+        ``MANDATORY_LEVELS`` (Pa).
+    lev_dim : str, optional
+        The model level dimension, by default "lev".
+    method : str, optional
+        "linear" (in pressure) or "log" (in log-pressure), by default
+        "linear".
+    plev_dim : str, optional
+        The name of the pressure level dimension of the result, by default
+        "plev".
+
+    Returns
+    -------
+    xr.DataArray
+        The interpolated data, with plev_dim in place of lev_dim. Target levels
+        outside a column's pressure range are NaN.
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unsupported method {method!r}, use one of {METHODS}.')
+
+    new_levels = np.asarray(new_levels, dtype=np.float64)
+    dtype = data.dtype if data.dtype.kind == 'f' else np.dtype(np.float64)
+
+    # the kernel needs each column in one chunk
+    if data.chunks is not None:
+        data = data.chunk({lev_dim: -1})
+    if pressure.chunks is not None:
+        pressure = pressure.chunk({lev_dim: -1})
+
+    result = xr.apply_ufunc(
+        _interp_columns,
+        pressure,
+        data,
+        input_core_dims=[[lev_dim], [lev_dim]],
+        output_core_dims=[[plev_dim]],
+        kwargs={'new_levels': new_levels, 'log': method == 'log',
+                'dtype': dtype},
+        dask='parallelized',
+        output_dtypes=[dtype],
+        dask_gufunc_kwargs={'output_sizes': {plev_dim: len(new_levels)}},
+        keep_attrs=True,
+    )
+
+    # put the pressure levels where the model levels were
+    dims = [plev_dim if d == lev_dim else d for d in data.dims]
+    dims += [d for d in result.dims if d not in dims]
+    result = result.transpose(*dims)
+    result = result.assign_coords({plev_dim: new_levels})
+    result[plev_dim].attrs.update({'units': pressure.attrs.get('units', 'Pa'),
+                                   'positive': 'down', 'axis': 'Z'})
+
+    return result
+
+
+def _interp_columns(p: np.ndarray,
+                    x: np.ndarray,
+                    new_levels: np.ndarray,
+                    log: bool = False,
+                    dtype: Optional[np.dtype] = None) -> np.ndarray:
+    # Interpolate the columns of x (levels along the last axis) at the
+    # pressures p to new_levels, vectorized over all columns.
+    lower, upper, weight = _plan_columns(p, new_levels, log)
+
+    return _apply_columns(x, lower, upper, weight, dtype)
+
+
+def _plan_columns(p: np.ndarray,
+                  new_levels: np.ndarray,
+                  log: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # The bracketing levels (lower and upper, in the order of the levels of
+    # p) and the weight of the upper level for every column of p (levels
+    # along the last axis) and target. The weight is NaN outside the column.
+    p = p.astype(np.float64)
+    nlev = p.shape[-1]
+
+    # make every column increase in pressure
+    flip = p[..., :1] > p[..., -1:]
+    if flip.any():
+        p = np.where(flip, p[..., ::-1], p)
+
+    targets = new_levels
+    if log:
+        p = np.log(p)
+        targets = np.log(new_levels)
+
+    shape = p.shape[:-1] + (len(targets),)
+    p = p.reshape(-1, nlev)
+
+    # Find the upper index of the bracketing levels of every column and target
+    # with one searchsorted: offsetting each column by a multiple of the range
+    # of the values makes the flattened columns one sorted array.
+    lo = min(p.min(), targets.min())
+    span = max(p.max(), targets.max()) - lo + 1.0
+    offsets = np.arange(p.shape[0])[:, None] * span
+    k = np.searchsorted((p - lo + offsets).ravel(),
+                        (targets - lo + offsets).ravel()).reshape(-1, len(targets))
+    k -= np.arange(p.shape[0])[:, None] * nlev
+    np.clip(k, 1, nlev - 1, out=k)
+
+    p_lower = np.take_along_axis(p, k - 1, axis=-1)
+    p_upper = np.take_along_axis(p, k, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = (targets - p_lower) / (p_upper - p_lower)
+    weight[(targets < p[:, :1]) | (targets > p[:, -1:])] = np.nan
+
+    # back to the level order of p
+    k = k.reshape(shape)
+    if flip.any():
+        flip = np.broadcast_to(flip, shape)
+        lower = np.where(flip, nlev - k, k - 1).astype(np.int16)
+        upper = np.where(flip, nlev - 1 - k, k).astype(np.int16)
+    else:
+        lower, upper = (k - 1).astype(np.int16), k.astype(np.int16)
+
+    return lower, upper, weight.reshape(shape)
+
+
+def _apply_columns(x: np.ndarray,
+                   lower: np.ndarray,
+                   upper: np.ndarray,
+                   weight: np.ndarray,
+                   dtype: Optional[np.dtype] = None) -> np.ndarray:
+    # Interpolate the columns of x (levels along the last axis) with the
+    # bracketing levels and weights of _plan_columns.
+    nlev = x.shape[-1]
+    shape = np.broadcast_shapes(x.shape[:-1], weight.shape[:-1])
+    x = np.broadcast_to(x, shape + (nlev,)).reshape(-1, nlev)
+    weight = np.broadcast_to(weight, shape + weight.shape[-1:])
+
+    # gather the bracketing values of all targets at once, with indices into
+    # the flattened columns
+    offsets = np.arange(x.shape[0])[:, None] * nlev
+    lower = np.broadcast_to(lower, weight.shape).reshape(x.shape[0], -1) + offsets
+    upper = np.broadcast_to(upper, weight.shape).reshape(x.shape[0], -1) + offsets
+    x = x.ravel()
+    x0, x1 = x[lower].astype(np.float64), x[upper].astype(np.float64)
+    out = x0 + (x1 - x0) * weight.reshape(x0.shape)
+
+    return out.reshape(weight.shape).astype(dtype or np.float64, copy=False)
+
+
+def _plan_hybrid(ps: np.ndarray,
+                 hyam: np.ndarray,
+                 hybm: np.ndarray,
+                 p0: float,
+                 new_levels: np.ndarray,
+                 log: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # _plan_columns of the pressure of hybrid levels, built for the columns of
+    # one chunk of ps only
+    pressure = hyam * p0 + hybm * np.asarray(ps, dtype=np.float64)[..., None]
+
+    return _plan_columns(pressure, new_levels, log)
+
+
+def interp_plan(pressure: xr.DataArray,
+                new_levels: Union[List[float], np.ndarray] = MANDATORY_LEVELS,
+                lev_dim: str = 'lev',
+                method: str = 'linear',
+                plev_dim: str = 'plev') -> xr.Dataset:
+    """
+    plan = interp_plan(pressure, new_levels, lev_dim, method).
+
+    Returns the (lazy, if pressure is a Dask array) interpolation plan of the
+    columns of a pressure field: the "lower" and "upper" bracketing model
+    level indices and the "weight" of the upper level of every column and
+    target level (NaN outside the column), for apply_plan. The plan is not
+    cached, see get_plan.
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unsupported method {method!r}, use one of {METHODS}.')
+
+    new_levels = np.asarray(new_levels, dtype=np.float64)
+    if pressure.chunks is not None:
+        pressure = pressure.chunk({lev_dim: -1})
+
+    lower, upper, weight = xr.apply_ufunc(
+        _plan_columns,
+        pressure,
+        input_core_dims=[[lev_dim]],
+        output_core_dims=[[plev_dim]] * 3,
+        kwargs={'new_levels': new_levels, 'log': method == 'log'},
+        dask='parallelized',
+        output_dtypes=[np.int16, np.int16, np.float64],
+        dask_gufunc_kwargs={'output_sizes': {plev_dim: len(new_levels)}},
+    )
+
+    return _to_plan(lower, upper, weight, new_levels, lev_dim, plev_dim,
+                    pressure.attrs.get('units', 'Pa'))
+
+
+def get_plan(ps: xr.DataArray,
+             hyam: xr.DataArray,
+             hybm: xr.DataArray,
+             new_levels: Union[List[float], np.ndarray] = MANDATORY_LEVELS,
+             p0: float = 100000.,
+             method: str = 'linear',
+             lev_dim: str = 'lev',
+             plev_dim: str = 'plev',
+             persist: bool = False) -> xr.Dataset:
+    """Get the interpolation plan of hybrid sigma-pressure levels.
+
+    The plan holds the bracketing model levels and weights of every column
+    (see ``interp_plan``). It is computed chunk by chunk from ps (the pressure
+    of each chunk is built in the chunk's task and dropped, the 4D pressure
+    field never exists) and kept in memory for the same ps, hyam, hybm, p0,
+    target levels and method, so the variables of a model run share it.
+
+    Parameters
+    ----------
+    ps : xr.DataArray
+        The surface pressure (NumPy or Dask).
+    hyam : xr.DataArray
+        The hybrid A coefficients (on ``lev_dim``).
+    hybm : xr.DataArray
+        The hybrid B coefficients (on ``lev_dim``).
+    new_levels : Union[List[float], np.ndarray], optional
+        The target pressure levels (in the units of ps and p0), by default
+        ``MANDATORY_LEVELS`` (Pa).
+    p0 : float, optional
+        The reference pressure, by default 100000 (Pa).
+    method : str, optional
+        "linear" (in pressure) or "log" (in log-pressure), by default
+        "linear".
+    lev_dim : str, optional
+        The model level dimension, by default "lev".
+    plev_dim : str, optional
+        The name of the pressure level dimension, by default "plev".
+    persist : bool, optional
+        Whether to compute the plan now and keep it in (Dask) memory, by
+        default False. A lazy plan is computed once for variables computed
+        together (e.g., with ``dask.compute`` or ``Dataset.compute``) but
+        again for each separate compute.
+
+    Returns
+    -------
+    xr.Dataset
+        The plan, with "lower", "upper" and "weight" on the dimensions of ps
+        and plev_dim.
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unsupported method {method!r}, use one of {METHODS}.')
+
+    new_levels = np.asarray(new_levels, dtype=np.float64)
+    key = _plan_key(ps, hyam, hybm, p0, new_levels, method, lev_dim, plev_dim)
+
+    with _lock:
+        plan, persisted = _plans.get(key, (None, False))
+        if plan is not None and (persisted or not persist):
+            _plans.move_to_end(key)
+            _stats['hits'] += 1
+            return plan
+        _stats['misses'] += 1
+
+    lower, upper, weight = xr.apply_ufunc(
+        _plan_hybrid,
+        ps,
+        hyam,
+        hybm,
+        input_core_dims=[[], [lev_dim], [lev_dim]],
+        output_core_dims=[[plev_dim]] * 3,
+        kwargs={'p0': p0, 'new_levels': new_levels, 'log': method == 'log'},
+        dask='parallelized',
+        output_dtypes=[np.int16, np.int16, np.float64],
+        dask_gufunc_kwargs={'output_sizes': {plev_dim: len(new_levels)}},
+    )
+    plan = _to_plan(lower, upper, weight, new_levels, lev_dim, plev_dim,
+                    ps.attrs.get('units', 'Pa'))
+    if persist:
+        plan = plan.persist()
+
+    with _lock:
+        _plans[key] = (plan, persist)
+        _plans.move_to_end(key)
+        while len(_plans) > PLAN_CACHE_SIZE:
+            _plans.popitem(last=False)
+
+    return plan
+
+
+def _plan_key(*args) -> str:
+    # a deterministic token of the plan inputs (the graph name of Dask
+    # arrays, a hash of the values of NumPy arrays)
+    from dask.base import tokenize
+
+    return tokenize(*args)
+
+
+def _to_plan(lower: xr.DataArray,
+             upper: xr.DataArray,
+             weight: xr.DataArray,
+             new_levels: np.ndarray,
+             lev_dim: str,
+             plev_dim: str,
+             units: str) -> xr.Dataset:
+    plan = xr.Dataset({'lower': lower, 'upper': upper, 'weight': weight})
+    plan = plan.assign_coords({plev_dim: new_levels})
+    plan[plev_dim].attrs.update({'units': units, 'positive': 'down',
+                                 'axis': 'Z'})
+    plan.attrs.update({'lev_dim': lev_dim, 'plev_dim': plev_dim})
+
+    return plan
+
+
+def apply_plan(data: Union[xr.DataArray, xr.Dataset],
+               plan: xr.Dataset) -> Union[xr.DataArray, xr.Dataset]:
+    """Interpolate data on model levels with an interpolation plan.
+
+    Parameters
+    ----------
+    data : Union[xr.DataArray, xr.Dataset]
+        The data on model levels (any dimension order, NumPy or Dask). The
+        data variables of a dataset without the model level dimension (e.g.,
+        PS) are kept as they are.
+    plan : xr.Dataset
+        The plan of get_plan or interp_plan, on the columns of data.
+
+    Returns
+    -------
+    Union[xr.DataArray, xr.Dataset]
+        The interpolated data, with the pressure level dimension of the plan
+        in place of the model level dimension. Target levels outside a
+        column's pressure range are NaN.
+    """
+    lev_dim, plev_dim = plan.attrs['lev_dim'], plan.attrs['plev_dim']
+
+    if isinstance(data, xr.Dataset):
+        variables = {key: apply_plan(var, plan) if lev_dim in var.dims else var
+                     for key, var in data.data_vars.items()}
+        coords = {key: coord for key, coord in data.coords.items()
+                  if lev_dim not in coord.dims}
+        ds = xr.Dataset(variables, coords=coords, attrs=data.attrs)
+
+        return ds.assign_coords({plev_dim: plan[plev_dim]})
+
+    dtype = data.dtype if data.dtype.kind == 'f' else np.dtype(np.float64)
+    if data.chunks is not None:
+        data = data.chunk({lev_dim: -1})
+
+    result = xr.apply_ufunc(
+        _apply_columns,
+        data,
+        plan['lower'],
+        plan['upper'],
+        plan['weight'],
+        input_core_dims=[[lev_dim], [plev_dim], [plev_dim], [plev_dim]],
+        output_core_dims=[[plev_dim]],
+        kwargs={'dtype': dtype},
+        dask='parallelized',
+        output_dtypes=[dtype],
+        keep_attrs=True,
+    )
+
+    # put the pressure levels where the model levels were
+    dims = [plev_dim if d == lev_dim else d for d in data.dims]
+    dims += [d for d in result.dims if d not in dims]
+    result = result.transpose(*dims)
+    result.name = data.name
+
+    return result.assign_coords({plev_dim: plan[plev_dim]})
+
+
+def cache_info() -> CacheInfo:
+    """Get the hits, misses and number of entries of the plan cache."""
+    with _lock:
+        return CacheInfo(_stats['hits'], _stats['misses'], len(_plans))
+
+
+def clear_cache():
+    """Drop the plans kept in memory and reset the statistics."""
+    with _lock:
+        _plans.clear()
+        _stats.update({'hits': 0, 'misses': 0})
+
+
+def hybrid_to_pressure(ds: xr.Dataset,
+                       var_key: Union[str, List[str]],
+                       new_levels: Union[List[float], np.ndarray] = MANDATORY_LEVELS,
+                       method: str = 'linear',
+                       lev_dim: str = 'lev',
+                       p0: Optional[float] = None) -> Union[xr.DataArray, xr.Dataset]:
+    """
+    data = hybrid_to_pressure(ds, var_key, new_levels, method).
+
+    Interpolates a variable (or a list of variables, returned as a dataset)
+    of a model-level dataset (with hyam, hybm and PS, and P0 if p0 is not
+    given, or 100000 Pa) to pressure levels, with the cached plan of get_plan.
+    """
+    if p0 is None:
+        p0 = float(ds['P0']) if 'P0' in ds else 100000.
+    plan = get_plan(ds['PS'], ds['hyam'], ds['hybm'], new_levels, p0=p0,
+                    method=method, lev_dim=lev_dim)
+
+    return apply_plan(ds[var_key], plan)
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Persisted index of the CDAT xml files used by cdw.getXmlFiles.
+
+cdw.getXmlFiles used to glob a pattern with a wildcard at every level of the
+xml tree (base/mip_era/activity/experiment/realm/frequency/variable/file),
+so every query listed the whole tree on a network filesystem. Here the xml
+filenames are stored in a sqlite index, decomposed into their DRS fields,
+and queries are index lookups.
+
+The index is refreshed incrementally with the directory mtime snapshot of
+crawler.walk: only directories that changed since the last refresh are
+listed again. By default, query refreshes the directories matching its
+patterns before every lookup (the directories glob would list: a stat of
+each, listing only the changed ones), so new xml files are always found
+without walking the rest of the tree. refresh_matches=False skips that
+refresh and may miss files published since the last refresh.
+
+Queries return the same paths as glob.glob (in sorted order): literal
+components are looked up in the index and every component is then matched
+with fnmatch, as glob does. Like glob, hidden files and directories are not
+matched by wildcards. Unlike glob, symlinked directories are not followed.
+
+Example Usage:
+-------------
+    import xmlindex
+
+    patterns = xmlindex.get_patterns(variable='tas', experiment='historical')
+    files = xmlindex.query('/p/user_pub/xclim/', patterns)
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+import crawler
+
+# The default index file.
+DEFAULT_INDEX = os.path.join(os.path.expanduser('~'), '.cache',
+                             'xcdat-validation', 'xmlindex.db')
+
+# The directory levels below the base directory, in order.
+DIR_FIELDS = ['mip_era', 'activity', 'experiment', 'realm', 'frequency',
+              'variable']
+# The fields of xml filenames (e.g., CMIP5.CMIP.historical.NCAR.CCSM4.r1i1p1.
+# mon.tas.atmos.glb-z1-gu.v20160829.0000000.0.xml) that are indexed.
+FILE_FIELDS = {'institute': 3, 'model': 4, 'realization': 5, 'gridLabel': 9,
+               'version': 10}
+
+_magic = re.compile('[*?[]')
+
+
+def get_patterns(mip_era: str = '*',
+                 activity: str = '*',
+                 experiment: str = '*',
+                 realm: str = '*',
+                 frequency: str = '*',
+                 variable: str = '*',
+                 model: str = '*',
+                 realization: str = '*',
+                 gridLabel: str = '*') -> List[str]:
+    """
+    patterns = get_patterns(**facets).
+
+    Returns the glob patterns of the directory levels and the filename of
+    the xml files matching the facets (as searched by cdw.getXmlFiles).
+    """
+    patterns = [mip_era, activity, experiment, realm, frequency, variable]
+    patterns.append('*.{0}.{1}.*.{2}.*.xml'.format(model, realization,
+                                                  gridLabel))
+
+    return [p.replace(' ', '') for p in patterns]
+
+
+def _connect(index: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(index)), exist_ok=True)
+    con = sqlite3.connect(index, timeout=30)
+    con.execute('create table if not exists xmls (dir text, '
+                + ', '.join(f'{f} text' for f in DIR_FIELDS)
+                + ', filename text, '
+                + ', '.join(f'{f} text' for f in FILE_FIELDS) + ')')
+    con.execute('create index if not exists xmls_dir_idx on xmls (dir)')
+    con.execute('create index if not exists xmls_facets_idx on xmls '
+                '(variable, experiment, frequency, mip_era)')
+    con.execute('create table if not exists bases (root text primary key, '
+                'refreshed real)')
+    crawler.create_snapshot_table(con)
+
+    return con
+
+
+def refresh(base: str,
+            index: str = DEFAULT_INDEX,
+            max_workers: int = crawler.MAX_WORKERS,
+            verbose: bool = False,
+            patterns: Optional[List[str]] = None) -> Dict[str, int]:
+    """Build or incrementally refresh the index of a base directory.
+
+    Parameters
+    ----------
+    base : str
+        The base directory of the xml tree (e.g., /p/user_pub/xclim/).
+    index : str, optional
+        The index file, by default ``DEFAULT_INDEX``.
+    max_workers : int, optional
+        The number of threads, by default ``crawler.MAX_WORKERS``.
+    verbose : bool, optional
+        Print progress, by default False.
+    patterns : Optional[List[str]], optional
+        The glob patterns of the directory levels (and the filename, which is
+        not used) to refresh, by default None which refreshes the whole tree.
+
+    Returns
+    -------
+    Dict[str, int]
+        The number of directories visited ("dirs") and listed ("listed"),
+        and the number of xml files indexed in the listed directories
+        ("written").
+    """
+    root = os.path.abspath(base)
+
+    con = _connect(index)
+    try:
+        stats = _refresh(con, root, max_workers, verbose, patterns)
+        con.commit()
+    finally:
+        con.close()
+
+    if verbose:
+        print(stats)
+
+    return stats
+
+
+def _refresh(con: sqlite3.Connection,
+             root: str,
+             max_workers: int = crawler.MAX_WORKERS,
+             verbose: bool = False,
+             patterns: Optional[List[str]] = None) -> Dict[str, int]:
+    # refresh the index of a base directory (see refresh), not committed
+
+    # walk from the literal leading levels of the patterns (if any), and
+    # only into the directories matching the other levels
+    dir_patterns = [] if patterns is None else patterns[:len(DIR_FIELDS)]
+    k = 0
+    while k < len(dir_patterns) and _magic.search(dir_patterns[k]) is None:
+        k += 1
+    top = '/'.join([root] + dir_patterns[:k])
+
+    snapshot = crawler.load_snapshot(con, [top], dir_patterns[k:])
+    visited = crawler.walk([top], snapshot, suffix='.xml',
+                           max_depth=len(DIR_FIELDS) - k,
+                           max_workers=max_workers, verbose=verbose,
+                           patterns=dir_patterns[k:])
+
+    # re-index the changed and removed directories
+    changed = [dpath for dpath, v in visited.items() if v[3]]
+    removed = crawler.removed_dirs(visited, snapshot)
+    con.executemany('delete from xmls where dir = ?',
+                    [(dpath,) for dpath in changed])
+    con.executemany('delete from xmls where dir = ? or (dir > ? and dir < ?)',
+                    [(dpath, dpath + '/', dpath + '0') for dpath in removed])
+
+    rows = []
+    for dpath in changed:
+        parts = dpath[len(root) + 1:].split('/')
+        if len(parts) != len(DIR_FIELDS):
+            continue
+        for fn in visited[dpath][4]:
+            fields = fn.split('.')
+            rows.append(tuple([dpath] + parts + [fn] + [
+                fields[i] if i < len(fields) else None
+                for i in FILE_FIELDS.values()
+            ]))
+    placeholders = ', '.join('?' * (len(DIR_FIELDS) + len(FILE_FIELDS) + 2))
+    con.executemany(f'insert into xmls values ({placeholders})', rows)
+
+    crawler.save_snapshot(con, visited, snapshot)
+    if patterns is None:
+        con.execute('insert or replace into bases values (?, ?)',
+                    (root, time.time()))
+
+    return {
+        'dirs': len(visited),
+        'listed': len(changed),
+        'written': len(rows),
+    }
+
+
+def query(base: str,
+          patterns: List[str],
+          index: str = DEFAULT_INDEX,
+          refresh_matches: bool = True) -> List[str]:
+    """Find the xml files matching glob patterns in the index.
+
+    Parameters
+    ----------
+    base : str
+        The base directory of the xml tree (e.g., /p/user_pub/xclim/).
+    patterns : List[str]
+        The glob patterns of the directory levels and the filename (see
+        ``get_patterns``).
+    index : Optional[str], optional
+        The index file, by default ``DEFAULT_INDEX``.
+    refresh_matches : bool, optional
+        Refresh (incrementally) the directories matching the patterns before
+        the lookup, so files are found as glob would find them, by default
+        True. If False, files added since the last refresh are missed. The
+        index is built first if it does not exist.
+
+    Returns
+    -------
+    List[str]
+        The matching files, as returned by
+        ``glob.glob(base + '/' + '/'.join(patterns))``.
+    """
+    root = os.path.abspath(base)
+
+    con = _connect(index)
+    try:
+        refreshed = con.execute('select refreshed from bases where root = ?',
+                                (root,)).fetchone()
+        if refreshed is None:
+            _refresh(con, root)
+        elif refresh_matches:
+            _refresh(con, root, patterns=patterns)
+        con.commit()
+
+        # look up the literal levels (and prefilter the filename with the
+        # sqlite glob, which matches like fnmatch unless there are sets)
+        where = ['dir > ?', 'dir < ?']
+        params = [root + '/', root + '0']
+        for field, pattern in zip(DIR_FIELDS + ['filename'], patterns):
+            if _magic.search(pattern) is None:
+                where.append(f'{field} = ?')
+                params.append(pattern)
+            elif '[' not in pattern:
+                where.append(f'{field} glob ?')
+                params.append(pattern)
+
+        rows = con.execute(
+            f'select {", ".join(DIR_FIELDS)}, filename from xmls '
+            f'where {" and ".join(where)} order by dir, filename', params
+        ).fetchall()
+    finally:
+        con.close()
+
+    # glob keeps the literal leading levels of the pattern as they are (e.g.,
+    # with a double slash after the base) and joins the rest with os.path.join
+    k = min(i for i, pattern in enumerate(patterns) if _magic.search(pattern))
+    if k > 0:
+        head = '/'.join([base] + patterns[:k])
+    else:
+        head = base.rstrip('/') or base
+
+    # match every level like glob
+    files = []
+    for row in rows:
+        if all(fnmatch.fnmatchcase(name, pattern)
+               for name, pattern in zip(row, patterns)):
+            files.append(head + '/' + '/'.join(row[k:]))
+
+    return files
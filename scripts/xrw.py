@@ -10,8 +10,9 @@ xarray wrangle (xrw): I/O and query utilities for accessing CMIPx data.
 @author: pochedls
 """
 
-import sqlite3
-import xarray as xr
+import catalog
+import dedup
+import metadata
 import numpy as np
 
 
@@ -34,6 +35,10 @@ def get_cmip_paths(**kwargs):
         member : realization for CMIP data
         gridLabel : grid label for CMIP data
         trim : Boolean to trim off duplicate files (default True)
+        write_back : Boolean to store the metadata read while trimming in
+                     the catalog db (default False, needs write access);
+                     otherwise it is stored in the per-user cache
+                     (metadata.DEFAULT_CACHE)
         verbose : Boolean if information about search should be printed
 
     Example Usage:
@@ -74,47 +79,23 @@ def get_cmip_paths(**kwargs):
     for key in kwargs:
         if key in searchDict.keys():
             searchDict[key] = kwargs[key]
-        if key == 'db':
-            db = kwargs['db']
-        else:
-            db = '/p/user_pub/xclim/persist/xml.db'
-        if key == 'verbose':
-            verbose = kwargs['verbose']
-        else:
-            verbose = True
-        if key == 'trim':
-            trim = kwargs['trim']
-        else:
-            trim = True
-        if key == 'criteria':
-            criteria = kwargs['criteria']
-        else:
-            criteria = ['ver', 'cdate', 'tpoints']
-
-    # Construct sqlite search
-    constraints = [key + "='" + searchDict[key] + "'" for key in searchDict.keys() if searchDict[key] != '*']
-    # ensure we don't use ignored / retired data
-    constraints = " and ".join(constraints) + " and retired = 0 and ignored = 0;"
-    query = "select * from paths where " + constraints
-
-    # perform sqlite search
+    db = kwargs.get('db', catalog.DEFAULT_DB)
+    verbose = kwargs.get('verbose', True)
+    trim = kwargs.get('trim', True)
+    criteria = kwargs.get('criteria', ['ver', 'cdate', 'tpoints'])
+    write_back = kwargs.get('write_back', False)
+
+    # perform sqlite search (parameterized, on a shared read-only connection,
+    # with recent results cached; retired / ignored data are excluded)
     if verbose:
         print('Searching for data...')
-    con = sqlite3.connect(db)
-    cur = con.cursor()
-    cur.execute(query)
-    headers = list(map(lambda x: x[0], cur.description))
-    result = cur.fetchall()
-    con.close()
+    headers, result = catalog.query_paths(db, **searchDict)
 
     # create a dictionary of paths
     # each path is a key linking to other metadata
     pathDict = {}
     for l in result:
-        dpath = l[0]
-        pathDict[dpath] = {}
-        for i, h in enumerate(headers[1:]):
-            pathDict[dpath][h] = l[i+1]
+        pathDict[l[0]] = dict(zip(headers[1:], l[1:]))
 
     dpaths = list(pathDict.keys())
 
@@ -122,14 +103,17 @@ def get_cmip_paths(**kwargs):
     if trim:
         if verbose:
             print('De-duplicating list...')
-        dpaths = trimModelList(pathDict, criteria=criteria, verbose=verbose)
+        dpaths = trimModelList(pathDict, criteria=criteria, verbose=verbose,
+                               db=db, write_back=write_back)
 
     return dpaths
 
 
 def trimModelList(pathDict,
                   criteria=['cdate', 'ver', 'tpoints'],
-                  verbose=False):
+                  verbose=False,
+                  db=None,
+                  write_back=False):
     """
     dpathsOut = trimModelList(pathDict).
 
@@ -149,67 +133,57 @@ def trimModelList(pathDict,
 
     An additional optional argument is verbose (boolean), which will output
     diagnostic information during execution. By default verbose is False.
+
+    Dataset metadata (cdate, tpoints, publish) is only read for paths that
+    are still tied when a criterion needs it, from the file headers and
+    concurrently (see metadata.py). Metadata stored in the catalog (pathDict
+    entries with cdate, publish, tpoints and meta_mtime) or in the per-user
+    cache of metadata.get_metadata is reused if the path is unchanged. Newly
+    read metadata is written back to the catalog db if write_back is True,
+    and otherwise (or if the catalog is read-only) to the cache.
     """
     keyMap = {}
-    models = []
-    rips = []
+    stored = {}
     # loop over dpaths and store metadata
     for dpath in pathDict.keys():
         # get initial metadata for sorting
         model = pathDict[dpath]['model']
         rip = pathDict[dpath]['member']
         ver = versionWeight(pathDict[dpath]['version'])
-        # collect all models and rips
-        models.append(model)
-        rips.append(rip)
         # store data in dictionary
         keyMap[dpath] = {'model': model, 'rip': rip, 'ver': ver}
-    # get unique models / rips
-    rips = list(set(rips))
-    models = list(set(models))
-    models.sort()
-    rips.sort()
-
-    # loop over each model + realization and filter by /criteria/
-    dpathsOut = []
-    for model in models:
-        if verbose:
-            print('  ' + model)
-        for rip in rips:
-            # subset dpaths for each model / realization
-            subdpaths = [fn for fn in keyMap.keys() if
-                         (keyMap[fn]['model'] == model
-                          and keyMap[fn]['rip'] == rip)]
-            # continue whittling down path list until only one is left
-            # by iteratively using each criteria
-            for crit in criteria:
-                subdpaths, keyMap = filter_dpaths(subdpaths, keyMap, crit)
-            # if more than one path is left after criteria is applied,
-            # choose first one
-            if len(subdpaths) > 0:
-                dpathsOut.append(subdpaths[0])
+        # metadata stored in the catalog (checked against the path mtime)
+        if pathDict[dpath].get('cdate') is not None:
+            stored[dpath] = (pathDict[dpath]['cdate'],
+                             bool(pathDict[dpath]['publish']),
+                             pathDict[dpath]['tpoints'],
+                             pathDict[dpath]['meta_mtime'])
+
+    # bucket dpaths by model + realization once, then filter each bucket
+    # by /criteria/ (see dedup.py)
+    groups = dedup.group_by_member(keyMap)
+
+    def filterFunc(subdpaths, crit):
+        return filter_dpaths(subdpaths, keyMap, crit)[0]
+
+    def prefetch(crit, subdpaths):
+        # fetch metadata for all tied dpaths in one concurrent batch
+        if crit not in metadata.META_CRITERIA:
+            return
+        need = [dpath for dpath in subdpaths if crit not in keyMap[dpath]]
+        meta = metadata.get_metadata(need, db=db, stored=stored,
+                                     write_back=write_back)
+        for dpath, (cdate, publish, tpoints) in meta.items():
+            keyMap[dpath]['cdate'] = cdate
+            keyMap[dpath]['publish'] = publish
+            keyMap[dpath]['tpoints'] = tpoints
+
+    dpathsOut = dedup.select(groups, criteria, filterFunc, prefetch=prefetch,
+                             verbose=verbose)
 
     # if verbose mode, print off dpaths and selection (*)
     if verbose:
-        # loop over models / rips and see if dpaths are in output list
-        # print dpaths used with asterisk and unchosen dpaths next
-        for model in models:
-            for rip in rips:
-                subdpaths = [fn for fn in keyMap.keys()
-                            if (keyMap[fn]['model'] == model
-                                and keyMap[fn]['rip'] == rip)]
-                if len(subdpaths) > 1:
-                    lowdpaths = []
-                    for fn in subdpaths:
-                        if fn in dpathsOut:
-                            fn1 = fn
-                        else:
-                            lowdpaths.append(fn)
-                    print('* ' + fn1)
-                    for fn in lowdpaths:
-                        print(fn)
-                elif len(subdpaths) == 1:
-                    print('* ' + subdpaths[0])
+        dedup.print_selection(groups, dpathsOut)
 
     return dpathsOut
 
@@ -223,36 +197,10 @@ def get_dataset_metadata(dpath):
         publish:    boolean if the underlying data is in the LLNL publish
                     directories (if it has been locally republished)
         tpoints:    the number of timesteps in the dataset
+
+    The metadata is read from the file headers (see metadata.py).
     """
-    try:
-        ds = xr.open_mfdataset(dpath + '*', combine='by_coords')
-    except:
-        print('problem opening, path skipped:\n', dpath)
-        cdate, publish, tpoints = [0 for _ in range(3)]
-        return cdate, publish, tpoints
-    if 'creation_date' in ds.attrs:
-        cdate = ds.creation_date
-    else:
-        cdate = '1989-03-06T17:00:00Z'  # Assume PCMDI dawn of time
-    # If missing, default to PCMDI dawn of time 9am Monday 6th March 1989
-    # most dates are of form: 2012-02-13T00:40:33Z
-    # some are: Thu Aug 11 22:49:09 EST 2011 - just make 20110101
-    if cdate[0].isalpha():
-        cdate = int(cdate.split(' ')[-1] + '0101')
-    else:
-        cdate = int(cdate.split('T')[0].replace('-', ''))
-    # check if republished
-    if bool(dpath.find('publish')):
-        publish = True
-    else:
-        publish = False
-    axisList = ds.coords
-    if 'time' in axisList:
-        tpoints = len(ds['time'])
-    else:
-        tpoints = 0
-    ds.close()
-    return cdate, publish, tpoints
+    return metadata.read_header_metadata(dpath)
 
 
 def filter_dpaths(dpaths, keyMap, crit):
@@ -288,16 +236,20 @@ def filter_dpaths(dpaths, keyMap, crit):
     for dpath in dpaths:
         if crit not in keyMap[dpath].keys():
             cdate, publish, tpoints = get_dataset_metadata(dpath)
-            # if the dataset cannot be loaded, remove it
-            if 0 in (cdate, publish, tpoints):
-                rdpaths.append(dpath)
             # update dictionary
             keyMap[dpath]['cdate'] = cdate
             keyMap[dpath]['publish'] = publish
             keyMap[dpath]['tpoints'] = tpoints
+        # if the dataset cannot be loaded, remove it
+        if crit in metadata.META_CRITERIA:
+            meta = [keyMap[dpath][k] for k in metadata.META_CRITERIA]
+            if 0 in meta:
+                rdpaths.append(dpath)
     # remove problematic dpaths
     for dpath in rdpaths:
         dpaths.remove(dpath)
+    if len(dpaths) == 0:
+        return dpaths, keyMap
     # get values
     values = []
     for dpath in dpaths:
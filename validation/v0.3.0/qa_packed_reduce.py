@@ -0,0 +1,47 @@
+#%%
+import os
+import sys
+import timeit
+
+import numpy as np
+import xarray as xr
+import xcdat
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../scripts"))
+import packed  # noqa: E402
+import reference  # noqa: E402
+
+# %% packed integer path vs. decoded path
+fn = '/p/user_pub/climate_work/pochedley1/surface/gistemp1200_GHCNv4_ERSSTv5.nc'
+v = "tempanomaly"
+
+#%%
+# decoded path: xarray unpacks the int16 data to floats (and masks _FillValue)
+ds = xcdat.open_dataset(fn)
+weights = ds.spatial.get_weights(axis=['Y', 'X'], lat_bounds=None, lon_bounds=None)
+
+start = timeit.default_timer()
+ts_decoded = reference.spatial_average(ds[v], weights)
+print('decoded path runtime:', timeit.default_timer() - start)
+
+#%%
+# packed path: keep the int16 data, apply scale_factor / add_offset at the end
+ds_raw = xr.open_dataset(fn, mask_and_scale=False)
+print(ds_raw[v].dtype, packed.get_packing(ds_raw[v]))
+
+start = timeit.default_timer()
+ts_packed = packed.spatial_average(ds_raw[v], weights)
+print('packed path runtime:', timeit.default_timer() - start)
+
+#%%
+# the decoded floats carry float32 rounding of scale_factor * raw, so the
+# paths agree to float32 precision rather than bit-for-bit
+print('max abs diff:', np.nanmax(np.abs(ts_packed - ts_decoded)))
+np.testing.assert_allclose(ts_packed, ts_decoded, rtol=1e-6, atol=1e-6)
+np.testing.assert_array_equal(np.isnan(ts_packed), np.isnan(ts_decoded))
+
+# tidy up
+ds.close()
+ds_raw.close()
+
+# %%
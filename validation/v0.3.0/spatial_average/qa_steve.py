@@ -1,9 +1,15 @@
 #%%
+import os
+import sys
+
 import cdms2
 import cdutil
 import numpy as np
 import xcdat
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../../scripts"))
+import reference  # noqa: E402
+
 # %% explicit method
 fn = '/p/user_pub/climate_work/pochedley1/surface/gistemp1200_GHCNv4_ERSSTv5.nc'
 offset = 270.
@@ -27,15 +33,9 @@ ds[v] = np.squeeze(ds[v]) + offset
 # get weights
 weights = ds.spatial.get_weights(axis=['Y', 'X'], lat_bounds=None, lon_bounds=None)
 
-# reshape to match the data array
-ntime = len(ds['time'])
-weights = np.tile(np.expand_dims(weights, axis=0), (ntime, 1, 1))
-weights = np.where(~np.isnan(ds[v]), weights, 0.)
-
-# calculate spatial average
-numerator = np.sum(weights*ds[v], axis=(1, 2))
-denominator = np.sum(weights, axis=(1, 2))
-ts_explicit = np.array(numerator / denominator)
+# calculate spatial average, streaming over blocks of time steps instead
+# of tiling the weights to (time, lat, lon) (same result, bit-for-bit)
+ts_explicit = reference.spatial_average(ds[v], weights)
 
 # tidy up
 ds.close()